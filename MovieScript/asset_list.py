@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+素材リストの表示とサムネイル・メタデータの読み込み
+背景・メドレーの一覧を、サムネイル・解像度・長さ付きで表示する。
+
+- リストは画面に見えている行だけを描画する（数千件でも追加・スクロールの時間は変わらない）
+- サムネイル・解像度・長さはワーカースレッドで1ファイルにつきFFmpegを1回だけ実行して取得し、
+  ファイルの識別子ごとにキャッシュする（2回目以降の起動ではキャッシュを読むだけ）
+- 読み込みは見えている行から順に行い、スクロールしたら新しく見えた行を優先する
+"""
+
+import os
+import re
+import threading
+import tkinter as tk
+from collections import OrderedDict
+from tkinter import ttk
+
+from media_cache import AUDIO_EXTENSIONS, STILL_IMAGE_EXTENSIONS, get_cache_dir, file_fingerprint, \
+    make_cache_key, load_json, save_json
+
+# サムネイルの大きさ（16:9）と1行の高さ（ピクセル）
+THUMBNAIL_SIZE = (64, 36)
+ROW_HEIGHT = 44
+# 同時に読み込むファイル数
+LOADER_THREADS = 2
+# メモリに保持するサムネイル画像の数（見えている行の分より十分多くする）
+MAX_PHOTO_IMAGES = 300
+# 見えている行の前後で先に読み込んでおく行数
+PREFETCH_ROWS = 10
+
+# 取得方法を変えたらキャッシュを無効化するため更新する
+ASSET_INFO_VERSION = 1
+
+DURATION_PATTERN = re.compile(r'Duration:\s*(\d+):(\d{2}):(\d{2}(?:\.\d+)?)')
+VIDEO_SIZE_PATTERN = re.compile(r'Video:.*?\b(\d{2,5})x(\d{2,5})\b')
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if minutes >= 60:
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def describe_info(info):
+    """リストに表示する素材の情報（例: 1920x1080・03:25）"""
+    if info is None:
+        return "読み込み中..."
+    parts = []
+    if info.get('size'):
+        parts.append(f"{info['size'][0]}x{info['size'][1]}")
+    if info.get('duration'):
+        parts.append(format_duration(info['duration']))
+    return "・".join(parts) if parts else "情報を取得できません"
+
+
+class AssetInfoLoader:
+    """素材のサムネイル・解像度・長さをワーカースレッドで読み込む
+
+    結果は result_queue に ('asset_info', (パス, 情報)) として入れる（メインスレッドで取り出す）。
+    情報は {'size': [幅, 高さ] または None, 'duration': 秒 または None, 'thumbnail': PNGのパス または None}。
+    """
+
+    def __init__(self, result_queue):
+        self.result_queue = result_queue
+        self.cache_dir = get_cache_dir('assets')
+        self.ffmpeg_path = None
+        self.info = {}  # パス -> 情報（読み込み済み）
+        self.pending = OrderedDict()  # 読み込み待ちのパス（先頭から処理する）
+        self.loading = set()
+        self.condition = threading.Condition()
+
+    def start(self, ffmpeg_path):
+        """FFmpegが見つかったら読み込みを始める（それまでの要求は待たせておく）"""
+        if self.ffmpeg_path:
+            return
+        self.ffmpeg_path = ffmpeg_path
+        for _ in range(LOADER_THREADS):
+            threading.Thread(target=self.worker, daemon=True).start()
+
+    def get(self, path):
+        return self.info.get(path)
+
+    def request(self, paths):
+        """paths の情報を読み込む（後から要求されたもの・paths の先頭のものほど先に読み込む）"""
+        with self.condition:
+            for path in reversed(paths):
+                if path in self.info or path in self.loading:
+                    continue
+                self.pending[path] = True
+                self.pending.move_to_end(path, last=False)
+            if self.pending:
+                self.condition.notify_all()
+
+    def worker(self):
+        from video_generator import VideoGenerator
+        generator = VideoGenerator(self.ffmpeg_path)
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                path, _ = self.pending.popitem(last=False)
+                self.loading.add(path)
+            try:
+                info = self.load(generator, path)
+            except Exception as e:
+                print(f"素材の情報を取得できませんでした: {os.path.basename(path)}: {e}")
+                info = {'size': None, 'duration': None, 'thumbnail': None}
+            with self.condition:
+                self.loading.discard(path)
+                self.info[path] = info
+            self.result_queue.put(('asset_info', (path, info)))
+
+    def load(self, generator, path):
+        """キャッシュにあれば読み込み、なければFFmpegで取得してキャッシュに保存する"""
+        key = make_cache_key(ASSET_INFO_VERSION, file_fingerprint(path), THUMBNAIL_SIZE)
+        cache_file = self.cache_dir / f"{key}.json"
+        thumbnail_file = self.cache_dir / f"{key}.png"
+        cached = load_json(cache_file)
+        if cached is not None:
+            cached['thumbnail'] = str(thumbnail_file) if cached['thumbnail'] else None
+            return cached
+
+        info = self.probe(generator, path, thumbnail_file)
+        save_json(cache_file, dict(info, thumbnail=bool(info['thumbnail'])))
+        return info
+
+    def probe(self, generator, path, thumbnail_file):
+        """FFmpegを1回実行して、サムネイルの作成と解像度・長さの取得を同時に行う"""
+        extension = os.path.splitext(path)[1].lower()
+        lines = []
+        cmd = [self.ffmpeg_path, '-hide_banner', '-i', path]
+        temp_file = thumbnail_file.with_name(f".tmp_{os.getpid()}_{threading.get_ident()}_{thumbnail_file.name}")
+        if extension not in AUDIO_EXTENSIONS:
+            width, height = THUMBNAIL_SIZE
+            scale = f'scale={width}:{height}:force_original_aspect_ratio=decrease'
+            if extension not in STILL_IMAGE_EXTENSIONS:
+                # 動画は冒頭の黒い画面を避けて、代表的なフレームを選ぶ
+                scale = f'thumbnail=50,{scale}'
+            cmd += ['-vf', scale, '-frames:v', '1', '-an', '-update', '1', '-f', 'image2', '-y', str(temp_file)]
+        try:
+            # 音声は出力を指定しないため終了コードは0以外になるが、入力の情報は出力される
+            generator.runner.run(cmd, "素材の情報の取得に失敗しました", stage="probe", check=False,
+                                 on_line=lines.append)
+            thumbnail = None
+            if temp_file.exists() and temp_file.stat().st_size > 0:
+                os.replace(temp_file, thumbnail_file)
+                thumbnail = str(thumbnail_file)
+        finally:
+            if temp_file.exists():
+                temp_file.unlink()
+
+        info = {'size': None, 'duration': None, 'thumbnail': thumbnail}
+        for line in lines:
+            duration = DURATION_PATTERN.search(line)
+            if duration and info['duration'] is None:
+                hours, minutes, seconds = duration.groups()
+                # 静止画の長さ（1フレーム分）は表示しない
+                if extension not in STILL_IMAGE_EXTENSIONS:
+                    info['duration'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+            size = VIDEO_SIZE_PATTERN.search(line)
+            if size and info['size'] is None and extension not in AUDIO_EXTENSIONS:
+                info['size'] = [int(size.group(1)), int(size.group(2))]
+        return info
+
+
+class AssetList:
+    """サムネイル付きの素材リスト（見えている行だけを描画する）
+
+    Listbox と同じく curselection() で選択中の行番号を返す。ウィジェットの操作はメインスレッドからのみ行う。
+    """
+
+    def __init__(self, parent, loader, rows=4, width=480, on_double_click=None):
+        self.loader = loader
+        self.items = []
+        self.selected = None
+        self.on_double_click = on_double_click
+        self.photos = OrderedDict()  # サムネイルのパス -> PhotoImage（最近使ったものを残す）
+        self.redraw_pending = False
+
+        self.frame = ttk.Frame(parent)
+        self.canvas = tk.Canvas(self.frame, height=rows * ROW_HEIGHT, width=width, bg='white',
+                                highlightthickness=1, highlightbackground='#c0c0c0')
+        self.scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=self.on_scroll, yscrollincrement=ROW_HEIGHT)
+        self.canvas.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.frame.columnconfigure(0, weight=1)
+
+        self.canvas.bind('<Configure>', lambda event: self.schedule_redraw())
+        self.canvas.bind('<Button-1>', self.on_click)
+        self.canvas.bind('<Double-Button-1>', self.on_double)
+        self.canvas.bind('<MouseWheel>', self.on_mousewheel)
+        self.canvas.bind('<Button-4>', lambda event: self.canvas.yview_scroll(-1, 'units'))
+        self.canvas.bind('<Button-5>', lambda event: self.canvas.yview_scroll(1, 'units'))
+
+    def grid(self, **kwargs):
+        self.frame.grid(**kwargs)
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def set_items(self, items):
+        """表示する素材のリストを置き換える（描画は見えている行だけなので件数によらず一定時間）"""
+        self.items = list(items)
+        if self.selected is not None and self.selected >= len(self.items):
+            self.selected = len(self.items) - 1 if self.items else None
+        self.canvas.configure(scrollregion=(0, 0, 0, len(self.items) * ROW_HEIGHT))
+        self.schedule_redraw()
+
+    def curselection(self):
+        return () if self.selected is None else (self.selected,)
+
+    def on_info(self, path):
+        """素材の情報が読み込まれた（見えている行なら描き直す）"""
+        first, last = self.visible_range()
+        if path in self.items[first:last]:
+            self.schedule_redraw()
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.schedule_redraw()
+
+    def on_mousewheel(self, event):
+        # Windows は1ノッチ120、macOS は小さな値が来る
+        step = -1 if event.delta > 0 else 1
+        self.canvas.yview_scroll(step if abs(event.delta) < 120 else step * (abs(event.delta) // 120), 'units')
+
+    def row_at(self, event):
+        index = int(self.canvas.canvasy(event.y) // ROW_HEIGHT)
+        return index if 0 <= index < len(self.items) else None
+
+    def on_click(self, event):
+        self.selected = self.row_at(event)
+        self.schedule_redraw()
+
+    def on_double(self, event):
+        index = self.row_at(event)
+        if index is not None and self.on_double_click:
+            self.on_double_click(index)
+
+    def visible_range(self):
+        top = self.canvas.canvasy(0)
+        height = max(self.canvas.winfo_height(), ROW_HEIGHT)
+        first = max(0, int(top // ROW_HEIGHT))
+        last = min(len(self.items), int((top + height) // ROW_HEIGHT) + 1)
+        return first, last
+
+    def schedule_redraw(self):
+        """描き直しはアイドル時に1回にまとめる（読み込み結果が続けて届いても1回だけ描く）"""
+        if not self.redraw_pending:
+            self.redraw_pending = True
+            self.canvas.after_idle(self.redraw)
+
+    def redraw(self):
+        self.redraw_pending = False
+        self.canvas.delete('row')
+        first, last = self.visible_range()
+        width = self.canvas.winfo_width()
+        thumbnail_width, thumbnail_height = THUMBNAIL_SIZE
+        for index in range(first, last):
+            path = self.items[index]
+            info = self.loader.get(path)
+            top = index * ROW_HEIGHT
+            if index == self.selected:
+                self.canvas.create_rectangle(0, top, width, top + ROW_HEIGHT, fill='#cce4ff', outline='',
+                                             tags='row')
+            image_top = top + (ROW_HEIGHT - thumbnail_height) // 2
+            photo = self.photo(info['thumbnail']) if info and info.get('thumbnail') else None
+            if photo is not None:
+                self.canvas.create_image(4 + thumbnail_width // 2, top + ROW_HEIGHT // 2, image=photo, tags='row')
+            else:
+                self.canvas.create_rectangle(4, image_top, 4 + thumbnail_width, image_top + thumbnail_height,
+                                             fill='#e8e8e8', outline='', tags='row')
+            text_left = thumbnail_width + 12
+            self.canvas.create_text(text_left, top + 13, text=os.path.basename(path), anchor=tk.W, tags='row')
+            self.canvas.create_text(text_left, top + 31, text=describe_info(info), anchor=tk.W,
+                                    fill='gray', font=('Arial', 9), tags='row')
+
+        # 見えている行とその前後を読み込む（見えている行が先）
+        self.loader.request(self.items[first:last]
+                            + self.items[last:last + PREFETCH_ROWS]
+                            + self.items[max(0, first - PREFETCH_ROWS):first])
+
+    def photo(self, thumbnail_file):
+        """サムネイルの PhotoImage（作成はメインスレッドで行う。読めない画像は None）"""
+        if thumbnail_file in self.photos:
+            self.photos.move_to_end(thumbnail_file)
+            return self.photos[thumbnail_file]
+        try:
+            photo = tk.PhotoImage(file=thumbnail_file)
+        except tk.TclError:
+            # PNGに対応していない古いTkでは枠だけを表示する
+            photo = None
+        self.photos[thumbnail_file] = photo
+        while len(self.photos) > MAX_PHOTO_IMAGES:
+            self.photos.popitem(last=False)
+        return photo
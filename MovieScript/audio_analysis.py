@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+音声解析
+FFmpegでデコードしたPCMを一定サイズのチャンクで読み込み、NumPyで音量・立ち上がりを解析する
+（曲の長さに関係なくメモリ使用量は一定）
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ffmpeg_runner import FFmpegRunner
+from media_cache import get_cache_dir, file_fingerprint, make_cache_key, load_json, save_json
+
+# 解析用のデコード設定（低サンプルレート・モノラル）
+ANALYSIS_SAMPLE_RATE = 8000
+# 解析結果（エンベロープ）の時間分解能（秒）
+FRAME_SECONDS = 0.5
+# 立ち上がり検出のため1フレームを分割する数
+SUBFRAMES = 8
+# 1回に読み込むフレーム数（= 60秒分）
+CHUNK_FRAMES = 120
+# 解析方法を変えたらキャッシュを無効化するため更新する
+ANALYSIS_VERSION = 1
+
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError("音声解析にはNumPyが必要です（pip install numpy）")
+
+
+def stream_pcm(ffmpeg_path, audio_file, sample_rate, chunk_samples, channels=1, runner=None):
+    """音声をfloat32のPCMにデコードし、chunk_samples ごとに返すジェネレーター
+
+    channels > 1 の場合は (samples, channels) の配列を返す。
+    最後のチャンクのみ短くなる場合がある。
+    runner: FFmpegRunner（キャンセル・停止検出を共有する。省略時は新しく作る）
+    """
+    require_numpy()
+    cmd = [
+        ffmpeg_path,
+        '-v', 'error',
+        '-i', audio_file,
+        '-vn',
+        '-ac', str(channels),
+        '-ar', str(sample_rate),
+        '-f', 'f32le',
+        '-'
+    ]
+    runner = runner or FFmpegRunner()
+    chunk_bytes = chunk_samples * channels * 4
+    with runner.stream(cmd, "音声のデコードに失敗しました", stage="analysis", stdout=True) as stream:
+        while True:
+            data = stream.read(chunk_bytes)
+            if not data:
+                break
+            usable = len(data) - len(data) % (channels * 4)
+            samples = np.frombuffer(data[:usable], dtype='<f4')
+            if channels > 1:
+                samples = samples.reshape(-1, channels)
+            yield samples
+
+
+def analyze_energy(ffmpeg_path, audio_file, runner=None):
+    """音量（RMS）と立ち上がり（オンセット）の強さを FRAME_SECONDS ごとに算出"""
+    require_numpy()
+    frame = int(ANALYSIS_SAMPLE_RATE * FRAME_SECONDS)
+    subframe = frame // SUBFRAMES
+
+    rms_chunks = []
+    onset_chunks = []
+    carry = np.zeros(0, dtype=np.float32)
+    previous_log_energy = None
+
+    for chunk in stream_pcm(ffmpeg_path, audio_file, ANALYSIS_SAMPLE_RATE, frame * CHUNK_FRAMES,
+                            runner=runner):
+        samples = np.concatenate([carry, chunk]) if carry.size else chunk
+        count = len(samples) // frame
+        carry = samples[count * frame:].copy()
+        if count == 0:
+            continue
+
+        frames = samples[:count * frame].reshape(count, SUBFRAMES, subframe)
+        sub_energy = np.mean(frames * frames, axis=2)  # (count, SUBFRAMES)
+        rms_chunks.append(np.sqrt(np.mean(sub_energy, axis=1)))
+
+        # サブフレーム間の対数エネルギーの増加量の合計を立ち上がりの強さとする
+        log_energy = np.log10(sub_energy.reshape(-1) + 1e-10)
+        if previous_log_energy is None:
+            previous_log_energy = log_energy[0]
+        diff = np.diff(np.concatenate([[previous_log_energy], log_energy]))
+        previous_log_energy = log_energy[-1]
+        onset_chunks.append(np.maximum(diff, 0).reshape(count, SUBFRAMES).sum(axis=1))
+
+    if not rms_chunks:
+        raise RuntimeError("音声データを読み込めませんでした")
+
+    rms = np.concatenate(rms_chunks)
+    onset = np.concatenate(onset_chunks)
+    return {
+        'version': ANALYSIS_VERSION,
+        'frame_seconds': FRAME_SECONDS,
+        'rms': np.round(rms, 6).tolist(),
+        'onset': np.round(onset, 4).tolist(),
+    }
+
+
+def load_analysis(ffmpeg_path, audio_file, runner=None):
+    """解析結果をキャッシュから取得（なければ解析して保存）"""
+    cache_file = get_cache_dir('analysis') / f"{make_cache_key(file_fingerprint(audio_file), ANALYSIS_VERSION)}.json"
+    analysis = load_json(cache_file)
+    if analysis is not None:
+        return analysis
+
+    analysis = analyze_energy(ffmpeg_path, audio_file, runner)
+    save_json(cache_file, analysis)
+    return analysis
+
+
+def find_highlight_start(analysis, window_seconds, onset_weight=0.5):
+    """音量と立ち上がりの合計スコアが最も高い区間の開始位置（秒）を返す"""
+    require_numpy()
+    frame_seconds = analysis['frame_seconds']
+    rms = np.asarray(analysis['rms'], dtype=np.float64)
+    onset = np.asarray(analysis['onset'], dtype=np.float64)
+
+    window = int(np.ceil(window_seconds / frame_seconds))
+    if window >= len(rms):
+        return 0.0
+
+    def normalize(values):
+        # 突発的なピークに引っ張られないよう95パーセンタイルで正規化
+        scale = np.percentile(values, 95)
+        return np.minimum(values / scale, 1.0) if scale > 0 else values
+
+    score = normalize(rms) + onset_weight * normalize(onset)
+    cumulative = np.concatenate([[0.0], np.cumsum(score)])
+    window_scores = cumulative[window:] - cumulative[:-window]
+    return float(np.argmax(window_scores) * frame_seconds)
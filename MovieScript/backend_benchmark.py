@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+メディア処理のバックエンドの比較
+同じBGM・背景で、FFmpeg（毎回サブプロセスを起動）とPyAV（インプロセス）のそれぞれについて
+長さの取得・単曲動画・ショート動画・単曲とショートの連続作成の時間を計測し、どちらが速いかを表示する。
+
+- 各処理は新しい VideoGenerator で計測する（メモリ上のデコード済み音声・エンコード済み背景がない状態）
+- 「単曲+ショート」は1つの VideoGenerator で続けて作成する（GUIの単曲+ショートやサービスのワーカーと同じ）
+- 背景の事前変換（background_cache）は計測前に済ませておく
+
+使い方:
+    python backend_benchmark.py BGM [BGM ...] --background 背景画像 [--short-seconds 30] [--probes 20]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from video_generator import VideoGenerator
+
+
+def run_probe(generator, bgm_file, background_file, output_dir, args):
+    for _ in range(args.probes):
+        generator.get_audio_duration(bgm_file)
+
+
+def run_single(generator, bgm_file, background_file, output_dir, args):
+    generator.create_single_video(bgm_file, [background_file], output_dir, "single")
+
+
+def run_short(generator, bgm_file, background_file, output_dir, args):
+    generator.create_short_version(bgm_file, [background_file], output_dir, args.short_seconds, "short",
+                                   auto_highlight=False)
+
+
+def run_single_and_short(generator, bgm_file, background_file, output_dir, args):
+    run_single(generator, bgm_file, background_file, output_dir, args)
+    run_short(generator, bgm_file, background_file, output_dir, args)
+
+
+# (表示名, 処理)
+CASES = [
+    ("長さの取得", run_probe),
+    ("単曲", run_single),
+    ("ショート", run_short),
+    ("単曲+ショート", run_single_and_short),
+]
+
+
+def measure(backend, case, bgm_file, background_file, args):
+    """1つの処理を指定したバックエンドで実行し、実時間（秒）を返す"""
+    output_dir = tempfile.mkdtemp(prefix="echogarden_bench_")
+    try:
+        generator = VideoGenerator(backend=backend)
+        started = time.perf_counter()
+        case(generator, bgm_file, background_file, output_dir, args)
+        return time.perf_counter() - started
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def format_winner(seconds):
+    ffmpeg_seconds, pyav_seconds = seconds["ffmpeg"], seconds["pyav"]
+    if pyav_seconds < ffmpeg_seconds:
+        return f"pyav（{ffmpeg_seconds / pyav_seconds:.1f}倍）"
+    return f"ffmpeg（{pyav_seconds / ffmpeg_seconds:.1f}倍）"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FFmpeg / PyAV バックエンドの処理時間を比較します")
+    parser.add_argument('bgm_files', nargs='+', help="BGMファイル（長さの違う曲を並べると傾向が分かります）")
+    parser.add_argument('--background', required=True, help="背景画像")
+    parser.add_argument('--short-seconds', type=int, default=30, help="ショート動画の長さ（秒）")
+    parser.add_argument('--probes', type=int, default=20, help="長さの取得を繰り返す回数")
+    args = parser.parse_args()
+
+    # 背景の事前変換は両方のバックエンドで共通なので計測に含めない
+    VideoGenerator().prepare_background_variants([args.background])
+
+    rows = []
+    for bgm_file in args.bgm_files:
+        audio_duration = VideoGenerator().get_audio_duration(bgm_file)
+        for name, case in CASES:
+            label = f"{name}×{args.probes}" if case is run_probe else name
+            seconds = {backend: measure(backend, case, bgm_file, args.background, args)
+                       for backend in ("ffmpeg", "pyav")}
+            rows.append((f"{os.path.basename(bgm_file)}（{audio_duration:.0f}秒）", label, seconds))
+
+    print()
+    print(f"{'BGM':<24} {'処理':<14} {'ffmpeg':>9} {'pyav':>9}  速い方")
+    for bgm_label, label, seconds in rows:
+        print(f"{bgm_label:<24} {label:<14} {seconds['ffmpeg']:>8.2f}秒 {seconds['pyav']:>8.2f}秒  "
+              f"{format_winner(seconds)}")
+
+
+if __name__ == '__main__':
+    main()
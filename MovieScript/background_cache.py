@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+背景画像の事前変換
+静止画の背景を取り込んだ時点で出力の解像度（横 1920x1080・縦 1080x1920）に収め（余白は黒）、
+出力と同じピクセルフォーマット（yuv420p）の1フレームの映像（Y4M）に変換してキャッシュする。
+
+エンコード時は毎フレームの画像のデコード・拡大縮小・色変換が不要になり、変換済みのフレームを読み込むだけになる
+（build_video_filter の scale/pad は同じ解像度の入力ではフレームをそのまま通すため、処理はほぼ発生しない）。
+変換結果は元画像の内容のハッシュごとのフォルダに保存するため、ファイル名の変更やコピーでは作り直さない。
+"""
+
+import os
+import threading
+
+from media_cache import STILL_IMAGE_EXTENSIONS, get_cache_dir, content_hash
+
+NORMALIZED_EXTENSION = '.y4m'
+
+# 変換方法を変えたらキャッシュを無効化するため更新する
+BACKGROUND_CACHE_VERSION = 1
+
+
+def can_normalize(background_file):
+    """事前に変換できる背景か（静止画のみ。GIF・動画はそのまま使う）"""
+    return os.path.splitext(background_file)[1].lower() in STILL_IMAGE_EXTENSIONS
+
+
+def is_normalized(background_file):
+    return background_file.endswith(NORMALIZED_EXTENSION)
+
+
+def normalized_path(background_file, width, height):
+    """変換済みの背景の保存先（<元画像のハッシュ>/<幅>x<高さ>_v<版>.y4m）"""
+    directory = get_cache_dir('backgrounds') / content_hash(background_file)
+    return directory / f"{width}x{height}_v{BACKGROUND_CACHE_VERSION}{NORMALIZED_EXTENSION}"
+
+
+def normalize_background(generator, background_file, width, height):
+    """背景画像を出力の解像度・ピクセルフォーマットに変換し、キャッシュのパスを返す"""
+    cache_file = normalized_path(background_file, width, height)
+    if cache_file.exists():
+        return str(cache_file)
+
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    # 取り込み時の変換と動画作成が同時に同じ画像を変換しても壊れたファイルを残さない
+    temp_file = cache_file.with_name(f".tmp_{os.getpid()}_{threading.get_ident()}_{cache_file.name}")
+    try:
+        generator.run_ffmpeg([
+            generator.ffmpeg_path,
+            '-i', background_file,
+            '-vf', generator.build_video_filter(width, height),
+            '-frames:v', '1',
+            '-pix_fmt', 'yuv420p',
+            '-r', str(generator.VIDEO_FPS),
+            '-f', 'yuv4mpegpipe',
+            '-y', str(temp_file)
+        ], "背景画像の変換に失敗しました", stage="background")
+        os.replace(temp_file, cache_file)
+    finally:
+        if temp_file.exists():
+            temp_file.unlink()
+    return str(cache_file)
+
+
+def build_input_args(background_file, duration):
+    """背景をループする入力引数
+
+    変換済みの背景（1フレームの映像）は -stream_loop で繰り返す。読み込みが速く、-shortest だけでは
+    映像が先行して長くなるため、入力側で長さを指定する。
+    """
+    if is_normalized(background_file):
+        return ['-stream_loop', '-1', '-t', str(duration), '-i', background_file]
+    return ['-loop', '1', '-i', background_file]
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+縦型動画の背景ぼかし埋め
+横長の背景を縦型（1080x1920）に収める際、上下の余白を黒帯ではなく、
+同じ背景を画面いっぱいに拡大してぼかしたもので埋める。
+
+- ぼかしは縮小した画像に対して行ってから拡大する（フル解像度でぼかすより大幅に軽い）
+- 静止画の背景は合成済みの1枚を作成してキャッシュするため、エンコードの処理量は黒帯の場合と同じ
+- 動画の背景（またはPillowがない場合）はFFmpegのフィルターで同じ処理を毎フレーム行う
+"""
+
+import os
+
+try:
+    from PIL import Image, ImageEnhance, ImageFilter, ImageOps
+except ImportError:
+    Image = None
+
+from media_cache import STILL_IMAGE_EXTENSIONS, get_cache_dir, file_fingerprint, make_cache_key, save_image
+
+# 余白の埋め方: pad（黒帯）/ blur（背景のぼかし）
+FILL_MODES = ("pad", "blur")
+
+# ぼかす前に縮小する倍率（1/8 の解像度でぼかしてから拡大する）
+DOWNSCALE = 8
+# ぼかしの半径（縮小後の画素数）
+BLUR_RADIUS = 6
+# 前景と区別しやすいよう、ぼかした背景を暗くする（明るさの倍率）
+DIM = 0.6
+
+# 処理内容を変えたらキャッシュを無効化するため更新する
+BLUR_FILL_VERSION = 1
+
+
+def validate_fill(fill):
+    if fill not in FILL_MODES:
+        raise ValueError(f"不明な余白の埋め方です: {fill}（{', '.join(FILL_MODES)}）")
+    return fill
+
+
+def small_size(width, height):
+    """ぼかしを行う縮小後の大きさ（偶数に揃える）"""
+    return max(2, width // DOWNSCALE // 2 * 2), max(2, height // DOWNSCALE // 2 * 2)
+
+
+def can_prerender(background_file):
+    """合成済みの画像を事前に作成できるか（静止画かつPillowがある場合）"""
+    return Image is not None and os.path.splitext(background_file)[1].lower() in STILL_IMAGE_EXTENSIONS
+
+
+def render_blur_fill(background_file, width, height):
+    """ぼかした背景の上に背景全体を収めた画像を作成し、キャッシュのパスを返す"""
+    key = make_cache_key(BLUR_FILL_VERSION, file_fingerprint(background_file), width, height,
+                         DOWNSCALE, BLUR_RADIUS, DIM)
+    # 透過は不要で、毎フレームの読み込みが速いJPEGで保存する（ぼかした画像はPNGだとデコードが重い）
+    cache_file = get_cache_dir('blur_fill') / f"{key}.jpg"
+    if cache_file.exists():
+        return str(cache_file)
+
+    with Image.open(background_file) as source:
+        source = source.convert('RGB')
+        # 画面を覆うように縮小・中央を切り抜いてから、小さいままぼかして暗くし、拡大する
+        fill = ImageOps.fit(source, small_size(width, height), Image.BILINEAR)
+        fill = fill.filter(ImageFilter.GaussianBlur(BLUR_RADIUS))
+        fill = ImageEnhance.Brightness(fill).enhance(DIM)
+        canvas = fill.resize((width, height), Image.BICUBIC)
+        front = ImageOps.contain(source, (width, height), Image.LANCZOS)
+    canvas.paste(front, ((width - front.width) // 2, (height - front.height) // 2))
+    save_image(canvas, cache_file, quality=95)
+    return str(cache_file)
+
+
+def build_blur_fill_filter(width, height):
+    """ぼかし埋めを毎フレーム行うビデオフィルター（-vf と filter_complex のどちらでも使える）"""
+    small_width, small_height = small_size(width, height)
+    return (
+        f'split=2[fill_back][fill_front];'
+        f'[fill_back]scale={small_width}:{small_height}:force_original_aspect_ratio=increase,'
+        f'crop={small_width}:{small_height},boxblur={BLUR_RADIUS}:1,lutyuv=y=val*{DIM},'
+        f'scale={width}:{height}:flags=bicubic,setsar=1[fill_blur];'
+        f'[fill_front]scale={width}:{height}:force_original_aspect_ratio=decrease,setsar=1[fill_fit];'
+        f'[fill_blur][fill_fit]overlay=(W-w)/2:(H-h)/2'
+    )
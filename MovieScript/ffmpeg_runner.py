@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FFmpeg実行レイヤー
+すべてのFFmpeg呼び出しを1か所で実行し、進捗通知・キャンセル・タイムアウト・停止検出・再試行を行う
+
+stderrは専用スレッドで読み続け、直近の行だけをリングバッファに保持する
+（数時間のエンコードでもメモリ使用量は一定）。
+失敗時はログの末尾から原因を判定し、種類ごとの例外（FFmpegError のサブクラス）を送出する。
+
+PCMの読み込みや生成した映像の書き込みなど、標準入出力をパイプでつなぐ場合は
+FFmpegRunner.stream を使う（キャンセル・タイムアウト・停止検出は run と同じ）。
+"""
+
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+
+# 保持するstderrの行数
+LOG_TAIL_LINES = 200
+# 例外メッセージに含めるエラー行の数
+ERROR_SUMMARY_LINES = 5
+# この秒数、進捗もログ出力もなければ停止したとみなす
+STALL_SECONDS = 120
+# 一時的なエラーの場合の最大実行回数（初回を含む）
+MAX_ATTEMPTS = 2
+RETRY_DELAY_SECONDS = 3
+# プロセスの状態を確認する間隔（秒）
+POLL_INTERVAL = 0.25
+
+# 処理段階ごとのタイムアウト: (基本秒数, 出力1秒あたりの追加秒数)
+# 追加秒数がある段階で出力の長さが分からない場合はタイムアウトしない（停止検出のみ）
+STAGE_TIMEOUTS = {
+    'probe': (60, 0),
+    'background': (120, 0),
+    'audio': (300, 1.0),
+    'concat': (600, 0.5),
+    'encode': (900, 4.0),
+    'slideshow': (300, 20.0),
+    'preview': (300, 2.0),
+    'analysis': (120, 0.5),
+    'visualizer': (300, 2.0),
+}
+
+# FFmpegの進捗出力（time=00:01:23.45）
+PROGRESS_TIME_PATTERN = re.compile(r'time=\s*(-?)(\d+):(\d+):(\d+(?:\.\d+)?)')
+# FFmpegの処理速度（speed=12.3x、実時間に対する倍率）
+PROGRESS_SPEED_PATTERN = re.compile(r'speed=\s*(\d+(?:\.\d+)?)x')
+# エラー内容を含む行
+ERROR_LINE_PATTERN = re.compile(
+    r'error|invalid|no such|not found|failed|cannot|unable|denied|no space|unknown', re.IGNORECASE)
+
+
+class RenderCancelledError(RuntimeError):
+    """ユーザー操作などで動画作成がキャンセルされた"""
+
+
+class FFmpegError(RuntimeError):
+    """FFmpegの実行に失敗した
+
+    log_tail: stderrの末尾（リスト）。transient が True の種類は再試行の対象。
+    """
+
+    transient = False
+
+    def __init__(self, message, stage=None, returncode=None, log_tail=None):
+        super().__init__(message)
+        self.stage = stage
+        self.returncode = returncode
+        self.log_tail = log_tail or []
+
+
+class FFmpegInputError(FFmpegError):
+    """入力ファイルが見つからない・壊れている"""
+
+
+class FFmpegOutputError(FFmpegError):
+    """出力先に書き込めない（容量不足・権限など）"""
+
+
+class FFmpegFilterError(FFmpegError):
+    """フィルターの指定が不正"""
+
+
+class FFmpegEncoderError(FFmpegError):
+    """エンコーダーが使えない・初期化できない"""
+
+
+class FFmpegTransientError(FFmpegError):
+    """一時的な原因（強制終了・メモリ不足など）で失敗した"""
+
+    transient = True
+
+
+class FFmpegTimeoutError(FFmpegError):
+    """処理段階ごとの制限時間を超えた"""
+
+    transient = True
+
+
+class FFmpegStallError(FFmpegError):
+    """進捗が一定時間止まった"""
+
+    transient = True
+
+
+# ログの内容から例外の種類を判定する（上から順に確認）
+ERROR_RULES = [
+    (FFmpegInputError, ('No such file or directory', 'Invalid data found when processing input',
+                        'moov atom not found', 'does not contain any stream')),
+    (FFmpegOutputError, ('No space left on device', 'Permission denied', 'Read-only file system')),
+    (FFmpegFilterError, ('Error initializing filter', 'Error reinitializing filters', 'No such filter',
+                         'Failed to configure', 'Error parsing filterchain')),
+    (FFmpegEncoderError, ('Unknown encoder', 'Error while opening encoder', 'Encoder not found')),
+    (FFmpegTransientError, ('Resource temporarily unavailable', 'Cannot allocate memory')),
+]
+
+
+def summarize_log(log_tail, limit=ERROR_SUMMARY_LINES):
+    """ログの末尾からエラー内容の行だけを取り出す（なければ最後の数行）"""
+    lines = [line for line in log_tail if ERROR_LINE_PATTERN.search(line)]
+    return (lines or list(log_tail))[-limit:]
+
+
+def classify_error(error_message, stage, returncode, log_tail):
+    """終了コードとログから適切な例外を作成"""
+    text = '\n'.join(log_tail)
+    error_class = FFmpegError
+    for candidate, patterns in ERROR_RULES:
+        if any(pattern in text for pattern in patterns):
+            error_class = candidate
+            break
+    else:
+        if returncode is not None and returncode < 0:
+            # シグナルで強制終了された（メモリ不足で停止された場合など）
+            error_class = FFmpegTransientError
+
+    summary = '\n'.join(summarize_log(log_tail))
+    return error_class(f"{error_message}: {summary}", stage, returncode, list(log_tail))
+
+
+def stage_timeout(stage, duration):
+    """処理段階と出力の長さから制限時間（秒）を求める（制限しない場合は None）"""
+    if stage not in STAGE_TIMEOUTS:
+        return None
+    base, per_second = STAGE_TIMEOUTS[stage]
+    if per_second and not duration:
+        return None
+    return base + per_second * (duration or 0)
+
+
+class FFmpegRunner:
+    """FFmpegプロセスの実行を管理する（1つのVideoGeneratorにつき1つ）"""
+
+    def __init__(self, log_lines=LOG_TAIL_LINES, stall_seconds=STALL_SECONDS,
+                 max_attempts=MAX_ATTEMPTS):
+        self.log_lines = log_lines
+        self.stall_seconds = stall_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.current_process = None
+        self.cancelled = False
+        # 計測モード（render_profiler.RenderProfiler）。None の場合は計測しない
+        self.profiler = None
+
+    def cancel(self):
+        """実行中のFFmpegを停止し、以降の実行もキャンセルする（他スレッドから呼び出し可）"""
+        self.cancelled = True
+        process = self.current_process
+        if process and process.poll() is None:
+            process.terminate()
+
+    def stream(self, cmd, error_message, stage="encode", duration=None, stdin=False, stdout=False,
+               timeout=None):
+        """標準入力・標準出力をパイプにしてFFmpegを起動する（with 文で使う FFmpegStream を返す）
+
+        stdin / stdout: True の場合、FFmpegStream.write / read でデータを受け渡す
+            （stdout にファイルオブジェクトを渡した場合は、FFmpegの出力をそのまま書き込ませる）
+        duration, timeout: run と同じ
+        途中までデータを受け渡した後では再実行できないため、一時的なエラーでも再試行しない。
+        """
+        if timeout is None:
+            timeout = stage_timeout(stage, duration)
+        return FFmpegStream(self, cmd, error_message, stage, stdin, stdout, timeout)
+
+    def run(self, cmd, error_message, stage="encode", duration=None, progress=None,
+            on_line=None, check=True, timeout=None):
+        """FFmpegを実行し、(終了コード, ログ末尾) を返す
+
+        duration: 出力の想定秒数（進捗率と制限時間の計算に使う）
+        progress: progress(stage, fraction, speed) 形式の進捗コールバック
+        on_line: stderrの各行を受け取るコールバック（読み取りスレッドから呼ばれる）
+        check: False の場合、終了コードが0以外でも例外にしない
+        timeout: 制限時間（秒）。省略時は処理段階から決める
+        """
+        if timeout is None:
+            timeout = stage_timeout(stage, duration)
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return self.run_once(cmd, error_message, stage, duration, progress, on_line,
+                                     check, timeout)
+            except FFmpegError as e:
+                if not e.transient or attempt >= self.max_attempts or self.cancelled:
+                    raise
+                print(f"FFmpegが一時的なエラーで停止しました。再試行します "
+                      f"({attempt}/{self.max_attempts - 1}): {e}")
+                self.wait_before_retry()
+
+    def wait_before_retry(self):
+        """再試行前に少し待つ（待機中のキャンセルにも反応する）"""
+        deadline = time.monotonic() + RETRY_DELAY_SECONDS
+        while time.monotonic() < deadline:
+            if self.cancelled:
+                raise RenderCancelledError("動画作成がキャンセルされました")
+            time.sleep(POLL_INTERVAL)
+
+    def run_once(self, cmd, error_message, stage, duration, progress, on_line, check, timeout):
+        if self.cancelled:
+            raise RenderCancelledError("動画作成がキャンセルされました")
+
+        profile = None
+        if self.profiler is not None:
+            # FFmpeg自身のベンチマーク出力を有効にする（bench: 行は集計のみでログには残さない）
+            cmd = cmd[:1] + self.profiler.ffmpeg_args() + cmd[1:]
+            profile = self.profiler.start_ffmpeg(stage, os.path.basename(cmd[-1]), duration)
+
+        process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE, text=True,
+                                   encoding='utf-8', errors='replace')
+        self.current_process = process
+        if self.cancelled:
+            # Popen中にキャンセルされた場合
+            process.terminate()
+
+        log_tail = deque(maxlen=self.log_lines)
+        # 読み取りスレッドが更新する進捗（GILにより単純な代入は安全）
+        state = {'elapsed': None, 'speed': None, 'last_activity': time.monotonic()}
+
+        def read_stderr():
+            # text=True では進捗行の \r も改行として扱われる
+            for line in process.stderr:
+                line = line.rstrip()
+                if not line:
+                    continue
+                if profile is not None and line.startswith('bench:'):
+                    profile.feed(line)
+                    continue
+                log_tail.append(line)
+                now = time.monotonic()
+                match = PROGRESS_TIME_PATTERN.search(line)
+                if match:
+                    if not match.group(1):
+                        hours, minutes, seconds = match.group(2, 3, 4)
+                        elapsed = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+                        # 同じ時刻のまま進捗行だけ出続ける場合は停止とみなす
+                        if elapsed != state['elapsed']:
+                            state['elapsed'] = elapsed
+                            state['last_activity'] = now
+                    speed_match = PROGRESS_SPEED_PATTERN.search(line)
+                    if speed_match:
+                        state['speed'] = float(speed_match.group(1))
+                else:
+                    state['last_activity'] = now
+                if on_line is not None:
+                    on_line(line)
+
+        reader = threading.Thread(target=read_stderr, name="ffmpeg-stderr")
+        reader.daemon = True
+        reader.start()
+
+        started = time.monotonic()
+        failure = None
+        reported_elapsed = None
+        try:
+            if progress is not None:
+                progress(stage, 0.0 if duration else None, None)
+            while True:
+                try:
+                    returncode = process.wait(timeout=POLL_INTERVAL)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+
+                now = time.monotonic()
+                if self.cancelled or failure is not None:
+                    process.kill()
+                elif timeout and now - started > timeout:
+                    failure = FFmpegTimeoutError(
+                        f"{error_message}: 制限時間（{timeout:.0f}秒）を超えました",
+                        stage, None, list(log_tail))
+                    process.kill()
+                elif self.stall_seconds and now - state['last_activity'] > self.stall_seconds:
+                    failure = FFmpegStallError(
+                        f"{error_message}: {self.stall_seconds}秒間進捗がありません",
+                        stage, None, list(log_tail))
+                    process.kill()
+                elif progress is not None and duration and state['elapsed'] != reported_elapsed:
+                    reported_elapsed = state['elapsed']
+                    progress(stage, min(1.0, reported_elapsed / duration), state['speed'])
+            reader.join()
+        finally:
+            self.current_process = None
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            reader.join(timeout=5)
+            process.stderr.close()
+            if profile is not None:
+                self.profiler.finish_ffmpeg(profile, time.monotonic() - started, process.returncode)
+
+        if self.cancelled:
+            raise RenderCancelledError("動画作成がキャンセルされました")
+        if failure is not None:
+            raise failure
+        if returncode != 0 and check:
+            raise classify_error(error_message, stage, returncode, log_tail)
+        if progress is not None:
+            progress(stage, 1.0, state['speed'])
+        return returncode, list(log_tail)
+
+
+class FFmpegStream:
+    """FFmpegRunner.stream で起動した、標準入出力をパイプでつないだFFmpegプロセス
+
+    read / write は呼び出し元のスレッドで行い、データの受け渡しも進捗として停止検出に使う。
+    キャンセル・制限時間・停止は監視スレッドが検出してプロセスを止め、with 文を抜けるときに例外を送出する。
+    """
+
+    def __init__(self, runner, cmd, error_message, stage, stdin, stdout, timeout):
+        self.runner = runner
+        self.cmd = cmd
+        self.error_message = error_message
+        self.stage = stage
+        self.use_stdin = stdin
+        self.use_stdout = stdout
+        self.timeout = timeout
+        self.process = None
+        self.log_tail = deque(maxlen=runner.log_lines)
+        self.failure = None
+        self.last_activity = None
+        self.finished = threading.Event()
+        self.threads = []
+        self.previous_process = None
+
+    def __enter__(self):
+        runner = self.runner
+        if runner.cancelled:
+            raise RenderCancelledError("動画作成がキャンセルされました")
+
+        self.process = subprocess.Popen(
+            self.cmd, stdin=subprocess.PIPE if self.use_stdin else subprocess.DEVNULL,
+            stdout=subprocess.PIPE if self.use_stdout is True else self.use_stdout or subprocess.DEVNULL,
+            stderr=subprocess.PIPE)
+        # 同時に複数のストリームを使う場合があるため、終了時に元のプロセスに戻す
+        self.previous_process = runner.current_process
+        runner.current_process = self.process
+        if runner.cancelled:
+            # Popen中にキャンセルされた場合
+            self.process.terminate()
+
+        self.started = self.last_activity = time.monotonic()
+        for target, name in ((self.read_stderr, "ffmpeg-stream-stderr"), (self.watch, "ffmpeg-stream-watch")):
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def read_stderr(self):
+        for line in self.process.stderr:
+            line = line.decode('utf-8', errors='replace').rstrip()
+            if line:
+                self.log_tail.append(line)
+                self.last_activity = time.monotonic()
+
+    def watch(self):
+        """キャンセル・制限時間・停止を監視し、該当すればプロセスを止める"""
+        while not self.finished.wait(POLL_INTERVAL):
+            if self.process.poll() is not None:
+                continue
+            now = time.monotonic()
+            stall_seconds = self.runner.stall_seconds
+            if self.runner.cancelled:
+                self.process.kill()
+            elif self.timeout and now - self.started > self.timeout:
+                self.failure = FFmpegTimeoutError(
+                    f"{self.error_message}: 制限時間（{self.timeout:.0f}秒）を超えました",
+                    self.stage, None, list(self.log_tail))
+                self.process.kill()
+            elif stall_seconds and now - self.last_activity > stall_seconds:
+                self.failure = FFmpegStallError(
+                    f"{self.error_message}: {stall_seconds}秒間進捗がありません",
+                    self.stage, None, list(self.log_tail))
+                self.process.kill()
+
+    def read(self, size):
+        """標準出力から最大 size バイト読み込む（終了していれば空のバイト列）"""
+        data = self.process.stdout.read(size)
+        self.last_activity = time.monotonic()
+        return data
+
+    def write(self, data):
+        """標準入力に書き込む"""
+        self.process.stdin.write(data)
+        self.last_activity = time.monotonic()
+
+    def __exit__(self, exc_type, exc, traceback):
+        process = self.process
+        try:
+            if exc_type is None:
+                if process.stdin:
+                    try:
+                        process.stdin.close()
+                    except OSError:
+                        # 先に終了していた場合（終了コードとログで判定する）
+                        pass
+                # 入力を閉じた後に止まった場合も監視スレッドが止める
+                process.wait()
+        finally:
+            self.finished.set()
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            for thread in self.threads:
+                thread.join(timeout=5)
+            for pipe in (process.stdin, process.stdout, process.stderr):
+                if pipe:
+                    try:
+                        pipe.close()
+                    except OSError:
+                        pass
+            if self.runner.current_process is process:
+                self.runner.current_process = self.previous_process
+
+        # 呼び出し側の例外はそのまま伝える（プロセスが止められたことによる入出力エラーを除く）
+        if exc_type is not None and not issubclass(exc_type, OSError):
+            return False
+        if self.runner.cancelled:
+            raise RenderCancelledError("動画作成がキャンセルされました")
+        if self.failure is not None:
+            raise self.failure
+        if process.returncode != 0:
+            raise classify_error(self.error_message, self.stage, process.returncode, self.log_tail)
+        return False
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+24時間配信（ライブ配信モード）
+プレイリストの曲と背景を順番に切り替えながら、終わりのない動画をリアルタイムで配信する。
+
+- 配信用のFFmpeg（パブリッシャー）を1つだけ起動し続け、標準入力のMPEG-TSを再エンコードせずに
+  RTMP / SRT / ファイル / 標準出力へ送る。曲が変わってもパブリッシャーは再起動しない（接続は切れない）
+- 背景ごとに10秒分の映像を、曲ごとにフェード付きの音声を1回だけエンコードしてキャッシュする。
+  配信中はそれらを -c copy で組み合わせ（映像はループ）、タイムスタンプを続けて流すだけなのでCPUをほとんど使わない
+- 次の曲の準備（初回のエンコード）は再生中の曲の裏で行う
+- プレイリストは1周ごとに読み直すため、配信を止めずに曲を追加・削除できる
+
+使い方:
+    python live_stream.py --playlist playlist.txt --backgrounds ../Image \\
+        --output rtmp://a.rtmp.youtube.com/live2/<ストリームキー>
+    # 動作確認（ファイルに実時間より速く書き出し、3曲で終了）
+    python live_stream.py --playlist ../Sound --backgrounds ../Image --output test.ts --no-realtime --max-tracks 3
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from ffmpeg_runner import FFmpegError, FFmpegRunner
+from media_cache import AUDIO_EXTENSIONS, BACKGROUND_EXTENSIONS, get_cache_dir, file_fingerprint, make_cache_key
+from video_generator import VideoGenerator
+from watch_folder import list_files
+import background_cache
+
+# 背景ごとに事前にエンコードする映像の長さ（秒）。配信中はこれをループする
+STILL_SEGMENT_SECONDS = 10
+# キーフレーム間隔（秒）。配信サービスの推奨値（2秒）に合わせる
+KEYFRAME_SECONDS = 2
+# 音声の形式（曲が変わってもパブリッシャーに同じ形式で渡すため、すべての曲をそろえる）
+AUDIO_BITRATE = '128k'
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_CHANNELS = 2
+AAC_FRAME_SAMPLES = 1024
+# 曲の切り替わりのフェードイン・アウト（秒）
+FADE_SECONDS = 2
+# パブリッシャーが終了した（接続が切れた）場合に再接続するまでの待ち時間（秒）
+RECONNECT_DELAY = 10
+# 曲の映像・音声（MPEG-TS）をパブリッシャーに渡す単位（バイト）
+FEED_CHUNK_BYTES = 64 * 1024
+
+# エンコード方法を変えたらキャッシュを無効化するため更新する
+LIVE_CACHE_VERSION = 1
+
+
+def output_format(output):
+    """出力先からパブリッシャーの (出力形式, 出力先) を決める"""
+    if output == '-':
+        return 'mpegts', 'pipe:1'
+    scheme = output.split('://', 1)[0].lower() if '://' in output else None
+    if scheme in ('rtmp', 'rtmps'):
+        return 'flv', output
+    if scheme in ('srt', 'udp', 'tcp'):
+        return 'mpegts', output
+    if scheme is not None:
+        raise ValueError(f"対応していない配信先です: {output}（rtmp / rtmps / srt / udp / tcp / ファイル / -）")
+    extension = os.path.splitext(output)[1].lower()
+    return {'.flv': 'flv', '.mkv': 'matroska'}.get(extension, 'mpegts'), output
+
+
+def load_playlist(playlist):
+    """プレイリスト（音声ファイルのフォルダ、または1行に1ファイルのテキスト・m3u）を読み込む"""
+    path = Path(playlist)
+    if path.is_dir():
+        return [str(track) for track in list_files(path.resolve(), AUDIO_EXTENSIONS)]
+    tracks = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            track = (path.parent / line).resolve()
+            if track.is_file():
+                tracks.append(str(track))
+            else:
+                print(f"警告: プレイリストの曲が見つかりません: {line}")
+    return tracks
+
+
+def resolve_backgrounds(backgrounds):
+    """背景の指定（ファイル・フォルダ）を静止画の背景のリストに変換（配信では動画の背景は使わない）"""
+    files = []
+    for background in backgrounds:
+        path = Path(background)
+        if path.is_dir():
+            files.extend(str(file) for file in list_files(path.resolve(), BACKGROUND_EXTENSIONS))
+        else:
+            files.append(str(path.resolve()))
+    stills = [file for file in files if background_cache.can_normalize(file)]
+    for file in sorted(set(files) - set(stills)):
+        print(f"警告: 配信では静止画以外の背景は使用できません: {os.path.basename(file)}")
+    return stills
+
+
+class LiveStreamer:
+    """プレイリストの曲を背景とともに途切れなく配信する"""
+
+    def __init__(self, generator, playlist, backgrounds, output, fade_sec=FADE_SECONDS, shuffle=False,
+                 realtime=True):
+        self.generator = generator
+        self.playlist = playlist
+        self.backgrounds = resolve_backgrounds(backgrounds)
+        if not self.backgrounds:
+            raise ValueError("配信に使える背景画像がありません")
+        self.format, self.target = output_format(output)
+        self.fade_sec = fade_sec
+        self.shuffle = shuffle
+        # False の場合は実時間を待たずに書き出す（ファイル出力での動作確認用）
+        self.realtime = realtime
+        self.cache_dir = get_cache_dir('live')
+        # パブリッシャーと送出用のFFmpeg（エンコード用の generator.runner とは別に、停止を検出する）
+        self.runner = FFmpegRunner()
+        self.publisher = None
+        self.feeder = None
+        self.stop_event = threading.Event()
+
+    def encode_cached(self, cache_file, cmd, error_message, stage, duration):
+        """cmd の出力先（最後の引数）を一時ファイルにしてエンコードし、キャッシュに置く"""
+        temp_file = cache_file.with_name(f".tmp_{os.getpid()}_{cache_file.name}")
+        try:
+            self.generator.run_ffmpeg(cmd + ['-y', str(temp_file)], error_message, stage=stage, duration=duration)
+            os.replace(temp_file, cache_file)
+        finally:
+            if temp_file.exists():
+                temp_file.unlink()
+
+    def still_segment(self, background_file):
+        """背景の映像（STILL_SEGMENT_SECONDS 秒、キーフレームは KEYFRAME_SECONDS 秒ごと）を用意する"""
+        source_name = os.path.basename(background_file)
+        background_file = self.generator.normalize_background(background_file, self.generator.VIDEO_SIZE)
+        fps = self.generator.VIDEO_FPS
+        key = make_cache_key(LIVE_CACHE_VERSION, file_fingerprint(background_file), self.generator.VIDEO_SIZE,
+                             fps, STILL_SEGMENT_SECONDS, KEYFRAME_SECONDS)
+        cache_file = self.cache_dir / f"still_{key}.mp4"
+        if not cache_file.exists():
+            print(f"配信用の背景を作成中: {source_name}")
+            keyint = str(fps * KEYFRAME_SECONDS)
+            self.encode_cached(cache_file, [
+                self.generator.ffmpeg_path,
+            ] + background_cache.build_input_args(background_file, STILL_SEGMENT_SECONDS) + [
+                '-vf', self.generator.build_video_filter(*self.generator.VIDEO_SIZE),
+                '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-tune', 'stillimage',
+                '-r', str(fps), '-g', keyint, '-keyint_min', keyint, '-sc_threshold', '0', '-bf', '0',
+                '-t', str(STILL_SEGMENT_SECONDS), '-an',
+            ], "配信用の背景の作成に失敗しました", "encode", STILL_SEGMENT_SECONDS)
+        return str(cache_file)
+
+    def track_audio(self, track_file):
+        """曲の音声（フェード付きのAAC）を用意し、(ファイル, 長さ) を返す
+
+        音声はADTS（.aac）で保存する。m4a と違い先頭のパケットが時刻0から始まる（エディットリストがない）ため、
+        -c copy で切り出しても曲の境目で前後の曲の音声が重ならない。
+        """
+        duration = self.generator.get_audio_duration(track_file)
+        if not duration:
+            raise ValueError(f"音声ファイルの長さを取得できませんでした: {track_file}")
+        key = make_cache_key(LIVE_CACHE_VERSION, file_fingerprint(track_file), self.fade_sec, AUDIO_BITRATE,
+                             AUDIO_SAMPLE_RATE, AUDIO_CHANNELS)
+        cache_file = self.cache_dir / f"audio_{key}.aac"
+        if not cache_file.exists():
+            print(f"配信用の音声を作成中: {os.path.basename(track_file)}")
+            self.encode_cached(cache_file, [
+                self.generator.ffmpeg_path, '-i', track_file, '-vn',
+                '-af', self.generator.build_audio_fade_filter(duration, self.fade_sec),
+                '-c:a', 'aac', '-b:a', AUDIO_BITRATE, '-ar', str(AUDIO_SAMPLE_RATE), '-ac', str(AUDIO_CHANNELS),
+                '-f', 'adts',
+            ], "配信用の音声の作成に失敗しました", "audio", duration)
+        # -c copy では音声をパケット（AACフレーム）単位でしか切れないため、曲の長さをフレームの整数倍にそろえる
+        frames = int(duration * AUDIO_SAMPLE_RATE) // AAC_FRAME_SAMPLES
+        return str(cache_file), frames * AAC_FRAME_SAMPLES / AUDIO_SAMPLE_RATE
+
+    def schedule(self):
+        """(曲, 背景) を終わりなく返す（プレイリストは1周ごとに読み直し、背景は曲ごとに順番に切り替える）"""
+        background_index = 0
+        while True:
+            tracks = load_playlist(self.playlist)
+            if not tracks:
+                raise ValueError(f"プレイリストに曲がありません: {self.playlist}")
+            if self.shuffle:
+                random.shuffle(tracks)
+            for track in tracks:
+                yield track, self.backgrounds[background_index % len(self.backgrounds)]
+                background_index += 1
+
+    def prepare(self, track, background):
+        """1曲分の配信素材を用意する（準備用のスレッドから呼ばれる。失敗した曲は None）"""
+        try:
+            audio_file, duration = self.track_audio(track)
+            return track, background, self.still_segment(background), audio_file, duration
+        except Exception as e:
+            print(f"警告: 曲を準備できないためスキップします: {os.path.basename(track)}: {e}")
+            return None
+
+    def publisher_command(self):
+        cmd = [self.generator.ffmpeg_path, '-hide_banner', '-loglevel', 'warning']
+        if self.realtime:
+            cmd.append('-re')
+        cmd += ['-f', 'mpegts', '-i', 'pipe:0', '-map', '0', '-c', 'copy']
+        if self.format == 'flv':
+            cmd += ['-flvflags', 'no_duration_filesize']
+        return cmd + ['-f', self.format, '-y', self.target]
+
+    def feed_command(self, still_file, audio_file, duration, offset):
+        """背景の映像をループして曲の音声と組み合わせ、配信の時刻 offset から始まるMPEG-TSを出力する"""
+        return [
+            self.generator.ffmpeg_path, '-hide_banner', '-loglevel', 'error',
+            '-stream_loop', '-1', '-i', still_file,
+            '-i', audio_file,
+            '-map', '0:v', '-map', '1:a', '-c', 'copy',
+            '-t', str(duration),
+            '-output_ts_offset', str(offset),
+            '-f', 'mpegts', 'pipe:1',
+        ]
+
+    def start_publisher(self):
+        print(f"配信を開始します: {self.target}（{self.format}）")
+        # 標準出力へ配信する場合は、FFmpegの出力を元の標準出力（ログは標準エラー）にそのまま書き込ませる
+        publisher = self.runner.stream(self.publisher_command(), "配信に失敗しました", stage="live", stdin=True,
+                                       stdout=sys.__stdout__ if self.target == 'pipe:1' else False)
+        self.publisher = publisher.__enter__()
+
+    def stop_publisher(self):
+        """パブリッシャーの入力を閉じて終了を待つ（一定時間出力が進まなければ停止検出で止める）"""
+        if self.publisher is None:
+            return
+        publisher = self.publisher
+        self.publisher = None
+        try:
+            publisher.__exit__(None, None, None)
+        except FFmpegError as e:
+            print(f"配信が中断されました: {e}")
+
+    def feed(self, still_file, audio_file, duration, offset):
+        """1曲分をパブリッシャーに流す（実時間で配信する場合は曲の長さだけかかる）。成功したら True"""
+        try:
+            with self.runner.stream(self.feed_command(still_file, audio_file, duration, offset),
+                                    "曲の送出に失敗しました", stage="live", stdout=True) as feeder:
+                self.feeder = feeder
+                while True:
+                    data = feeder.read(FEED_CHUNK_BYTES)
+                    if not data:
+                        break
+                    # パブリッシャーが終了している場合は BrokenPipeError になり、送出用のFFmpegも止める
+                    self.publisher.write(data)
+        except FFmpegError as e:
+            if not self.stop_event.is_set():
+                print(f"曲の送出が中断されました: {e}")
+                return False
+        finally:
+            self.feeder = None
+        return True
+
+    def reconnect(self):
+        """パブリッシャーを起動し直す（配信のタイムスタンプは0から数え直す）"""
+        self.stop_publisher()
+        print(f"{RECONNECT_DELAY}秒後に再接続します...")
+        self.stop_event.wait(RECONNECT_DELAY)
+        if not self.stop_event.is_set():
+            self.start_publisher()
+
+    def run(self, max_tracks=None):
+        """配信を続ける（max_tracks 曲流したら終了）"""
+        schedule = self.schedule()
+        played = 0
+        failures = 0
+        offset = 0.0
+        with ThreadPoolExecutor(max_workers=1) as preparer:
+            upcoming = preparer.submit(self.prepare, *next(schedule))
+            self.start_publisher()
+            try:
+                while not self.stop_event.is_set() and (max_tracks is None or played < max_tracks):
+                    item = upcoming.result()
+                    upcoming = preparer.submit(self.prepare, *next(schedule))
+                    if item is not None:
+                        track, background, still_file, audio_file, duration = item
+                        print(f"再生中: {os.path.basename(track)}（背景: {os.path.basename(background)}、"
+                              f"{duration:.0f}秒、配信開始から{offset / 3600:.2f}時間）")
+                        if self.feed(still_file, audio_file, duration, offset):
+                            offset += duration
+                            played += 1
+                            failures = 0
+                            continue
+                        if self.stop_event.is_set():
+                            break
+                        if self.publisher.process.poll() is not None:
+                            # 配信先との接続が切れた場合は、パブリッシャーを起動し直して次の曲から続ける
+                            self.reconnect()
+                            offset = 0.0
+                            continue
+                    # 準備・送出できなかった曲は飛ばす（プレイリストの全曲が続けて失敗したら終了する）
+                    failures += 1
+                    if failures > len(load_playlist(self.playlist)):
+                        raise RuntimeError("プレイリストに配信できる曲がありません")
+            finally:
+                upcoming.cancel()
+                self.stop_publisher()
+        print(f"配信を終了しました（{played}曲）")
+
+    def stop(self):
+        """配信を停止する（他スレッドから呼び出し可）"""
+        self.stop_event.set()
+        feeder = self.feeder
+        if feeder is not None:
+            feeder.process.terminate()
+
+
+def main():
+    """メイン関数"""
+    parser = argparse.ArgumentParser(description="EchoGarden 24時間配信")
+    parser.add_argument('--playlist', required=True,
+                        help="曲のフォルダ、または1行に1ファイルのプレイリスト（テキスト・m3u）")
+    parser.add_argument('--backgrounds', nargs='+', required=True, help="背景画像のファイル・フォルダ")
+    parser.add_argument('--output', required=True,
+                        help="配信先（rtmp://... / srt://... / ファイル / - で標準出力にMPEG-TS）")
+    parser.add_argument('--shuffle', action='store_true', help="1周ごとに曲順をシャッフルする")
+    parser.add_argument('--fade', type=float, default=FADE_SECONDS, help="曲の切り替わりのフェード（秒）")
+    parser.add_argument('--no-realtime', action='store_true',
+                        help="実時間を待たずに書き出す（ファイル出力での動作確認用）")
+    parser.add_argument('--max-tracks', type=int, help="指定した曲数を流したら終了する")
+    args = parser.parse_args()
+
+    if args.output == '-':
+        # 標準出力は配信データに使うため、ログは標準エラーに出す
+        sys.stdout = sys.stderr
+
+    streamer = LiveStreamer(VideoGenerator(), args.playlist, args.backgrounds, args.output, fade_sec=args.fade,
+                            shuffle=args.shuffle, realtime=not args.no_realtime)
+    try:
+        streamer.run(args.max_tracks)
+    except KeyboardInterrupt:
+        print("停止中...")
+        streamer.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+メディア解析・中間ファイルのキャッシュ
+素材ファイルごとの解析結果や事前エンコード済みファイルを保存する
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+from pathlib import Path
+
+# キャッシュの保存先（環境変数 ECHOGARDEN_CACHE_DIR で変更可能）
+DEFAULT_CACHE_ROOT = Path.home() / ".echogarden" / "cache"
+
+# 素材として扱うファイルの拡張子
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.m4a', '.flac', '.aac')
+BACKGROUND_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.mp4', '.mov', '.avi')
+# 背景のうち1枚の静止画として事前に加工できるもの（GIFはアニメーションの場合があるため除く）
+STILL_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def get_cache_dir(name):
+    """用途ごとのキャッシュディレクトリを取得（なければ作成）"""
+    root = Path(os.environ.get('ECHOGARDEN_CACHE_DIR', DEFAULT_CACHE_ROOT))
+    cache_dir = root / name
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def file_fingerprint(path):
+    """ファイルの識別子（絶対パス・サイズ・更新日時から算出）
+
+    内容のハッシュより高速で、ファイルが差し替えられれば値が変わる。
+    """
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def make_cache_key(*parts):
+    """任意の値の組からキャッシュキーを作成"""
+    data = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def load_json(path):
+    """JSONキャッシュを読み込む（存在しない・壊れている場合は None）"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_json(path, data):
+    """JSONキャッシュを書き込む（途中で中断されても壊れたファイルを残さない）"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp_', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def save_image(image, path, **options):
+    """PIL の画像をキャッシュに書き込む（途中で中断されても壊れたファイルを残さない。形式は拡張子から決まる）"""
+    path = Path(path)
+    temp_path = path.with_name(f".tmp_{os.getpid()}_{path.name}")
+    try:
+        image.save(temp_path, **options)
+        os.replace(temp_path, path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def content_hash(path):
+    """ファイル内容のSHA-1（計算結果はファイルの識別子ごとにキャッシュし、変更時のみ再計算）"""
+    cache_file = get_cache_dir('hashes') / f"{file_fingerprint(path)}.json"
+    cached = load_json(cache_file)
+    if cached is not None:
+        return cached['sha1']
+
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    sha1 = digest.hexdigest()
+    save_json(cache_file, {'sha1': sha1})
+    return sha1
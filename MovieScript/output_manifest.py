@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+出力マニフェスト（差分ビルド）
+出力動画の横に入力ファイルのハッシュと作成パラメータを記録した .manifest.json を保存し、
+再実行時に内容が一致する出力は作り直さない
+"""
+
+import os
+from datetime import datetime
+
+from media_cache import content_hash, make_cache_key, load_json, save_json
+
+MANIFEST_SUFFIX = ".manifest.json"
+# エンコード設定など出力内容が変わる変更をしたら更新する（既存の出力はすべて作り直しになる）
+MANIFEST_VERSION = 1
+
+
+def manifest_path(output_file):
+    """出力ファイルに対応するマニフェストのパス"""
+    return output_file + MANIFEST_SUFFIX
+
+
+def build_manifest(kind, input_files, params):
+    """入力ファイルの内容とパラメータからマニフェストを作成
+
+    key は入力の内容（順序を含む）とパラメータだけから決まり、ファイルの場所には依存しない。
+    """
+    hashes = [content_hash(path) for path in input_files]
+    return {
+        'version': MANIFEST_VERSION,
+        'kind': kind,
+        'key': make_cache_key(MANIFEST_VERSION, kind, hashes, params),
+        'inputs': [{'path': os.path.abspath(path), 'sha1': sha1}
+                   for path, sha1 in zip(input_files, hashes)],
+        'params': params,
+    }
+
+
+def is_up_to_date(output_file, manifest):
+    """出力ファイルが存在し、保存済みマニフェストと key・サイズが一致するか"""
+    if not os.path.exists(output_file):
+        return False
+    saved = load_json(manifest_path(output_file))
+    if not saved:
+        return False
+    return (saved.get('key') == manifest['key']
+            and saved.get('output_size') == os.path.getsize(output_file))
+
+
+def read_manifest(output_file):
+    """保存済みのマニフェストを読み込む（ない場合は空の dict）"""
+    return load_json(manifest_path(output_file)) or {}
+
+
+def remove_manifest(output_file):
+    """古いマニフェストを削除（作り直し中に中断されても最新と誤判定しないため）"""
+    path = manifest_path(output_file)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def write_manifest(output_file, manifest):
+    """作成が完了した出力のマニフェストを保存"""
+    data = dict(manifest)
+    data['output_size'] = os.path.getsize(output_file)
+    data['created_at'] = datetime.now().isoformat(timespec='seconds')
+    save_json(manifest_path(output_file), data)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PyAVによるインプロセスのメディア処理
+FFmpegのサブプロセスを起動する代わりに、同じライブラリ（libav*）をプロセス内で直接使う。
+
+- 長さ・解像度の取得はプロセスを起動せず、コンテナのヘッダーだけを読む
+- デコードしたBGMはメモリに保持し、同じ VideoGenerator での単曲・ショート・次のジョブで使い回す
+- 静止画の背景は1GOP分（キーフレーム1枚と変化のないフレーム）だけエンコードしてメモリに保持し、
+  タイムスタンプをずらしたパケットを動画全体に並べる。背景のエンコードは曲の長さに関係なく1GOP分で済む
+
+対応するのは変換済みの静止画の背景（background_cache）に音声を付けるだけの動画で、
+それ以外（ビジュアライザー・スライドショー・タイトルの重ね合わせ・画質の自動調整）はFFmpegで作成する。
+"""
+
+import io
+import time
+from collections import OrderedDict
+from fractions import Fraction
+
+try:
+    import av
+    import numpy as np
+except ImportError:
+    av = None
+
+from ffmpeg_runner import RenderCancelledError
+from media_cache import file_fingerprint
+
+# VideoGenerator の backend に指定できる値（既定は ffmpeg）
+BACKENDS = ("ffmpeg", "pyav")
+
+# 背景として繰り返すGOPの長さ（秒）。x264 の既定のキーフレーム間隔（250 フレーム）と同じ
+GOP_SECONDS = 10
+# 音声のエンコード設定（FFmpegのAACエンコーダーの既定値と同じ）
+AUDIO_BITRATE = 128000
+AUDIO_LAYOUT = 'stereo'
+# メモリに保持するBGMの数と長さの上限（これより長い曲は使うたびにデコードする）
+MAX_CACHED_TRACKS = 4
+MAX_CACHED_TRACK_SECONDS = 30 * 60
+
+
+def require_pyav():
+    if av is None:
+        raise RuntimeError("インプロセスの処理にはPyAVとNumPyが必要です（pip install av numpy）")
+
+
+def validate_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"不明なバックエンドです: {backend}（{', '.join(BACKENDS)}）")
+    if backend == "pyav":
+        require_pyav()
+    return backend
+
+
+def fade_gain(positions, total, fade_samples):
+    """フェードイン・アウトの音量（afade の既定と同じ直線）"""
+    gain = np.ones(len(positions), dtype=np.float32)
+    if fade_samples > 0:
+        gain = np.minimum(gain, positions / fade_samples)
+        gain = np.minimum(gain, (total - positions) / fade_samples)
+    return np.clip(gain, 0.0, 1.0).astype(np.float32)
+
+
+class InProcessMedia:
+    """デコード済みの音声・エンコード済みの背景を保持して動画を作成する（VideoGenerator ごとに1つ）"""
+
+    def __init__(self):
+        require_pyav()
+        # BGMのフィンガープリント -> (サンプル (チャンネル, サンプル数) の float32, サンプルレート)
+        self.tracks = OrderedDict()
+        # (背景, fps, GOPのフレーム数) -> 1GOPをエンコードしたMP4（メモリ上）
+        self.still_gops = {}
+
+    def probe_duration(self, media_file):
+        """メディアの長さ（秒）。コンテナに長さがなければストリームの長さを使う"""
+        with av.open(media_file) as container:
+            if container.duration:
+                return container.duration / av.time_base
+            for stream in container.streams:
+                if stream.duration and stream.time_base:
+                    return float(stream.duration * stream.time_base)
+        return 0
+
+    def probe_size(self, media_file):
+        with av.open(media_file) as container:
+            if not container.streams.video:
+                return None
+            stream = container.streams.video[0]
+            return stream.codec_context.width, stream.codec_context.height
+
+    def keeps_track(self, duration):
+        """この長さ（秒）のBGMをデコード後にメモリに保持するか（しない場合は使うたびにデコードする）"""
+        return duration <= MAX_CACHED_TRACK_SECONDS
+
+    def load_track(self, audio_file):
+        """BGMをデコードして (サンプル, サンプルレート) を返す（最近使った曲はメモリから返す）"""
+        key = file_fingerprint(audio_file)
+        if key in self.tracks:
+            self.tracks.move_to_end(key)
+            return self.tracks[key]
+
+        chunks = []
+        with av.open(audio_file) as container:
+            stream = container.streams.audio[0]
+            rate = stream.codec_context.sample_rate
+            resampler = av.AudioResampler(format='fltp', layout=AUDIO_LAYOUT, rate=rate)
+            for frame in container.decode(stream):
+                chunks.extend(out.to_ndarray() for out in resampler.resample(frame))
+            chunks.extend(out.to_ndarray() for out in resampler.resample(None))
+        if not chunks:
+            raise RuntimeError(f"音声をデコードできませんでした: {audio_file}")
+        track = (np.concatenate(chunks, axis=1).astype(np.float32), rate)
+
+        if self.keeps_track(track[0].shape[1] / rate):
+            self.tracks[key] = track
+            while len(self.tracks) > MAX_CACHED_TRACKS:
+                self.tracks.popitem(last=False)
+        return track
+
+    def encode_still_gop(self, still_file, fps, gop_frames):
+        """静止画の背景を1GOP分エンコードしたMP4（メモリ上のバイト列）を返す
+
+        Bフレームを使わないため、GOPの途中で切っても残りのフレームは正しくデコードできる。
+        """
+        key = (still_file, fps, gop_frames)
+        if key in self.still_gops:
+            return self.still_gops[key]
+
+        with av.open(still_file) as source:
+            frame = next(source.decode(video=0)).reformat(format='yuv420p')
+        # デコード時のピクチャタイプ（I）が残っていると全フレームがキーフレームになる
+        frame.pict_type = 0
+        buffer = io.BytesIO()
+        with av.open(buffer, 'w', format='mp4') as output:
+            stream = output.add_stream('libx264', rate=fps, options={
+                'x264-params': f'keyint={gop_frames}:min-keyint={gop_frames}:scenecut=0:bframes=0:open-gop=0'})
+            stream.width = frame.width
+            stream.height = frame.height
+            stream.pix_fmt = 'yuv420p'
+            for index in range(gop_frames):
+                frame.pts = index
+                frame.time_base = Fraction(1, fps)
+                for packet in stream.encode(frame):
+                    output.mux(packet)
+            for packet in stream.encode(None):
+                output.mux(packet)
+        self.still_gops[key] = buffer.getvalue()
+        return self.still_gops[key]
+
+    def render_still_video(self, still_file, audio_file, output_file, fps, fade_sec, start=0.0, duration=None,
+                           progress=None, cancelled=None):
+        """静止画の背景にBGM（start から duration 秒、省略時は全体）を付けた動画を作成する
+
+        progress: progress(割合, 速度) で進捗を通知 / cancelled: True を返したら中断する
+        戻り値: 動画の長さ（秒）
+        """
+        samples, rate = self.load_track(audio_file)
+        first = int(start * rate)
+        last = samples.shape[1] if duration is None else min(samples.shape[1], first + int(duration * rate))
+        total_samples = last - first
+        if total_samples <= 0:
+            raise ValueError("切り出す範囲に音声がありません")
+        seconds = total_samples / rate
+        total_frames = round(seconds * fps)
+        gop_frames = GOP_SECONDS * fps
+        fade_samples = int(fade_sec * rate)
+
+        started = time.perf_counter()
+        with av.open(io.BytesIO(self.encode_still_gop(still_file, fps, gop_frames))) as gop, \
+                av.open(output_file, 'w') as output:
+            template = gop.streams.video[0]
+            packets = [(packet.pts, packet.dts, packet.duration, packet.is_keyframe, bytes(packet))
+                       for packet in gop.demux(template) if packet.size]
+            video_stream = output.add_stream_from_template(template)
+            audio_stream = output.add_stream('aac', rate=rate)
+            audio_stream.layout = AUDIO_LAYOUT
+            audio_stream.bit_rate = AUDIO_BITRATE
+            gop_ticks = int(gop_frames / fps / template.time_base)
+
+            written_frames = 0
+            audio_position = 0
+            gop_index = 0
+            while written_frames < total_frames:
+                if cancelled and cancelled():
+                    raise RenderCancelledError("動画作成がキャンセルされました")
+                # 背景: 同じGOPのパケットをタイムスタンプをずらして書き込む（最後のGOPは途中で切る）
+                offset = gop_index * gop_ticks
+                for pts, dts, packet_duration, keyframe, data in packets[:total_frames - written_frames]:
+                    packet = av.Packet(data)
+                    packet.pts = pts + offset
+                    packet.dts = dts + offset
+                    packet.duration = packet_duration
+                    packet.time_base = template.time_base
+                    packet.is_keyframe = keyframe
+                    packet.stream = video_stream
+                    output.mux(packet)
+                    written_frames += 1
+
+                # 音声: 同じ区間をフェードを付けてエンコードする
+                end = min(total_samples, round(written_frames / fps * rate))
+                if written_frames >= total_frames:
+                    end = total_samples
+                if end > audio_position:
+                    positions = np.arange(audio_position, end, dtype=np.float32)
+                    chunk = samples[:, first + audio_position:first + end] * fade_gain(
+                        positions, total_samples, fade_samples)
+                    frame = av.AudioFrame.from_ndarray(np.ascontiguousarray(chunk), format='fltp',
+                                                       layout=AUDIO_LAYOUT)
+                    frame.sample_rate = rate
+                    frame.pts = audio_position
+                    frame.time_base = Fraction(1, rate)
+                    for packet in audio_stream.encode(frame):
+                        output.mux(packet)
+                    audio_position = end
+
+                gop_index += 1
+                if progress:
+                    elapsed = time.perf_counter() - started
+                    progress(written_frames / total_frames,
+                             written_frames / fps / elapsed if elapsed > 0 else None)
+            for packet in audio_stream.encode(None):
+                output.mux(packet)
+        return seconds
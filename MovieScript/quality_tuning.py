@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ファイルサイズ・ビットレートを目標にした画質の自動調整
+本番と同じ入力・フィルターで数秒のサンプルを複数のCRFでエンコードし、
+CRFとビットレートの関係（ビットレートの対数はCRFにほぼ比例する）を当てはめて、
+目標に収まるCRFを求める。本番のエンコードは1回だけ（2パスエンコードは行わない）。
+
+サンプルの結果は入力素材（背景・ビジュアライザー等）とフィルターの組ごとにキャッシュし、
+同じ素材では目標が変わってもサンプルを作り直さない。
+"""
+
+import math
+import os
+
+from media_cache import (AUDIO_EXTENSIONS, get_cache_dir, file_fingerprint, content_hash, make_cache_key,
+                         load_json, save_json)
+
+# サンプルのCRFと長さ（x264の既定のキーフレーム間隔 250 フレーム = 10秒を含む長さ）
+SAMPLE_CRFS = (23, 29, 35)
+SAMPLE_SECONDS = 10
+# 選択するCRFの範囲。目標は上限として扱うため、x264 の既定（23）より高画質にはしない
+MIN_CRF = 23
+MAX_CRF = 45
+# 予測の誤差とコンテナのヘッダー分として、目標の95%を狙う
+SAFETY_MARGIN = 0.95
+# 音声のビットレート（FFmpegのAACエンコーダーの既定値）
+AUDIO_KBPS = 128
+
+# サンプルの取り方を変えたらキャッシュを無効化するため更新する
+QUALITY_TUNING_VERSION = 1
+
+
+def normalize_target(target_size_mb=None, max_video_kbps=None):
+    """ジョブ仕様の目標（ファイルサイズ・映像ビットレート）を検証して dict に変換（未指定なら None）"""
+    for name, value in (('target_size_mb', target_size_mb), ('max_video_kbps', max_video_kbps)):
+        if value is not None and (not isinstance(value, (int, float)) or value <= 0):
+            raise ValueError(f"{name} は正の数値で指定してください")
+    if not target_size_mb and not max_video_kbps:
+        return None
+    return {'size_mb': target_size_mb, 'video_kbps': max_video_kbps}
+
+
+def target_video_kbps(target, duration):
+    """目標から映像に使えるビットレート（kbps）を求める"""
+    limits = []
+    if target.get('size_mb'):
+        total_kbps = target['size_mb'] * 1024 * 1024 * 8 / 1000 / duration
+        limits.append(total_kbps * SAFETY_MARGIN - AUDIO_KBPS)
+    if target.get('video_kbps'):
+        limits.append(target['video_kbps'] * SAFETY_MARGIN)
+    return max(1.0, min(limits))
+
+
+def input_fingerprint(path):
+    """サンプルのキャッシュキーに使う入力の識別子（一時フォルダの連結リストは内容で識別する）
+
+    サンプルは映像だけをエンコードするため、音声の入力は曲が違っても同じものとして扱う。
+    """
+    if os.path.splitext(path)[1].lower() in AUDIO_EXTENSIONS:
+        return 'audio'
+    if not os.path.exists(path):
+        return path
+    if path.endswith('.txt'):
+        return content_hash(path)
+    return file_fingerprint(path)
+
+
+def sample_cache_key(input_args, video_args):
+    """入力素材とフィルター設定からサンプルのキャッシュキーを作成"""
+    parts = []
+    for index, arg in enumerate(input_args):
+        if index > 0 and input_args[index - 1] == '-i':
+            parts.append(input_fingerprint(arg))
+        elif index > 0 and input_args[index - 1] == '-t':
+            # 入力の長さ（ループする背景の長さ）はサンプルの内容に影響しない
+            parts.append('-')
+        else:
+            parts.append(arg)
+    return make_cache_key(QUALITY_TUNING_VERSION, SAMPLE_CRFS, SAMPLE_SECONDS, parts, video_args)
+
+
+def fit_model(samples):
+    """[(CRF, kbps)] から ln(kbps) = a + b * CRF を最小二乗で当てはめ、(a, b) を返す"""
+    points = [(crf, math.log(max(kbps, 0.1))) for crf, kbps in samples]
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / variance if variance else 0.0
+    return mean_y - slope * mean_x, slope
+
+
+def nearest_samples(samples, target_kbps):
+    """目標のビットレートを挟む2つのサンプル（挟めない場合は最も近い2つ）"""
+    samples = sorted(samples)
+    for lower, upper in zip(samples, samples[1:]):
+        if upper[1] <= target_kbps <= lower[1]:
+            return [lower, upper]
+    if target_kbps > samples[0][1]:
+        return samples[:2]
+    return samples[-2:]
+
+
+def choose_crf(samples, target_kbps):
+    """目標のビットレートに収まるCRFと、そのCRFでの予測ビットレートを返す
+
+    目標を挟む2つのサンプルの間で ln(kbps) を直線で補間する（範囲外は直線を延長する）。
+    """
+    a, b = fit_model(nearest_samples(samples, target_kbps))
+    if b >= 0:
+        # CRFを上げてもビットレートが下がらない（ほぼ静止した映像など）場合は最も低いサンプルで判断する
+        crf = MIN_CRF if max(kbps for _, kbps in samples) <= target_kbps else MAX_CRF
+    else:
+        crf = (math.log(target_kbps) - a) / b
+    crf = round(min(MAX_CRF, max(MIN_CRF, crf)) * 2) / 2  # x264 は小数のCRFも指定できる
+    return crf, math.exp(a + b * crf)
+
+
+def is_extrapolated(samples, crf):
+    """選んだCRFがサンプルの範囲外か（範囲外では予測の誤差が大きい）"""
+    crfs = [sample_crf for sample_crf, _ in samples]
+    return crf not in crfs and not min(crfs) <= crf <= max(crfs)
+
+
+class QualityTuner:
+    """サンプルエンコードからCRFを決める"""
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.cache_dir = get_cache_dir('quality')
+
+    def encode_sample(self, input_args, video_args, crf):
+        """指定したCRFでサンプルをエンコードし、映像のビットレート（kbps）を返す"""
+        sample_file = os.path.join(self.generator.create_temp_directory(), f"quality_sample_{crf}.mp4")
+        print(f"画質調整用のサンプルを作成中... (CRF {crf})")
+        self.generator.run_ffmpeg(
+            [self.generator.ffmpeg_path] + input_args + ['-t', str(SAMPLE_SECONDS)] + video_args
+            + ['-crf', str(crf), '-an', '-y', sample_file],
+            "画質調整用のサンプル作成に失敗しました", stage="encode", duration=SAMPLE_SECONDS)
+        kbps = os.path.getsize(sample_file) * 8 / 1000 / SAMPLE_SECONDS
+        os.remove(sample_file)
+        return kbps
+
+    def tune(self, input_args, video_args, target_kbps):
+        """サンプルから目標に収まるCRFを求め、(CRF, 予測kbps) を返す
+
+        サンプルの範囲外になった場合は、そのCRFのサンプルを追加して求め直す。
+        サンプルの結果はキャッシュに保存し、同じ素材では再利用する。
+        """
+        cache_file = self.cache_dir / f"{sample_cache_key(input_args, video_args)}.json"
+        cached = load_json(cache_file)
+        if cached is not None:
+            samples = [tuple(sample) for sample in cached['samples']]
+        else:
+            samples = [(crf, self.encode_sample(input_args, video_args, crf)) for crf in SAMPLE_CRFS]
+            save_json(cache_file, {'samples': samples})
+
+        crf, predicted_kbps = choose_crf(samples, target_kbps)
+        if is_extrapolated(samples, crf):
+            samples.append((crf, self.encode_sample(input_args, video_args, crf)))
+            save_json(cache_file, {'samples': samples})
+            crf, predicted_kbps = choose_crf(samples, target_kbps)
+        return crf, predicted_kbps
+
+    def build_quality_args(self, target, input_args, video_args, duration):
+        """目標に収まるCRFのエンコード引数を返す
+
+        input_args: 本番と同じ入力引数（FFmpegのパスは含まない）
+        video_args: 本番と同じ映像のエンコード・フィルター引数（CRFは含まない）
+        """
+        target_kbps = target_video_kbps(target, duration)
+        crf, predicted_kbps = self.tune(input_args, video_args, target_kbps)
+        print(f"画質を自動調整しました: CRF {crf}（映像の目標 {target_kbps:.0f}kbps、予測 {predicted_kbps:.0f}kbps）")
+        if predicted_kbps > target_kbps * 1.1:
+            print("警告: 最も低い画質でも目標のサイズに収まらない見込みです（目標を大きくしてください）")
+        args = ['-crf', str(crf)]
+        if target.get('video_kbps'):
+            # ビットレートの上限はVBVで保証する（CRFの予測が外れても超えない）
+            max_kbps = int(target['video_kbps'])
+            args += ['-maxrate', f'{max_kbps}k', '-bufsize', f'{max_kbps * 2}k']
+        return args
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分散レンダリング
+ジョブキュー（コーディネーター）と、ジョブを取得して動画を作成するワーカーを分ける
+
+ワーカーは一定間隔でハートビートを送り、途絶えたワーカーのジョブは別のワーカーに割り当て直される。
+ワーカーとの通信方法（トランスポート）は差し替え可能:
+    LocalTransport  同じマシン上のワーカープロセスがSQLiteのジョブキューを直接共有する（動作確認用）
+    HTTPTransport   他のマシンのワーカーがレンダリングサービスのAPI経由でジョブを受け取る。
+                    入力ファイルが共有ストレージになければダウンロードし、出力はアップロードする
+
+コーディネーターとワーカーは共通の認証トークン（--token または環境変数 ECHOGARDEN_RENDER_TOKEN）で
+リクエストを確認する。localhost 以外で待ち受ける場合はトークンと、ジョブが参照できるフォルダ（--root）が必須。
+
+使い方:
+    # コーディネーター（LAN内のアドレスで待ち受け、共有フォルダだけをジョブに使わせる）
+    export ECHOGARDEN_RENDER_TOKEN=<十分に長いランダムな文字列>
+    python render_service.py --host 192.168.1.10 --root /srv/echogarden --concurrency 1
+    # 各ノードのワーカー（同じトークンを設定しておく）
+    python render_cluster.py worker --coordinator http://192.168.1.10:8765
+    # 同じマシンで複数のワーカープロセスを起動する（動作確認用）
+    python render_cluster.py local --workers 3
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+from urllib.parse import quote
+
+from media_cache import get_cache_dir, file_fingerprint, make_cache_key
+from output_manifest import MANIFEST_SUFFIX, manifest_path
+from pyav_backend import BACKENDS
+from render_history import RenderEstimator, RenderHistory, format_estimate
+from render_jobs import CLAIM_ORDERS, RenderJobStore, run_render_job, split_job, validate_job_spec
+from video_generator import VideoGenerator, RenderCancelledError
+
+DEFAULT_DB_PATH = Path(__file__).parent / "render_jobs.db"
+
+# ハートビートの送信間隔と、途絶えたとみなすまでの秒数
+HEARTBEAT_INTERVAL = 10
+HEARTBEAT_TIMEOUT = 60
+# 待機中のジョブがない場合に次に確認するまでの秒数
+CLAIM_INTERVAL = 5
+# ジョブ仕様のうち入力ファイルを指すキー
+INPUT_KEYS = ('bgm_file', 'background_files', 'melody_files')
+# ファイル転送時の読み書きの単位
+TRANSFER_CHUNK_SIZE = 1024 * 1024
+# 認証トークンを指定する環境変数
+TOKEN_ENV = "ECHOGARDEN_RENDER_TOKEN"
+
+
+def job_input_files(spec):
+    """ジョブ仕様が参照する入力ファイルのリスト"""
+    files = []
+    for key in INPUT_KEYS:
+        value = spec.get(key)
+        if isinstance(value, list):
+            files.extend(value)
+        elif value:
+            files.append(value)
+    return files
+
+
+class Coordinator:
+    """ジョブの投入・割り当て・ハートビートの確認・割り当て直しを行う"""
+
+    def __init__(self, store, heartbeat_timeout=HEARTBEAT_TIMEOUT, estimator=None, order='fifo',
+                 allowed_roots=None, output_roots=None):
+        self.store = store
+        self.heartbeat_timeout = heartbeat_timeout
+        # 投入時に処理時間・出力サイズを予測する（render_history.RenderEstimator、None で予測しない）
+        self.estimator = estimator
+        # 待機中のジョブを取り出す順序（render_jobs.CLAIM_ORDERS のキー）
+        self.order = order
+        # ジョブが参照できるフォルダと、出力先に指定できるフォルダ（None で制限しない）
+        self.allowed_roots = allowed_roots
+        self.output_roots = output_roots
+
+    def submit(self, spec):
+        """ジョブを検証して出力ごとに分けて投入し、ジョブIDのリストを返す"""
+        validate_job_spec(spec, self.allowed_roots, self.output_roots)
+        job_ids = []
+        for part in split_job(spec):
+            estimate = self.estimate(part)
+            job_id = self.store.add(part, estimate)
+            if self.estimator is not None:
+                print(f"ジョブの予測: {job_id} ({part['type']}) {format_estimate(estimate)}")
+            job_ids.append(job_id)
+        return job_ids
+
+    def estimate(self, spec):
+        """ジョブの処理時間・出力サイズを予測する（予測できない・失敗した場合は None）"""
+        if self.estimator is None:
+            return None
+        try:
+            return self.estimator.estimate(spec)
+        except Exception as e:
+            print(f"処理時間を予測できませんでした: {e}")
+            return None
+
+    def claim(self, worker_id):
+        """ワーカーに次のジョブを割り当てる（応答のないワーカーのジョブも対象にする）"""
+        requeued = self.store.requeue_stale(self.heartbeat_timeout)
+        if requeued:
+            print(f"応答のないワーカーのジョブを割り当て直します: {requeued}件")
+        job = self.store.claim_next(worker_id, self.order)
+        if job is not None:
+            # ワーカー側で転送済みの入力を使い回せるよう、入力ファイルの識別子を付ける
+            job['inputs'] = {path: file_fingerprint(path)
+                             for path in job_input_files(job['spec']) if os.path.exists(path)}
+            print(f"ジョブを割り当てました: {job['id']} → {worker_id}")
+        return job
+
+    def heartbeat(self, worker_id, job_id, stage=None, progress=None):
+        return self.store.heartbeat(job_id, worker_id, stage, progress)
+
+    def finish(self, worker_id, job_id, outputs):
+        return self.store.finish(job_id, outputs, worker_id)
+
+    def fail(self, worker_id, job_id, error):
+        return self.store.fail(job_id, error, worker_id)
+
+    def assigned_job(self, worker_id, job_id):
+        """ワーカーに割り当て中のジョブ（ファイル転送の許可に使う）。なければ None"""
+        job = self.store.get(job_id)
+        if job is None or job['worker_id'] != worker_id or job['status'] != 'running':
+            return None
+        return job
+
+
+class LocalTransport:
+    """同じマシン上のワーカー用: SQLiteのジョブキューを直接使う（ファイルはそのまま参照する）"""
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, heartbeat_timeout=HEARTBEAT_TIMEOUT, order='fifo'):
+        self.coordinator = Coordinator(RenderJobStore(db_path), heartbeat_timeout, order=order)
+
+    def claim(self, worker_id):
+        return self.coordinator.claim(worker_id)
+
+    def heartbeat(self, worker_id, job_id, stage, progress):
+        return self.coordinator.heartbeat(worker_id, job_id, stage, progress)
+
+    def finish(self, worker_id, job_id, outputs):
+        return self.coordinator.finish(worker_id, job_id, outputs)
+
+    def fail(self, worker_id, job_id, error):
+        return self.coordinator.fail(worker_id, job_id, error)
+
+    def prepare_job(self, worker_id, job):
+        return job['spec']
+
+    def publish_outputs(self, worker_id, job, spec, outputs):
+        return outputs
+
+
+class HTTPTransport:
+    """他のマシンのワーカー用: レンダリングサービスのAPIでジョブの取得・報告・ファイル転送を行う"""
+
+    def __init__(self, base_url, timeout=30, token=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        # コーディネーターと共通の認証トークン（None で送らない）
+        self.token = token
+        # ダウンロードした入力ファイルの保存先（内容が変わらなければ再利用する）
+        self.cache_dir = get_cache_dir('transfers')
+
+    def headers(self, **extra):
+        """認証トークンを付けたリクエストヘッダー"""
+        headers = dict(extra)
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        return headers
+
+    def request(self, method, path, data=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8') if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method,
+                                         headers=self.headers(**{'Content-Type': 'application/json'}))
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def claim(self, worker_id):
+        return self.request('POST', f"/workers/{quote(worker_id)}/claim", {})['job']
+
+    def heartbeat(self, worker_id, job_id, stage, progress):
+        return self.request('POST', f"/jobs/{job_id}/heartbeat",
+                            {'worker_id': worker_id, 'stage': stage, 'progress': progress})['assigned']
+
+    def finish(self, worker_id, job_id, outputs):
+        return self.request('POST', f"/jobs/{job_id}/finish",
+                            {'worker_id': worker_id, 'outputs': outputs})['accepted']
+
+    def fail(self, worker_id, job_id, error):
+        return self.request('POST', f"/jobs/{job_id}/fail",
+                            {'worker_id': worker_id, 'error': error})['accepted']
+
+    def file_url(self, worker_id, job_id, **params):
+        query = '&'.join(f"{key}={quote(str(value))}" for key, value in params.items())
+        return f"{self.base_url}/jobs/{job_id}/files?worker_id={quote(worker_id)}&{query}"
+
+    def fetch_input(self, worker_id, job, path):
+        """入力ファイルが共有ストレージにあればそのパス、なければダウンロードしたファイルのパス"""
+        if os.path.exists(path):
+            return path
+        fingerprint = job.get('inputs', {}).get(path)
+        if fingerprint is None:
+            raise RuntimeError(f"入力ファイルがコーディネーターにありません: {path}")
+        local_file = self.cache_dir / make_cache_key(path, fingerprint) / os.path.basename(path)
+        if not local_file.exists():
+            print(f"入力ファイルを転送中: {os.path.basename(path)}")
+            local_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = local_file.with_name(f".tmp_{os.getpid()}_{local_file.name}")
+            request = urllib.request.Request(self.file_url(worker_id, job['id'], path=path),
+                                             headers=self.headers())
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response, \
+                        open(temp_file, 'wb') as f:
+                    shutil.copyfileobj(response, f, TRANSFER_CHUNK_SIZE)
+                os.replace(temp_file, local_file)
+            finally:
+                if temp_file.exists():
+                    temp_file.unlink()
+        return str(local_file)
+
+    def prepare_job(self, worker_id, job):
+        """入力ファイル・出力先をこのマシンで使えるパスに置き換えたジョブ仕様を返す"""
+        spec = dict(job['spec'])
+        for key in INPUT_KEYS:
+            value = spec.get(key)
+            if isinstance(value, list):
+                spec[key] = [self.fetch_input(worker_id, job, path) for path in value]
+            elif value:
+                spec[key] = self.fetch_input(worker_id, job, value)
+        output_dir = spec.get('output_dir')
+        if output_dir and not os.path.isdir(output_dir):
+            # 出力先が共有されていなければ一時フォルダに作成して、完了後にアップロードする
+            spec['output_dir'] = tempfile.mkdtemp(prefix="echogarden_worker_")
+        return spec
+
+    def publish_outputs(self, worker_id, job, spec, outputs):
+        """一時フォルダに作成した出力をコーディネーターにアップロードし、アップロード先のパスを返す
+
+        差分ビルドのマニフェストも出力の横にアップロードする（次回の作成で作り直しを省略できるように）。
+        """
+        if spec.get('output_dir') == job['spec'].get('output_dir'):
+            return outputs
+        published = []
+        for output_file in outputs:
+            print(f"出力ファイルを転送中: {os.path.basename(output_file)}")
+            published_file = self.upload_file(worker_id, job, output_file, os.path.basename(output_file))
+            if os.path.exists(manifest_path(output_file)):
+                self.upload_file(worker_id, job, manifest_path(output_file),
+                                 os.path.basename(published_file) + MANIFEST_SUFFIX)
+            published.append(published_file)
+        shutil.rmtree(spec['output_dir'], ignore_errors=True)
+        return published
+
+    def upload_file(self, worker_id, job, local_file, name):
+        """ファイルをジョブの出力フォルダにアップロードし、コーディネーター側のパスを返す"""
+        with open(local_file, 'rb') as f:
+            request = urllib.request.Request(
+                self.file_url(worker_id, job['id'], name=name),
+                data=f, method='PUT',
+                headers=self.headers(**{'Content-Type': 'application/octet-stream',
+                                        'Content-Length': str(os.path.getsize(local_file))}))
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))['path']
+
+
+class RenderWorker:
+    """トランスポートからジョブを受け取り、ハートビートを送りながら動画を作成する"""
+
+    def __init__(self, transport, worker_id=None, ffmpeg_path=None,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, backend="ffmpeg"):
+        self.transport = transport
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        # FFmpegの検出とバックエンドの確認は起動時に1回だけ行う
+        self.ffmpeg_path = VideoGenerator(ffmpeg_path, backend).ffmpeg_path
+        self.backend = backend
+        self.heartbeat_interval = heartbeat_interval
+        self.stop_event = threading.Event()
+        # このマシンでの処理時間を記録する（このマシンで投入するジョブの予測に使われる）
+        self.history = RenderHistory()
+
+    def run(self, max_jobs=None):
+        """ジョブを取得して実行し続ける（max_jobs 件実行したら終了）"""
+        print(f"ワーカーを起動しました: {self.worker_id}")
+        done = 0
+        while not self.stop_event.is_set() and (max_jobs is None or done < max_jobs):
+            try:
+                job = self.transport.claim(self.worker_id)
+            except (OSError, urllib.error.URLError) as e:
+                print(f"コーディネーターに接続できません: {e}")
+                job = None
+            if job is None:
+                self.stop_event.wait(CLAIM_INTERVAL)
+                continue
+            self.run_job(job)
+            done += 1
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run_job(self, job):
+        job_id = job['id']
+        print(f"ジョブを開始します: {job_id} ({job['spec'].get('type')})")
+        # キャンセル状態を持ち越さないよう、ジョブごとにVideoGeneratorを作る
+        generator = VideoGenerator(self.ffmpeg_path, self.backend)
+        state = {'stage': None, 'progress': None, 'lost': False}
+        finished = threading.Event()
+
+        def on_progress(stage, fraction, speed):
+            state['stage'] = stage
+            if fraction is not None:
+                state['progress'] = fraction
+
+        def send_heartbeats():
+            while not finished.wait(self.heartbeat_interval):
+                try:
+                    assigned = self.transport.heartbeat(self.worker_id, job_id, state['stage'],
+                                                        state['progress'])
+                except (OSError, urllib.error.URLError) as e:
+                    print(f"ハートビートを送信できません: {e}")
+                    continue
+                if not assigned:
+                    # 応答が遅れて他のワーカーに割り当て直された場合は作成を中止する
+                    print(f"ジョブが他のワーカーに割り当て直されたため中止します: {job_id}")
+                    state['lost'] = True
+                    generator.cancel()
+                    return
+
+        generator.progress_callback = on_progress
+        heartbeat_thread = threading.Thread(target=send_heartbeats, name="worker-heartbeat")
+        heartbeat_thread.daemon = True
+        heartbeat_thread.start()
+        try:
+            spec = self.transport.prepare_job(self.worker_id, job)
+            outputs = run_render_job(generator, spec, RenderEstimator(generator, self.history))
+            outputs = self.transport.publish_outputs(self.worker_id, job, spec, outputs)
+            if self.transport.finish(self.worker_id, job_id, outputs):
+                print(f"ジョブが完了しました: {job_id}")
+            else:
+                print(f"ジョブは他のワーカーに割り当て直されていたため、結果は破棄されました: {job_id}")
+        except RenderCancelledError:
+            if not state['lost']:
+                self.transport.fail(self.worker_id, job_id, "動画作成がキャンセルされました")
+        except Exception as e:
+            print(f"ジョブが失敗しました: {job_id} - {e}")
+            self.transport.fail(self.worker_id, job_id, str(e))
+        finally:
+            finished.set()
+            heartbeat_thread.join(timeout=5)
+            generator.progress_callback = None
+
+
+def run_local_worker(db_path, worker_id, ffmpeg_path=None, max_jobs=None, order='fifo', backend="ffmpeg"):
+    """ワーカープロセスの処理（multiprocessing から呼ばれる）"""
+    worker = RenderWorker(LocalTransport(db_path, order=order), worker_id, ffmpeg_path, backend=backend)
+    try:
+        worker.run(max_jobs)
+    except KeyboardInterrupt:
+        pass
+
+
+def run_local_cluster(db_path, worker_count, ffmpeg_path=None, order='fifo', backend="ffmpeg"):
+    """同じマシンで worker_count 個のワーカープロセスを起動し、終了するまで待つ"""
+    processes = []
+    for index in range(worker_count):
+        process = multiprocessing.Process(
+            target=run_local_worker, args=(str(db_path), f"local-{index + 1}", ffmpeg_path, None, order, backend),
+            name=f"render-worker-{index + 1}")
+        process.start()
+        processes.append(process)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("停止中...")
+        for process in processes:
+            process.terminate()
+            process.join()
+
+
+def main():
+    """メイン関数"""
+    parser = argparse.ArgumentParser(description="EchoGarden 分散レンダリングワーカー")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    worker_parser = subparsers.add_parser('worker', help="コーディネーターからジョブを受け取って実行する")
+    worker_parser.add_argument('--coordinator', required=True, help="レンダリングサービスのURL")
+    worker_parser.add_argument('--id', help="ワーカーの名前（既定: ホスト名-プロセスID）")
+    worker_parser.add_argument('--token', default=os.environ.get(TOKEN_ENV),
+                               help=f"コーディネーターと共通の認証トークン（既定: 環境変数 {TOKEN_ENV}）")
+    worker_parser.add_argument('--backend', choices=BACKENDS, default='ffmpeg',
+                               help="メディア処理のバックエンド（pyav: 対応する処理をプロセス内で行う）")
+
+    local_parser = subparsers.add_parser('local', help="同じマシンで複数のワーカープロセスを起動する")
+    local_parser.add_argument('--workers', type=int, default=2, help="ワーカープロセスの数")
+    local_parser.add_argument('--db', default=str(DEFAULT_DB_PATH), help="ジョブキューのSQLiteファイル")
+    local_parser.add_argument('--order', choices=sorted(CLAIM_ORDERS), default='fifo',
+                              help="待機中のジョブを実行する順序（shortest: 予測の処理時間が短い順、"
+                                   "deadline: 締め切りに間に合わせる順）")
+    local_parser.add_argument('--backend', choices=BACKENDS, default='ffmpeg',
+                              help="メディア処理のバックエンド（pyav: 対応する処理をプロセス内で行う）")
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        worker = RenderWorker(HTTPTransport(args.coordinator, token=args.token), args.id, backend=args.backend)
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            print("停止中...")
+    else:
+        run_local_cluster(args.db, max(1, args.workers), order=args.order, backend=args.backend)
+
+
+if __name__ == "__main__":
+    main()
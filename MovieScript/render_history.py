@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+レンダリング履歴と所要時間の予測
+完了した動画作成ごとに、動画の種類・設定の組み合わせ（プロファイル）・長さ・入力の解像度・
+処理時間・出力サイズをSQLiteに記録し、その履歴から新しいジョブの処理時間とディスク使用量を予測する。
+
+予測は「出力1秒あたりの処理時間・バイト数」の中央値に、ジョブの出力の長さを掛けて求める。
+同じ種類・プロファイル・解像度の履歴がなければ、条件を緩めた履歴を使う（種類が同じ履歴もなければ予測しない）。
+"""
+
+import os
+import sqlite3
+import statistics
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from media_cache import get_cache_dir
+from render_jobs import normalize_short_clips, split_job
+
+# 予測に使う直近の履歴の件数
+RECENT_RUNS = 20
+# 解像度を調べる背景の上限（スライドショー等で大量にある場合）
+MAX_PROBED_BACKGROUNDS = 10
+# 入力の解像度の区分（画素数の上限, 名前）。これを超えるものは uhd
+RESOLUTION_CLASSES = ((1280 * 720, 'sd'), (2560 * 1440, 'hd'))
+
+
+def default_history_path():
+    return get_cache_dir('history') / "render_history.db"
+
+
+def job_mode(spec):
+    """履歴の分類に使う動画の種類（耐久動画は作り方ごとに処理時間が大きく違うため分ける）"""
+    job_type = spec['type']
+    if job_type == "loop" and spec.get('long_form'):
+        return "long_form"
+    if job_type == "loop" and spec.get('durations_minutes'):
+        return "loop_variants"
+    if job_type == "short" and spec.get('short_clips'):
+        return "short_clips"
+    return job_type
+
+
+def job_profile(spec):
+    """処理時間に影響する設定の組み合わせを表す文字列（例: "spectrum+slideshow+title:intro"）"""
+    features = []
+    if spec['type'] == "preview":
+        features.append(f"preview:{spec.get('preview_type', 'single')}")
+    if spec.get('visualizer') and spec['type'] not in ("melody", "short"):
+        features.append(spec['visualizer'])
+    if spec.get('slideshow') and len(spec.get('background_files', [])) > 1 and spec['type'] != "short":
+        features.append("slideshow")
+    if spec.get('title_card') and spec['type'] not in ("short", "preview"):
+        layout = spec['title_card'].get('layout', 'intro') if isinstance(spec['title_card'], dict) else 'intro'
+        features.append(f"title:{layout}")
+    if spec.get('short_fill') == "blur" and (spec['type'] == "short" or spec.get('preview_type') == "short"):
+        features.append("blur")
+    if spec.get('target_size_mb') or spec.get('max_video_kbps'):
+        features.append("tuned")
+    return "+".join(features) or "plain"
+
+
+def resolution_class(pixels):
+    if not pixels:
+        return None
+    for limit, name in RESOLUTION_CLASSES:
+        if pixels <= limit:
+            return name
+    return 'uhd'
+
+
+def format_estimate(estimate):
+    """予測を表示用の文字列にする（例: "約12分・850MB"）"""
+    if not estimate:
+        return "予測なし"
+    seconds = estimate['seconds']
+    if seconds < 60:
+        duration = f"約{max(1, round(seconds))}秒"
+    elif seconds < 3600:
+        duration = f"約{round(seconds / 60)}分"
+    else:
+        hours, minutes = divmod(round(seconds / 60), 60)
+        duration = f"約{hours}時間{minutes}分" if minutes else f"約{hours}時間"
+    megabytes = estimate['bytes'] / 1024 / 1024
+    size = f"{megabytes / 1024:.1f}GB" if megabytes >= 1024 else f"{max(1, round(megabytes))}MB"
+    return f"{duration}・{size}"
+
+
+class RenderHistory:
+    """完了した動画作成の記録（SQLite）"""
+
+    def __init__(self, db_path=None):
+        self.db_path = str(db_path or default_history_path())
+        self.lock = threading.Lock()
+        with self.connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    mode TEXT NOT NULL,
+                    profile TEXT NOT NULL,
+                    resolution TEXT,
+                    audio_seconds REAL,
+                    output_seconds REAL NOT NULL,
+                    input_width INTEGER,
+                    input_height INTEGER,
+                    output_count INTEGER NOT NULL,
+                    wall_seconds REAL NOT NULL,
+                    output_bytes INTEGER NOT NULL,
+                    created_at TEXT NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS runs_mode ON runs (mode, profile, resolution)')
+
+    @contextmanager
+    def connect(self):
+        """呼び出しごとに接続を開き、終了時にコミットして閉じる（スレッド間で共有しない）"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add(self, run):
+        with self.lock, self.connect() as conn:
+            conn.execute(
+                'INSERT INTO runs (mode, profile, resolution, audio_seconds, output_seconds, input_width, '
+                'input_height, output_count, wall_seconds, output_bytes, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (run['mode'], run['profile'], run['resolution'], run['audio_seconds'],
+                 run['output_seconds'], run['input_width'], run['input_height'], run['output_count'],
+                 run['wall_seconds'], run['output_bytes'], datetime.now().isoformat(timespec='seconds'))
+            )
+
+    def find_rates(self, mode, profile, resolution):
+        """出力1秒あたりの処理時間・バイト数の中央値と件数を返す（履歴がなければ None）
+
+        種類・プロファイル・解像度が同じ履歴 → 種類・プロファイルが同じ履歴 → 種類が同じ履歴の順に探す。
+        """
+        conditions = [
+            ('mode = ? AND profile = ? AND resolution IS ?', (mode, profile, resolution)),
+            ('mode = ? AND profile = ?', (mode, profile)),
+            ('mode = ?', (mode,)),
+        ]
+        with self.connect() as conn:
+            for where, params in conditions:
+                rows = conn.execute(
+                    f'SELECT wall_seconds / output_seconds AS wall_rate, output_bytes / output_seconds AS byte_rate '
+                    f'FROM runs WHERE {where} AND output_seconds > 0 ORDER BY id DESC LIMIT ?',
+                    params + (RECENT_RUNS,)
+                ).fetchall()
+                if rows:
+                    return {
+                        'wall_rate': statistics.median(row['wall_rate'] for row in rows),
+                        'byte_rate': statistics.median(row['byte_rate'] for row in rows),
+                        'samples': len(rows),
+                    }
+        return None
+
+
+class RenderEstimator:
+    """VideoGeneratorで入力の長さ・解像度を調べ、履歴の記録と予測を行う"""
+
+    def __init__(self, generator, history=None):
+        self.generator = generator
+        self.history = history or RenderHistory()
+
+    def probe_inputs(self, spec):
+        """(音声の長さ, 入力の最大の幅, 高さ) を返す（メドレーは各動画の長さの合計）"""
+        if spec['type'] == "melody":
+            audio_seconds = sum(self.generator.get_audio_duration(path) for path in spec['melody_files'])
+        else:
+            audio_seconds = self.generator.get_audio_duration(spec['bgm_file'])
+        sizes = [self.generator.get_video_size(path)
+                 for path in spec['background_files'][:MAX_PROBED_BACKGROUNDS]]
+        width, height = max((size for size in sizes if size), key=lambda size: size[0] * size[1],
+                            default=(None, None))
+        return audio_seconds, width, height
+
+    def expected_output_seconds(self, spec, audio_seconds):
+        """ジョブが作成する出力の長さの合計（秒）"""
+        mode = job_mode(spec)
+        if mode in ("loop", "long_form"):
+            minutes = [spec.get('duration_minutes', 15)]
+        elif mode == "loop_variants":
+            minutes = spec['durations_minutes']
+        elif mode == "short":
+            return min(spec.get('duration_seconds', spec.get('short_duration_seconds', 30)), audio_seconds)
+        elif mode == "short_clips":
+            return sum(min(duration, audio_seconds - min(start or 0, audio_seconds))
+                       for start, duration in normalize_short_clips(spec['short_clips']))
+        elif mode == "preview":
+            segments = 3 if spec.get('preview_type') == "loop" else 2
+            return min(self.generator.PREVIEW_SEGMENT_SECONDS * segments, audio_seconds)
+        else:
+            return audio_seconds
+        return sum(self.generator.get_loop_count(m, audio_seconds) * audio_seconds for m in minutes)
+
+    def estimate(self, spec):
+        """ジョブの処理時間（秒）と出力サイズ（バイト）を予測する（予測できなければ None）
+
+        単曲・耐久動画のショートバージョン（create_short）も含めた合計を返す。
+        """
+        total = {'seconds': 0.0, 'bytes': 0.0, 'samples': 0}
+        audio_seconds, width, height = self.probe_inputs(spec)
+        if not audio_seconds:
+            return None
+        resolution = resolution_class(width * height if width else None)
+        for part in split_job(spec):
+            rates = self.history.find_rates(job_mode(part), job_profile(part), resolution)
+            if rates is None:
+                return None
+            output_seconds = self.expected_output_seconds(part, audio_seconds)
+            total['seconds'] += rates['wall_rate'] * output_seconds
+            part_bytes = rates['byte_rate'] * output_seconds
+            if part.get('target_size_mb') and part['type'] != "preview":
+                # 画質の自動調整では出力1本あたりの上限を超えない
+                outputs = {'loop_variants': len(part.get('durations_minutes') or []),
+                           'short_clips': len(part.get('short_clips') or [])}.get(job_mode(part), 1)
+                part_bytes = min(part_bytes, part['target_size_mb'] * 1024 * 1024 * outputs)
+            total['bytes'] += part_bytes
+            total['samples'] = max(total['samples'], rates['samples'])
+        return total
+
+    def record(self, spec, outputs, started, wall_seconds):
+        """1回の動画作成の結果を履歴に記録する
+
+        started（time.time()）より前に更新された出力は、差分ビルドで作成を省略したものとして除外する。
+        """
+        created = [path for path in outputs if os.path.exists(path) and os.path.getmtime(path) >= started]
+        if not created:
+            return
+        output_seconds = sum(self.generator.get_audio_duration(path) for path in created)
+        if not output_seconds:
+            return
+        audio_seconds, width, height = self.probe_inputs(spec)
+        self.history.add({
+            'mode': job_mode(spec),
+            'profile': job_profile(spec),
+            'resolution': resolution_class(width * height if width else None),
+            'audio_seconds': audio_seconds,
+            'output_seconds': output_seconds,
+            'input_width': width,
+            'input_height': height,
+            'output_count': len(created),
+            'wall_seconds': wall_seconds,
+            'output_bytes': sum(os.path.getsize(path) for path in created),
+        })
+
@@ -0,0 +1,579 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+レンダリングジョブ
+ジョブ仕様（dict）の検証・実行と、SQLiteによる永続ジョブキュー
+"""
+
+import os
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from render_profiler import RenderProfiler
+from slideshow import normalize_options as normalize_slideshow_options
+from title_card import normalize_options as normalize_title_card_options
+from blur_fill import validate_fill as validate_short_fill
+from quality_tuning import normalize_target as normalize_quality_target
+from visualizer import STYLES as VISUALIZER_STYLES
+
+# ジョブタイプ
+JOB_TYPES = ("single", "loop", "melody", "short", "preview")
+
+# ジョブの状態
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+# クラッシュ等で中断されたジョブを再実行する上限回数
+MAX_ATTEMPTS = 3
+
+# ジョブ仕様のうちファイル・フォルダを指すキー（allowed_roots の検証対象）
+PATH_KEYS = ('bgm_file', 'background_files', 'melody_files', 'output_dir')
+
+# 待機中のジョブを取り出す順序（ORDER BY 句）
+#   fifo      投入順
+#   shortest  予測の処理時間が短い順（予測できないジョブは最後）
+#   deadline  締め切りまでの余裕（締め切り - 予測の処理時間）が少ない順。締め切りのないジョブはその後に短い順
+CLAIM_ORDERS = {
+    'fifo': 'created_at, rowid',
+    'shortest': 'estimated_seconds IS NULL, estimated_seconds, created_at, rowid',
+    'deadline': ('deadline IS NULL, julianday(deadline) - COALESCE(estimated_seconds, 0) / 86400.0, '
+                 'estimated_seconds IS NULL, estimated_seconds, created_at, rowid'),
+}
+
+
+def validate_job_spec(spec, allowed_roots=None, output_roots=None):
+    """ジョブ仕様を検証し、不正な場合は ValueError を送出する
+
+    allowed_roots を指定した場合、入力ファイル・出力先はそのいずれかのフォルダの中に限る。
+    output_roots を指定した場合、出力先はそのいずれかのフォルダの中に限る。
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("ジョブ仕様はJSONオブジェクトで指定してください")
+
+    job_type = spec.get('type')
+    if job_type not in JOB_TYPES:
+        raise ValueError(f"不明な動画タイプです: {job_type}（{', '.join(JOB_TYPES)}）")
+
+    if not spec.get('background_files'):
+        raise ValueError("background_files を指定してください")
+    if job_type != "preview" and not spec.get('output_dir'):
+        raise ValueError("output_dir を指定してください")
+
+    if job_type == "melody":
+        if not spec.get('melody_files'):
+            raise ValueError("melody_files を指定してください")
+    elif not spec.get('bgm_file'):
+        raise ValueError("bgm_file を指定してください")
+
+    visualizer = spec.get('visualizer')
+    if visualizer and visualizer not in VISUALIZER_STYLES:
+        raise ValueError(f"不明なビジュアライザーです: {visualizer}")
+
+    slideshow_options = spec.get('slideshow')
+    if slideshow_options:
+        if not isinstance(slideshow_options, (bool, dict)):
+            raise ValueError("slideshow は true またはオブジェクトで指定してください")
+        normalize_slideshow_options(slideshow_options)
+
+    title_card = spec.get('title_card')
+    if title_card:
+        if not isinstance(title_card, (bool, dict)):
+            raise ValueError("title_card は true またはオブジェクトで指定してください")
+        if not spec.get('title'):
+            raise ValueError("title_card を指定する場合は title（動画タイトル）を指定してください")
+        normalize_title_card_options(title_card)
+
+    if 'short_fill' in spec:
+        validate_short_fill(spec['short_fill'])
+
+    normalize_quality_target(spec.get('target_size_mb'), spec.get('max_video_kbps'))
+
+    if spec.get('deadline') is not None:
+        parse_deadline(spec['deadline'])
+
+    if spec.get('duration_minutes') is not None and not is_positive_int(spec['duration_minutes']):
+        raise ValueError("duration_minutes は正の整数（分）で指定してください")
+    for key in ('duration_seconds', 'short_duration_seconds'):
+        if spec.get(key) is not None and not (is_number(spec[key]) and spec[key] > 0):
+            raise ValueError(f"{key} は正の数値（秒）で指定してください")
+    if spec.get('start_seconds') is not None and not (is_number(spec['start_seconds'])
+                                                      and spec['start_seconds'] >= 0):
+        raise ValueError("start_seconds は0以上の数値（秒）で指定してください")
+
+    durations = spec.get('durations_minutes')
+    if durations is not None:
+        if not isinstance(durations, list) or not durations or not all(map(is_positive_int, durations)):
+            raise ValueError("durations_minutes は正の整数（分）のリストで指定してください")
+
+    if spec.get('short_clips') is not None:
+        normalize_short_clips(spec['short_clips'])
+
+    if spec.get('long_form'):
+        if durations:
+            raise ValueError("long_form と durations_minutes は同時に指定できません")
+        for key in ('part_minutes', 'part_size_mb'):
+            value = spec.get(key)
+            if value is not None and (not is_number(value) or value < 0):
+                raise ValueError(f"{key} は0以上の数値で指定してください")
+
+    for key in ('background_files', 'melody_files'):
+        if key in spec and not isinstance(spec[key], list):
+            raise ValueError(f"{key} はリストで指定してください")
+
+    if allowed_roots is not None:
+        validate_job_paths(spec, allowed_roots)
+    if output_roots is not None and spec.get('output_dir') \
+            and not is_under_roots(spec['output_dir'], output_roots):
+        raise ValueError(f"出力先に指定できないフォルダです: {spec['output_dir']}")
+
+
+def is_number(value):
+    """数値か（JSON の true / false は Python では int になるため除く）"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_positive_int(value):
+    """正の整数か（true / false は除く）"""
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def job_paths(spec):
+    """ジョブ仕様が参照するファイル・フォルダ（入力ファイルと出力先）のリスト"""
+    paths = []
+    for key in PATH_KEYS:
+        value = spec.get(key)
+        if isinstance(value, list):
+            paths.extend(value)
+        elif value:
+            paths.append(value)
+    return paths
+
+
+def validate_job_paths(spec, allowed_roots):
+    """入力ファイル・出力先が許可したフォルダの中にあるか検証する（シンボリックリンクは解決する）"""
+    for path in job_paths(spec):
+        if not isinstance(path, str) or not path:
+            raise ValueError(f"パスは文字列で指定してください: {path!r}")
+        if not is_under_roots(path, allowed_roots):
+            raise ValueError(f"許可されていないフォルダのパスです: {path}")
+
+
+def is_under_roots(path, roots):
+    """path がいずれかのフォルダ（またはその中）にあるか（シンボリックリンクは解決する）"""
+    if not isinstance(path, str) or not path:
+        return False
+    real_path = os.path.realpath(path)
+    return any(os.path.commonpath([os.path.realpath(root), real_path]) == os.path.realpath(root)
+               for root in roots)
+
+
+def parse_deadline(deadline):
+    """締め切り（ISO 8601 の日時）を検証し、ローカル時刻の文字列に揃えて返す"""
+    try:
+        parsed = datetime.fromisoformat(deadline)
+    except (TypeError, ValueError):
+        raise ValueError("deadline は ISO 8601 形式の日時で指定してください（例: 2025-01-31T18:00:00）")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat(timespec='seconds')
+
+
+def normalize_short_clips(short_clips):
+    """まとめて作成するショートの区間を検証し、[(開始位置 または None, 長さ)] に変換する
+
+    各区間は長さ（秒）の数値、または {"duration_seconds": 30, "start_seconds": 45} で指定する
+    （start_seconds を省略すると short_highlight に従って決める）。
+    """
+    if not isinstance(short_clips, list) or not short_clips:
+        raise ValueError("short_clips は区間のリストで指定してください")
+    windows = []
+    for clip in short_clips:
+        if not isinstance(clip, dict):
+            clip = {'duration_seconds': clip}
+        duration = clip.get('duration_seconds')
+        start = clip.get('start_seconds')
+        if not is_number(duration) or duration <= 0:
+            raise ValueError("short_clips の duration_seconds は正の数値（秒）で指定してください")
+        if start is not None and (not is_number(start) or start < 0):
+            raise ValueError("short_clips の start_seconds は0以上の数値（秒）で指定してください")
+        windows.append((start, duration))
+    return windows
+
+
+def split_job(spec):
+    """独立して作成できる出力ごとにジョブ仕様を分ける（別々のワーカーで並行して作成できる）
+
+    単曲・耐久動画のショートバージョンは本編とは別のジョブにする。
+    """
+    if spec.get('type') in ("single", "loop") and spec.get('create_short'):
+        main = dict(spec, create_short=False)
+        short = dict(spec, type="short", create_short=False,
+                     duration_seconds=spec.get('short_duration_seconds', 30))
+        return [main, short]
+    return [spec]
+
+
+def run_render_job(generator, spec, estimator=None):
+    """ジョブ仕様に従って動画を作成し、出力ファイルのリストを返す
+
+    spec の主なキー:
+        type, bgm_file, background_files, output_dir, title,
+        duration_minutes（耐久動画）, duration_seconds（ショート）,
+        durations_minutes（耐久動画を複数の長さでまとめて作成する: [15, 30, 60] など）,
+        long_form（耐久動画を1ループ単位で作成して連結する長時間モード）,
+        part_minutes / part_size_mb（長時間モードで出力を分割する時間・サイズの上限）,
+        melody_files（メドレー）, create_short, short_duration_seconds,
+        short_clips（1曲から長さ・開始位置の違うショートをまとめて作成する: [15, 30, 60] や
+                     [{"duration_seconds": 30, "start_seconds": 45}]。指定時は short_duration_seconds は使わない）,
+        short_highlight（ショートの盛り上がり部分自動検出、既定 True）, start_seconds,
+        short_fill（ショートの余白の埋め方: pad = 黒帯（既定） / blur = 背景のぼかし）,
+        visualizer（単曲・耐久動画のビジュアライザー: spectrum / waveform）,
+        slideshow（背景を順番に切り替える: true または
+                   {hold_seconds, transition_seconds, ken_burns}）,
+        title_card（タイトルを画面に表示する: true または
+                    {layout: intro / static, artist, tracks, font}）,
+        incremental（true の場合、入力・設定が前回と同じ出力は作り直さない）,
+        target_size_mb / max_video_kbps（出力1本あたりのファイルサイズ・映像ビットレートの上限。
+                                        サンプルエンコードから画質を自動調整する）,
+        deadline（締め切りの日時。レンダリングサービスを --order deadline で起動した場合の実行順に使う）,
+        profile（true の場合、処理時間・メモリの内訳を <出力>.profile.txt / .json に保存する）
+
+    estimator: render_history.RenderEstimator（指定時は出力ごとの処理時間・サイズを履歴に記録する）
+    """
+    validate_job_spec(spec)
+
+    # 計測モード: ジョブ全体の時間・メモリの内訳をレポートに書き出す
+    profiler = RenderProfiler() if spec.get('profile') else None
+    generator.profiler = profiler
+    try:
+        outputs = render_outputs(generator, spec, estimator)
+    finally:
+        generator.profiler = None
+
+    if profiler is not None:
+        profiler.finish()
+        profiler.probe_components(generator, spec.get('bgm_file'), spec['background_files'])
+        report_file = profiler.write_report(spec.get('output_dir'), spec, outputs)
+        print(f"プロファイルを保存しました: {report_file}")
+    return outputs
+
+
+def render_outputs(generator, spec, estimator=None):
+    """ジョブの種類に応じて動画を作成し、出力ファイルのリストを返す
+
+    単曲・耐久動画のショートバージョンは本編の後に作成する（履歴には別々に記録する）。
+    """
+    output_dir = spec.get('output_dir')
+    outputs = []
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    # 差分ビルド: 出力の横のマニフェストと一致すれば作成を省略する
+    generator.incremental = bool(spec.get('incremental', False))
+    # 画質の自動調整: 出力ごとにサイズ・ビットレートの上限に収まるCRFを選ぶ
+    generator.quality_target = normalize_quality_target(spec.get('target_size_mb'), spec.get('max_video_kbps'))
+
+    for part in split_job(spec):
+        started = time.time()
+        wall_start = time.perf_counter()
+        part_outputs = render_part(generator, part)
+        outputs.extend(part_outputs)
+        if estimator is not None:
+            try:
+                estimator.record(part, part_outputs, started, time.perf_counter() - wall_start)
+            except Exception as e:
+                # 履歴の記録に失敗しても動画の作成は成功として扱う
+                print(f"レンダリング履歴を記録できませんでした: {e}")
+    return outputs
+
+
+def render_part(generator, spec):
+    """split_job で分けた1つのジョブ仕様の動画を作成し、出力ファイルのリストを返す"""
+    job_type = spec['type']
+    title = spec.get('title', '')
+    output_dir = spec.get('output_dir')
+    background_files = spec['background_files']
+    short_duration = spec.get('short_duration_seconds', 30)
+    outputs = []
+
+    if job_type == "single":
+        outputs.append(generator.create_single_video(
+            spec['bgm_file'], background_files, output_dir, title,
+            visualizer=spec.get('visualizer'),
+            slideshow_options=spec.get('slideshow'),
+            title_card=spec.get('title_card')))
+    elif job_type == "loop" and spec.get('long_form'):
+        # 8〜12時間などの長時間動画: 処理量・一時ファイルが1ループ分で済む
+        outputs.extend(generator.create_long_loop_video(
+            spec['bgm_file'], background_files, output_dir,
+            spec.get('duration_minutes', 15), title,
+            visualizer=spec.get('visualizer'),
+            slideshow_options=spec.get('slideshow'),
+            part_minutes=spec.get('part_minutes'),
+            part_size_mb=spec.get('part_size_mb'),
+            title_card=spec.get('title_card')))
+    elif job_type == "loop" and spec.get('durations_minutes'):
+        # 最長の動画を1回だけエンコードし、短い動画はそこから切り出す
+        outputs.extend(generator.create_loop_variants(
+            spec['bgm_file'], background_files, output_dir,
+            spec['durations_minutes'], title,
+            visualizer=spec.get('visualizer'),
+            slideshow_options=spec.get('slideshow'),
+            title_card=spec.get('title_card')))
+    elif job_type == "loop":
+        outputs.append(generator.create_loop_video(
+            spec['bgm_file'], background_files, output_dir,
+            spec.get('duration_minutes', 15), title,
+            visualizer=spec.get('visualizer'),
+            slideshow_options=spec.get('slideshow'),
+            title_card=spec.get('title_card')))
+    elif job_type == "melody":
+        outputs.append(generator.create_melody_video(
+            spec['melody_files'], background_files, output_dir, title,
+            slideshow_options=spec.get('slideshow'),
+            title_card=spec.get('title_card')))
+    elif job_type == "short" and spec.get('short_clips'):
+        # BGM・背景を1回だけデコードし、すべての区間を1つのFFmpegで書き出す
+        outputs.extend(generator.create_short_clips(
+            spec['bgm_file'], background_files, output_dir,
+            normalize_short_clips(spec['short_clips']), title,
+            auto_highlight=spec.get('short_highlight', True),
+            fill=spec.get('short_fill', 'pad')))
+    elif job_type == "short":
+        outputs.append(generator.create_short_version(
+            spec['bgm_file'], background_files, output_dir,
+            spec.get('duration_seconds', short_duration), title,
+            start_seconds=spec.get('start_seconds'),
+            auto_highlight=spec.get('short_highlight', True),
+            fill=spec.get('short_fill', 'pad')))
+    elif job_type == "preview":
+        outputs.append(generator.create_preview(
+            spec['bgm_file'], background_files, output_dir,
+            video_type=spec.get('preview_type', 'single'),
+            duration_minutes=spec.get('duration_minutes', 15),
+            duration_seconds=short_duration,
+            title=title,
+            auto_highlight=spec.get('short_highlight', True),
+            short_fill=spec.get('short_fill', 'pad'),
+            visualizer=spec.get('visualizer'),
+            slideshow_options=spec.get('slideshow'),
+            title_card=spec.get('title_card')))
+    return outputs
+
+
+class RenderJobStore:
+    """SQLiteに保存する永続ジョブキュー（プロセス再起動後も保持される）"""
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self.lock = threading.Lock()
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self.connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    spec TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    progress REAL,
+                    outputs TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT NOT NULL,
+                    started_at TEXT,
+                    finished_at TEXT,
+                    worker_id TEXT,
+                    heartbeat_at TEXT,
+                    estimated_seconds REAL,
+                    estimated_bytes INTEGER,
+                    deadline TEXT
+                )
+            ''')
+            # 分散ワーカー・処理時間の予測に対応する前に作られたDBには列を追加する
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for column, column_type in (('worker_id', 'TEXT'), ('heartbeat_at', 'TEXT'),
+                                        ('estimated_seconds', 'REAL'), ('estimated_bytes', 'INTEGER'),
+                                        ('deadline', 'TEXT')):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+
+    @contextmanager
+    def connect(self):
+        """呼び出しごとに接続を開き、終了時にコミットして閉じる（スレッド間で共有しない）"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def now(self):
+        return datetime.now().isoformat(timespec='seconds')
+
+    def row_to_job(self, row):
+        """DBの行をAPI応答用のdictに変換"""
+        if row is None:
+            return None
+        job = dict(row)
+        job['spec'] = json.loads(job['spec'])
+        job['outputs'] = json.loads(job['outputs']) if job['outputs'] else []
+        return job
+
+    def add(self, spec, estimate=None):
+        """ジョブをキューに追加してIDを返す
+
+        estimate: 予測の処理時間・出力サイズ（render_history.RenderEstimator.estimate の結果）
+        """
+        job_id = uuid.uuid4().hex[:12]
+        deadline = parse_deadline(spec['deadline']) if spec.get('deadline') is not None else None
+        with self.lock, self.connect() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, spec, status, created_at, estimated_seconds, estimated_bytes, deadline) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, json.dumps(spec, ensure_ascii=False), STATUS_QUEUED, self.now(),
+                 estimate['seconds'] if estimate else None,
+                 int(estimate['bytes']) if estimate else None, deadline)
+            )
+        return job_id
+
+    def get(self, job_id):
+        with self.connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self.row_to_job(row)
+
+    def list(self, status=None):
+        with self.connect() as conn:
+            if status:
+                rows = conn.execute('SELECT * FROM jobs WHERE status = ? ORDER BY created_at, rowid',
+                                    (status,)).fetchall()
+            else:
+                rows = conn.execute('SELECT * FROM jobs ORDER BY created_at, rowid').fetchall()
+        return [self.row_to_job(row) for row in rows]
+
+    def claim_next(self, worker_id=None, order='fifo'):
+        """次の待機中ジョブを実行中にして返す（なければ None）
+
+        worker_id: 別プロセス・別ノードのワーカーが取得する場合の識別子（ハートビートで生存を確認する）。
+        同じDBを複数プロセスで共有しても、1つのジョブを取得できるのは1つのワーカーだけ。
+        order: 取り出す順序（CLAIM_ORDERS のキー）
+        """
+        with self.lock:
+            while True:
+                with self.connect() as conn:
+                    row = conn.execute(
+                        f'SELECT * FROM jobs WHERE status = ? ORDER BY {CLAIM_ORDERS[order]} LIMIT 1',
+                        (STATUS_QUEUED,)
+                    ).fetchone()
+                    if row is None:
+                        return None
+                    now = self.now()
+                    cursor = conn.execute(
+                        'UPDATE jobs SET status = ?, stage = NULL, progress = 0, attempts = attempts + 1, '
+                        'started_at = ?, worker_id = ?, heartbeat_at = ? WHERE id = ? AND status = ?',
+                        (STATUS_RUNNING, now, worker_id, now if worker_id else None,
+                         row['id'], STATUS_QUEUED)
+                    )
+                if cursor.rowcount:
+                    return self.get(row['id'])
+                # 他のプロセスが先に取得した場合は次のジョブを探す
+
+    def update_progress(self, job_id, stage, progress):
+        with self.connect() as conn:
+            conn.execute('UPDATE jobs SET stage = ?, progress = ? WHERE id = ?',
+                         (stage, progress, job_id))
+
+    def heartbeat(self, job_id, worker_id, stage=None, progress=None):
+        """ワーカーの生存を記録し、ジョブがまだそのワーカーに割り当てられていれば True を返す"""
+        with self.connect() as conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET heartbeat_at = ?, stage = COALESCE(?, stage), '
+                'progress = COALESCE(?, progress) WHERE id = ? AND worker_id = ? AND status = ?',
+                (self.now(), stage, progress, job_id, worker_id, STATUS_RUNNING)
+            )
+            return cursor.rowcount > 0
+
+    def finish(self, job_id, outputs, worker_id=None):
+        """ジョブを完了にする（worker_id を指定した場合は、そのワーカーが実行中のときだけ）"""
+        with self.connect() as conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET status = ?, progress = 1, outputs = ?, error = NULL, '
+                'finished_at = ? WHERE id = ? AND (? IS NULL OR (worker_id = ? AND status = ?))',
+                (STATUS_DONE, json.dumps(outputs, ensure_ascii=False), self.now(), job_id,
+                 worker_id, worker_id, STATUS_RUNNING)
+            )
+            return cursor.rowcount > 0
+
+    def fail(self, job_id, error, worker_id=None):
+        """ジョブを失敗にする（worker_id の扱いは finish と同じ）"""
+        with self.connect() as conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, finished_at = ? '
+                'WHERE id = ? AND (? IS NULL OR (worker_id = ? AND status = ?))',
+                (STATUS_FAILED, error, self.now(), job_id, worker_id, worker_id, STATUS_RUNNING)
+            )
+            return cursor.rowcount > 0
+
+    def requeue_stale(self, timeout_seconds):
+        """ハートビートが timeout_seconds 以上途絶えたワーカーのジョブを待機中に戻す
+
+        再実行回数の上限に達したジョブは失敗扱いにする。戻したジョブ数を返す。
+        """
+        deadline = (datetime.now() - timedelta(seconds=timeout_seconds)).isoformat(timespec='seconds')
+        with self.lock, self.connect() as conn:
+            stale = 'status = ? AND worker_id IS NOT NULL AND heartbeat_at < ?'
+            conn.execute(
+                f'UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE {stale} AND attempts >= ?',
+                (STATUS_FAILED, "ワーカーの応答がなく、再実行回数の上限に達しました", self.now(),
+                 STATUS_RUNNING, deadline, MAX_ATTEMPTS)
+            )
+            cursor = conn.execute(
+                f'UPDATE jobs SET status = ?, stage = NULL, progress = NULL, worker_id = NULL '
+                f'WHERE {stale}',
+                (STATUS_QUEUED, STATUS_RUNNING, deadline)
+            )
+            return cursor.rowcount
+
+    def requeue(self, job_id):
+        """実行中のジョブを待機中に戻す（サービス停止時）
+
+        停止による中断は失敗ではないため、claim_next で数えた実行回数も元に戻す。
+        """
+        with self.connect() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, stage = NULL, progress = NULL, attempts = MAX(attempts - 1, 0) '
+                'WHERE id = ? AND status = ?',
+                (STATUS_QUEUED, job_id, STATUS_RUNNING)
+            )
+
+    def recover_interrupted(self):
+        """前回のプロセスで実行中のまま残ったジョブを待機中に戻す
+
+        対象はこのプロセスのワーカー（worker_id なし）が実行していたジョブだけ。
+        分散ワーカーが実行中のジョブは動き続けている可能性があるため、requeue_stale に任せる。
+        再実行回数の上限に達したジョブは失敗扱いにする。戻したジョブ数を返す。
+        """
+        with self.lock, self.connect() as conn:
+            interrupted = 'status = ? AND worker_id IS NULL'
+            conn.execute(
+                f'UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE {interrupted} AND attempts >= ?',
+                (STATUS_FAILED, "再実行回数の上限に達しました", self.now(),
+                 STATUS_RUNNING, MAX_ATTEMPTS)
+            )
+            cursor = conn.execute(
+                f'UPDATE jobs SET status = ?, stage = NULL, progress = NULL WHERE {interrupted}',
+                (STATUS_QUEUED, STATUS_RUNNING)
+            )
+            return cursor.rowcount
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+レンダリングのプロファイリング
+FFmpeg自身のベンチマーク出力（-benchmark / -benchmark_all）とPython側の処理時間を集計し、
+さらに背景のscale/pad・afade・AAC・x264を個別に計測して、ジョブごとに時間とメモリの内訳を報告する
+
+有効にするとFFmpegのログが増え、計測用の短い処理も実行されるため、通常は無効にしておく。
+"""
+
+import os
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+from ffmpeg_runner import FFmpegRunner, FFmpegError
+from media_cache import save_json
+import background_cache
+
+# -benchmark の集計行
+BENCH_SUMMARY_PATTERN = re.compile(r'bench: utime=([\d.]+)s stime=([\d.]+)s rtime=([\d.]+)s')
+BENCH_MAXRSS_PATTERN = re.compile(r'bench: maxrss=(\d+)\s*KiB')
+# -benchmark_all の処理ごとの行（マイクロ秒）: bench: 12 user 3 sys 15 real decode_video 0:0
+BENCH_STEP_PATTERN = re.compile(r'bench:\s+(\d+) user\s+(\d+) sys\s+(\d+) real (\w+)')
+
+# これを超える処理時間（マイクロ秒）は計測値の異常とみなす
+MAX_STEP_MICROSECONDS = 3600 * 1000000
+
+# 個別計測の設定
+PROBE_FRAMES = 50  # 映像の計測フレーム数
+PROBE_AUDIO_SECONDS = 60  # 音声の計測に使う長さ（曲の先頭から）
+MAX_PROBED_BACKGROUNDS = 10
+
+
+class FFmpegCallProfile:
+    """1回のFFmpeg実行の計測結果"""
+
+    def __init__(self, stage, label, duration):
+        self.stage = stage
+        self.label = label
+        self.duration = duration
+        self.wall = None
+        self.returncode = None
+        self.utime = None
+        self.stime = None
+        self.rtime = None
+        self.maxrss_kib = None
+        # 処理の種類（decode_video など）ごとの実時間の合計（マイクロ秒）
+        self.steps = {}
+
+    def feed(self, line):
+        """bench: で始まる行を集計（行は保持しない）"""
+        match = BENCH_STEP_PATTERN.search(line)
+        if match:
+            step = match.group(4)
+            real = int(match.group(3))
+            # スレッドをまたぐ処理では負の値がラップアラウンドして巨大な値になるため除外する
+            if real < MAX_STEP_MICROSECONDS:
+                self.steps[step] = self.steps.get(step, 0) + real
+            return
+        match = BENCH_SUMMARY_PATTERN.search(line)
+        if match:
+            self.utime, self.stime, self.rtime = (float(v) for v in match.groups())
+            return
+        match = BENCH_MAXRSS_PATTERN.search(line)
+        if match:
+            self.maxrss_kib = int(match.group(1))
+
+    def to_dict(self):
+        return {
+            'stage': self.stage,
+            'label': self.label,
+            'output_seconds': self.duration,
+            'wall_seconds': round(self.wall, 3) if self.wall is not None else None,
+            'cpu_user_seconds': self.utime,
+            'cpu_system_seconds': self.stime,
+            'max_rss_mb': round(self.maxrss_kib / 1024, 1) if self.maxrss_kib else None,
+            'speed': round(self.duration / self.wall, 2) if self.duration and self.wall else None,
+            'steps_seconds': {step: round(us / 1e6, 3) for step, us in sorted(self.steps.items())},
+            'returncode': self.returncode,
+        }
+
+
+class PythonMemoryTracer:
+    """tracemalloc（プロセス全体で1つ）を複数のセクション・スレッドで共有する
+
+    最初のセクションの開始時に計測を始め、最後のセクションの終了時に止める。
+    ピークはプロセス全体の値のため、他のスレッドのセクションと重なった区間、
+    および同じスレッドで内側に入れ子になったセクションのピークは報告しない（None）。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = []  # 計測中のセクション（dict）
+        self.started_tracing = False
+
+    def enter(self):
+        """セクションの計測を開始し、exit に渡す情報を返す"""
+        token = {'thread': threading.get_ident(), 'shared': False}
+        with self.lock:
+            if not self.active:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self.started_tracing = True
+                tracemalloc.reset_peak()
+            else:
+                token['shared'] = True
+                for other in self.active:
+                    if other['thread'] != token['thread']:
+                        other['shared'] = True
+            self.active.append(token)
+        return token
+
+    def exit(self, token):
+        """セクションの計測を終了し、ピークのメモリ使用量（バイト、報告しない場合は None）を返す"""
+        with self.lock:
+            peak = None if token['shared'] else tracemalloc.get_traced_memory()[1]
+            self.active.remove(token)
+            if not self.active and self.started_tracing:
+                tracemalloc.stop()
+                self.started_tracing = False
+        return peak
+
+
+MEMORY_TRACER = PythonMemoryTracer()
+
+
+class RenderProfiler:
+    """1ジョブ分の計測結果を集める"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.ffmpeg_calls = []
+        self.sections = []
+        self.components = []
+        # スレッドごとのセクションの入れ子の深さと、FFmpegの実行時間の合計（セクション内の分を差し引くため）
+        self.local = threading.local()
+
+    def finish(self):
+        """ジョブの処理が終わった時刻を記録（以降の個別計測は合計時間に含めない）"""
+        self.finished = time.perf_counter()
+
+    def ffmpeg_args(self):
+        """計測用にFFmpegへ追加するオプション"""
+        return ['-benchmark', '-benchmark_all']
+
+    def start_ffmpeg(self, stage, label, duration):
+        call = FFmpegCallProfile(stage, label, duration)
+        self.ffmpeg_calls.append(call)
+        return call
+
+    def finish_ffmpeg(self, call, wall, returncode):
+        call.wall = wall
+        call.returncode = returncode
+        # FFmpegを実行したスレッド（= 呼び出し元のセクションのスレッド）の合計に加える
+        self.local.ffmpeg_wall = getattr(self.local, 'ffmpeg_wall', 0.0) + wall
+
+    @contextmanager
+    def section(self, name):
+        """Python側の処理時間とメモリ使用量（ピーク）を計測
+
+        セクション内で実行したFFmpegの時間は ffmpeg_seconds に分け、python_seconds から差し引く
+        （FFmpegの時間はFFmpegの実行ごとの計測に含まれるため）。
+        入れ子のセクションは外側のセクションに含まれるため、合計には外側だけを数える。
+        """
+        depth = getattr(self.local, 'depth', 0)
+        self.local.depth = depth + 1
+        ffmpeg_start = getattr(self.local, 'ffmpeg_wall', 0.0)
+        token = MEMORY_TRACER.enter()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            peak = MEMORY_TRACER.exit(token)
+            self.local.depth = depth
+            ffmpeg_seconds = getattr(self.local, 'ffmpeg_wall', 0.0) - ffmpeg_start
+            self.sections.append({
+                'name': name,
+                'wall_seconds': round(wall, 3),
+                'ffmpeg_seconds': round(ffmpeg_seconds, 3),
+                'python_seconds': round(max(0.0, wall - ffmpeg_seconds), 3),
+                'cpu_seconds': round(cpu, 3),
+                'peak_python_memory_mb': round(peak / (1024 * 1024), 1) if peak is not None else None,
+                'nested': depth > 0,
+            })
+
+    def benchmark(self, ffmpeg_path, args):
+        """FFmpegを -benchmark 付きで実行し、実時間（秒）を返す（失敗時は None）"""
+        cmd = [ffmpeg_path, '-hide_banner', '-nostats', '-benchmark'] + args
+        try:
+            _, log_tail = FFmpegRunner(max_attempts=1).run(cmd, "計測に失敗しました", stage="probe")
+        except FFmpegError as e:
+            print(f"計測をスキップします: {e}")
+            return None
+        for line in log_tail:
+            match = BENCH_SUMMARY_PATTERN.search(line)
+            if match:
+                return float(match.group(3))
+        return None
+
+    def encoded_seconds(self):
+        """本番エンコード（encode段階）で出力した秒数の合計"""
+        return sum(call.duration or 0 for call in self.ffmpeg_calls if call.stage == 'encode')
+
+    def probe_components(self, generator, bgm_file, background_files):
+        """背景のscale/pad、x264、afade、AACの処理時間をそれぞれ単独で計測し、ジョブ全体での所要時間を見積もる
+
+        背景は本番と同じく事前変換（normalize_background）した入力を build_input_args でループして
+        1フレームあたり、音声処理は出力1秒あたりの時間を測り、本番のフレーム数・秒数を掛ける。
+        """
+        ffmpeg_path = generator.ffmpeg_path
+        width, height = generator.VIDEO_SIZE
+        fps = generator.VIDEO_FPS
+        seconds = self.encoded_seconds()
+        frames = seconds * fps
+        video_filter = generator.build_video_filter(width, height)
+
+        input_files = []
+        for background_file in list(dict.fromkeys(background_files))[:MAX_PROBED_BACKGROUNDS]:
+            name = os.path.basename(background_file)
+            input_file = generator.normalize_background(background_file, generator.VIDEO_SIZE)
+            input_files.append(input_file)
+            if background_cache.is_normalized(input_file):
+                name += "、変換済み"
+            scale_time = self.benchmark(ffmpeg_path, background_cache.build_input_args(
+                input_file, PROBE_FRAMES / fps + 1) + [
+                '-vf', video_filter, '-frames:v', str(PROBE_FRAMES), '-f', 'null', '-'])
+            if scale_time is not None:
+                self.add_component(f"背景の読み込み・scale/pad（{name}）", scale_time / PROBE_FRAMES,
+                                   "フレーム", frames)
+
+        # x264: 縮小済みの1フレームを繰り返しエンコード（読み込み・縮小は1回だけ）
+        if input_files:
+            encode_time = self.benchmark(ffmpeg_path, [
+                '-i', input_files[0],
+                '-vf', f'{video_filter},loop=loop=-1:size=1,fps={fps},format=yuv420p',
+                '-frames:v', str(PROBE_FRAMES * 2), '-c:v', 'libx264', '-f', 'null', '-'])
+            if encode_time is not None:
+                self.add_component("x264エンコード", encode_time / (PROBE_FRAMES * 2), "フレーム", frames)
+
+        if bgm_file:
+            audio_seconds = generator.get_audio_duration(bgm_file)
+            probe_seconds = min(PROBE_AUDIO_SECONDS, audio_seconds) if audio_seconds else PROBE_AUDIO_SECONDS
+            base_args = ['-t', str(probe_seconds), '-i', bgm_file, '-vn']
+            decode_time = self.benchmark(ffmpeg_path, base_args + ['-f', 'null', '-'])
+            fade_time = self.benchmark(ffmpeg_path, base_args + [
+                '-af', generator.build_audio_fade_filter(probe_seconds, 3), '-f', 'null', '-'])
+            aac_time = self.benchmark(ffmpeg_path, base_args + ['-c:a', 'aac', '-f', 'null', '-'])
+            if decode_time is not None:
+                self.add_component("音声のデコード", decode_time / probe_seconds, "秒", seconds)
+                if fade_time is not None:
+                    self.add_component("afade", max(0.0, fade_time - decode_time) / probe_seconds,
+                                       "秒", seconds)
+                if aac_time is not None:
+                    self.add_component("AACエンコード", max(0.0, aac_time - decode_time) / probe_seconds,
+                                       "秒", seconds)
+
+    def add_component(self, name, unit_seconds, unit, units):
+        self.components.append({
+            'name': name,
+            'seconds_per_unit': round(unit_seconds, 6),
+            'unit': unit,
+            'units': round(units, 1),
+            'estimated_seconds': round(unit_seconds * units, 2),
+        })
+
+    def build_report(self, spec, outputs):
+        """計測結果を時間の大きい順に並べたレポートを作成"""
+        total = (self.finished or time.perf_counter()) - self.started
+        calls = sorted((call.to_dict() for call in self.ffmpeg_calls),
+                       key=lambda call: call['wall_seconds'] or 0, reverse=True)
+        ffmpeg_total = sum(call['wall_seconds'] or 0 for call in calls)
+        python_total = sum(section['python_seconds'] for section in self.sections if not section['nested'])
+        rss_values = [call['max_rss_mb'] for call in calls if call['max_rss_mb']]
+        return {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'job_type': spec.get('type'),
+            'outputs': outputs,
+            'total_seconds': round(total, 3),
+            'ffmpeg_seconds': round(ffmpeg_total, 3),
+            'python_seconds': round(python_total, 3),
+            'other_seconds': round(max(0.0, total - ffmpeg_total - python_total), 3),
+            'max_ffmpeg_rss_mb': max(rss_values) if rss_values else None,
+            'ffmpeg_calls': calls,
+            'python_sections': sorted(self.sections, key=lambda s: s['python_seconds'], reverse=True),
+            'components': sorted(self.components, key=lambda c: c['estimated_seconds'], reverse=True),
+        }
+
+    def format_report(self, report):
+        """レポートを読みやすいテキストに整形"""
+        lines = [
+            f"プロファイル: {report['job_type']} ({report['created_at']})",
+            f"合計 {report['total_seconds']:.1f}秒 = FFmpeg {report['ffmpeg_seconds']:.1f}秒"
+            f" + Python {report['python_seconds']:.1f}秒 + その他 {report['other_seconds']:.1f}秒",
+        ]
+        if report['max_ffmpeg_rss_mb']:
+            lines.append(f"FFmpegの最大メモリ使用量: {report['max_ffmpeg_rss_mb']:.0f}MB")
+
+        lines += ["", "[FFmpeg 実行ごと（時間順）]"]
+        for call in report['ffmpeg_calls']:
+            detail = ", ".join(f"{step} {sec:.1f}秒" for step, sec in call['steps_seconds'].items())
+            speed = f" {call['speed']}x" if call['speed'] else ""
+            memory = f" {call['max_rss_mb']:.0f}MB" if call['max_rss_mb'] else ""
+            lines.append(f"  {call['wall_seconds']:8.2f}秒 {call['stage']:<10} {call['label']}{speed}{memory}")
+            if detail:
+                lines.append(f"            {detail}")
+
+        lines += ["", "[Python 処理（時間順）]"]
+        for section in report['python_sections']:
+            details = [f"CPU {section['cpu_seconds']:.2f}秒"]
+            if section['ffmpeg_seconds']:
+                details.append(f"FFmpeg {section['ffmpeg_seconds']:.2f}秒を除く")
+            if section['peak_python_memory_mb'] is not None:
+                details.append(f"ピーク {section['peak_python_memory_mb']:.0f}MB")
+            nested = "└ " if section['nested'] else ""
+            lines.append(f"  {section['python_seconds']:8.2f}秒 {nested}{section['name']}（{', '.join(details)}）")
+
+        lines += ["", "[処理ごとの見積もり（単独計測 × 本番の量、時間順）]"]
+        for component in report['components']:
+            lines.append(f"  {component['estimated_seconds']:8.2f}秒 {component['name']}"
+                         f"（{component['seconds_per_unit'] * 1000:.2f}ミリ秒/{component['unit']}"
+                         f" × {component['units']:.0f}）")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, output_dir, spec, outputs):
+        """レポートを JSON とテキストで保存し、テキストのパスを返す"""
+        if outputs:
+            base = os.path.splitext(outputs[0])[0]
+        else:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            base = os.path.join(output_dir or ".", f"render_{timestamp}")
+        report = self.build_report(spec, outputs)
+        save_json(f"{base}.profile.json", report)
+        text_file = f"{base}.profile.txt"
+        with open(text_file, 'w', encoding='utf-8') as f:
+            f.write(self.format_report(report))
+        return text_file
@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+EchoGarden レンダリングサービス
+ローカルのHTTP経由で動画作成ジョブを受け付け、永続キューから順に実行する
+
+使い方:
+    python render_service.py --port 8765 --concurrency 2
+    python render_service.py --watch   # config.json の watch_folders を監視して自動で作成
+    python render_service.py --order shortest   # 予測の処理時間が短いジョブから実行
+    python render_service.py --backend pyav   # 対応する処理をFFmpegを起動せずプロセス内で行う
+    python render_service.py --token <トークン> --root ../Sound --root ../Image --root ../Output
+        # 認証トークンを必須にし、ジョブが参照できるフォルダを制限する
+    python render_service.py --output-root ../Output   # ジョブの出力先に指定できるフォルダ
+
+認証:
+    --token（または環境変数 ECHOGARDEN_RENDER_TOKEN）を指定すると、/health 以外のリクエストには
+    "Authorization: Bearer <トークン>" ヘッダーが必要になる。localhost 以外で待ち受ける場合は
+    --token と --root が必須。
+    POST の本文は Content-Type: application/json、PUT は application/octet-stream でなければ 415 を返す
+    （ブラウザのページからの単純なリクエストでジョブを投入させないため）。
+    ジョブの出力先は --output-root（省略時は --root、それもなければ設定ファイルの output_directory
+    または Movie フォルダ）の中に限る。
+
+API:
+    GET  /health        サービスの状態
+    GET  /jobs          ジョブ一覧（?status=queued などで絞り込み）
+    GET  /jobs/<id>     ジョブの状態・進捗・出力ファイル・予測の処理時間（estimated_seconds）と
+                        出力サイズ（estimated_bytes）
+    POST /jobs          ジョブを追加（JSON本文は render_jobs.run_render_job の spec）
+
+分散ワーカー用（render_cluster.HTTPTransport が使う）:
+    POST /workers/<worker_id>/claim   次のジョブを割り当てる
+    POST /jobs/<id>/heartbeat         ワーカーの生存と進捗を報告
+    POST /jobs/<id>/finish, /fail     結果を報告
+    GET  /jobs/<id>/files?path=...    入力ファイルをダウンロード
+    PUT  /jobs/<id>/files?name=...    出力ファイル（とマニフェスト）をアップロード。同じ名前のファイルがある場合、
+                                      差分ビルドのジョブは上書きし、それ以外は連番を付けた名前で保存する
+
+JSON本文は1MBまで、アップロードは1ファイル --max-upload-mb（既定32GB）までで、超える場合は 413 を返す。
+"""
+
+import argparse
+import hmac
+import json
+import os
+import shutil
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs, unquote
+
+from video_generator import VideoGenerator
+from render_cluster import Coordinator, job_input_files, TRANSFER_CHUNK_SIZE, TOKEN_ENV
+from pyav_backend import BACKENDS
+from render_history import RenderEstimator, RenderHistory
+from output_manifest import MANIFEST_SUFFIX, remove_manifest
+from render_jobs import CLAIM_ORDERS, RenderJobStore, run_render_job
+from watch_folder import FolderWatcher, load_watch_templates
+
+DEFAULT_PORT = 8765
+DEFAULT_DB_PATH = Path(__file__).parent / "render_jobs.db"
+DEFAULT_CONFIG_PATH = Path(__file__).parent / "config.json"
+# 設定ファイルに output_directory がない場合に出力先として許可するフォルダ
+DEFAULT_OUTPUT_DIR = Path(__file__).parent.parent / "Movie"
+
+# 進捗をDBに書き込む最短間隔（秒）
+PROGRESS_INTERVAL = 1.0
+
+# 認証なしで待ち受けてよいアドレス
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+# JSON本文（ジョブ仕様・ワーカーの報告）の上限（バイト）
+MAX_JSON_BYTES = 1024 * 1024
+# アップロードできる出力ファイル1つの上限（MB、--max-upload-mb で変更可能）
+DEFAULT_MAX_UPLOAD_MB = 32 * 1024
+
+
+class RequestBodyError(ValueError):
+    """リクエスト本文を受け付けられない（status は応答のHTTPステータス）"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class RenderService:
+    """FFmpeg検出済みのVideoGeneratorを保持し、ジョブを同時実行数の上限内で処理する"""
+
+    def __init__(self, store, concurrency=1, ffmpeg_path=None, order='fifo', history=None, backend="ffmpeg",
+                 allowed_roots=None, output_roots=None):
+        self.store = store
+        # 0 の場合はこのマシンでは作成せず、分散ワーカー（render_cluster.py）に任せる
+        self.concurrency = max(0, concurrency)
+        # FFmpegの検出は起動時に1回だけ行う
+        self.generator = VideoGenerator(ffmpeg_path, backend)
+        # 処理時間の履歴（投入時の予測と、このマシンで作成したジョブの記録に使う）
+        self.history = history or RenderHistory()
+        # ジョブの投入・ワーカーへの割り当て
+        # （allowed_roots: ジョブが参照できるフォルダ、output_roots: 出力先に指定できるフォルダ）
+        self.coordinator = Coordinator(store, estimator=RenderEstimator(self.generator, self.history),
+                                       order=order, allowed_roots=allowed_roots, output_roots=output_roots)
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.workers = []
+        self.active = {}  # job_id -> VideoGenerator
+        self.active_lock = threading.Lock()
+        # アップロードされた出力のファイル名を決める処理を直列にする（同じ名前を2回使わない）
+        self.upload_lock = threading.Lock()
+
+    def start(self):
+        """中断されたジョブを復帰させてワーカーを起動"""
+        recovered = self.store.recover_interrupted()
+        if recovered:
+            print(f"中断されていたジョブを再開します: {recovered}件")
+
+        for i in range(self.concurrency):
+            worker = threading.Thread(target=self.worker_loop, name=f"render-worker-{i}")
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        self.wakeup.set()
+
+    def stop(self):
+        """ワーカーを停止し、実行中のジョブは次回起動時に再開できるよう待機中に戻す"""
+        self.stop_event.set()
+        self.wakeup.set()
+        with self.active_lock:
+            active = list(self.active.items())
+        for job_id, generator in active:
+            generator.cancel()
+            self.store.requeue(job_id)
+        for worker in self.workers:
+            worker.join(timeout=10)
+
+    def submit(self, spec):
+        """ジョブを検証してキューに追加し、ジョブIDのリストを返す
+
+        ショートバージョンは別のジョブに分け、空いているワーカーで並行して作成する。
+        """
+        job_ids = self.coordinator.submit(spec)
+        self.wakeup.set()
+        return job_ids
+
+    def worker_loop(self):
+        # ワーカーごとに専用のVideoGeneratorを持つ（一時ディレクトリを共有しないため）
+        # インプロセスのバックエンドでは、デコード済みの音声・エンコード済みの背景を次のジョブでも使う
+        generator = VideoGenerator(self.generator.ffmpeg_path, self.generator.backend)
+        while not self.stop_event.is_set():
+            job = self.store.claim_next(order=self.coordinator.order)
+            if job is None:
+                self.wakeup.wait(timeout=5)
+                self.wakeup.clear()
+                continue
+            self.run_job(generator, job)
+
+    def run_job(self, generator, job):
+        job_id = job['id']
+        print(f"ジョブを開始します: {job_id} ({job['spec'].get('type')})")
+
+        last_update = [0.0]
+
+        def on_progress(stage, fraction, speed):
+            now = time.monotonic()
+            if fraction in (0.0, 1.0, None) or now - last_update[0] >= PROGRESS_INTERVAL:
+                last_update[0] = now
+                self.store.update_progress(job_id, stage, fraction)
+
+        generator.progress_callback = on_progress
+        with self.active_lock:
+            self.active[job_id] = generator
+        try:
+            outputs = run_render_job(generator, job['spec'], RenderEstimator(generator, self.history))
+            self.store.finish(job_id, outputs)
+            print(f"ジョブが完了しました: {job_id}")
+        except Exception as e:
+            if self.stop_event.is_set():
+                # 停止による中断は失敗扱いにしない
+                print(f"ジョブを中断しました: {job_id}")
+            else:
+                self.store.fail(job_id, str(e))
+                print(f"ジョブが失敗しました: {job_id} - {e}")
+        finally:
+            generator.progress_callback = None
+            with self.active_lock:
+                self.active.pop(job_id, None)
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """ジョブ操作用のJSON API"""
+
+    service = None  # make_server で設定
+    token = None  # 認証トークン（None で認証しない）
+    max_upload_bytes = DEFAULT_MAX_UPLOAD_MB * 1024 * 1024
+
+    def authorized(self):
+        """認証トークンを確認し、一致しなければ 401 を返して False"""
+        if not self.token:
+            return True
+        header = self.headers.get('Authorization', '')
+        if header.startswith('Bearer ') and hmac.compare_digest(header[len('Bearer '):].encode('utf-8'),
+                                                                self.token.encode('utf-8')):
+            return True
+        self.send_json(401, {'error': '認証トークンが正しくありません'})
+        return False
+
+    def has_content_type(self, expected):
+        """Content-Type が expected か確認し、異なれば 415 を返して False
+
+        ブラウザのページは text/plain などの単純なリクエストなら事前確認なしに送れるため、それらを受け付けない。
+        """
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type == expected:
+            return True
+        self.send_json(415, {'error': f"Content-Type は {expected} を指定してください"})
+        return False
+
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        if parts != ['health'] and not self.authorized():
+            return
+
+        if parts == ['health']:
+            self.send_json(200, {
+                'status': 'ok',
+                'ffmpeg': self.service.generator.ffmpeg_path,
+                'concurrency': self.service.concurrency,
+                'order': self.service.coordinator.order,
+                'backend': self.service.generator.backend,
+            })
+        elif parts == ['jobs']:
+            status = parse_qs(url.query).get('status', [None])[0]
+            self.send_json(200, {'jobs': self.service.store.list(status)})
+        elif len(parts) == 3 and parts[2] == 'files':
+            self.send_job_file(url)
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = self.service.store.get(parts[1])
+            if job is None:
+                self.send_json(404, {'error': 'ジョブが見つかりません'})
+            else:
+                self.send_json(200, job)
+        else:
+            self.send_json(404, {'error': 'Not Found'})
+
+    def content_length(self, limit):
+        """Content-Length を検証して返す（不正・上限超過の場合は RequestBodyError）"""
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            raise RequestBodyError(411, "Content-Length を指定してください")
+        if length < 0:
+            raise RequestBodyError(400, "Content-Length が正しくありません")
+        if length > limit:
+            raise RequestBodyError(413, f"本文が大きすぎます（上限 {limit // (1024 * 1024)}MB）")
+        return length
+
+    def read_json(self):
+        length = self.content_length(MAX_JSON_BYTES)
+        return json.loads(self.rfile.read(length).decode('utf-8'))
+
+    def do_POST(self):
+        if not self.authorized() or not self.has_content_type('application/json'):
+            return
+        parts = [p for p in urlparse(self.path).path.split('/') if p]
+        if len(parts) == 3 and parts[0] in ('jobs', 'workers'):
+            self.handle_worker_request(parts)
+            return
+        if parts != ['jobs']:
+            self.send_json(404, {'error': 'Not Found'})
+            return
+
+        try:
+            spec = self.read_json()
+            job_ids = self.service.submit(spec)
+        except RequestBodyError as e:
+            self.send_json(e.status, {'error': str(e)})
+            return
+        except (ValueError, json.JSONDecodeError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        estimates = [{key: job[key] for key in ('id', 'estimated_seconds', 'estimated_bytes')}
+                     for job in map(self.service.store.get, job_ids)]
+        self.send_json(201, {'id': job_ids[0], 'ids': job_ids, 'status': 'queued', 'estimates': estimates})
+
+    def handle_worker_request(self, parts):
+        """分散ワーカーからのジョブ取得・ハートビート・結果報告"""
+        coordinator = self.service.coordinator
+        try:
+            data = self.read_json()
+        except RequestBodyError as e:
+            self.send_json(e.status, {'error': str(e)})
+            return
+        except (ValueError, json.JSONDecodeError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        if parts[0] == 'workers' and parts[2] == 'claim':
+            self.send_json(200, {'job': coordinator.claim(unquote(parts[1]))})
+        elif parts[2] == 'heartbeat':
+            assigned = coordinator.heartbeat(data.get('worker_id'), parts[1], data.get('stage'),
+                                             data.get('progress'))
+            self.send_json(200, {'assigned': assigned})
+        elif parts[2] == 'finish':
+            accepted = coordinator.finish(data.get('worker_id'), parts[1], data.get('outputs', []))
+            self.send_json(200, {'accepted': accepted})
+        elif parts[2] == 'fail':
+            accepted = coordinator.fail(data.get('worker_id'), parts[1], data.get('error', ''))
+            self.send_json(200, {'accepted': accepted})
+        else:
+            self.send_json(404, {'error': 'Not Found'})
+
+    def find_transfer_job(self, url):
+        """ファイル転送の対象ジョブ（リクエストしたワーカーに割り当て中のもの）と検索条件を返す"""
+        parts = [p for p in url.path.split('/') if p]
+        if len(parts) != 3 or parts[0] != 'jobs' or parts[2] != 'files':
+            return None, None
+        query = parse_qs(url.query)
+        worker_id = query.get('worker_id', [None])[0]
+        return self.service.coordinator.assigned_job(worker_id, parts[1]), query
+
+    def send_job_file(self, url):
+        """割り当て中のジョブが参照する入力ファイルだけをダウンロードさせる"""
+        job, query = self.find_transfer_job(url)
+        path = query.get('path', [None])[0] if query else None
+        if job is None or path not in job_input_files(job['spec']) or not os.path.isfile(path):
+            self.send_json(404, {'error': 'ファイルが見つかりません'})
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile, TRANSFER_CHUNK_SIZE)
+
+    def do_PUT(self):
+        """ワーカーが作成した出力ファイル・マニフェストをジョブの出力フォルダに保存"""
+        if not self.authorized() or not self.has_content_type('application/octet-stream'):
+            return
+        job, query = self.find_transfer_job(urlparse(self.path))
+        name = os.path.basename(query.get('name', [''])[0]) if query else ''
+        if job is None or not name or not job['spec'].get('output_dir'):
+            self.send_json(404, {'error': 'ジョブが見つかりません'})
+            return
+
+        output_dir = job['spec']['output_dir']
+        os.makedirs(output_dir, exist_ok=True)
+        try:
+            remaining = self.content_length(MAX_JSON_BYTES if name.endswith(MANIFEST_SUFFIX)
+                                            else self.max_upload_bytes)
+            if remaining > shutil.disk_usage(output_dir).free:
+                raise RequestBodyError(507, "出力フォルダの空き容量が足りません")
+        except RequestBodyError as e:
+            self.send_json(e.status, {'error': str(e)})
+            return
+
+        reserved = None
+        if name.endswith(MANIFEST_SUFFIX):
+            # マニフェストは、先にアップロードした出力の横にだけ保存する
+            if not os.path.isfile(os.path.join(output_dir, name[:-len(MANIFEST_SUFFIX)])):
+                self.send_json(404, {'error': 'マニフェストに対応する出力ファイルがありません'})
+                return
+            output_file = os.path.join(output_dir, name)
+        elif job['spec'].get('incremental'):
+            # 差分ビルドでは同じ名前の出力を作り直す（マニフェストと対応させるため）
+            output_file = os.path.join(output_dir, name)
+        else:
+            output_file = reserved = self.reserve_output(output_dir, name)
+
+        temp_file = os.path.join(output_dir, f".tmp_upload_{job['id']}_{name}")
+        try:
+            with open(temp_file, 'wb') as f:
+                while remaining > 0:
+                    chunk = self.rfile.read(min(TRANSFER_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise OSError("アップロードが途中で切断されました")
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            if not name.endswith(MANIFEST_SUFFIX):
+                # 差し替える出力の古いマニフェストは、新しいものが届くまで最新と判定させない
+                remove_manifest(output_file)
+            os.replace(temp_file, output_file)
+        except BaseException:
+            if reserved:
+                os.remove(reserved)
+            raise
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+        self.send_json(200, {'path': output_file})
+
+    def reserve_output(self, output_dir, name):
+        """既存のファイルと重ならない出力ファイルのパスを決め、空のファイルを作って確保する
+
+        ワーカーは一時フォルダに作成するため、ファイル名の連番はここで付ける（並行するアップロードとも重ならない）。
+        """
+        with self.service.upload_lock:
+            output_file = os.path.join(output_dir, self.service.generator.get_unique_filename(output_dir, name))
+            open(output_file, 'xb').close()
+        return output_file
+
+    def log_message(self, format, *args):
+        print(f"[HTTP] {self.address_string()} {format % args}")
+
+
+def make_server(service, host='127.0.0.1', port=DEFAULT_PORT, token=None, max_upload_mb=DEFAULT_MAX_UPLOAD_MB):
+    """サービスに紐づいたHTTPサーバーを作成（token を指定すると認証を必須にする）
+
+    max_upload_mb: ワーカーがアップロードできる出力ファイル1つの上限（MB）
+    """
+    handler = type('BoundRenderRequestHandler', (RenderRequestHandler,),
+                   {'service': service, 'token': token, 'max_upload_bytes': max_upload_mb * 1024 * 1024})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    """メイン関数"""
+    parser = argparse.ArgumentParser(description="EchoGarden レンダリングサービス")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="待ち受けアドレス（既定: localhostのみ。それ以外は --token と --root が必須）")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="待ち受けポート")
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help="同時に実行するジョブ数（0 の場合は分散ワーカーだけで実行する）")
+    parser.add_argument('--db', default=str(DEFAULT_DB_PATH), help="ジョブキューのSQLiteファイル")
+    parser.add_argument('--order', choices=sorted(CLAIM_ORDERS), default='fifo',
+                        help="待機中のジョブを実行する順序（shortest: 予測の処理時間が短い順、"
+                             "deadline: 締め切りに間に合わせる順）")
+    parser.add_argument('--backend', choices=BACKENDS, default='ffmpeg',
+                        help="メディア処理のバックエンド（pyav: 対応する処理をプロセス内で行う。PyAVが必要）")
+    parser.add_argument('--watch', action='store_true',
+                        help="設定ファイルの watch_folders を監視し、新しいBGMの動画を自動で作成する")
+    parser.add_argument('--config', default=str(DEFAULT_CONFIG_PATH), help="設定ファイル（--watch 用）")
+    parser.add_argument('--token', default=os.environ.get(TOKEN_ENV),
+                        help=f"ワーカー・クライアントと共通の認証トークン（既定: 環境変数 {TOKEN_ENV}）")
+    parser.add_argument('--root', action='append', dest='roots',
+                        help="ジョブの入力ファイル・出力先として許可するフォルダ（複数指定可、省略時は制限しない）")
+    parser.add_argument('--output-root', action='append', dest='output_roots',
+                        help="ジョブの出力先として許可するフォルダ（複数指定可。省略時は --root、"
+                             "それもなければ設定ファイルの output_directory または Movie フォルダ）")
+    parser.add_argument('--max-upload-mb', type=int, default=DEFAULT_MAX_UPLOAD_MB,
+                        help="分散ワーカーがアップロードできる出力ファイル1つの上限（MB）")
+    args = parser.parse_args()
+
+    if args.host not in LOOPBACK_HOSTS and not (args.token and args.roots):
+        parser.error("localhost 以外で待ち受ける場合は --token と --root を指定してください")
+
+    config = {}
+    if args.watch or os.path.exists(args.config):
+        with open(args.config, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    templates = []
+    if args.watch:
+        templates = load_watch_templates(config, Path(args.config).parent, config.get('output_directory'))
+        if not templates:
+            parser.error("設定ファイルに watch_folders がありません")
+
+    default_output_dir = config.get('output_directory') or DEFAULT_OUTPUT_DIR
+    output_roots = args.output_roots or args.roots or [str((Path(args.config).parent / default_output_dir).resolve())]
+    # 監視フォルダの出力先は設定ファイルで指定したものなので、常に許可する
+    output_roots = output_roots + [template['output_dir'] for template in templates]
+    print(f"出力先に指定できるフォルダ: {', '.join(output_roots)}")
+
+    store = RenderJobStore(args.db)
+    service = RenderService(store, concurrency=args.concurrency, order=args.order, backend=args.backend,
+                            allowed_roots=args.roots, output_roots=output_roots)
+
+    watcher = None
+    if args.watch:
+        watcher = FolderWatcher(service, templates, Path(args.config).parent)
+
+    service.start()
+    if watcher:
+        watcher.start()
+
+    server = make_server(service, args.host, args.port, args.token, args.max_upload_mb)
+    print(f"レンダリングサービスを起動しました: http://{args.host}:{args.port}")
+
+    # SIGTERMでも実行中のジョブを待機中に戻してから終了する
+    signal.signal(signal.SIGTERM,
+                  lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("停止中...")
+    finally:
+        server.server_close()
+        if watcher:
+            watcher.stop()
+        service.stop()
+
+
+if __name__ == "__main__":
+    main()
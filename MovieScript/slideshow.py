@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+スライドショー背景
+選択した背景画像を順番に表示し、クロスフェードでつなぐ（任意でゆっくり拡大・縮小する）
+
+画像ごとの表示部分と画像間の切り替え部分を短いクリップとして1回だけエンコードしてキャッシュし、
+動画全体はそれらを連結リストに並べてストリームコピーで組み立てる。
+そのため動画の長さに関係なく、エンコードするのは画像数×2本の短いクリップだけで済む。
+"""
+
+import os
+
+from media_cache import get_cache_dir, file_fingerprint, make_cache_key
+
+# 既定の設定
+DEFAULT_HOLD_SECONDS = 10  # 1枚あたりの表示時間（切り替えを含む）
+DEFAULT_TRANSITION_SECONDS = 1.5  # クロスフェードの長さ
+
+# パン・ズーム（ケン・バーンズ効果）で表示中に拡大する割合
+KEN_BURNS_ZOOM = 0.08
+# パン・ズーム時は出力の何倍の解像度から切り出すか（位置の丸めによる揺れを抑える）
+KEN_BURNS_SUPERSAMPLE = 2
+
+# 全クリップ共通のエンコード設定（連結時にストリームコピーできるよう揃える）
+CLIP_ENCODE_ARGS = [
+    '-c:v', 'libx264',
+    '-preset', 'medium',
+    '-crf', '20',
+    '-pix_fmt', 'yuv420p',
+    '-video_track_timescale', '12800',
+    '-an',
+]
+# クリップの作り方を変えたらキャッシュを無効化するため更新する
+SLIDESHOW_VERSION = 1
+
+
+def normalize_options(options):
+    """スライドショー設定（True または dict）を検証して dict に変換"""
+    if options is True or options is None:
+        options = {}
+    hold_seconds = float(options.get('hold_seconds', DEFAULT_HOLD_SECONDS))
+    transition_seconds = float(options.get('transition_seconds', DEFAULT_TRANSITION_SECONDS))
+    if hold_seconds <= 0:
+        raise ValueError("スライドショーの表示時間は0より大きくしてください")
+    if transition_seconds < 0 or transition_seconds >= hold_seconds:
+        raise ValueError("スライドショーの切り替え時間は0以上・表示時間未満にしてください")
+    return {
+        'hold_seconds': hold_seconds,
+        'transition_seconds': transition_seconds,
+        'ken_burns': bool(options.get('ken_burns', False)),
+    }
+
+
+class SlideshowBuilder:
+    """画像ごと・切り替えごとのクリップを用意し、連結リストを作成する"""
+
+    def __init__(self, generator, width, height, fps, hold_seconds=DEFAULT_HOLD_SECONDS,
+                 transition_seconds=DEFAULT_TRANSITION_SECONDS, ken_burns=False):
+        self.generator = generator
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.ken_burns = ken_burns
+        # フレーム数で扱い、連結後の長さがずれないようにする
+        self.hold_frames = max(1, round(hold_seconds * fps))
+        self.transition_frames = min(round(transition_seconds * fps), self.hold_frames - 1)
+        self.cache_dir = get_cache_dir('slideshow')
+
+    def motion_frames(self):
+        """1枚の画像が画面に映っているフレーム数（前後の切り替えを含む）"""
+        return self.hold_frames + self.transition_frames
+
+    def build_image_filter(self, index, start_frame, frame_count):
+        """画像の表示中の start_frame から frame_count フレーム分を作るフィルター
+
+        パン・ズーム時は偶数番目を拡大、奇数番目を縮小にする。
+        """
+        if not self.ken_burns:
+            return (f'{self.generator.build_video_filter(self.width, self.height)},setsar=1,'
+                    f'loop=loop={frame_count - 1}:size=1,'
+                    f'settb=1/{self.fps},setpts=N,fps={self.fps},format=yuv420p')
+
+        scale = KEN_BURNS_SUPERSAMPLE
+        last_frame = max(1, self.motion_frames() - 1)
+        progress = f'(on+{start_frame})/{last_frame}'
+        if index % 2 == 1:
+            progress = f'(1-{progress})'
+        return (
+            f'{self.generator.build_video_filter(self.width * scale, self.height * scale)},setsar=1,'
+            f"zoompan=z='1+{KEN_BURNS_ZOOM}*{progress}':"
+            f"x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)':"
+            f'd={frame_count}:s={self.width}x{self.height}:fps={self.fps},'
+            f'settb=1/{self.fps},setpts=N,fps={self.fps},format=yuv420p'
+        )
+
+    def clip_path(self, *parts):
+        key = make_cache_key(self.width, self.height, self.fps, self.hold_frames,
+                             self.transition_frames, self.ken_burns, SLIDESHOW_VERSION, *parts)
+        return self.cache_dir / f"{key}.mp4"
+
+    def encode_clip(self, cache_file, input_args, filter_args, frame_count, label):
+        """クリップをエンコードしてキャッシュに保存（作成済みならそのまま使う）"""
+        if cache_file.exists():
+            return str(cache_file)
+
+        print(f"スライドショーのクリップを作成中: {label}")
+        temp_file = cache_file.with_name(f".tmp_{os.getpid()}_{cache_file.name}")
+        cmd = [self.generator.ffmpeg_path] + input_args + filter_args + [
+            '-frames:v', str(frame_count),
+            '-r', str(self.fps),
+        ] + CLIP_ENCODE_ARGS + ['-y', str(temp_file)]
+        try:
+            self.generator.run_ffmpeg(cmd, "スライドショーのクリップ作成に失敗しました",
+                                      stage="slideshow", duration=frame_count / self.fps)
+            os.replace(temp_file, cache_file)
+        finally:
+            if temp_file.exists():
+                temp_file.unlink()
+        return str(cache_file)
+
+    def hold_clip(self, index, image_file):
+        """画像を単独で表示する部分のクリップ"""
+        frame_count = self.hold_frames - self.transition_frames
+        cache_file = self.clip_path('hold', file_fingerprint(image_file), index % 2)
+        return self.encode_clip(
+            cache_file,
+            ['-i', image_file],
+            ['-vf', self.build_image_filter(index, self.transition_frames, frame_count)],
+            frame_count,
+            os.path.basename(image_file),
+        )
+
+    def transition_clip(self, index, image_file, next_index, next_file):
+        """image_file から next_file へのクロスフェード部分のクリップ"""
+        frames = self.transition_frames
+        cache_file = self.clip_path('transition', file_fingerprint(image_file), index % 2,
+                                    file_fingerprint(next_file), next_index % 2)
+        outgoing = self.build_image_filter(index, self.hold_frames, frames)
+        incoming = self.build_image_filter(next_index, 0, frames)
+        filter_complex = (
+            f'[0:v]{outgoing}[a];[1:v]{incoming}[b];'
+            f'[a][b]xfade=transition=fade:duration={frames / self.fps}:offset=0[v]'
+        )
+        return self.encode_clip(
+            cache_file,
+            ['-i', image_file, '-i', next_file],
+            ['-filter_complex', filter_complex, '-map', '[v]'],
+            frames,
+            f"{os.path.basename(image_file)} → {os.path.basename(next_file)}",
+        )
+
+    def build_cycle(self, image_files):
+        """全画像を1周するクリップの並びを返す（最後の画像から最初の画像へもつなぐ）"""
+        cycle = []
+        count = len(image_files)
+        for index, image_file in enumerate(image_files):
+            cycle.append(self.hold_clip(index, image_file))
+            if self.transition_frames > 0:
+                next_index = (index + 1) % count
+                cycle.append(self.transition_clip(index, image_file, next_index, image_files[next_index]))
+        return cycle
+
+    def write_concat_list(self, image_files, duration, list_file):
+        """duration 秒を満たすまで1周分のクリップを繰り返す連結リストを書き出す"""
+        cycle = self.build_cycle(image_files)
+        cycle_seconds = len(image_files) * self.hold_frames / self.fps
+        cycle_count = int(duration / cycle_seconds) + 1
+        with open(list_file, 'w', encoding='utf-8') as f:
+            for _ in range(cycle_count):
+                for clip in cycle:
+                    f.write(f"file '{clip}'\n")
+        print(f"スライドショー: {len(image_files)}枚 × {cycle_count}周")
+        return list_file
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+音声解析のテスト
+解析結果（エンベロープ）から盛り上がり部分の開始位置を求める find_highlight_start
+
+実行: python -m unittest test_audio_analysis
+"""
+
+import unittest
+
+from audio_analysis import FRAME_SECONDS, find_highlight_start, np
+
+
+def make_analysis(rms, onset=None):
+    """FRAME_SECONDS ごとの音量・立ち上がりから解析結果を作成"""
+    return {
+        'frame_seconds': FRAME_SECONDS,
+        'rms': list(rms),
+        'onset': list(onset if onset is not None else [0.0] * len(rms)),
+    }
+
+
+@unittest.skipIf(np is None, "NumPyがインストールされていません")
+class FindHighlightStartTest(unittest.TestCase):
+
+    def test_loudest_window(self):
+        # 60〜90秒が最も大きい
+        rms = [0.1] * 120 + [0.8] * 60 + [0.2] * 120
+        self.assertEqual(find_highlight_start(make_analysis(rms), 30), 60.0)
+
+    def test_onset_weight(self):
+        # 音量は同じで、立ち上がりが多い区間を選ぶ
+        rms = [0.5] * 200
+        onset = [0.0] * 100 + [1.0] * 40 + [0.0] * 60
+        self.assertEqual(find_highlight_start(make_analysis(rms, onset), 20), 50.0)
+        # 立ち上がりの重みを0にすると音量だけで決まる（同点なら先頭）
+        self.assertEqual(find_highlight_start(make_analysis(rms, onset), 20, onset_weight=0), 0.0)
+
+    def test_spike_does_not_dominate(self):
+        # 一瞬の大きなピークより、長く続く盛り上がりを選ぶ
+        rms = [0.1] * 200
+        rms[20] = 100.0
+        rms[120:160] = [0.6] * 40
+        self.assertEqual(find_highlight_start(make_analysis(rms), 20), 60.0)
+
+    def test_window_longer_than_track(self):
+        self.assertEqual(find_highlight_start(make_analysis([0.5] * 40), 20), 0.0)
+        self.assertEqual(find_highlight_start(make_analysis([0.5] * 40), 60), 0.0)
+
+    def test_silence(self):
+        self.assertEqual(find_highlight_start(make_analysis([0.0] * 100), 10), 0.0)
+
+    def test_result_fits_in_track(self):
+        # 最後が最も大きい場合も、区間が曲の終わりを超えない位置を返す
+        rms = [0.1] * 100 + [0.9] * 20
+        start = find_highlight_start(make_analysis(rms), 15)
+        self.assertEqual(start, 45.0)
+        self.assertLessEqual(start + 15, len(rms) * FRAME_SECONDS)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FFmpeg実行レイヤーのテスト
+エラーの分類・制限時間の計算と、FFmpegRunner の再試行・タイムアウト・停止検出・キャンセル
+（FFmpegの代わりにPythonのスクリプトを実行するため、FFmpegがなくても実行できる）
+
+実行: python -m unittest test_ffmpeg_runner
+"""
+
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import ffmpeg_runner
+from ffmpeg_runner import (
+    FFmpegEncoderError, FFmpegError, FFmpegFilterError, FFmpegInputError, FFmpegOutputError,
+    FFmpegRunner, FFmpegStallError, FFmpegTimeoutError, FFmpegTransientError, RenderCancelledError,
+    classify_error, stage_timeout,
+)
+
+
+def script(code):
+    """FFmpegの代わりに実行するコマンド"""
+    return [sys.executable, '-c', code]
+
+
+class ClassifyErrorTest(unittest.TestCase):
+
+    def test_error_types(self):
+        cases = [
+            ("input.mp3: No such file or directory", FFmpegInputError),
+            ("moov atom not found", FFmpegInputError),
+            ("output.mp4: No space left on device", FFmpegOutputError),
+            ("Error initializing filter 'scale'", FFmpegFilterError),
+            ("Unknown encoder 'libx265'", FFmpegEncoderError),
+            ("Cannot allocate memory", FFmpegTransientError),
+            ("Conversion failed!", FFmpegError),
+        ]
+        for line, error_class in cases:
+            with self.subTest(line=line):
+                error = classify_error("失敗しました", 'encode', 1, ["frame=  10", line])
+                self.assertIs(type(error), error_class)
+                self.assertEqual(error.stage, 'encode')
+                self.assertEqual(error.returncode, 1)
+                self.assertEqual(error.log_tail, ["frame=  10", line])
+                self.assertIn(line, str(error))
+
+    def test_transient(self):
+        self.assertTrue(classify_error("失敗", 'encode', 1, ["Cannot allocate memory"]).transient)
+        self.assertFalse(classify_error("失敗", 'encode', 1, ["Invalid data found when processing input"]).transient)
+
+    def test_killed_by_signal(self):
+        # シグナルで強制終了された場合は、ログに原因がなくても一時的なエラー
+        self.assertIs(type(classify_error("失敗", 'encode', -9, ["frame=  10"])), FFmpegTransientError)
+        # ログに原因があればそちらを優先する
+        self.assertIs(type(classify_error("失敗", 'encode', -9, ["Permission denied"])), FFmpegOutputError)
+
+    def test_summary(self):
+        log = [f"frame={i}" for i in range(20)] + ["Error while opening encoder", "frame=21"]
+        error = classify_error("失敗しました", 'encode', 1, log)
+        self.assertEqual(str(error), "失敗しました: Error while opening encoder")
+        # エラーの行がなければ末尾の数行
+        error = classify_error("失敗しました", 'encode', 1, log[:20])
+        self.assertEqual(str(error).splitlines()[-1], "frame=19")
+
+
+class StageTimeoutTest(unittest.TestCase):
+
+    def test_fixed_stage(self):
+        self.assertEqual(stage_timeout('probe', None), 60)
+        self.assertEqual(stage_timeout('probe', 3600), 60)
+
+    def test_scales_with_duration(self):
+        self.assertEqual(stage_timeout('encode', 100), 900 + 4.0 * 100)
+        self.assertEqual(stage_timeout('concat', 600), 600 + 0.5 * 600)
+
+    def test_unknown_duration_or_stage(self):
+        # 出力の長さに比例する段階で長さが分からない場合は制限しない
+        self.assertIsNone(stage_timeout('encode', None))
+        self.assertIsNone(stage_timeout('encode', 0))
+        self.assertIsNone(stage_timeout('unknown', 100))
+
+
+class FFmpegRunnerTest(unittest.TestCase):
+
+    def test_success(self):
+        runner = FFmpegRunner()
+        lines = []
+        returncode, log_tail = runner.run(
+            script("import sys; sys.stderr.write('line 1\\n\\nline 2\\n')"),
+            "失敗しました", stage='probe', on_line=lines.append)
+        self.assertEqual(returncode, 0)
+        self.assertEqual(log_tail, ['line 1', 'line 2'])
+        self.assertEqual(lines, ['line 1', 'line 2'])
+        self.assertIsNone(runner.current_process)
+
+    def test_log_tail_is_bounded(self):
+        runner = FFmpegRunner(log_lines=5)
+        _, log_tail = runner.run(
+            script("import sys\nfor i in range(100): sys.stderr.write(f'line {i}\\n')"),
+            "失敗しました", stage='probe')
+        self.assertEqual(log_tail, [f'line {i}' for i in range(95, 100)])
+
+    def test_failure_is_classified(self):
+        runner = FFmpegRunner()
+        with self.assertRaises(FFmpegInputError) as context:
+            runner.run(script("import sys; sys.stderr.write('a.mp3: No such file or directory\\n'); sys.exit(1)"),
+                       "読み込みに失敗しました", stage='probe')
+        self.assertEqual(context.exception.returncode, 1)
+        self.assertTrue(str(context.exception).startswith("読み込みに失敗しました: "))
+
+    def test_check_false(self):
+        runner = FFmpegRunner()
+        returncode, _ = runner.run(script("import sys; sys.exit(1)"), "失敗しました", stage='probe',
+                                   check=False)
+        self.assertEqual(returncode, 1)
+
+    def test_progress(self):
+        runner = FFmpegRunner()
+        reports = []
+        runner.run(script(
+            "import sys, time\n"
+            "for t in ('00:00:02.00', '00:00:05.00'):\n"
+            "    sys.stderr.write(f'frame=1 time={t} speed=2.5x\\n'); sys.stderr.flush(); time.sleep(0.6)\n"),
+            "失敗しました", stage='encode', duration=10,
+            progress=lambda stage, fraction, speed: reports.append((fraction, speed)))
+        self.assertEqual(reports[0], (0.0, None))
+        self.assertIn((0.5, 2.5), reports)
+        self.assertEqual(reports[-1], (1.0, 2.5))
+
+    @mock.patch.object(ffmpeg_runner, 'RETRY_DELAY_SECONDS', 0)
+    def test_retries_transient_error(self):
+        runner = FFmpegRunner(max_attempts=2)
+        with self.assertRaises(FFmpegTransientError):
+            with mock.patch.object(runner, 'run_once', wraps=runner.run_once) as run_once:
+                runner.run(script("import sys; sys.stderr.write('Cannot allocate memory\\n'); sys.exit(1)"),
+                           "失敗しました", stage='probe')
+        self.assertEqual(run_once.call_count, 2)
+
+    def test_does_not_retry_permanent_error(self):
+        runner = FFmpegRunner(max_attempts=3)
+        with self.assertRaises(FFmpegFilterError):
+            with mock.patch.object(runner, 'run_once', wraps=runner.run_once) as run_once:
+                runner.run(script("import sys; sys.stderr.write('No such filter: foo\\n'); sys.exit(1)"),
+                           "失敗しました", stage='probe')
+        self.assertEqual(run_once.call_count, 1)
+
+    def test_timeout(self):
+        runner = FFmpegRunner(max_attempts=1)
+        with self.assertRaises(FFmpegTimeoutError):
+            runner.run(script("import time; time.sleep(30)"), "失敗しました", stage='probe', timeout=0.5)
+
+    def test_stall(self):
+        runner = FFmpegRunner(stall_seconds=1, max_attempts=1)
+        # 同じ時刻の進捗行だけが出続ける場合も停止とみなす
+        with self.assertRaises(FFmpegStallError):
+            runner.run(script(
+                "import sys, time\n"
+                "for _ in range(100):\n"
+                "    sys.stderr.write('frame=1 time=00:00:01.00\\n'); sys.stderr.flush(); time.sleep(0.2)\n"),
+                "失敗しました", stage='encode')
+
+    def test_cancel(self):
+        runner = FFmpegRunner()
+        timer = threading.Timer(0.5, runner.cancel)
+        timer.start()
+        try:
+            with self.assertRaises(RenderCancelledError):
+                runner.run(script("import time; time.sleep(30)"), "失敗しました", stage='probe')
+        finally:
+            timer.cancel()
+        # キャンセル後の実行は起動せずに中止する
+        with self.assertRaises(RenderCancelledError):
+            runner.run(script("pass"), "失敗しました", stage='probe')
+
+
+class FFmpegStreamTest(unittest.TestCase):
+
+    def test_read_and_write(self):
+        runner = FFmpegRunner()
+        with runner.stream(script("import sys; sys.stdout.buffer.write(sys.stdin.buffer.read(3)[::-1])"),
+                           "失敗しました", stage='probe', stdin=True, stdout=True) as stream:
+            stream.write(b'abc')
+            stream.process.stdin.flush()
+            self.assertEqual(stream.read(10), b'cba')
+        self.assertIsNone(runner.current_process)
+
+    def test_stdout_to_file(self):
+        # 標準出力をファイルに書き込ませ、標準入力だけをパイプにする
+        runner = FFmpegRunner()
+        with tempfile.TemporaryFile() as output:
+            with runner.stream(script("import sys; sys.stdout.buffer.write(sys.stdin.buffer.read()[::-1])"),
+                               "失敗しました", stage='probe', stdin=True, stdout=output) as stream:
+                stream.write(b'abc')
+            output.seek(0)
+            self.assertEqual(output.read(), b'cba')
+
+    def test_failure(self):
+        runner = FFmpegRunner()
+        with self.assertRaises(FFmpegInputError):
+            with runner.stream(script("import sys; sys.stderr.write('Invalid data found when processing input\\n');"
+                                      " sys.exit(1)"),
+                               "失敗しました", stage='probe', stdout=True) as stream:
+                stream.read(10)
+
+    def test_stall(self):
+        runner = FFmpegRunner(stall_seconds=1)
+        with self.assertRaises(FFmpegStallError):
+            with runner.stream(script("import time; time.sleep(30)"), "失敗しました", stage='probe',
+                               stdout=True) as stream:
+                stream.read(10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+耐久動画の長時間モードのテスト
+出力の分割（1ファイルに入れるループ数の時間・サイズの上限と、最後のパートに入る残りのループ）
+
+実行: python -m unittest test_long_form
+"""
+
+import os
+import tempfile
+import unittest
+
+from video_generator import VideoGenerator
+
+MB = 1024 * 1024
+
+
+class UnitsPerPartTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.generator = VideoGenerator(ffmpeg_path='ffmpeg')
+
+    def make_units(self, loop_count, size=MB, outro_size=None):
+        """冒頭・途中（使い回し）・末尾のループ単位のファイルを作り、ループ順のリストを返す"""
+        sizes = {'unit_intro.mp4': size, 'unit_middle.mp4': size, 'unit_outro.mp4': outro_size or size}
+        paths = {}
+        for name, unit_size in sizes.items():
+            paths[name] = os.path.join(self.temp_dir.name, name)
+            with open(paths[name], 'wb') as f:
+                f.write(b'0' * unit_size)
+        return ([paths['unit_intro.mp4']] + [paths['unit_middle.mp4']] * (loop_count - 2)
+                + [paths['unit_outro.mp4']])
+
+    def test_minutes(self):
+        units = self.make_units(20)
+        self.assertEqual(self.generator.get_units_per_part(units, 300, 60, None), 12)
+        # 上限を超えないよう切り捨てる（60分 / 7分 = 8.57）
+        self.assertEqual(self.generator.get_units_per_part(units, 420, 60, None), 8)
+
+    def test_size(self):
+        units = self.make_units(20)
+        # コンテナのヘッダー分の余裕（2%）を残す
+        self.assertEqual(self.generator.get_units_per_part(units, 300, None, 10), 9)
+        self.assertEqual(self.generator.get_units_per_part(units, 300, None, 10.3), 10)
+
+    def test_size_uses_largest_unit(self):
+        # 音声を付け直した末尾のループが大きい場合も、どのパートも上限を超えない
+        units = self.make_units(20, outro_size=2 * MB)
+        self.assertEqual(self.generator.get_units_per_part(units, 300, None, 10), 4)
+
+    def test_smaller_limit_wins(self):
+        units = self.make_units(20)
+        self.assertEqual(self.generator.get_units_per_part(units, 300, 60, 5), 4)
+        self.assertEqual(self.generator.get_units_per_part(units, 300, 10, 100), 2)
+
+    def test_unit_over_limit(self):
+        # 1ループ分が上限を超える場合も、1ループずつには分割する
+        units = self.make_units(5, size=2 * MB)
+        self.assertEqual(self.generator.get_units_per_part(units, 300, None, 1), 1)
+        self.assertEqual(self.generator.get_units_per_part(units, 300, 3, None), 1)
+
+
+class SplitUnitsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.generator = VideoGenerator(ffmpeg_path='ffmpeg')
+        self.units = ['intro'] + ['middle'] * 8 + ['outro']
+
+    def test_remainder(self):
+        parts = self.generator.split_units(self.units, 4)
+        self.assertEqual([len(part) for part in parts], [4, 4, 2])
+        # 最後のパートは残りのループで、末尾のループ（フェードアウト）で終わる
+        self.assertEqual(parts[0][0], 'intro')
+        self.assertEqual(parts[-1], ['middle', 'outro'])
+        self.assertEqual(sum(parts, []), self.units)
+
+    def test_exact_division(self):
+        self.assertEqual([len(part) for part in self.generator.split_units(self.units, 5)], [5, 5])
+
+    def test_single_part(self):
+        self.assertEqual(self.generator.split_units(self.units, 12), [self.units])
+        self.assertEqual(self.generator.split_units(['single'], 1), [['single']])
+
+
+if __name__ == "__main__":
+    unittest.main()
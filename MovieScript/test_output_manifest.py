@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+出力マニフェスト（差分ビルド）のテスト
+入力の内容・パラメータ・出力ファイルの状態から、作り直しが必要かを判定する
+
+実行: python -m unittest test_output_manifest
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from output_manifest import (
+    build_manifest, is_up_to_date, manifest_path, read_manifest, remove_manifest, write_manifest,
+)
+
+
+class OutputManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        # ハッシュのキャッシュもテスト用のフォルダに保存する
+        patcher = mock.patch.dict(os.environ, {'ECHOGARDEN_CACHE_DIR': os.path.join(self.temp_dir.name, 'cache')})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.temp_dir.cleanup)
+
+        self.bgm = self.write_file('song.mp3', b'bgm')
+        self.background = self.write_file('bg.png', b'background')
+        self.output = self.write_file('output.mp4', b'video')
+
+    def write_file(self, name, data):
+        path = os.path.join(self.temp_dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def build(self, params=None, inputs=None):
+        return build_manifest('single', inputs or [self.bgm, self.background],
+                              params if params is not None else {'duration': 60})
+
+    def test_not_up_to_date_without_manifest(self):
+        self.assertFalse(is_up_to_date(self.output, self.build()))
+        self.assertEqual(read_manifest(self.output), {})
+
+    def test_up_to_date_after_write(self):
+        manifest = self.build()
+        write_manifest(self.output, manifest)
+        self.assertTrue(is_up_to_date(self.output, self.build()))
+        saved = read_manifest(self.output)
+        self.assertEqual(saved['key'], manifest['key'])
+        self.assertEqual(saved['output_size'], len(b'video'))
+        self.assertIn('created_at', saved)
+
+    def test_changed_params(self):
+        write_manifest(self.output, self.build())
+        self.assertFalse(is_up_to_date(self.output, self.build({'duration': 30})))
+
+    def test_changed_input_content(self):
+        write_manifest(self.output, self.build())
+        self.write_file('song.mp3', b'another bgm')
+        self.assertFalse(is_up_to_date(self.output, self.build()))
+
+    def test_input_order(self):
+        write_manifest(self.output, self.build())
+        self.assertFalse(is_up_to_date(self.output, self.build(inputs=[self.background, self.bgm])))
+
+    def test_key_does_not_depend_on_location(self):
+        # 同じ内容のファイルを別の場所に移しても key は変わらない
+        moved = self.write_file('moved.mp3', b'bgm')
+        self.assertEqual(self.build(inputs=[moved, self.background])['key'], self.build()['key'])
+
+    def test_changed_or_missing_output(self):
+        write_manifest(self.output, self.build())
+        # 途中で書き込みが止まった出力などサイズが違う場合
+        self.write_file('output.mp4', b'truncated video')
+        self.assertFalse(is_up_to_date(self.output, self.build()))
+        os.remove(self.output)
+        self.assertFalse(is_up_to_date(self.output, self.build()))
+
+    def test_remove_manifest(self):
+        write_manifest(self.output, self.build())
+        remove_manifest(self.output)
+        self.assertFalse(os.path.exists(manifest_path(self.output)))
+        self.assertFalse(is_up_to_date(self.output, self.build()))
+        # マニフェストがなくてもエラーにしない
+        remove_manifest(self.output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+画質の自動調整のテスト
+サンプルのCRFとビットレートから目標に収まるCRFを選ぶ計算（補間・範囲の制限）と、
+選んだCRFがサンプルの範囲外の場合にサンプルを追加して求め直す判断
+（サンプルのエンコードは置き換えるため、FFmpegがなくても実行できる）
+
+実行: python -m unittest test_quality_tuning
+"""
+
+import math
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from quality_tuning import (
+    MAX_CRF, MIN_CRF, SAMPLE_CRFS, QualityTuner, choose_crf, fit_model, is_extrapolated, nearest_samples,
+)
+
+
+def kbps_at(crf, a=10.0, b=-0.1):
+    """ln(kbps) = a + b * CRF に従うビットレート"""
+    return math.exp(a + b * crf)
+
+
+def make_samples(crfs=SAMPLE_CRFS, a=10.0, b=-0.1):
+    return [(crf, kbps_at(crf, a, b)) for crf in crfs]
+
+
+class FitModelTest(unittest.TestCase):
+
+    def test_recovers_line(self):
+        a, b = fit_model(make_samples())
+        self.assertAlmostEqual(a, 10.0)
+        self.assertAlmostEqual(b, -0.1)
+
+    def test_single_crf(self):
+        # CRFが1種類しかない場合は傾き0（ビットレートの平均）
+        a, b = fit_model([(29, kbps_at(29)), (29, kbps_at(29))])
+        self.assertEqual(b, 0.0)
+        self.assertAlmostEqual(a, math.log(kbps_at(29)))
+
+
+class NearestSamplesTest(unittest.TestCase):
+
+    def test_brackets_target(self):
+        samples = make_samples()
+        self.assertEqual(nearest_samples(samples, kbps_at(26)), samples[:2])
+        self.assertEqual(nearest_samples(samples, kbps_at(32)), samples[1:])
+        # 順番に関係なくCRF順に並べて選ぶ
+        self.assertEqual(nearest_samples(list(reversed(samples)), kbps_at(32)), samples[1:])
+
+    def test_outside_samples(self):
+        samples = make_samples()
+        # 最も低いCRFより高いビットレートなら先頭の2つ、最も高いCRFより低ければ末尾の2つ
+        self.assertEqual(nearest_samples(samples, kbps_at(20)), samples[:2])
+        self.assertEqual(nearest_samples(samples, kbps_at(40)), samples[1:])
+
+
+class ChooseCrfTest(unittest.TestCase):
+
+    def test_interpolation(self):
+        crf, predicted = choose_crf(make_samples(), kbps_at(26))
+        self.assertEqual(crf, 26.0)
+        self.assertAlmostEqual(predicted, kbps_at(26))
+
+    def test_rounds_to_half(self):
+        self.assertEqual(choose_crf(make_samples(), kbps_at(26.3))[0], 26.5)
+        self.assertEqual(choose_crf(make_samples(), kbps_at(31.2))[0], 31.0)
+
+    def test_interpolates_between_nearest_samples(self):
+        # 全体の当てはめではなく、目標を挟む2つのサンプルの直線を使う
+        samples = [(23, kbps_at(23)), (29, kbps_at(29)), (35, kbps_at(35, a=9.4, b=-0.08))]
+        target = math.exp((math.log(samples[1][1]) + math.log(samples[2][1])) / 2)
+        self.assertEqual(choose_crf(samples, target)[0], 32.0)
+
+    def test_extrapolation(self):
+        # サンプルの範囲外は直線を延長する
+        crf, predicted = choose_crf(make_samples(), kbps_at(40))
+        self.assertEqual(crf, 40.0)
+        self.assertAlmostEqual(predicted, kbps_at(40))
+
+    def test_clamped(self):
+        for target, expected in ((kbps_at(10), MIN_CRF), (kbps_at(60), MAX_CRF)):
+            with self.subTest(expected=expected):
+                crf, predicted = choose_crf(make_samples(), target)
+                self.assertEqual(crf, expected)
+                # 予測は制限したCRFでのビットレート
+                self.assertAlmostEqual(predicted, kbps_at(expected))
+
+    def test_bitrate_does_not_decrease(self):
+        # CRFを上げてもビットレートが下がらない場合は、目標に収まるかで最も高画質・低画質を選ぶ
+        samples = [(crf, 500.0) for crf in SAMPLE_CRFS]
+        self.assertEqual(choose_crf(samples, 800.0)[0], MIN_CRF)
+        self.assertEqual(choose_crf(samples, 300.0)[0], MAX_CRF)
+
+
+class IsExtrapolatedTest(unittest.TestCase):
+
+    def test_range(self):
+        samples = make_samples()
+        cases = [(23, False), (26.5, False), (35, False), (22.5, True), (40, True)]
+        for crf, expected in cases:
+            with self.subTest(crf=crf):
+                self.assertEqual(is_extrapolated(samples, crf), expected)
+
+    def test_added_sample(self):
+        # 範囲外のCRFでもサンプルを追加済みなら範囲外とみなさない
+        self.assertFalse(is_extrapolated(make_samples(SAMPLE_CRFS + (40,)), 40))
+        self.assertFalse(is_extrapolated(make_samples(SAMPLE_CRFS + (40,)), 37.5))
+
+
+class QualityTunerTest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        # サンプルのキャッシュもテスト用のフォルダに保存する
+        patcher = mock.patch.dict(os.environ, {'ECHOGARDEN_CACHE_DIR': temp_dir.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tuner = QualityTuner(None)
+        self.input_args = ['-loop', '1', '-i', 'background.png']
+        self.video_args = ['-c:v', 'libx264']
+
+    def tune(self, target_kbps, encoded_kbps=kbps_at):
+        """encoded_kbps(CRF) をサンプルのビットレートとして調整し、((CRF, 予測), エンコードしたCRF) を返す"""
+        with mock.patch.object(self.tuner, 'encode_sample',
+                               side_effect=lambda input_args, video_args, crf: encoded_kbps(crf)) as encode:
+            result = self.tuner.tune(self.input_args, self.video_args, target_kbps)
+        return result, [call.args[2] for call in encode.call_args_list]
+
+    def test_within_samples(self):
+        (crf, _), encoded = self.tune(kbps_at(26))
+        self.assertEqual(crf, 26.0)
+        self.assertEqual(encoded, list(SAMPLE_CRFS))
+
+    def test_resamples_when_extrapolated(self):
+        # CRF 35 より先はビットレートが速く下がる映像では、延長した予測（CRF 40）よりも低いCRFで収まる
+        def encoded_kbps(crf):
+            return kbps_at(crf) if crf <= 35 else kbps_at(35) * math.exp(-0.2 * (crf - 35))
+
+        (crf, predicted), encoded = self.tune(kbps_at(40), encoded_kbps)
+        self.assertEqual(encoded, list(SAMPLE_CRFS) + [40.0])
+        self.assertEqual(crf, 37.5)
+        self.assertAlmostEqual(predicted, kbps_at(40))
+
+    def test_reuses_cached_samples(self):
+        self.tune(kbps_at(40))
+        # 追加したサンプルも含めて再利用し、同じ素材ではエンコードしない
+        (crf, _), encoded = self.tune(kbps_at(40))
+        self.assertEqual(crf, 40.0)
+        self.assertEqual(encoded, [])
+        (crf, _), encoded = self.tune(kbps_at(30))
+        self.assertEqual(crf, 30.0)
+        self.assertEqual(encoded, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
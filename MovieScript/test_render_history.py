@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+レンダリング履歴のテスト
+履歴（一時フォルダのSQLite）からの処理時間・サイズの予測（中央値・条件を緩めた履歴の利用）と、
+差分ビルドで作成を省略した出力を除いた記録
+（入力の長さ・解像度は置き換えるため、FFmpegがなくても実行できる）
+
+実行: python -m unittest test_render_history
+"""
+
+import os
+import tempfile
+import time
+import unittest
+
+from render_history import RECENT_RUNS, RenderEstimator, RenderHistory
+from video_generator import VideoGenerator
+
+
+def make_run(mode='single', profile='plain', resolution='hd', wall_seconds=60.0, output_seconds=60.0,
+             output_bytes=6000):
+    return {
+        'mode': mode, 'profile': profile, 'resolution': resolution, 'audio_seconds': output_seconds,
+        'output_seconds': output_seconds, 'input_width': 1920, 'input_height': 1080, 'output_count': 1,
+        'wall_seconds': wall_seconds, 'output_bytes': output_bytes,
+    }
+
+
+class FakeGenerator:
+    """音声の長さ・背景の解像度を決まった値で返す VideoGenerator の代わり"""
+
+    PREVIEW_SEGMENT_SECONDS = VideoGenerator.PREVIEW_SEGMENT_SECONDS
+    get_loop_count = VideoGenerator.get_loop_count
+
+    def __init__(self, durations):
+        self.durations = durations
+
+    def get_audio_duration(self, path):
+        return self.durations.get(os.path.basename(path))
+
+    def get_video_size(self, path):
+        return (1920, 1080)
+
+
+class HistoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.history = RenderHistory(os.path.join(self.temp_dir.name, 'history.db'))
+
+    def add_runs(self, wall_rates, **run):
+        for wall_rate in wall_rates:
+            self.history.add(make_run(wall_seconds=wall_rate * 60, output_bytes=int(wall_rate * 6000), **run))
+
+
+class FindRatesTest(HistoryTestCase):
+
+    def test_median(self):
+        # 1件だけ極端に遅い記録があっても予測は大きく変わらない
+        self.add_runs([1.0, 2.0, 50.0])
+        rates = self.history.find_rates('single', 'plain', 'hd')
+        self.assertEqual(rates, {'wall_rate': 2.0, 'byte_rate': 200.0, 'samples': 3})
+        self.add_runs([3.0])
+        self.assertEqual(self.history.find_rates('single', 'plain', 'hd')['wall_rate'], 2.5)
+
+    def test_recent_runs_only(self):
+        self.add_runs(range(1, RECENT_RUNS + 6))
+        rates = self.history.find_rates('single', 'plain', 'hd')
+        self.assertEqual(rates['samples'], RECENT_RUNS)
+        # 直近の RECENT_RUNS 件（6〜25）の中央値
+        self.assertEqual(rates['wall_rate'], 15.5)
+
+    def test_same_conditions_first(self):
+        self.add_runs([1.0], resolution='hd')
+        self.add_runs([4.0], resolution='sd')
+        self.add_runs([9.0], profile='spectrum')
+        self.assertEqual(self.history.find_rates('single', 'plain', 'hd')['wall_rate'], 1.0)
+        self.assertEqual(self.history.find_rates('single', 'plain', 'sd')['wall_rate'], 4.0)
+
+    def test_relaxes_resolution(self):
+        self.add_runs([1.0], resolution='hd')
+        self.add_runs([4.0], resolution='sd')
+        self.add_runs([9.0], profile='spectrum')
+        # 解像度が同じ履歴がなければ、種類・プロファイルが同じ履歴（解像度を問わない）
+        self.assertEqual(self.history.find_rates('single', 'plain', 'uhd'),
+                         {'wall_rate': 2.5, 'byte_rate': 250.0, 'samples': 2})
+        # 解像度が分からない（None）場合も同じ
+        self.assertEqual(self.history.find_rates('single', 'plain', None)['samples'], 2)
+
+    def test_relaxes_profile(self):
+        self.add_runs([1.0, 4.0])
+        self.add_runs([9.0], profile='spectrum', resolution='sd')
+        # プロファイルが同じ履歴もなければ、種類が同じ履歴をすべて使う
+        self.assertEqual(self.history.find_rates('single', 'waveform', 'hd')['wall_rate'], 4.0)
+
+    def test_no_history_for_mode(self):
+        self.add_runs([1.0])
+        self.assertIsNone(self.history.find_rates('loop', 'plain', 'hd'))
+
+    def test_ignores_empty_outputs(self):
+        self.history.add(make_run(output_seconds=0))
+        self.assertIsNone(self.history.find_rates('single', 'plain', 'hd'))
+        self.add_runs([2.0])
+        self.assertEqual(self.history.find_rates('single', 'plain', 'hd')['samples'], 1)
+
+
+class RenderEstimatorTest(HistoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.generator = FakeGenerator({'song.mp3': 120.0})
+        self.estimator = RenderEstimator(self.generator, self.history)
+        self.spec = {'type': 'single', 'bgm_file': 'song.mp3', 'background_files': ['bg.png']}
+
+    def test_estimate(self):
+        self.assertIsNone(self.estimator.estimate(self.spec))
+        self.add_runs([0.5, 0.5])
+        self.assertEqual(self.estimator.estimate(self.spec), {'seconds': 60.0, 'bytes': 6000.0, 'samples': 2})
+
+    def test_estimate_loop(self):
+        self.add_runs([0.5], mode='loop')
+        # 15分に達するまで曲単位でループした長さ（8回 × 120秒）
+        estimate = self.estimator.estimate(dict(self.spec, type='loop', duration_minutes=15))
+        self.assertEqual(estimate['seconds'], 0.5 * 8 * 120)
+
+    def test_estimate_includes_short(self):
+        self.add_runs([0.5])
+        spec = dict(self.spec, create_short=True, short_duration_seconds=15)
+        # ショートバージョンの履歴がなければ予測しない
+        self.assertIsNone(self.estimator.estimate(spec))
+        self.add_runs([2.0], mode='short')
+        self.assertEqual(self.estimator.estimate(spec)['seconds'], 0.5 * 120 + 2.0 * 15)
+
+    def test_target_size_limits_bytes(self):
+        self.history.add(make_run(output_bytes=60 * 1024 * 1024))
+        estimate = self.estimator.estimate(dict(self.spec, target_size_mb=50))
+        self.assertEqual(estimate['bytes'], 50 * 1024 * 1024)
+
+    def test_unknown_audio_duration(self):
+        self.add_runs([0.5])
+        self.assertIsNone(self.estimator.estimate(dict(self.spec, bgm_file='missing.mp3')))
+
+    def write_output(self, name, size, modified=None):
+        path = os.path.join(self.temp_dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(b'0' * size)
+        if modified is not None:
+            os.utime(path, (modified, modified))
+        self.generator.durations[name] = 100.0
+        return path
+
+    def recorded_runs(self):
+        with self.history.connect() as conn:
+            return [dict(row) for row in conn.execute('SELECT * FROM runs')]
+
+    def test_record_excludes_outputs_older_than_start(self):
+        started = time.time()
+        # 差分ビルドで作り直さなかった出力は開始前の更新日時のまま
+        skipped = self.write_output('skipped.mp4', 300, modified=started - 3600)
+        created = self.write_output('created.mp4', 200)
+        missing = os.path.join(self.temp_dir.name, 'missing.mp4')
+        self.estimator.record(self.spec, [skipped, created, missing], started, 50.0)
+
+        runs = self.recorded_runs()
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(runs[0]['output_count'], 1)
+        self.assertEqual(runs[0]['output_seconds'], 100.0)
+        self.assertEqual(runs[0]['output_bytes'], 200)
+        self.assertEqual(runs[0]['wall_seconds'], 50.0)
+        self.assertEqual((runs[0]['mode'], runs[0]['profile'], runs[0]['resolution']), ('single', 'plain', 'hd'))
+
+    def test_record_skips_when_nothing_created(self):
+        started = time.time()
+        skipped = self.write_output('skipped.mp4', 300, modified=started - 3600)
+        self.estimator.record(self.spec, [skipped], started, 1.0)
+        self.assertEqual(self.recorded_runs(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
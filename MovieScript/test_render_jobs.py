@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+レンダリングジョブのテスト
+ジョブ仕様の検証・分割と、RenderJobStore の状態遷移（取得・再投入・中断からの復旧）
+
+実行: python -m unittest test_render_jobs
+"""
+
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from render_jobs import (
+    MAX_ATTEMPTS, STATUS_DONE, STATUS_FAILED, STATUS_QUEUED, STATUS_RUNNING,
+    RenderJobStore, normalize_short_clips, split_job, validate_job_spec,
+)
+
+
+def make_spec(**extra):
+    """検証を通る最小限の単曲ジョブ仕様"""
+    spec = {
+        'type': 'single',
+        'bgm_file': '/music/song.mp3',
+        'background_files': ['/images/bg.png'],
+        'output_dir': '/output',
+    }
+    spec.update(extra)
+    return spec
+
+
+class ValidateJobSpecTest(unittest.TestCase):
+
+    def test_valid_spec(self):
+        validate_job_spec(make_spec())
+        validate_job_spec(make_spec(type='loop', duration_minutes=60, durations_minutes=[15, 30]))
+        validate_job_spec(make_spec(type='short', duration_seconds=15.5, start_seconds=0))
+        validate_job_spec(make_spec(create_short=True, short_duration_seconds=45))
+        validate_job_spec(make_spec(type='melody', bgm_file=None, melody_files=['/output/a.mp4']))
+        validate_job_spec(make_spec(type='preview', output_dir=None))
+
+    def test_rejects_invalid_spec(self):
+        invalid_specs = [
+            [],
+            make_spec(type='unknown'),
+            make_spec(background_files=[]),
+            make_spec(output_dir=None),
+            make_spec(bgm_file=None),
+            make_spec(type='melody', bgm_file=None),
+            make_spec(background_files='/images/bg.png'),
+            make_spec(visualizer='unknown'),
+            make_spec(title_card=True),
+            make_spec(deadline='tomorrow'),
+            make_spec(durations_minutes=[]),
+            make_spec(durations_minutes=[15, 0]),
+            make_spec(durations_minutes=[1.5]),
+            make_spec(durations_minutes=[True]),
+            make_spec(duration_minutes='abc'),
+            make_spec(duration_minutes=0),
+            make_spec(duration_minutes=True),
+            make_spec(duration_minutes=1.5),
+            make_spec(type='short', duration_seconds='30'),
+            make_spec(type='short', duration_seconds=0),
+            make_spec(type='short', duration_seconds=True),
+            make_spec(create_short=True, short_duration_seconds='abc'),
+            make_spec(type='short', start_seconds=-1),
+            make_spec(type='short', start_seconds=True),
+            make_spec(type='loop', long_form=True, part_minutes=True),
+            make_spec(long_form=True, durations_minutes=[15]),
+            make_spec(long_form=True, part_minutes=-1),
+            make_spec(short_clips=[]),
+        ]
+        for spec in invalid_specs:
+            with self.subTest(spec=spec):
+                with self.assertRaises(ValueError):
+                    validate_job_spec(spec)
+
+    def test_allowed_roots(self):
+        with tempfile.TemporaryDirectory() as root:
+            spec = make_spec(bgm_file=os.path.join(root, 'song.mp3'),
+                             background_files=[os.path.join(root, 'images', 'bg.png')],
+                             output_dir=os.path.join(root, 'output'))
+            validate_job_spec(spec, [root])
+            # allowed_roots を指定しなければパスは制限しない
+            validate_job_spec(make_spec(bgm_file='/etc/passwd'))
+
+            outside_specs = [
+                dict(spec, bgm_file='/etc/passwd'),
+                dict(spec, background_files=[spec['bgm_file'], '/etc/hosts']),
+                dict(spec, output_dir=os.path.join(root, '..', 'output')),
+                # 名前の前方が一致するだけの別フォルダ
+                dict(spec, output_dir=root + '-other'),
+            ]
+            for outside in outside_specs:
+                with self.subTest(spec=outside):
+                    with self.assertRaises(ValueError):
+                        validate_job_spec(outside, [root])
+
+    def test_output_roots(self):
+        with tempfile.TemporaryDirectory() as root:
+            output_dir = os.path.join(root, 'Movie')
+            validate_job_spec(make_spec(output_dir=output_dir), output_roots=[output_dir])
+            validate_job_spec(make_spec(output_dir=os.path.join(output_dir, 'shorts')), output_roots=[output_dir])
+            # 入力ファイルは制限しない
+            validate_job_spec(make_spec(output_dir=output_dir, bgm_file='/music/song.mp3'), output_roots=[output_dir])
+            # 出力先のないプレビューは制限しない
+            validate_job_spec(make_spec(type='preview', output_dir=None), output_roots=[output_dir])
+            for outside in ('/etc', root, os.path.join(output_dir, '..', 'other')):
+                with self.subTest(output_dir=outside):
+                    with self.assertRaises(ValueError):
+                        validate_job_spec(make_spec(output_dir=outside), output_roots=[output_dir])
+
+    def test_allowed_roots_resolves_symlinks(self):
+        with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as outside:
+            link = os.path.join(root, 'link')
+            os.symlink(outside, link)
+            spec = make_spec(bgm_file=os.path.join(root, 'song.mp3'),
+                             background_files=[os.path.join(root, 'bg.png')],
+                             output_dir=link)
+            with self.assertRaises(ValueError):
+                validate_job_spec(spec, [root])
+
+
+class SplitJobTest(unittest.TestCase):
+
+    def test_without_short(self):
+        spec = make_spec()
+        self.assertEqual(split_job(spec), [spec])
+
+    def test_short_becomes_separate_job(self):
+        spec = make_spec(type='loop', create_short=True, short_duration_seconds=15)
+        main, short = split_job(spec)
+        self.assertEqual(main['type'], 'loop')
+        self.assertFalse(main['create_short'])
+        self.assertEqual(short['type'], 'short')
+        self.assertFalse(short['create_short'])
+        self.assertEqual(short['duration_seconds'], 15)
+        # 元の仕様は変更しない
+        self.assertTrue(spec['create_short'])
+
+    def test_short_default_duration(self):
+        _, short = split_job(make_spec(create_short=True))
+        self.assertEqual(short['duration_seconds'], 30)
+
+    def test_other_types_are_not_split(self):
+        spec = make_spec(type='short', create_short=True)
+        self.assertEqual(split_job(spec), [spec])
+
+
+class NormalizeShortClipsTest(unittest.TestCase):
+
+    def test_durations_and_windows(self):
+        windows = normalize_short_clips([15, 30.5, {'duration_seconds': 60, 'start_seconds': 45},
+                                         {'duration_seconds': 20}])
+        self.assertEqual(windows, [(None, 15), (None, 30.5), (45, 60), (None, 20)])
+
+    def test_rejects_invalid_clips(self):
+        invalid_clips = [
+            None, [], 30, [0], [-5], [True], ['30'],
+            [{'start_seconds': 10}],
+            [{'duration_seconds': 30, 'start_seconds': -1}],
+            [{'duration_seconds': 30, 'start_seconds': False}],
+        ]
+        for clips in invalid_clips:
+            with self.subTest(clips=clips):
+                with self.assertRaises(ValueError):
+                    normalize_short_clips(clips)
+
+
+class RenderJobStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, 'jobs', 'jobs.db')
+        self.store = RenderJobStore(self.db_path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def set_heartbeat(self, job_id, seconds_ago):
+        """ハートビートの時刻を過去にずらす"""
+        heartbeat_at = (datetime.now() - timedelta(seconds=seconds_ago)).isoformat(timespec='seconds')
+        with self.store.connect() as conn:
+            conn.execute('UPDATE jobs SET heartbeat_at = ? WHERE id = ?', (heartbeat_at, job_id))
+
+    def test_add_and_claim(self):
+        first = self.store.add(make_spec(title='1'))
+        second = self.store.add(make_spec(title='2'))
+        self.assertEqual(self.store.get(first)['status'], STATUS_QUEUED)
+
+        job = self.store.claim_next()
+        self.assertEqual(job['id'], first)
+        self.assertEqual(job['status'], STATUS_RUNNING)
+        self.assertEqual(job['attempts'], 1)
+        self.assertEqual(job['spec']['title'], '1')
+        self.assertIsNone(job['worker_id'])
+
+        self.assertEqual(self.store.claim_next()['id'], second)
+        self.assertIsNone(self.store.claim_next())
+
+    def test_claim_order(self):
+        slow = self.store.add(make_spec(), estimate={'seconds': 600, 'bytes': 1})
+        unknown = self.store.add(make_spec())
+        fast = self.store.add(make_spec(), estimate={'seconds': 60, 'bytes': 1})
+        claimed = [self.store.claim_next(order='shortest')['id'] for _ in range(3)]
+        self.assertEqual(claimed, [fast, slow, unknown])
+
+    def test_claim_order_deadline(self):
+        later = (datetime.now() + timedelta(hours=2)).isoformat(timespec='seconds')
+        sooner = (datetime.now() + timedelta(hours=1)).isoformat(timespec='seconds')
+        no_deadline = self.store.add(make_spec(), estimate={'seconds': 10, 'bytes': 1})
+        relaxed = self.store.add(make_spec(deadline=later), estimate={'seconds': 60, 'bytes': 1})
+        # 締め切りは遅いが処理時間が長く、余裕は少ない
+        urgent = self.store.add(make_spec(deadline=later), estimate={'seconds': 5400, 'bytes': 1})
+        soon = self.store.add(make_spec(deadline=sooner), estimate={'seconds': 60, 'bytes': 1})
+        claimed = [self.store.claim_next(order='deadline')['id'] for _ in range(4)]
+        self.assertEqual(claimed, [urgent, soon, relaxed, no_deadline])
+
+    def test_claim_is_exclusive_between_stores(self):
+        # 同じDBを共有する別プロセスのストアでも、1つのジョブを取得できるのは1回だけ
+        other = RenderJobStore(self.db_path)
+        job_id = self.store.add(make_spec())
+        self.assertEqual(self.store.claim_next(worker_id='a')['id'], job_id)
+        self.assertIsNone(other.claim_next(worker_id='b'))
+
+    def test_finish_and_fail(self):
+        job_id = self.store.add(make_spec())
+        self.store.claim_next()
+        self.assertTrue(self.store.finish(job_id, ['/output/a.mp4']))
+        job = self.store.get(job_id)
+        self.assertEqual(job['status'], STATUS_DONE)
+        self.assertEqual(job['outputs'], ['/output/a.mp4'])
+        self.assertEqual(job['progress'], 1)
+
+        job_id = self.store.add(make_spec())
+        self.store.claim_next()
+        self.assertTrue(self.store.fail(job_id, "失敗"))
+        job = self.store.get(job_id)
+        self.assertEqual(job['status'], STATUS_FAILED)
+        self.assertEqual(job['error'], "失敗")
+
+    def test_worker_must_own_job(self):
+        job_id = self.store.add(make_spec())
+        self.store.claim_next(worker_id='a')
+        self.assertTrue(self.store.heartbeat(job_id, 'a', stage='encode', progress=0.5))
+        self.assertFalse(self.store.heartbeat(job_id, 'b'))
+        self.assertFalse(self.store.finish(job_id, [], worker_id='b'))
+        self.assertFalse(self.store.fail(job_id, "失敗", worker_id='b'))
+        job = self.store.get(job_id)
+        self.assertEqual(job['status'], STATUS_RUNNING)
+        self.assertEqual(job['stage'], 'encode')
+        self.assertTrue(self.store.finish(job_id, [], worker_id='a'))
+        # 完了後はハートビートを受け付けない
+        self.assertFalse(self.store.heartbeat(job_id, 'a'))
+
+    def test_requeue_stale(self):
+        stale = self.store.add(make_spec())
+        alive = self.store.add(make_spec())
+        local = self.store.add(make_spec())
+        self.store.claim_next(worker_id='a')
+        self.store.claim_next(worker_id='b')
+        self.store.claim_next()
+        self.set_heartbeat(stale, 600)
+        self.set_heartbeat(alive, 10)
+
+        self.assertEqual(self.store.requeue_stale(120), 1)
+        job = self.store.get(stale)
+        self.assertEqual(job['status'], STATUS_QUEUED)
+        self.assertIsNone(job['worker_id'])
+        # 応答が途絶えたワーカーは、再投入後に完了を報告しても受け付けない
+        self.assertFalse(self.store.finish(stale, [], worker_id='a'))
+        self.assertEqual(self.store.get(alive)['status'], STATUS_RUNNING)
+        # このプロセスのワーカー（worker_id なし）のジョブはハートビートで判定しない
+        self.assertEqual(self.store.get(local)['status'], STATUS_RUNNING)
+
+    def test_requeue_stale_gives_up_after_max_attempts(self):
+        job_id = self.store.add(make_spec())
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            job = self.store.claim_next(worker_id='a')
+            self.assertEqual(job['attempts'], attempt)
+            self.set_heartbeat(job_id, 600)
+            self.store.requeue_stale(120)
+        job = self.store.get(job_id)
+        self.assertEqual(job['status'], STATUS_FAILED)
+        self.assertTrue(job['error'])
+        self.assertIsNone(self.store.claim_next())
+
+    def test_requeue(self):
+        job_id = self.store.add(make_spec())
+        self.store.claim_next()
+        self.store.update_progress(job_id, 'encode', 0.5)
+        self.store.requeue(job_id)
+        job = self.store.get(job_id)
+        self.assertEqual(job['status'], STATUS_QUEUED)
+        self.assertIsNone(job['stage'])
+        self.assertIsNone(job['progress'])
+        # 完了したジョブは戻さない
+        self.store.claim_next()
+        self.store.finish(job_id, [])
+        self.store.requeue(job_id)
+        self.assertEqual(self.store.get(job_id)['status'], STATUS_DONE)
+
+    def test_requeue_does_not_count_as_attempt(self):
+        # サービスを何度停止しても、再実行回数の上限で失敗にならない
+        job_id = self.store.add(make_spec())
+        for _ in range(MAX_ATTEMPTS + 1):
+            self.assertEqual(self.store.claim_next()['attempts'], 1)
+            self.store.requeue(job_id)
+            self.assertEqual(self.store.recover_interrupted(), 0)
+            job = self.store.get(job_id)
+            self.assertEqual(job['status'], STATUS_QUEUED)
+            self.assertEqual(job['attempts'], 0)
+
+    def test_recover_interrupted(self):
+        local = self.store.add(make_spec())
+        remote = self.store.add(make_spec())
+        self.store.claim_next()
+        self.store.claim_next(worker_id='a')
+
+        # 再起動後のプロセスとして同じDBを開く
+        store = RenderJobStore(self.db_path)
+        self.assertEqual(store.recover_interrupted(), 1)
+        self.assertEqual(store.get(local)['status'], STATUS_QUEUED)
+        # 分散ワーカーのジョブは動き続けている可能性があるため戻さない
+        self.assertEqual(store.get(remote)['status'], STATUS_RUNNING)
+        self.assertTrue(store.heartbeat(remote, 'a'))
+
+    def test_recover_interrupted_gives_up_after_max_attempts(self):
+        job_id = self.store.add(make_spec())
+        for _ in range(MAX_ATTEMPTS):
+            self.store.claim_next()
+            self.store.recover_interrupted()
+        job = self.store.get(job_id)
+        self.assertEqual(job['status'], STATUS_FAILED)
+        self.assertEqual(job['attempts'], MAX_ATTEMPTS)
+
+
+if __name__ == "__main__":
+    unittest.main()
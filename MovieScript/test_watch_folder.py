@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+監視フォルダのテスト
+出力フォルダに既にある動画（本編・ショートバージョン）から、投入するジョブを決める
+
+実行: python -m unittest test_watch_folder
+"""
+
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+from output_manifest import manifest_path
+from video_generator import VideoGenerator
+from watch_folder import FolderWatcher, load_watch_templates
+
+
+class FolderWatcherSubmitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.base_dir = Path(self.temp_dir.name)
+        for name in ('Sound', 'Image', 'Movie'):
+            (self.base_dir / name).mkdir()
+        (self.base_dir / 'Image' / 'bg.png').write_bytes(b'png')
+        self.bgm = self.base_dir / 'Sound' / 'song.mp3'
+        self.bgm.write_bytes(b'mp3')
+
+        self.submitted = []
+        service = SimpleNamespace(
+            store=SimpleNamespace(list=lambda: []),
+            generator=VideoGenerator(ffmpeg_path='ffmpeg'),
+            coordinator=SimpleNamespace(allowed_roots=None, output_roots=None),
+            submit=lambda spec: self.submitted.append(spec) or ['job'],
+        )
+        self.watcher = FolderWatcher(service, [], self.base_dir)
+
+    def submit(self, **template):
+        """テンプレートでBGMを投入し、投入したジョブ仕様（スキップした場合は None）を返す"""
+        template = dict({'path': 'Sound', 'backgrounds': 'Image', 'output_dir': 'Movie'}, **template)
+        template = load_watch_templates({'watch_folders': [template]}, self.base_dir)[0]
+        self.submitted.clear()
+        self.watcher.submitted.clear()
+        self.watcher.skipped.clear()
+        self.watcher.submit(self.bgm, template)
+        return self.submitted[0] if self.submitted else None
+
+    def create_outputs(self, *names, manifest=False):
+        for name in names:
+            output_file = self.base_dir / 'Movie' / name
+            output_file.write_bytes(b'video')
+            if manifest:
+                Path(manifest_path(str(output_file))).write_text('{}')
+
+    def test_submits_when_nothing_exists(self):
+        spec = self.submit(create_short=True)
+        self.assertEqual(spec['type'], 'single')
+        self.assertTrue(spec['create_short'])
+        self.assertEqual(spec['bgm_file'], str(self.bgm))
+        self.assertEqual(spec['background_files'], [str((self.base_dir / 'Image' / 'bg.png').resolve())])
+
+    def test_skips_when_all_outputs_exist(self):
+        self.create_outputs('song.mp4', 'song_short_30s.mp4')
+        self.assertIsNone(self.submit(create_short=True))
+        # 次回の確認でも再び判定しない
+        self.assertEqual(len(self.watcher.skipped), 1)
+
+    def test_creates_missing_short(self):
+        self.create_outputs('song.mp4')
+        spec = self.submit(create_short=True, short_duration_seconds=15)
+        self.assertEqual(spec['type'], 'short')
+        self.assertEqual(spec['duration_seconds'], 15)
+
+    def test_creates_missing_main(self):
+        self.create_outputs('song_short_30s.mp4')
+        spec = self.submit(create_short=True)
+        self.assertEqual(spec['type'], 'single')
+        self.assertFalse(spec['create_short'])
+
+    def test_short_clips(self):
+        self.create_outputs('song.mp4', 'song_short_15s.mp4', 'song_short_30s_2.mp4')
+        # 同じ長さのショートには番号が付く（song_short_30s_3.mp4 がない）
+        spec = self.submit(create_short=True, short_clips=[15, 30, 30])
+        self.assertEqual(spec['type'], 'short')
+        self.assertEqual(spec['short_clips'], [15, 30, 30])
+
+        self.create_outputs('song_short_30s_3.mp4')
+        self.assertIsNone(self.submit(create_short=True, short_clips=[15, 30, 30]))
+
+    def test_loop_outputs(self):
+        self.create_outputs('song_15min.mp4', 'song_30min.mp4')
+        self.assertIsNone(self.submit(type='loop', durations_minutes=[30, 15]))
+        self.assertIsNotNone(self.submit(type='loop', durations_minutes=[15, 30, 60]))
+        self.assertIsNotNone(self.submit(type='loop', duration_minutes=45))
+        self.assertIsNone(self.submit(type='loop'))
+
+        self.create_outputs('song_600min_part1.mp4')
+        self.assertIsNone(self.submit(type='loop', long_form=True, duration_minutes=600, part_minutes=120))
+        self.assertIsNotNone(self.submit(type='loop', long_form=True, duration_minutes=600))
+
+    def test_outputs_with_manifest_are_left_to_incremental_build(self):
+        # 差分ビルドで作成した出力は、入力・設定が変わっていれば作り直す
+        self.create_outputs('song.mp4', manifest=True)
+        spec = self.submit()
+        self.assertEqual(spec['type'], 'single')
+        self.assertTrue(spec['incremental'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+タイトル表示
+動画タイトル・アーティスト名・曲目リストを出力と同じ大きさの透過PNGとして1回だけ描画してキャッシュし、
+FFmpegでは画像として重ねるだけにする（drawtext のようにフレームごとに文字を描画しない）。
+
+表示方法:
+    intro   冒頭の数秒だけフェードイン・アウトで中央に表示（それ以降は合成しない）
+    static  常に左下に表示。背景が1枚の静止画の場合は背景画像に焼き込んだものを使うため、
+            合成の処理自体が発生しない
+"""
+
+import os
+
+try:
+    from PIL import Image, ImageDraw, ImageFont, ImageOps
+except ImportError:
+    Image = None
+
+from media_cache import STILL_IMAGE_EXTENSIONS, get_cache_dir, file_fingerprint, make_cache_key, save_image
+
+LAYOUTS = ("intro", "static")
+
+# 冒頭表示の長さとフェードの長さ（秒）
+INTRO_SECONDS = 6
+FADE_SECONDS = 1
+
+# 文字の大きさ（出力の高さに対する割合）: タイトル, アーティスト, 曲目
+INTRO_FONT_SCALES = (0.075, 0.042, 0.032)
+STATIC_FONT_SCALES = (0.040, 0.028, 0.024)
+# 画面端からの余白と、文字が収まる最大幅（出力に対する割合）
+MARGIN_SCALE = 0.05
+MAX_TEXT_WIDTH = 0.9
+# 曲目リストに使える高さ（出力の高さに対する割合）
+MAX_TRACKS_HEIGHT = 0.5
+
+# フォントを指定しない場合に順に探す（日本語を表示できるものを優先）
+FONT_CANDIDATES = [
+    "/System/Library/Fonts/ヒラギノ角ゴシック W6.ttc",
+    "/System/Library/Fonts/Hiragino Sans GB.ttc",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/truetype/noto/NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+]
+
+# 描画方法を変えたらキャッシュを無効化するため更新する
+TITLE_CARD_VERSION = 1
+
+
+def require_pillow():
+    if Image is None:
+        raise RuntimeError("タイトル表示にはPillowが必要です（pip install pillow）")
+
+
+def normalize_options(options):
+    """タイトル表示の設定（True または dict）を検証して dict に変換"""
+    if options is True or options is None:
+        options = {}
+    layout = options.get('layout', 'intro')
+    if layout not in LAYOUTS:
+        raise ValueError(f"不明なタイトルの表示方法です: {layout}（{', '.join(LAYOUTS)}）")
+    tracks = options.get('tracks') or []
+    if not isinstance(tracks, list):
+        raise ValueError("tracks（曲目リスト）はリストで指定してください")
+    return {
+        'layout': layout,
+        'artist': str(options.get('artist') or '').strip(),
+        'tracks': [str(track) for track in tracks],
+        'font': options.get('font') or None,
+    }
+
+
+def find_font(font_file=None):
+    """使用するフォントファイル（見つからなければ None = Pillow の既定フォント）"""
+    if font_file:
+        if not os.path.exists(font_file):
+            raise ValueError(f"フォントファイルが見つかりません: {font_file}")
+        return font_file
+    for candidate in FONT_CANDIDATES:
+        if os.path.exists(candidate):
+            return candidate
+    print("警告: 日本語フォントが見つからないため既定のフォントを使用します（title_font で指定できます）")
+    return None
+
+
+def load_font(font_file, size):
+    if font_file:
+        return ImageFont.truetype(font_file, size)
+    return ImageFont.load_default(size)
+
+
+def fit_font(draw, text, font_file, size, max_width):
+    """text が max_width に収まるまで小さくしたフォントを返す"""
+    font = load_font(font_file, size)
+    while size > 8 and draw.textlength(text, font=font) > max_width:
+        size = int(size * 0.9)
+        font = load_font(font_file, size)
+    return font
+
+
+def build_lines(title, options, height):
+    """描画する行のリスト [(文字列, 文字の大きさ)] を作成（曲目は入りきる分だけ）"""
+    scales = INTRO_FONT_SCALES if options['layout'] == 'intro' else STATIC_FONT_SCALES
+    title_size, artist_size, track_size = (max(8, int(height * scale)) for scale in scales)
+    lines = [(title, title_size)]
+    if options['artist']:
+        lines.append((options['artist'], artist_size))
+    tracks = options['tracks']
+    if tracks:
+        max_tracks = max(1, int(height * MAX_TRACKS_HEIGHT / (track_size * 1.4)))
+        if len(tracks) > max_tracks:
+            tracks = tracks[:max_tracks - 1] + [f"…ほか{len(tracks) - max_tracks + 1}曲"]
+        lines.append(('', track_size // 2))
+        lines.extend((f"{index + 1}. {track}", track_size) for index, track in enumerate(tracks))
+    return lines
+
+
+def render_title_image(title, options, width, height):
+    """タイトル画像（出力と同じ大きさの透過PNG）を描画し、キャッシュのパスを返す"""
+    require_pillow()
+    font_file = find_font(options['font'])
+    key = make_cache_key(TITLE_CARD_VERSION, title, options['artist'], options['tracks'],
+                         options['layout'], width, height,
+                         file_fingerprint(font_file) if font_file else None)
+    cache_file = get_cache_dir('titles') / f"{key}.png"
+    if cache_file.exists():
+        return str(cache_file)
+
+    image = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    margin = int(height * MARGIN_SCALE)
+    max_width = int(width * MAX_TEXT_WIDTH)
+
+    rendered = []
+    for text, size in build_lines(title, options, height):
+        font = fit_font(draw, text, font_file, size, max_width) if text else None
+        rendered.append((text, font, int(size * 1.4)))
+    block_height = sum(line_height for _, _, line_height in rendered)
+
+    if options['layout'] == 'intro':
+        y = (height - block_height) // 2
+    else:
+        y = height - margin - block_height
+    for text, font, line_height in rendered:
+        if text:
+            text_width = draw.textlength(text, font=font)
+            x = (width - text_width) / 2 if options['layout'] == 'intro' else margin
+            # 明るい背景でも読めるよう半透明の縁取りを付ける
+            stroke = max(1, font.size // 12)
+            draw.text((x, y), text, font=font, fill=(255, 255, 255, 255),
+                      stroke_width=stroke, stroke_fill=(0, 0, 0, 160))
+        y += line_height
+
+    save_image(image, cache_file)
+    return str(cache_file)
+
+
+def can_bake(background_file):
+    """背景画像に焼き込めるか（静止画のみ）"""
+    return os.path.splitext(background_file)[1].lower() in STILL_IMAGE_EXTENSIONS
+
+
+def bake_into_background(background_file, title_image, width, height):
+    """背景画像を出力サイズに収め（余白は黒）、タイトルを重ねた画像を作成してキャッシュのパスを返す
+
+    VideoGenerator.build_video_filter と同じ配置にするため、以降のスケール処理では変化しない。
+    """
+    require_pillow()
+    key = make_cache_key(TITLE_CARD_VERSION, file_fingerprint(background_file),
+                         file_fingerprint(title_image), width, height)
+    cache_file = get_cache_dir('titles') / f"background_{key}.png"
+    if cache_file.exists():
+        return str(cache_file)
+
+    with Image.open(background_file) as source:
+        fitted = ImageOps.contain(source.convert('RGB'), (width, height), Image.LANCZOS)
+    canvas = Image.new('RGBA', (width, height), (0, 0, 0, 255))
+    canvas.paste(fitted, ((width - fitted.width) // 2, (height - fitted.height) // 2))
+    with Image.open(title_image) as overlay:
+        canvas.alpha_composite(overlay.convert('RGBA'))
+    save_image(canvas.convert('RGB'), cache_file)
+    return str(cache_file)
+
+
+def build_input_args(title_overlay, fps):
+    """タイトル画像の入力引数（冒頭表示の場合はその長さだけ読み込む）"""
+    args = ['-loop', '1', '-framerate', str(fps)]
+    if title_overlay['layout'] == 'intro':
+        args += ['-t', str(INTRO_SECONDS)]
+    return args + ['-i', title_overlay['image']]
+
+
+def build_overlay_filter(base_graph, base_label, title_overlay, title_input, output_label="v",
+                         suffix="", offset=0):
+    """base_graph の出力 [base_label] にタイトル画像を重ねる filter_complex（出力ラベル [output_label]）
+
+    冒頭表示ではタイトル画像の入力が終わった後は背景をそのまま通す（eof_action=pass）。
+    offset: 背景が動画の途中（秒）から始まる場合に、タイトルの表示もその位置から始める（プレビュー用）
+    """
+    if title_overlay['layout'] == 'intro':
+        fade_out = INTRO_SECONDS - FADE_SECONDS
+        title_filter = (f'format=rgba,fade=t=in:st=0:d={FADE_SECONDS}:alpha=1,'
+                        f'fade=t=out:st={fade_out}:d={FADE_SECONDS}:alpha=1')
+        if offset:
+            title_filter += f',trim=start={offset},setpts=PTS-STARTPTS'
+        overlay = 'overlay=0:0:eof_action=pass'
+    else:
+        title_filter = 'format=rgba'
+        overlay = 'overlay=0:0'
+    return (
+        f'{base_graph};'
+        f'[{title_input}:v]{title_filter}[title{suffix}];'
+        f'[{base_label}][title{suffix}]{overlay},format=yuv420p[{output_label}]'
+    )
+
+
+def overlaps_intro(title_overlay, start):
+    """動画の start 秒から始まる区間にタイトルの表示が含まれるか（常に表示する場合は常に True）"""
+    return title_overlay['layout'] != 'intro' or start < INTRO_SECONDS
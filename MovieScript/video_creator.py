@@ -5,6 +5,10 @@ EchoGarden 動画作成ツール
 BGMと背景画像を使用して動画を作成するGUIアプリケーション
 """
 
+import time
+# 起動時間計測の基準時刻（Tkinterの読み込みも含めて計測する）
+STARTUP_T0 = time.perf_counter()
+
 # Tkinterの非推奨警告を抑制
 import os
 os.environ['TK_SILENCE_DEPRECATION'] = '1'
@@ -17,226 +21,398 @@ from datetime import datetime
 from pathlib import Path
 import subprocess
 import sys
+import queue
+from collections import deque
+
+from media_cache import AUDIO_EXTENSIONS, BACKGROUND_EXTENSIONS
+from asset_list import AssetList, AssetInfoLoader
+
+# 起動時にスキャンする素材フォルダ（config.json の asset_directories で変更可能）
+DEFAULT_ASSET_DIRECTORIES = ["../Image", "../Sound"]
+# GUIから同時に実行する動画作成ジョブ数（config.json の max_concurrent_jobs で変更可能）
+DEFAULT_MAX_CONCURRENT_JOBS = 2
+
+# ジョブの処理段階の表示名
+STAGE_LABELS = {
+    'encode': "エンコード中",
+    'audio': "音声処理中",
+    'concat': "連結中",
+    'preview': "プレビュー作成中",
+    'visualizer': "ビジュアライザー作成中",
+    'slideshow': "スライドショー作成中",
+    'background': "背景の準備中",
+}
+
+# ビジュアライザーの表示名 -> ジョブ仕様の値
+VISUALIZER_CHOICES = {
+    "なし": None,
+    "スペクトラム": "spectrum",
+    "波形": "waveform",
+}
+
+# タイトル表示の選択肢（表示名 -> ジョブ仕様の layout）
+TITLE_LAYOUT_CHOICES = {
+    "冒頭のみ": "intro",
+    "常に表示": "static",
+}
+
+
+def format_clock(seconds):
+    """経過時間の表示（mm:ss、1時間以上は h:mm:ss）"""
+    minutes, seconds = divmod(int(seconds), 60)
+    if minutes >= 60:
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+class JobRow:
+    """ジョブパネルの1行（ジョブ1件分の状態と表示）
+
+    ウィジェットの操作はメインスレッドからのみ行う。
+    """
+
+    def __init__(self, parent, job_id, name, on_cancel):
+        self.job_id = job_id
+        self.name = name
+        self.spec = None
+        self.open_output = False
+        self.generator = None
+        self.cancel_requested = False
+        self.started_at = None
+        self.finished_at = None
+        self.estimate = None  # 履歴から予測した処理時間・出力サイズ
+
+        self.name_label = ttk.Label(parent, text=name, width=26)
+        self.status_label = ttk.Label(parent, text="待機中", width=16)
+        self.progress = ttk.Progressbar(parent, mode='determinate', maximum=100, length=160)
+        self.elapsed_label = ttk.Label(parent, text="--:--", width=14)
+        self.speed_label = ttk.Label(parent, text="", width=8)
+        self.cancel_button = ttk.Button(parent, text="キャンセル", command=lambda: on_cancel(job_id))
+
+    def widgets(self):
+        return [self.name_label, self.status_label, self.progress,
+                self.elapsed_label, self.speed_label, self.cancel_button]
+
+    def grid(self, row):
+        for column, widget in enumerate(self.widgets()):
+            widget.grid(row=row, column=column, sticky=tk.W, padx=(0, 5), pady=1)
+
+    def destroy(self):
+        for widget in self.widgets():
+            widget.destroy()
+
+    def set_status(self, text):
+        self.status_label.config(text=text)
+
+    def set_estimate(self, estimate, text):
+        """予測を反映（待機中は状態欄に、実行中は経過時間の横に表示する）"""
+        self.estimate = estimate
+        if self.started_at is None and self.finished_at is None:
+            self.set_status(f"待機中 {text}")
+        self.update_elapsed()
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.set_status("開始中...")
+
+    def update_progress(self, stage, fraction, speed):
+        if self.finished_at is not None or self.cancel_requested:
+            return
+        self.set_status(STAGE_LABELS.get(stage, stage))
+        if fraction is None:
+            # 長さが分からない処理は進捗率を表示しない
+            self.progress.config(mode='indeterminate')
+            self.progress.start()
+        else:
+            self.progress.stop()
+            self.progress.config(mode='determinate', value=fraction * 100)
+        # 処理速度（実時間に対する倍率）
+        self.speed_label.config(text=f"{speed:.1f}x" if speed else "")
+
+    def update_elapsed(self):
+        if self.started_at is None:
+            return
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        text = format_clock(end - self.started_at)
+        if self.estimate and self.finished_at is None:
+            text += f" / {format_clock(self.estimate['seconds'])}"
+        self.elapsed_label.config(text=text)
+
+    def finish(self, status):
+        self.finished_at = time.monotonic()
+        self.update_elapsed()
+        self.progress.stop()
+        self.progress.config(mode='determinate', value=100 if status == "完了" else self.progress['value'])
+        self.speed_label.config(text="")
+        self.set_status(status)
+        self.cancel_button.config(state=tk.DISABLED)
+
 
 class VideoCreatorApp:
+    # 背景処理の結果をメインループで取り出す間隔（ミリ秒）
+    UI_POLL_INTERVAL_MS = 50
+
     def __init__(self, root):
-        print("VideoCreatorApp.__init__ 開始")
-        try:
-            print("1. root ウィンドウ設定")
-            self.root = root
-            self.root.title("EchoGarden 動画作成ツール")
-            self.root.geometry("800x600")
-            self.root.configure(bg='#f0f0f0')
-            
-            print("2. 変数を初期化中...")
-            # 変数の初期化
-            self.bgm_file = tk.StringVar()
-            self.background_files = []
-            self.output_directory = tk.StringVar()
-            self.video_type = tk.StringVar(value="single")
-            self.duration_minutes = tk.IntVar(value=15)
-            self.melody_files = []
-            self.create_short_version = tk.BooleanVar(value=False)
-            self.short_duration_seconds = tk.IntVar(value=30)
-            self.video_title = tk.StringVar()
-            print("変数の初期化完了")
-            
-            print("3. 設定ファイルパス設定")
-            # 設定ファイルの読み込み
-            print("Path(__file__) を作成中...")
-            current_file_path = Path(__file__)
-            print(f"current_file_path: {current_file_path}")
-            print("current_file_path.parent を取得中...")
-            parent_dir = current_file_path.parent
-            print(f"parent_dir: {parent_dir}")
-            print("config.json パスを作成中...")
-            self.config_file = parent_dir / "config.json"
-            print(f"設定ファイルパス: {self.config_file}")
-            
-            print("4. ローディング画面を表示中...")
-            # 起動時のローディング画面を表示
-            self.show_loading_screen()
-            print("ローディング画面表示完了")
-            
-            print("5. 初期化処理をスケジュール")
-            # 初期化処理を非同期で実行（少し待機してから実行）
-            self.root.after(500, self.init_app)
-            print("VideoCreatorApp.__init__ 完了")
-        except Exception as e:
-            print(f"VideoCreatorApp.__init__ エラー: {e}")
-            import traceback
-            traceback.print_exc()
-            raise
-    
-    def show_loading_screen(self):
-        """起動時のローディング画面を表示"""
-        print("show_loading_screen 開始")
+        self.root = root
+        self.root.title("EchoGarden 動画作成ツール")
+        self.root.geometry("900x800")
+        self.root.configure(bg='#f0f0f0')
+
+        # 変数の初期化
+        self.bgm_file = tk.StringVar()
+        self.background_files = []
+        self.output_directory = tk.StringVar()
+        self.video_type = tk.StringVar(value="single")
+        self.duration_minutes = tk.IntVar(value=15)
+        self.loop_variant_minutes = tk.StringVar()  # 例: "15,30,45,60,120"
+        self.long_form = tk.BooleanVar(value=False)
+        self.part_minutes = tk.IntVar(value=0)  # 0 は分割しない
+        self.part_size_mb = tk.IntVar(value=0)
+        self.melody_files = []
+        self.create_short_version = tk.BooleanVar(value=False)
+        self.short_duration_seconds = tk.IntVar(value=30)
+        self.short_clip_seconds = tk.StringVar()  # 例: "15,30,60"
+        self.short_auto_highlight = tk.BooleanVar(value=True)
+        self.short_blur_fill = tk.BooleanVar(value=False)  # 余白を背景のぼかしで埋める
+        self.visualizer_style = tk.StringVar(value="なし")
+        self.incremental_build = tk.BooleanVar(value=False)
+        self.target_size_mb = tk.IntVar(value=0)  # 0 は画質を自動調整しない
+        self.slideshow_enabled = tk.BooleanVar(value=False)
+        self.slideshow_hold_seconds = tk.IntVar(value=10)
+        self.slideshow_ken_burns = tk.BooleanVar(value=False)
+        self.video_title = tk.StringVar()
+        self.title_card_enabled = tk.BooleanVar(value=False)
+        self.title_card_layout = tk.StringVar(value="冒頭のみ")
+        self.title_card_artist = tk.StringVar()
+        self.title_card_tracks = tk.BooleanVar(value=False)  # メドレーの曲目リストを表示
+        self.title_font = None
+        self.library_backgrounds = []
+        self.ffmpeg_path = None
+
+        # ジョブ管理（メインスレッドからのみ操作する）
+        self.jobs = {}  # job_id -> JobRow（表示順）
+        self.pending_jobs = deque()
+        self.running_jobs = set()
+        self.next_job_id = 0
+        self.max_concurrent_jobs = DEFAULT_MAX_CONCURRENT_JOBS
+        self.profile_renders = False
+        self.media_backend = "ffmpeg"
+        # 処理時間の履歴（最初に使う時にワーカースレッドで開く）
+        self.render_history = None
+        self.render_history_lock = threading.Lock()
+        # 背景の事前変換（取り込みごとにスレッドを起動し、変換は1つずつ行う）
+        self.background_prepare_lock = threading.Lock()
+
+        self.config_file = Path(__file__).parent / "config.json"
+        self.metrics_file = Path(__file__).parent / "startup_metrics.jsonl"
+
+        # ワーカースレッドからの結果はこのキュー経由でメインスレッドに渡す
+        self.ui_queue = queue.Queue()
+        # 背景・メドレーの一覧のサムネイル・解像度・長さ（FFmpegが見つかってから読み込む）
+        self.asset_loader = AssetInfoLoader(self.ui_queue)
+
+        # ウィジェットを即座に作成し、重い初期化はバックグラウンドで行う
+        self.create_widgets()
+        self.watch_settings()
+        self.status_label.config(text="初期化中...（操作はすぐに行えます）")
+        self.root.after_idle(self.on_interactive)
+
+        thread = threading.Thread(target=self.background_init)
+        thread.daemon = True
+        thread.start()
+        self.root.after(self.UI_POLL_INTERVAL_MS, self.process_ui_queue)
+        self.root.after(1000, self.update_job_timers)
+
+    def on_interactive(self):
+        """ウィンドウが操作可能になった時刻を記録"""
+        self.time_to_interactive = time.perf_counter() - STARTUP_T0
+        print(f"起動時間: 操作可能まで {self.time_to_interactive * 1000:.0f}ms")
+
+    def background_init(self):
+        """設定読み込み・FFmpeg検出・素材スキャンをバックグラウンドで実行"""
+        config = self.read_config()
+        self.ui_queue.put(('config', config))
+
+        ffmpeg_path = None
         try:
-            # ローディングフレーム
-            self.loading_frame = ttk.Frame(self.root)
-            self.loading_frame.place(relx=0.5, rely=0.5, anchor=tk.CENTER)
-            print("ローディングフレーム作成完了")
-            
-            # ロゴ・タイトル
-            title_label = ttk.Label(self.loading_frame, text="EchoGarden", 
-                                   font=('Arial', 24, 'bold'))
-            title_label.pack(pady=(0, 10))
-            print("タイトルラベル作成完了")
-            
-            subtitle_label = ttk.Label(self.loading_frame, text="動画作成ツール", 
-                                      font=('Arial', 14))
-            subtitle_label.pack(pady=(0, 30))
-            print("サブタイトルラベル作成完了")
-            
-            # プログレスバー
-            self.loading_progress = ttk.Progressbar(self.loading_frame, mode='indeterminate', 
-                                                  length=300)
-            self.loading_progress.pack(pady=(0, 20))
-            print("プログレスバー作成完了")
-            
-            # ステータスラベル
-            self.loading_status = ttk.Label(self.loading_frame, text="初期化中...", 
-                                           font=('Arial', 10))
-            self.loading_status.pack()
-            print("ステータスラベル作成完了")
-            
-            # プログレスバーを開始
-            self.loading_progress.start()
-            print("プログレスバー開始")
-            print("show_loading_screen 完了")
+            from video_generator import VideoGenerator
+            ffmpeg_path = VideoGenerator.find_ffmpeg()
+            self.ui_queue.put(('ffmpeg', ffmpeg_path))
         except Exception as e:
-            print(f"show_loading_screen エラー: {e}")
-            import traceback
-            traceback.print_exc()
-    
-    def init_app(self):
-        """アプリケーションの初期化処理"""
+            self.ui_queue.put(('ffmpeg_error', str(e)))
+
+        directories = config.get('asset_directories', DEFAULT_ASSET_DIRECTORIES)
+        assets = self.scan_assets(directories)
+        self.ui_queue.put(('assets', assets))
+        self.ui_queue.put(('init_done', time.perf_counter() - STARTUP_T0))
+
+        # ライブラリの背景は操作可能になった後で変換しておく（変換済みのものはすぐ終わる）
+        if ffmpeg_path:
+            self.prepare_backgrounds_thread(assets['background'], ffmpeg_path)
+
+    def process_ui_queue(self):
+        """ワーカースレッドからの結果をメインスレッドで反映"""
         try:
-            print("=== init_app 開始 ===")
-            
-            # 設定ファイルの読み込み
-            print("1. 設定ファイル読み込み開始")
-            print("loading_status の存在確認中...")
-            if hasattr(self, 'loading_status'):
-                print("loading_status 属性が存在します")
-                if self.loading_status.winfo_exists():
-                    print("loading_status ウィジェットが存在します、テキストを更新中...")
-                    self.loading_status.config(text="設定ファイルを読み込み中...")
-                    print("root.update_idletasks() を呼び出し中...")
-                    self.root.update_idletasks()
-                    print("root.update_idletasks() 完了")
-                else:
-                    print("loading_status ウィジェットが存在しません")
-            else:
-                print("loading_status 属性が存在しません")
-            print("設定ファイルを読み込み中...")
-            self.load_config()
-            print("設定ファイルの読み込み完了")
-            
-            # メインウィジェットの作成
-            print("2. GUIウィジェット作成開始")
-            if hasattr(self, 'loading_status') and self.loading_status.winfo_exists():
-                self.loading_status.config(text="GUIを初期化中...")
-                self.root.update_idletasks()
-            print("GUIを初期化中...")
-            self.create_widgets()
-            print("GUIの初期化完了")
-            
-            # ローディング画面を非表示
-            print("3. ローディング画面非表示処理")
-            if hasattr(self, 'loading_status') and self.loading_status.winfo_exists():
-                self.loading_status.config(text="完了！")
-                self.root.update_idletasks()
-            print("初期化完了、ローディング画面を非表示")
-            self.root.after(500, self.hide_loading_screen)
-            print("=== init_app 正常完了 ===")
-            
-        except Exception as e:
-            print(f"=== init_app エラー発生 ===")
-            print(f"初期化エラー: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            if hasattr(self, 'loading_status') and self.loading_status.winfo_exists():
-                self.loading_status.config(text=f"エラー: {str(e)}")
-                self.root.update_idletasks()
-            self.root.after(2000, self.show_error_and_exit, str(e))
-    
-    def hide_loading_screen(self):
-        """ローディング画面を非表示にする"""
-        print("hide_loading_screen 開始")
+            while True:
+                kind, payload = self.ui_queue.get_nowait()
+                self.handle_ui_message(kind, payload)
+        except queue.Empty:
+            pass
+        self.root.after(self.UI_POLL_INTERVAL_MS, self.process_ui_queue)
+
+    def handle_ui_message(self, kind, payload):
+        if kind.startswith('job_'):
+            self.handle_job_message(kind, payload)
+        elif kind == 'config':
+            self.apply_config(payload)
+        elif kind == 'ffmpeg':
+            self.ffmpeg_path = payload
+            self.asset_loader.start(payload)
+        elif kind == 'asset_info':
+            path, _ = payload
+            for asset_list in (self.bg_list, self.library_list, self.melody_list):
+                asset_list.on_info(path)
+        elif kind == 'ffmpeg_error':
+            self.status_label.config(text="FFmpegが見つかりません。FFmpegをインストールしてください。")
+        elif kind == 'assets':
+            self.apply_assets(payload)
+        elif kind == 'init_done':
+            if self.ffmpeg_path:
+                self.update_status_summary()
+            self.record_startup_metrics(payload)
+
+    def record_startup_metrics(self, init_seconds):
+        """起動時間を記録（操作可能までの時間を継続的に追跡するため）"""
+        interactive = getattr(self, 'time_to_interactive', None)
+        print(f"起動時間: バックグラウンド初期化完了まで {init_seconds * 1000:.0f}ms")
+        metrics = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'time_to_interactive_ms': round(interactive * 1000) if interactive is not None else None,
+            'background_init_ms': round(init_seconds * 1000),
+            'ffmpeg_found': bool(self.ffmpeg_path),
+            'library_backgrounds': len(self.library_backgrounds),
+        }
         try:
-            # プログレスバーを停止
-            if hasattr(self, 'loading_progress') and self.loading_progress.winfo_exists():
-                print("プログレスバーを停止中...")
-                self.loading_progress.stop()
-                print("プログレスバー停止完了")
-            
-            # ローディングフレームを破棄
-            if hasattr(self, 'loading_frame') and self.loading_frame.winfo_exists():
-                print("ローディングフレームを破棄中...")
-                self.loading_frame.destroy()
-                print("ローディングフレーム破棄完了")
-            
-            # メインウィジェットを確実に表示
-            print("メインウィジェットの表示を更新中...")
-            self.root.update_idletasks()
-            print("メインウィジェット表示更新完了")
-            
-            print("hide_loading_screen 完了")
-        except Exception as e:
-            print(f"hide_loading_screen エラー: {e}")
-            import traceback
-            traceback.print_exc()
-    
-    def show_error_and_exit(self, error_message):
-        """エラーを表示して終了"""
-        messagebox.showerror("起動エラー", f"アプリケーションの起動に失敗しました:\n{error_message}")
-        self.root.destroy()
-        
-    def load_config(self):
-        """設定ファイルを読み込む"""
-        print("load_config 開始")
+            with open(self.metrics_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(metrics, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f"起動時間の記録に失敗しました: {e}")
+
+    def read_config(self):
+        """設定ファイルを読み込む（ワーカースレッドから呼ばれる）"""
         try:
-            print(f"設定ファイルパス確認: {self.config_file}")
-            print("config_file.exists() を呼び出し中...")
-            exists_result = self.config_file.exists()
-            print(f"config_file.exists() 結果: {exists_result}")
-            
-            if exists_result:
-                print("設定ファイルが存在します、読み込み開始")
-                print("ファイルを開いています...")
+            if self.config_file.exists():
                 with open(self.config_file, 'r', encoding='utf-8') as f:
-                    print("ファイルを開きました、JSONを読み込み中...")
-                    config = json.load(f)
-                    print("JSON読み込み完了、変数に設定中...")
-                    print(f"config内容: {config}")
-                    
-                    print("output_directory を設定中...")
-                    self.output_directory.set(config.get('output_directory', ''))
-                    print("create_short_version を設定中...")
-                    self.create_short_version.set(config.get('create_short_version', False))
-                    print("short_duration_seconds を設定中...")
-                    self.short_duration_seconds.set(config.get('short_duration_seconds', 30))
-                    print("video_title を設定中...")
-                    self.video_title.set(config.get('video_title', ''))
-                    print("設定ファイルを読み込みました")
-            else:
-                print("設定ファイルが存在しません、デフォルト設定を使用します")
-            print("load_config 完了")
+                    return json.load(f)
         except Exception as e:
             print(f"設定ファイルの読み込みエラー: {e}")
-            import traceback
-            traceback.print_exc()
             # エラーが発生してもデフォルト設定で続行
-    
+        return {}
+
+    def watch_settings(self):
+        """設定ファイルを読み込むまでの間に、ユーザーが変更した入力・設定を記録する
+
+        設定ファイルはバックグラウンドで読み込むため、それより先に操作された項目は apply_config で上書きしない。
+        """
+        self.touched_settings = set()
+        self.setting_traces = []
+        for name, variable in vars(self).items():
+            if isinstance(variable, tk.Variable):
+                trace = variable.trace_add('write', lambda *args, name=name: self.touched_settings.add(name))
+                self.setting_traces.append((variable, trace))
+
+    def apply_config(self, config):
+        """読み込んだ設定を反映（起動直後にユーザーが変更した項目は上書きしない）"""
+        visualizer_labels = {value: label for label, value in VISUALIZER_CHOICES.items()}
+        layout_labels = {value: label for label, value in TITLE_LAYOUT_CHOICES.items()}
+        values = {
+            'output_directory': config.get('output_directory', ''),
+            'video_title': config.get('video_title', ''),
+            'create_short_version': config.get('create_short_version', False),
+            'short_duration_seconds': config.get('short_duration_seconds', 30),
+            'short_clip_seconds': config.get('short_clip_seconds', ''),
+            'short_auto_highlight': config.get('short_auto_highlight', True),
+            'short_blur_fill': config.get('short_blur_fill', False),
+            'visualizer_style': visualizer_labels.get(config.get('visualizer'), "なし"),
+            'incremental_build': config.get('incremental_build', False),
+            'target_size_mb': config.get('target_size_mb', 0),
+            'loop_variant_minutes': config.get('loop_variant_minutes', ''),
+            'long_form': config.get('long_form', False),
+            'part_minutes': config.get('part_minutes', 0),
+            'part_size_mb': config.get('part_size_mb', 0),
+            'slideshow_enabled': config.get('slideshow_enabled', False),
+            'slideshow_hold_seconds': config.get('slideshow_hold_seconds', 10),
+            'slideshow_ken_burns': config.get('slideshow_ken_burns', False),
+            'title_card_enabled': config.get('title_card_enabled', False),
+            'title_card_layout': layout_labels.get(config.get('title_card_layout'), "冒頭のみ"),
+            'title_card_artist': config.get('title_card_artist', ''),
+            'title_card_tracks': config.get('title_card_tracks', False),
+        }
+        touched = set(self.touched_settings)
+        for name, value in values.items():
+            if name not in touched:
+                getattr(self, name).set(value)
+        # 設定の反映後は記録しない
+        for variable, trace in self.setting_traces:
+            variable.trace_remove('write', trace)
+        self.setting_traces = []
+        # 日本語フォントが自動で見つからない環境向け（GUIには表示しない設定）
+        self.title_font = config.get('title_font') or None
+        self.max_concurrent_jobs = max(1, config.get('max_concurrent_jobs', DEFAULT_MAX_CONCURRENT_JOBS))
+        # 処理時間の内訳を記録する（GUIには表示しない設定）
+        self.profile_renders = bool(config.get('profile_renders', False))
+        # メディア処理のバックエンド（"pyav" で対応する処理をプロセス内で行う。GUIには表示しない設定）
+        self.media_backend = config.get('media_backend', "ffmpeg")
+
+    def scan_assets(self, directories):
+        """素材フォルダからBGM・背景画像の候補を収集（ワーカースレッドから呼ばれる）"""
+        base_dir = Path(__file__).parent
+        assets = {'bgm': [], 'background': []}
+        for directory in directories:
+            directory = (base_dir / directory).resolve()
+            if not directory.is_dir():
+                continue
+            for path in sorted(directory.iterdir()):
+                ext = path.suffix.lower()
+                if ext in AUDIO_EXTENSIONS:
+                    assets['bgm'].append(str(path))
+                elif ext in BACKGROUND_EXTENSIONS:
+                    assets['background'].append(str(path))
+        return assets
+
+    def apply_assets(self, assets):
+        """スキャンした素材を選択候補として反映"""
+        self.bgm_combobox.config(values=assets['bgm'])
+        self.library_backgrounds = assets['background']
+        self.library_list.set_items(self.library_backgrounds)
+
     def save_config(self):
-        """設定ファイルを保存"""
-        config = {
+        """設定ファイルを保存（GUIで編集しない項目はそのまま残す）"""
+        config = self.read_config()
+        config.update({
             'output_directory': self.output_directory.get(),
             'create_short_version': self.create_short_version.get(),
             'short_duration_seconds': self.short_duration_seconds.get(),
+            'short_clip_seconds': self.short_clip_seconds.get().strip(),
+            'short_auto_highlight': self.short_auto_highlight.get(),
+            'short_blur_fill': self.short_blur_fill.get(),
+            'visualizer': VISUALIZER_CHOICES.get(self.visualizer_style.get()),
+            'incremental_build': self.incremental_build.get(),
+            'target_size_mb': self.target_size_mb.get(),
+            'loop_variant_minutes': self.loop_variant_minutes.get().strip(),
+            'long_form': self.long_form.get(),
+            'part_minutes': self.part_minutes.get(),
+            'part_size_mb': self.part_size_mb.get(),
+            'slideshow_enabled': self.slideshow_enabled.get(),
+            'slideshow_hold_seconds': self.slideshow_hold_seconds.get(),
+            'slideshow_ken_burns': self.slideshow_ken_burns.get(),
+            'title_card_enabled': self.title_card_enabled.get(),
+            'title_card_layout': TITLE_LAYOUT_CHOICES.get(self.title_card_layout.get(), 'intro'),
+            'title_card_artist': self.title_card_artist.get().strip(),
+            'title_card_tracks': self.title_card_tracks.get(),
             'video_title': self.video_title.get()
-        }
+        })
         try:
             with open(self.config_file, 'w', encoding='utf-8') as f:
                 json.dump(config, f, ensure_ascii=False, indent=2)
@@ -244,62 +420,52 @@ class VideoCreatorApp:
             pass
     
     def create_widgets(self):
-        print("create_widgets 開始")
-        try:
-            # ttkテーマを明示的に設定
-            style = ttk.Style()
-            style.theme_use('clam')
-
-            print("1. メインフレーム作成")
-            self.main_frame = tk.Frame(self.root, bg="#f0f0f0")
-            self.main_frame.pack(fill="both", expand=True)
-
-            print("2. タイトルラベル作成")
-            title_label = ttk.Label(self.main_frame, text="EchoGarden 動画作成ツール", font=('Arial', 16, 'bold'))
-            title_label.grid(row=0, column=0, columnspan=3, pady=(0, 20))
+        # ttkテーマを明示的に設定
+        style = ttk.Style()
+        style.theme_use('clam')
 
-            print("3. タイトル入力セクション作成")
-            self.create_title_section(self.main_frame, 1)
+        self.main_frame = tk.Frame(self.root, bg="#f0f0f0")
+        self.main_frame.pack(fill="both", expand=True)
 
-            print("4. BGM選択セクション作成")
-            self.create_bgm_section(self.main_frame, 2)
+        title_label = ttk.Label(self.main_frame, text="EchoGarden 動画作成ツール", font=('Arial', 16, 'bold'))
+        title_label.grid(row=0, column=0, columnspan=3, pady=(0, 20))
 
-            print("5. 背景画像選択セクション作成")
-            self.create_background_section(self.main_frame, 3)
+        self.create_title_section(self.main_frame, 1)
+        self.create_bgm_section(self.main_frame, 2)
+        self.create_background_section(self.main_frame, 3)
+        self.create_video_type_section(self.main_frame, 4)
+        self.create_short_version_section(self.main_frame, 5)
+        self.create_output_section(self.main_frame, 6)
 
-            print("6. 動画タイプ選択セクション作成")
-            self.create_video_type_section(self.main_frame, 4)
+        button_frame = ttk.Frame(self.main_frame)
+        button_frame.grid(row=7, column=0, columnspan=3, pady=20)
+        preview_button = ttk.Button(button_frame, text="プレビュー", command=self.create_preview)
+        preview_button.pack(side=tk.LEFT, padx=(0, 10))
+        create_button = ttk.Button(button_frame, text="動画を作成", command=self.create_video, style='Accent.TButton')
+        create_button.pack(side=tk.LEFT)
 
-            print("7. ショートバージョン設定セクション作成")
-            self.create_short_version_section(self.main_frame, 5)
+        self.create_jobs_section(self.main_frame, 8)
 
-            print("8. 出力設定セクション作成")
-            self.create_output_section(self.main_frame, 6)
+        self.status_label = ttk.Label(self.main_frame, text="準備完了")
+        self.status_label.grid(row=9, column=0, columnspan=3)
 
-            print("9. 作成ボタン作成")
-            create_button = ttk.Button(self.main_frame, text="動画を作成", command=self.create_video, style='Accent.TButton')
-            create_button.grid(row=7, column=0, columnspan=3, pady=20)
+        # グリッド重み設定
+        self.root.columnconfigure(0, weight=1)
+        self.root.rowconfigure(0, weight=1)
+        self.main_frame.columnconfigure(1, weight=1)
 
-            print("10. プログレスバー作成")
-            self.progress = ttk.Progressbar(self.main_frame, mode='indeterminate')
-            self.progress.grid(row=8, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 10))
+    def create_jobs_section(self, parent, row):
+        """ジョブパネルを作成（複数の動画作成を並行して管理する）"""
+        jobs_frame = ttk.LabelFrame(parent, text="ジョブ", padding="10")
+        jobs_frame.grid(row=row, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 10))
+        jobs_frame.columnconfigure(0, weight=1)
 
-            print("11. ステータスラベル作成")
-            self.status_label = ttk.Label(self.main_frame, text="準備完了")
-            self.status_label.grid(row=9, column=0, columnspan=3)
+        self.jobs_frame = ttk.Frame(jobs_frame)
+        self.jobs_frame.grid(row=0, column=0, sticky=(tk.W, tk.E))
 
-            print("12. グリッド重み設定")
-            self.root.columnconfigure(0, weight=1)
-            self.root.rowconfigure(0, weight=1)
-            self.main_frame.columnconfigure(1, weight=1)
+        clear_button = ttk.Button(jobs_frame, text="終了したジョブを消去", command=self.clear_finished_jobs)
+        clear_button.grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
 
-            print("create_widgets 完了")
-        except Exception as e:
-            print(f"create_widgets エラー: {e}")
-            import traceback
-            traceback.print_exc()
-            raise
-    
     def create_title_section(self, parent, row):
         """タイトル入力セクションを作成"""
         # タイトル入力フレーム
@@ -316,6 +482,18 @@ class VideoCreatorApp:
         info_label = ttk.Label(title_frame, text="※ ファイル名に使用されます（特殊文字は自動的に除去、重複時は番号付きになります）", 
                               font=('Arial', 9), foreground='gray')
         info_label.grid(row=1, column=0, columnspan=2, sticky=tk.W, pady=(5, 0))
+
+        # タイトルを画面に表示（文字は1回だけ画像にして重ねる）
+        title_card_frame = ttk.Frame(title_frame)
+        title_card_frame.grid(row=2, column=0, columnspan=2, sticky=tk.W, pady=(8, 0))
+        ttk.Checkbutton(title_card_frame, text="タイトルを画面に表示",
+                        variable=self.title_card_enabled).pack(side=tk.LEFT)
+        ttk.Combobox(title_card_frame, textvariable=self.title_card_layout,
+                     values=list(TITLE_LAYOUT_CHOICES), state='readonly', width=10).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Label(title_card_frame, text="アーティスト:").pack(side=tk.LEFT, padx=(15, 5))
+        ttk.Entry(title_card_frame, textvariable=self.title_card_artist, width=20).pack(side=tk.LEFT)
+        ttk.Checkbutton(title_card_frame, text="曲目リスト（メドレー）",
+                        variable=self.title_card_tracks).pack(side=tk.LEFT, padx=(15, 0))
     
     def create_bgm_section(self, parent, row):
         """BGM選択セクションを作成"""
@@ -326,8 +504,9 @@ class VideoCreatorApp:
         
         ttk.Label(bgm_frame, text="BGMファイル:").grid(row=0, column=0, sticky=tk.W, padx=(0, 10))
         
-        bgm_entry = ttk.Entry(bgm_frame, textvariable=self.bgm_file, width=50)
-        bgm_entry.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=(0, 10))
+        # 素材フォルダのスキャン完了後に候補が入る
+        self.bgm_combobox = ttk.Combobox(bgm_frame, textvariable=self.bgm_file, width=50)
+        self.bgm_combobox.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=(0, 10))
         
         bgm_button = ttk.Button(bgm_frame, text="選択", command=self.select_bgm)
         bgm_button.grid(row=0, column=2)
@@ -342,18 +521,36 @@ class VideoCreatorApp:
         bg_button = ttk.Button(bg_frame, text="背景画像・映像を選択", command=self.select_backgrounds)
         bg_button.grid(row=0, column=0, pady=(0, 10))
         
-        # 選択されたファイルのリストボックス
-        self.bg_listbox = tk.Listbox(bg_frame, height=4)
-        self.bg_listbox.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
-        
-        # スクロールバー
-        bg_scrollbar = ttk.Scrollbar(bg_frame, orient=tk.VERTICAL, command=self.bg_listbox.yview)
-        bg_scrollbar.grid(row=1, column=1, sticky=(tk.N, tk.S))
-        self.bg_listbox.configure(yscrollcommand=bg_scrollbar.set)
+        # 選択されたファイルのリスト（サムネイル・解像度・長さ付き）
+        self.bg_list = AssetList(bg_frame, self.asset_loader, rows=4)
+        self.bg_list.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(0, 10))
         
         # 削除ボタン
         remove_bg_button = ttk.Button(bg_frame, text="選択項目を削除", command=self.remove_background)
         remove_bg_button.grid(row=2, column=0)
+
+        # 素材フォルダ（ライブラリ）から追加（ダブルクリックでも追加）
+        library_frame = ttk.Frame(bg_frame)
+        library_frame.grid(row=3, column=0, sticky=(tk.W, tk.E), pady=(10, 0))
+        library_frame.columnconfigure(1, weight=1)
+        ttk.Label(library_frame, text="ライブラリ:").grid(row=0, column=0, sticky=(tk.W, tk.N))
+        self.library_list = AssetList(library_frame, self.asset_loader, rows=4,
+                                      on_double_click=self.add_library_background)
+        self.library_list.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=(5, 5))
+        ttk.Button(library_frame, text="追加",
+                   command=self.add_library_background).grid(row=0, column=2, sticky=tk.N)
+
+        # スライドショー（選択した背景を順番に表示）
+        slideshow_frame = ttk.Frame(bg_frame)
+        slideshow_frame.grid(row=4, column=0, sticky=tk.W, pady=(10, 0))
+        ttk.Checkbutton(slideshow_frame, text="スライドショー",
+                        variable=self.slideshow_enabled).pack(side=tk.LEFT)
+        ttk.Label(slideshow_frame, text="1枚あたり:").pack(side=tk.LEFT, padx=(15, 0))
+        ttk.Spinbox(slideshow_frame, from_=3, to=600, textvariable=self.slideshow_hold_seconds,
+                    width=6).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Label(slideshow_frame, text="秒").pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Checkbutton(slideshow_frame, text="ゆっくりズーム",
+                        variable=self.slideshow_ken_burns).pack(side=tk.LEFT, padx=(15, 0))
     
     def create_video_type_section(self, parent, row):
         """動画タイプ選択セクションを作成"""
@@ -377,10 +574,15 @@ class VideoCreatorApp:
         duration_frame.grid(row=1, column=1, sticky=tk.W, padx=(20, 0))
         
         ttk.Label(duration_frame, text="動画長:").pack(side=tk.LEFT)
-        duration_spinbox = ttk.Spinbox(duration_frame, from_=15, to=120, 
+        duration_spinbox = ttk.Spinbox(duration_frame, from_=15, to=720, 
                                      textvariable=self.duration_minutes, width=10)
         duration_spinbox.pack(side=tk.LEFT, padx=(5, 0))
         ttk.Label(duration_frame, text="分").pack(side=tk.LEFT, padx=(5, 0))
+
+        # 複数の長さをまとめて作成（最長の動画を1回だけエンコードして切り出す）
+        ttk.Label(duration_frame, text="まとめて作成:").pack(side=tk.LEFT, padx=(15, 0))
+        ttk.Entry(duration_frame, textvariable=self.loop_variant_minutes, width=18).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Label(duration_frame, text="分（カンマ区切り）").pack(side=tk.LEFT, padx=(5, 0))
         
         # メドレー用のファイル選択
         melody_frame = ttk.Frame(type_frame)
@@ -390,8 +592,29 @@ class VideoCreatorApp:
         melody_button.pack(side=tk.LEFT)
         
         # メドレーファイルリスト
-        self.melody_listbox = tk.Listbox(melody_frame, height=3, width=40)
-        self.melody_listbox.pack(side=tk.LEFT, padx=(10, 0))
+        self.melody_list = AssetList(melody_frame, self.asset_loader, rows=3, width=400)
+        self.melody_list.pack(side=tk.LEFT, padx=(10, 0))
+
+        # ビジュアライザー（単曲・耐久動画）
+        visualizer_frame = ttk.Frame(type_frame)
+        visualizer_frame.grid(row=3, column=0, columnspan=2, sticky=tk.W, pady=(10, 0))
+        ttk.Label(visualizer_frame, text="ビジュアライザー:").pack(side=tk.LEFT)
+        visualizer_combobox = ttk.Combobox(visualizer_frame, textvariable=self.visualizer_style,
+                                           values=list(VISUALIZER_CHOICES), state='readonly', width=12)
+        visualizer_combobox.pack(side=tk.LEFT, padx=(5, 0))
+
+        # 長時間モード（耐久動画を1ループ単位で作成して連結し、必要なら分割する）
+        long_form_frame = ttk.Frame(type_frame)
+        long_form_frame.grid(row=4, column=0, columnspan=2, sticky=tk.W, pady=(5, 0))
+        ttk.Checkbutton(long_form_frame, text="長時間モード（8〜12時間など）",
+                        variable=self.long_form).pack(side=tk.LEFT)
+        ttk.Label(long_form_frame, text="分割:").pack(side=tk.LEFT, padx=(15, 0))
+        ttk.Spinbox(long_form_frame, from_=0, to=720, textvariable=self.part_minutes,
+                    width=6).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Label(long_form_frame, text="分まで").pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Spinbox(long_form_frame, from_=0, to=256000, increment=100, textvariable=self.part_size_mb,
+                    width=8).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Label(long_form_frame, text="MBまで（0は分割しない）").pack(side=tk.LEFT, padx=(5, 0))
     
     def create_output_section(self, parent, row):
         """出力設定セクションを作成"""
@@ -407,6 +630,19 @@ class VideoCreatorApp:
         
         output_button = ttk.Button(output_frame, text="選択", command=self.select_output_directory)
         output_button.grid(row=0, column=2)
+
+        # 差分ビルド
+        incremental_check = ttk.Checkbutton(output_frame, text="入力・設定が同じ動画は作り直さない",
+                                            variable=self.incremental_build)
+        incremental_check.grid(row=1, column=0, columnspan=3, sticky=tk.W, pady=(5, 0))
+
+        # ファイルサイズの目標（サンプルのエンコードから画質を自動調整する）
+        size_frame = ttk.Frame(output_frame)
+        size_frame.grid(row=2, column=0, columnspan=3, sticky=tk.W, pady=(5, 0))
+        ttk.Label(size_frame, text="ファイルサイズ上限:").pack(side=tk.LEFT)
+        ttk.Spinbox(size_frame, from_=0, to=256000, increment=10, textvariable=self.target_size_mb,
+                    width=8).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Label(size_frame, text="MB（0は画質を自動調整しない）").pack(side=tk.LEFT, padx=(5, 0))
     
     def create_short_version_section(self, parent, row):
         """ショートバージョン設定セクションを作成"""
@@ -429,11 +665,28 @@ class VideoCreatorApp:
                                      textvariable=self.short_duration_seconds, width=10)
         duration_spinbox.pack(side=tk.LEFT, padx=(5, 0))
         ttk.Label(duration_frame, text="秒").pack(side=tk.LEFT, padx=(5, 0))
+
+        # 切り出し位置
+        highlight_check = ttk.Checkbutton(duration_frame, text="盛り上がり部分を自動で切り出す",
+                                          variable=self.short_auto_highlight)
+        highlight_check.pack(side=tk.LEFT, padx=(20, 0))
+
+        # 横長の背景の上下の余白（黒帯の代わりに背景をぼかして埋める）
+        blur_check = ttk.Checkbutton(duration_frame, text="余白を背景のぼかしで埋める",
+                                     variable=self.short_blur_fill)
+        blur_check.pack(side=tk.LEFT, padx=(20, 0))
+
+        # 長さの違うショートをまとめて作成（BGM・背景を1回だけデコードして同時に書き出す）
+        clips_frame = ttk.Frame(short_frame)
+        clips_frame.grid(row=2, column=0, columnspan=2, sticky=tk.W, pady=(5, 0))
+        ttk.Label(clips_frame, text="まとめて作成:").pack(side=tk.LEFT)
+        ttk.Entry(clips_frame, textvariable=self.short_clip_seconds, width=18).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Label(clips_frame, text="秒（カンマ区切り）").pack(side=tk.LEFT, padx=(5, 0))
         
         # 説明ラベル
         info_label = ttk.Label(short_frame, text="※ Instagram Reels、TikTok、YouTube Shorts などに最適化", 
                               font=('Arial', 9), foreground='gray')
-        info_label.grid(row=2, column=0, columnspan=2, sticky=tk.W, pady=(5, 0))
+        info_label.grid(row=3, column=0, columnspan=2, sticky=tk.W, pady=(5, 0))
     
     def select_bgm(self):
         """BGMファイルを選択"""
@@ -465,16 +718,42 @@ class VideoCreatorApp:
         if filenames:
             self.background_files.extend(filenames)
             self.update_background_list()
+            self.prepare_backgrounds(filenames)
+
+    def prepare_backgrounds(self, background_files):
+        """追加した背景を出力用に変換しておく（動画作成時に毎回変換しないため）"""
+        if not self.ffmpeg_path:
+            return
+        threading.Thread(target=self.prepare_backgrounds_thread,
+                         args=(list(background_files), self.ffmpeg_path), daemon=True).start()
+
+    def prepare_backgrounds_thread(self, background_files, ffmpeg_path):
+        """背景を横・縦の出力用に変換する（ワーカースレッドから呼ばれる）"""
+        from video_generator import VideoGenerator
+        with self.background_prepare_lock:
+            try:
+                VideoGenerator(ffmpeg_path).prepare_background_variants(background_files)
+            except Exception as e:
+                # 変換できなかった背景は動画作成時に元の画像を使う
+                print(f"背景の事前変換に失敗しました: {e}")
     
     def update_background_list(self):
         """背景ファイルリストを更新"""
-        self.bg_listbox.delete(0, tk.END)
-        for file in self.background_files:
-            self.bg_listbox.insert(tk.END, os.path.basename(file))
+        self.bg_list.set_items(self.background_files)
     
+    def add_library_background(self, index=None):
+        """ライブラリで選択した（ダブルクリックした）背景を追加"""
+        if index is None:
+            selection = self.library_list.curselection()
+            if not selection:
+                return
+            index = selection[0]
+        self.background_files.append(self.library_backgrounds[index])
+        self.update_background_list()
+
     def remove_background(self):
         """選択された背景ファイルを削除"""
-        selection = self.bg_listbox.curselection()
+        selection = self.bg_list.curselection()
         if selection:
             index = selection[0]
             del self.background_files[index]
@@ -497,9 +776,7 @@ class VideoCreatorApp:
     
     def update_melody_list(self):
         """メドレーファイルリストを更新"""
-        self.melody_listbox.delete(0, tk.END)
-        for file in self.melody_files:
-            self.melody_listbox.insert(tk.END, os.path.basename(file))
+        self.melody_list.set_items(self.melody_files)
     
     def select_output_directory(self):
         """出力ディレクトリを選択"""
@@ -532,110 +809,276 @@ class VideoCreatorApp:
         if self.video_type.get() == "melody" and not self.melody_files:
             messagebox.showerror("エラー", "メドレー用の動画ファイルを選択してください。")
             return False
+
+        try:
+            self.parse_variant_minutes()
+        except ValueError:
+            messagebox.showerror("エラー", "まとめて作成する長さは「15,30,60」のように分をカンマ区切りで入力してください。")
+            return False
+
+        try:
+            self.parse_short_clip_seconds()
+        except ValueError:
+            messagebox.showerror("エラー", "まとめて作成するショートの長さは「15,30,60」のように秒をカンマ区切りで入力してください。")
+            return False
+
+        if (self.video_type.get() == "loop" and self.long_form.get()
+                and self.loop_variant_minutes.get().strip()):
+            messagebox.showerror("エラー", "長時間モードと「まとめて作成」は同時に使用できません。")
+            return False
         
         return True
+
+    def parse_variant_minutes(self):
+        """まとめて作成する耐久動画の長さ（分）のリストを返す（未入力の場合は None）"""
+        text = self.loop_variant_minutes.get().replace('、', ',').strip()
+        if not text:
+            return None
+        minutes = [int(part) for part in text.split(',') if part.strip()]
+        if not minutes or any(m <= 0 for m in minutes):
+            raise ValueError(text)
+        return minutes
     
+    def parse_short_clip_seconds(self):
+        """まとめて作成するショートの長さ（秒）のリストを返す（未入力の場合は None）"""
+        text = self.short_clip_seconds.get().replace('、', ',').strip()
+        if not text:
+            return None
+        seconds = [int(part) for part in text.split(',') if part.strip()]
+        if not seconds or any(s <= 0 for s in seconds):
+            raise ValueError(text)
+        return seconds
+
+    def build_job_spec(self):
+        """現在の入力内容からジョブ仕様を作成（メインスレッドで呼ぶ）"""
+        return {
+            'type': self.video_type.get(),
+            'bgm_file': self.bgm_file.get(),
+            'background_files': list(self.background_files),
+            'melody_files': list(self.melody_files),
+            'output_dir': self.output_directory.get(),
+            'title': self.video_title.get().strip(),
+            'duration_minutes': self.duration_minutes.get(),
+            'durations_minutes': self.parse_variant_minutes() if self.video_type.get() == "loop" else None,
+            'long_form': self.video_type.get() == "loop" and self.long_form.get(),
+            'part_minutes': self.part_minutes.get() or None,
+            'part_size_mb': self.part_size_mb.get() or None,
+            'create_short': self.create_short_version.get(),
+            'short_duration_seconds': self.short_duration_seconds.get(),
+            'short_clips': self.parse_short_clip_seconds(),
+            'short_highlight': self.short_auto_highlight.get(),
+            'short_fill': "blur" if self.short_blur_fill.get() else "pad",
+            'visualizer': VISUALIZER_CHOICES.get(self.visualizer_style.get()),
+            'slideshow': self.build_slideshow_options(),
+            'title_card': self.build_title_card_options(),
+            'incremental': self.incremental_build.get(),
+            'target_size_mb': self.target_size_mb.get() or None,
+            'profile': self.profile_renders,
+        }
+
+    def build_title_card_options(self):
+        """タイトル表示の設定をジョブ仕様の形式で返す（無効の場合は None）"""
+        if not self.title_card_enabled.get():
+            return None
+        options = {
+            'layout': TITLE_LAYOUT_CHOICES.get(self.title_card_layout.get(), 'intro'),
+            'artist': self.title_card_artist.get().strip(),
+            'font': self.title_font,
+        }
+        if self.video_type.get() == "melody" and self.title_card_tracks.get():
+            # 曲名はメドレー用動画のファイル名から作る
+            options['tracks'] = [Path(path).stem for path in self.melody_files]
+        return options
+
+    def build_slideshow_options(self):
+        """スライドショー設定をジョブ仕様の形式で返す（無効の場合は None）"""
+        if not self.slideshow_enabled.get():
+            return None
+        return {
+            'hold_seconds': self.slideshow_hold_seconds.get(),
+            'ken_burns': self.slideshow_ken_burns.get(),
+        }
+
     def create_video(self):
-        """動画作成を開始"""
+        """動画作成ジョブをキューに追加"""
         if not self.validate_inputs():
             return
-        
+
         # 設定を保存
         self.save_config()
-        
-        # 別スレッドで動画作成を実行
-        thread = threading.Thread(target=self.create_video_thread)
+
+        spec = self.build_job_spec()
+        loop_minutes = spec['durations_minutes'] or [spec['duration_minutes']]
+        type_names = {'single': "単曲", 'loop': f"耐久{'/'.join(map(str, loop_minutes))}分", 'melody': "メドレー"}
+        self.enqueue_job(spec, f"{spec['title']}（{type_names[spec['type']]}）")
+
+    def create_preview(self):
+        """プレビュー作成ジョブをキューに追加"""
+        if not self.validate_inputs():
+            return
+
+        if self.video_type.get() == "melody":
+            messagebox.showerror("エラー", "メドレー動画はプレビューに対応していません。")
+            return
+
+        spec = self.build_job_spec()
+        spec['preview_type'] = spec['type']
+        spec['type'] = 'preview'
+        spec['output_dir'] = None  # 一時フォルダに作成
+        spec['create_short'] = False
+        self.enqueue_job(spec, f"{spec['title']}（プレビュー）", open_output=True)
+
+    def enqueue_job(self, spec, name, open_output=False):
+        """ジョブパネルに行を追加し、同時実行数に空きがあれば開始する"""
+        self.next_job_id += 1
+        job = JobRow(self.jobs_frame, self.next_job_id, name, self.cancel_job)
+        job.spec = spec
+        job.open_output = open_output
+        job.grid(len(self.jobs))
+        self.jobs[job.job_id] = job
+        self.pending_jobs.append(job.job_id)
+        thread = threading.Thread(target=self.estimate_job_thread, args=(job.job_id, spec))
         thread.daemon = True
         thread.start()
-    
-    def create_video_thread(self):
-        """動画作成スレッド"""
+        self.start_pending_jobs()
+
+    def get_render_history(self):
+        """処理時間の履歴を返す（ワーカースレッドから呼ばれる）"""
+        from render_history import RenderHistory
+
+        with self.render_history_lock:
+            if self.render_history is None:
+                self.render_history = RenderHistory()
+            return self.render_history
+
+    def estimate_job_thread(self, job_id, spec):
+        """履歴からジョブの処理時間・出力サイズを予測する（ウィジェットには触れず ui_queue で通知する）"""
+        from video_generator import VideoGenerator
+        from render_history import RenderEstimator, format_estimate
+
         try:
-            self.progress.start()
-            self.status_label.config(text="FFmpegを確認中...")
-            self.root.update_idletasks()
-            
-            # 動画作成スクリプトを呼び出し
-            from video_generator import VideoGenerator
-            
-            generator = VideoGenerator()
-            
-            self.status_label.config(text="動画作成エンジンを初期化中...")
-            self.root.update_idletasks()
-            
-            self.status_label.config(text="動画を作成中...")
-            self.root.update_idletasks()
-            
-            video_type = self.video_type.get()
-            video_title = self.video_title.get().strip()
-            
-            if video_type == "single":
-                generator.create_single_video(
-                    self.bgm_file.get(),
-                    self.background_files,
-                    self.output_directory.get(),
-                    video_title
-                )
-                # ショートバージョンも作成
-                if self.create_short_version.get():
-                    generator.create_short_version(
-                        self.bgm_file.get(),
-                        self.background_files,
-                        self.output_directory.get(),
-                        self.short_duration_seconds.get(),
-                        video_title
-                    )
-            elif video_type == "loop":
-                generator.create_loop_video(
-                    self.bgm_file.get(),
-                    self.background_files,
-                    self.output_directory.get(),
-                    self.duration_minutes.get(),
-                    video_title
-                )
-                # ショートバージョンも作成
-                if self.create_short_version.get():
-                    generator.create_short_version(
-                        self.bgm_file.get(),
-                        self.background_files,
-                        self.output_directory.get(),
-                        self.short_duration_seconds.get(),
-                        video_title
-                    )
-            elif video_type == "melody":
-                generator.create_melody_video(
-                    self.melody_files,
-                    self.background_files,
-                    self.output_directory.get(),
-                    video_title
-                )
-                # メドレーのショートバージョンは作成しない（複雑すぎるため）
-            
-            self.progress.stop()
-            self.status_label.config(text="動画作成完了！")
-            messagebox.showinfo("完了", "動画の作成が完了しました。")
-            
+            estimator = RenderEstimator(VideoGenerator(self.ffmpeg_path), self.get_render_history())
+            estimate = estimator.estimate(spec)
         except Exception as e:
-            self.progress.stop()
-            self.status_label.config(text="エラーが発生しました")
-            messagebox.showerror("エラー", f"動画作成中にエラーが発生しました:\n{str(e)}")
+            print(f"処理時間を予測できませんでした: {e}")
+            return
+        self.ui_queue.put(('job_estimate', (job_id, estimate, format_estimate(estimate))))
+
+    def start_pending_jobs(self):
+        """待機中のジョブを同時実行数の上限まで開始"""
+        while self.pending_jobs and len(self.running_jobs) < self.max_concurrent_jobs:
+            job = self.jobs[self.pending_jobs.popleft()]
+            self.running_jobs.add(job.job_id)
+            job.start()
+            thread = threading.Thread(target=self.run_job_thread, args=(job,))
+            thread.daemon = True
+            thread.start()
+        self.update_status_summary()
+
+    def run_job_thread(self, job):
+        """ジョブ実行スレッド（ウィジェットには触れず、結果は ui_queue で通知する）"""
+        from video_generator import VideoGenerator, RenderCancelledError
+        from render_jobs import run_render_job
+        from render_history import RenderEstimator
+
+        job_id = job.job_id
+        try:
+            generator = VideoGenerator(self.ffmpeg_path, self.media_backend)
+            generator.progress_callback = lambda stage, fraction, speed: self.ui_queue.put(
+                ('job_progress', (job_id, stage, fraction, speed)))
+            job.generator = generator
+            if job.cancel_requested:
+                generator.cancel()
+
+            outputs = run_render_job(generator, job.spec, RenderEstimator(generator, self.get_render_history()))
+            self.ui_queue.put(('job_done', (job_id, outputs)))
+        except RenderCancelledError:
+            self.ui_queue.put(('job_cancelled', job_id))
+        except Exception as e:
+            self.ui_queue.put(('job_failed', (job_id, str(e))))
+
+    def cancel_job(self, job_id):
+        """ジョブをキャンセル（待機中なら取り除き、実行中ならFFmpegを停止する）"""
+        job = self.jobs[job_id]
+        if job_id in self.pending_jobs:
+            self.pending_jobs.remove(job_id)
+            job.finish("キャンセル")
+            self.update_status_summary()
+        elif job_id in self.running_jobs:
+            job.cancel_requested = True
+            job.set_status("キャンセル中...")
+            if job.generator is not None:
+                job.generator.cancel()
+
+    def handle_job_message(self, kind, payload):
+        """ジョブスレッドからの通知を反映"""
+        if kind == 'job_progress':
+            job_id, stage, fraction, speed = payload
+            self.jobs[job_id].update_progress(stage, fraction, speed)
+            return
+        if kind == 'job_estimate':
+            job_id, estimate, text = payload
+            if job_id in self.jobs:
+                self.jobs[job_id].set_estimate(estimate, text)
+            return
+
+        job_id = payload[0] if isinstance(payload, tuple) else payload
+        job = self.jobs[job_id]
+        self.running_jobs.discard(job_id)
+
+        if kind == 'job_done':
+            outputs = payload[1]
+            job.finish("完了")
+            if job.open_output and outputs:
+                self.open_file(outputs[-1])
+            else:
+                messagebox.showinfo("完了", f"動画の作成が完了しました。\n{job.name}")
+        elif kind == 'job_cancelled':
+            job.finish("キャンセル")
+        elif kind == 'job_failed':
+            job.finish("エラー")
+            messagebox.showerror("エラー", f"動画作成中にエラーが発生しました:\n{job.name}\n{payload[1]}")
+
+        self.start_pending_jobs()
+
+    def update_job_timers(self):
+        """実行中ジョブの経過時間を毎秒更新"""
+        for job_id in self.running_jobs:
+            self.jobs[job_id].update_elapsed()
+        self.root.after(1000, self.update_job_timers)
+
+    def update_status_summary(self):
+        running = len(self.running_jobs)
+        pending = len(self.pending_jobs)
+        if running or pending:
+            self.status_label.config(text=f"実行中: {running}件 / 待機中: {pending}件")
+        else:
+            self.status_label.config(text="準備完了")
+
+    def clear_finished_jobs(self):
+        """終了したジョブの行をパネルから消去"""
+        for job_id in [j for j, job in self.jobs.items() if job.finished_at is not None]:
+            self.jobs.pop(job_id).destroy()
+        for index, job in enumerate(self.jobs.values()):
+            job.grid(index)
+
+    def open_file(self, path):
+        """作成したファイルを既定のアプリケーションで開く"""
+        try:
+            if sys.platform == 'darwin':
+                subprocess.Popen(['open', path])
+            elif sys.platform == 'win32':
+                os.startfile(path)
+            else:
+                subprocess.Popen(['xdg-open', path])
+        except Exception as e:
+            print(f"ファイルを開けませんでした: {e}")
 
 def main():
     """メイン関数"""
-    print("=== main() 開始 ===")
-    try:
-        print("1. Tkinter root ウィンドウ作成")
-        root = tk.Tk()
-        print("2. VideoCreatorApp インスタンス作成")
-        app = VideoCreatorApp(root)
-        print("3. mainloop() 開始")
-        root.mainloop()
-        print("4. mainloop() 終了")
-    except Exception as e:
-        print(f"main() エラー: {e}")
-        import traceback
-        traceback.print_exc()
-    print("=== main() 終了 ===")
+    root = tk.Tk()
+    app = VideoCreatorApp(root)
+    root.mainloop()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -14,12 +14,236 @@ from pathlib import Path
 from datetime import datetime
 import json
 import random
+from contextlib import nullcontext
+
+import audio_analysis
+# RenderCancelledError は呼び出し側のためにここからも参照できるようにする
+from ffmpeg_runner import FFmpegRunner, FFmpegError, RenderCancelledError
+import visualizer as audio_visualizer
+import slideshow
+import output_manifest
+import title_card as title_renderer
+import blur_fill
+import quality_tuning
+import background_cache
+import pyav_backend
+
 
 class VideoGenerator:
-    def __init__(self):
+    # 出力解像度（通常動画 / SNS用縦型動画）
+    VIDEO_SIZE = (1920, 1080)
+    SHORT_VIDEO_SIZE = (1080, 1920)
+    # 出力のフレームレート（-loop 1 の既定値と同じ）
+    VIDEO_FPS = 25
+
+    # 長さ違いの耐久動画をまとめて作る際のキーフレーム間隔（秒）。切り出し位置の細かさになる
+    LOOP_KEYFRAME_SECONDS = 2
+
+    # プレビュー設定
+    PREVIEW_SCALE = 4  # 出力解像度の1/4で描画
+    PREVIEW_FPS = 12
+    PREVIEW_SEGMENT_SECONDS = 6  # 冒頭・つなぎ目・末尾それぞれの長さ
+
+    # FFmpegの入力情報の映像ストリームの行（Stream #0:0: Video: png, rgb24, 1920x1080）から解像度を読み取る
+    VIDEO_SIZE_PATTERN = re.compile(r'Video:.*?\b(\d{2,5})x(\d{2,5})\b')
+
+    def __init__(self, ffmpeg_path=None, backend="ffmpeg"):
         self.temp_dir = None
-        self.ffmpeg_path = self.find_ffmpeg()
-        
+        # 検出済みのパスが渡された場合は再検索しない
+        self.ffmpeg_path = ffmpeg_path or self.find_ffmpeg()
+        # メディア処理のバックエンド: "ffmpeg"（毎回サブプロセスを起動）/ "pyav"（対応する処理はプロセス内で行う）
+        self.backend = pyav_backend.validate_backend(backend)
+        self.media = pyav_backend.InProcessMedia() if self.backend == "pyav" else None
+        # 進捗通知用コールバック: callback(stage, fraction, speed)
+        self.progress_callback = None
+        # FFmpegの実行（進捗・キャンセル・タイムアウト・再試行）
+        self.runner = FFmpegRunner()
+        # 差分ビルド: 入力・設定が前回と同じ出力は作り直さず、背景の選択も固定する
+        self.incremental = False
+        # 画質の自動調整の目標（quality_tuning.normalize_target の戻り値、None で x264 の既定の画質）
+        self.quality_target = None
+
+    def build_video_filter(self, width, height):
+        """背景を指定解像度に収めるビデオフィルターを生成（アスペクト比維持・余白は黒）"""
+        return (f'scale={width}:{height}:force_original_aspect_ratio=decrease,'
+                f'pad={width}:{height}:(ow-iw)/2:(oh-ih)/2')
+
+    def prepare_short_background(self, background_file, fill="pad"):
+        """縦型動画の背景とビデオフィルターを用意し、(背景ファイル, フィルター) を返す
+
+        fill: "pad"（余白は黒）/ "blur"（余白を背景のぼかしで埋める）
+        静止画のぼかし埋めは合成済みの画像をキャッシュして使うため、エンコード時の処理は黒帯と同じになる。
+        """
+        width, height = self.SHORT_VIDEO_SIZE
+        if blur_fill.validate_fill(fill) == "blur":
+            if not blur_fill.can_prerender(background_file):
+                return background_file, blur_fill.build_blur_fill_filter(width, height)
+            with self.profile_section("ぼかし背景の作成"):
+                background_file = blur_fill.render_blur_fill(background_file, width, height)
+        background_file = self.normalize_background(background_file, self.SHORT_VIDEO_SIZE)
+        return background_file, self.build_video_filter(width, height)
+
+    def prepare_background_variants(self, background_files):
+        """背景の取り込み時に、横・縦の出力用に変換した背景を作成しておく"""
+        for background_file in background_files:
+            for size in (self.VIDEO_SIZE, self.SHORT_VIDEO_SIZE):
+                self.normalize_background(background_file, size)
+
+    def normalize_background(self, background_file, size):
+        """静止画の背景を出力の解像度・ピクセルフォーマットに変換済みのもの（キャッシュ）に置き換える
+
+        静止画以外、または変換できなかった場合は元のファイルをそのまま返す。
+        """
+        if not background_cache.can_normalize(background_file):
+            return background_file
+        try:
+            with self.profile_section("背景の事前変換"):
+                return background_cache.normalize_background(self, background_file, *size)
+        except RenderCancelledError:
+            raise
+        except Exception as e:
+            print(f"警告: 背景を事前に変換できないため、元の画像を使用します: {e}")
+            return background_file
+
+    def build_audio_fade_filter(self, duration, fade_sec):
+        """フェードイン・アウトのオーディオフィルターを生成"""
+        return f'afade=t=in:st=0:d={fade_sec},afade=t=out:st={duration - fade_sec}:d={fade_sec}'
+
+    def build_background_filter_args(self, width, height, visualizer_clip=None, visualizer_input=2,
+                                     title_overlay=None, title_input=None, audio_map='1:a'):
+        """背景用のフィルター引数を生成（ビジュアライザー・タイトルがあれば filter_complex で重ねる）
+
+        audio_map: 音声として出力する入力（None で音声を割り当てない）
+        """
+        video_filter = self.build_video_filter(width, height)
+        show_title = self.title_needs_overlay(title_overlay)
+        if not visualizer_clip and not show_title:
+            return ['-vf', video_filter]
+        if visualizer_clip:
+            graph = audio_visualizer.build_overlay_filter(
+                video_filter, width, height, visualizer_input,
+                output_label='viz_out' if show_title else 'v')
+            base_label = 'viz_out'
+        else:
+            graph = f'[0:v]{video_filter}[bg]'
+            base_label = 'bg'
+        if show_title:
+            graph = title_renderer.build_overlay_filter(graph, base_label, title_overlay, title_input)
+        args = ['-filter_complex', graph, '-map', '[v]']
+        if audio_map:
+            args += ['-map', audio_map]
+        return args
+
+    def prepare_background(self, background_files, duration, temp_dir, slideshow_options=None,
+                           manifest=None, title_overlay=None):
+        """背景の入力引数を用意する
+
+        戻り値: (入力引数, エンコード済みかどうか)
+        スライドショーの場合は作成済みクリップの連結リストを返す（映像はストリームコピーできる）。
+        title_overlay: 常に表示するタイトルは、静止画の背景なら背景画像に焼き込む
+        """
+        if slideshow_options and len(background_files) > 1:
+            options = slideshow.normalize_options(slideshow_options)
+            print(f"スライドショーを作成中... ({len(background_files)}枚)")
+            builder = slideshow.SlideshowBuilder(self, *self.VIDEO_SIZE, self.VIDEO_FPS, **options)
+            with self.profile_section("スライドショーのクリップ準備"):
+                list_file = builder.write_concat_list(background_files, duration,
+                                                      os.path.join(temp_dir, "slideshow.txt"))
+            return ['-f', 'concat', '-safe', '0', '-i', list_file], True
+
+        # 背景画像をランダムに選択
+        background_file = self.choose_background(background_files, manifest)
+        background_file = self.bake_title(background_file, title_overlay)
+        background_file = self.normalize_background(background_file, self.VIDEO_SIZE)
+        return background_cache.build_input_args(background_file, duration), False
+
+    def build_video_output_args(self, prebuilt_background, visualizer_clip=None, keyframe_interval=None,
+                                title_overlay=None, title_input=None):
+        """映像の出力引数を生成（エンコード済みの背景はそのままコピーする）
+
+        keyframe_interval: 再エンコードする場合に、指定した秒数ごとにキーフレームを置く
+        title_overlay / title_input: 重ねるタイトルとその入力番号（焼き込み済みなら重ねない）
+        """
+        if (prebuilt_background and not visualizer_clip and not self.title_needs_overlay(title_overlay)
+                and not self.quality_target):
+            return ['-map', '0:v', '-map', '1:a', '-c:v', 'copy']
+        args = ['-c:v', 'libx264', '-pix_fmt', 'yuv420p']
+        if keyframe_interval:
+            args += ['-force_key_frames', f'expr:gte(t,n_forced*{keyframe_interval})']
+        return args + self.build_background_filter_args(
+            *self.VIDEO_SIZE, visualizer_clip=visualizer_clip,
+            title_overlay=title_overlay, title_input=title_input)
+
+    def build_quality_args(self, cmd, video_args, duration):
+        """画質の自動調整が有効な場合、目標に収まるCRFの引数を返す（無効なら空のリスト）
+
+        cmd: 入力まで組み立てたFFmpegコマンド / video_args: 映像のエンコード・フィルター引数
+        duration: 出力全体の長さ（秒）。目標のファイルサイズからビットレートを求めるのに使う
+        """
+        if not self.quality_target:
+            return []
+        with self.profile_section("画質の自動調整"):
+            return quality_tuning.QualityTuner(self).build_quality_args(
+                self.quality_target, cmd[1:], video_args, duration)
+
+    def prepare_title_card(self, title, title_card):
+        """タイトル画像を用意して重ね方の情報を返す（title_card が None の場合は None）
+
+        文字はここで1回だけ画像に描画してキャッシュし、エンコード中は画像を重ねるだけにする。
+        """
+        if not title_card:
+            return None
+        if not title:
+            print("警告: 動画タイトルが空のため、タイトルは表示しません")
+            return None
+        options = title_renderer.normalize_options(title_card)
+        with self.profile_section("タイトル画像の作成"):
+            image = title_renderer.render_title_image(title, options, *self.VIDEO_SIZE)
+        return {'image': image, 'layout': options['layout'], 'baked': False}
+
+    def title_card_params(self, title, title_card):
+        """差分ビルドの設定に含めるタイトル表示の内容"""
+        if not title_card or not title:
+            return None
+        return dict(title_renderer.normalize_options(title_card), title=title)
+
+    def title_needs_overlay(self, title_overlay):
+        """エンコード時にタイトル画像を重ねる必要があるか（背景に焼き込み済みなら不要）"""
+        return bool(title_overlay) and not title_overlay['baked']
+
+    def bake_title(self, background_file, title_overlay):
+        """常に表示するタイトルを静止画の背景に焼き込み、使用する背景のパスを返す"""
+        if (not title_overlay or title_overlay['layout'] != 'static'
+                or not title_renderer.can_bake(background_file)):
+            return background_file
+        title_overlay['baked'] = True
+        return title_renderer.bake_into_background(background_file, title_overlay['image'],
+                                                   *self.VIDEO_SIZE)
+
+    def add_title_input(self, cmd, title_overlay, title_input):
+        """タイトル画像を重ねる場合はその入力を cmd に追加し、入力番号を返す"""
+        if not self.title_needs_overlay(title_overlay):
+            return None
+        cmd += title_renderer.build_input_args(title_overlay, self.VIDEO_FPS)
+        return title_input
+
+    def prepare_visualizer(self, bgm_file, style, audio_duration):
+        """ビジュアライザー映像を用意してパスを返す（style が None の場合は None）"""
+        if not style:
+            return None
+        if style not in audio_visualizer.STYLES:
+            raise ValueError(f"不明なビジュアライザーです: {style}")
+        if self.cancelled:
+            raise RenderCancelledError("動画作成がキャンセルされました")
+        print(f"ビジュアライザーを作成中... ({style})")
+        self.report_progress("visualizer", None)
+        with self.profile_section(f"ビジュアライザー ({style})"):
+            clip = audio_visualizer.get_visualizer_clip(
+                self.ffmpeg_path, bgm_file, self.VIDEO_SIZE[0], self.VIDEO_SIZE[1],
+                self.VIDEO_FPS, style=style, audio_duration=audio_duration, runner=self.runner)
+        self.report_progress("visualizer", 1.0)
+        return clip
+
     def sanitize_filename(self, filename):
         """ファイル名を安全にする（特殊文字を除去）"""
         # ファイル名に使用できない文字を除去または置換
@@ -48,7 +272,79 @@ class VideoGenerator:
                 return new_filename
             counter += 1
         
-    def find_ffmpeg(self):
+    def build_output_path(self, output_dir, filename, default_filename):
+        """出力ファイルのパスを決定
+
+        タイトルから作ったファイル名は通常は連番を付けて重複を避けるが、
+        差分ビルド時は同じファイルを再利用・上書きする。
+        """
+        if filename:
+            if not self.incremental:
+                filename = self.get_unique_filename(output_dir, filename)
+            return os.path.join(output_dir, filename)
+        return os.path.join(output_dir, default_filename)
+
+    def check_manifest(self, output_file, kind, input_files, params):
+        """差分ビルド用のマニフェストを作成し、(マニフェスト, 作成済みかどうか) を返す
+
+        差分ビルドでない場合は (None, False)。
+        """
+        if not self.incremental:
+            return None, False
+        manifest = self.build_render_manifest(kind, input_files, params)
+        if output_manifest.is_up_to_date(output_file, manifest):
+            print(f"入力・設定に変更がないためスキップします: {output_file}")
+            return manifest, True
+        output_manifest.remove_manifest(output_file)
+        return manifest, False
+
+    def build_render_manifest(self, kind, input_files, params):
+        """入力ファイルと作成パラメータ（画質の目標を含む）からマニフェストを作成"""
+        with self.profile_section("マニフェスト（入力のハッシュ）"):
+            return output_manifest.build_manifest(kind, input_files, dict(params, quality=self.quality_target))
+
+    def single_manifest_params(self, background_files, visualizer, slideshow_options, title_params):
+        """単曲動画のマニフェストのパラメータ"""
+        return {'size': self.VIDEO_SIZE, 'fps': self.VIDEO_FPS, 'visualizer': visualizer,
+                'slideshow': self.slideshow_params(background_files, slideshow_options),
+                'title_card': title_params}
+
+    def loop_manifest_params(self, background_files, duration_minutes, visualizer, slideshow_options,
+                             title_params):
+        """耐久動画のマニフェストのパラメータ"""
+        return dict(self.single_manifest_params(background_files, visualizer, slideshow_options, title_params),
+                    duration_minutes=duration_minutes)
+
+    def short_manifest_params(self, duration_seconds, start_seconds, auto_highlight, fill):
+        """ショート動画のマニフェストのパラメータ"""
+        return {'size': self.SHORT_VIDEO_SIZE, 'duration_seconds': duration_seconds,
+                'start_seconds': start_seconds, 'auto_highlight': auto_highlight, 'fill': fill}
+
+    def finish_output(self, output_file, manifest):
+        """作成完了後にマニフェストを保存（差分ビルド時のみ）"""
+        if manifest is not None:
+            output_manifest.write_manifest(output_file, manifest)
+
+    def choose_background(self, background_files, manifest=None):
+        """背景画像を1枚選ぶ
+
+        差分ビルド時はマニフェストの key を種にして毎回同じ画像を選び、選択結果を記録する。
+        """
+        chooser = random.Random(manifest['key']) if manifest is not None else random
+        background_file = chooser.choice(background_files)
+        if manifest is not None:
+            manifest['background'] = os.path.abspath(background_file)
+        print(f"使用する背景: {os.path.basename(background_file)}")
+        return background_file
+
+    def slideshow_params(self, background_files, slideshow_options):
+        """マニフェスト用のスライドショー設定（使わない場合は None）"""
+        if slideshow_options and len(background_files) > 1:
+            return slideshow.normalize_options(slideshow_options)
+        return None
+
+    @staticmethod
+    def find_ffmpeg():
         """FFmpegのパスを検索"""
         # 一般的なFFmpegのインストール場所をチェック
         possible_paths = [
@@ -91,13 +387,77 @@ class VideoGenerator:
             shutil.rmtree(self.temp_dir)
             self.temp_dir = None
     
+    @property
+    def cancelled(self):
+        return self.runner.cancelled
+
+    @property
+    def profiler(self):
+        """計測モード（render_profiler.RenderProfiler）。None の場合は計測しない"""
+        return self.runner.profiler
+
+    @profiler.setter
+    def profiler(self, profiler):
+        self.runner.profiler = profiler
+
+    def profile_section(self, name):
+        """Python側の処理を計測するコンテキスト（計測モードでなければ何もしない）"""
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.section(name)
+
+    def run_ffmpeg(self, cmd, error_message, stage="encode", duration=None):
+        """FFmpegを実行し、進捗をコールバックに通知する
+
+        duration: 出力の想定秒数（指定時は進捗率と制限時間を計算する）
+        失敗時は原因に応じた FFmpegError のサブクラスを送出する。
+        """
+        self.runner.run(cmd, error_message, stage=stage, duration=duration,
+                        progress=self.report_progress)
+
+    def can_render_in_process(self, background_file, visualizer_clip=None, title_overlay=None):
+        """インプロセスのバックエンドで作成できるか（変換済みの静止画の背景に音声を付けるだけの動画）"""
+        return (self.media is not None and background_cache.is_normalized(background_file)
+                and not visualizer_clip and not self.title_needs_overlay(title_overlay)
+                and not self.quality_target)
+
+    def render_in_process(self, background_file, audio_file, output_file, fade_sec, start=0.0, duration=None):
+        """静止画の背景にBGMを付けた動画をプロセス内で作成し、動画の長さ（秒）を返す"""
+        print("インプロセスで動画を作成中...")
+        with self.profile_section("インプロセスのエンコード"):
+            return self.media.render_still_video(
+                background_file, audio_file, output_file, self.VIDEO_FPS, fade_sec, start, duration,
+                progress=lambda fraction, speed: self.report_progress("encode", fraction, speed),
+                cancelled=lambda: self.cancelled)
+
+    def report_progress(self, stage, fraction, speed=None):
+        """進捗をコールバックに通知（コールバックの例外は処理を止めない）"""
+        if self.progress_callback is None:
+            return
+        try:
+            self.progress_callback(stage, fraction, speed)
+        except Exception as e:
+            print(f"進捗通知でエラー: {e}")
+
+    def cancel(self):
+        """動画作成をキャンセルし、実行中のFFmpegプロセスを停止する（他スレッドから呼び出し可）"""
+        self.runner.cancel()
+
     def get_audio_duration(self, audio_file):
         """音声ファイルの長さを取得（リターンコード無視版）"""
-        cmd = [self.ffmpeg_path, '-i', audio_file]
+        if self.media is not None:
+            try:
+                return self.media.probe_duration(audio_file)
+            except Exception as e:
+                print(f"インプロセスで長さを取得できないため、FFmpegで取得します: {e}")
+        cmd = [self.ffmpeg_path, '-hide_banner', '-i', audio_file]
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            # タグ情報が長くても取りこぼさないよう、Duration行は読み取り時に拾う
+            duration_lines = []
+            self.runner.run(cmd, "音声ファイルの長さ取得に失敗しました", stage="probe", check=False,
+                            on_line=lambda line: 'Duration:' in line and duration_lines.append(line))
             # リターンコードに関係なくstderrをパース
-            for line in result.stderr.split('\n'):
+            for line in duration_lines:
                 if 'Duration:' in line:
                     duration_str = line.split('Duration:')[1].split(',')[0].strip()
                     time_parts = duration_str.split(':')
@@ -107,12 +467,43 @@ class VideoGenerator:
                     total_seconds = hours * 3600 + minutes * 60 + seconds
                     return total_seconds
             return 0
+        except RenderCancelledError:
+            raise
         except Exception as e:
             print(f"音声ファイルの長さ取得でエラー: {e}")
             return 0
     
-    def create_single_video(self, bgm_file, background_files, output_dir, title=""):
-        """単曲動画を作成"""
+    def get_video_size(self, media_file):
+        """画像・動画の解像度 (幅, 高さ) を取得（取得できない場合は None）"""
+        if self.media is not None:
+            try:
+                return self.media.probe_size(media_file)
+            except Exception as e:
+                print(f"インプロセスで解像度を取得できないため、FFmpegで取得します: {e}")
+        cmd = [self.ffmpeg_path, '-hide_banner', '-i', media_file]
+        video_lines = []
+        try:
+            self.runner.run(cmd, "解像度の取得に失敗しました", stage="probe", check=False,
+                            on_line=lambda line: 'Video:' in line and video_lines.append(line))
+        except RenderCancelledError:
+            raise
+        except Exception as e:
+            print(f"解像度の取得でエラー: {e}")
+            return None
+        for line in video_lines:
+            match = self.VIDEO_SIZE_PATTERN.search(line)
+            if match:
+                return int(match.group(1)), int(match.group(2))
+        return None
+
+    def create_single_video(self, bgm_file, background_files, output_dir, title="", visualizer=None,
+                            slideshow_options=None, title_card=None):
+        """単曲動画を作成
+
+        visualizer: ビジュアライザーの種類（"spectrum" / "waveform"、None で無し）
+        slideshow_options: 背景を順番に切り替える設定（True または dict、None で1枚をランダムに使用）
+        title_card: タイトルを画面に表示する設定（True または dict、None で表示しない）
+        """
         print("単曲動画を作成中...")
         
         # 一時ディレクトリを作成
@@ -130,40 +521,55 @@ class VideoGenerator:
             # 出力ファイル名を生成
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             safe_title = self.sanitize_filename(title)
-            if safe_title:
-                filename = f"{safe_title}.mp4"
-                filename = self.get_unique_filename(output_dir, filename)
-                output_file = os.path.join(output_dir, filename)
-            else:
-                output_file = os.path.join(output_dir, f"single_video_{timestamp}.mp4")
+            output_file = self.build_output_path(
+                output_dir, f"{safe_title}.mp4" if safe_title else None,
+                f"single_video_{timestamp}.mp4")
             
             print(f"出力ファイル: {output_file}")
+
+            # 入力・設定が前回と同じなら作り直さない
+            manifest, up_to_date = self.check_manifest(
+                output_file, "single", [bgm_file] + list(background_files),
+                self.single_manifest_params(background_files, visualizer, slideshow_options,
+                                            self.title_card_params(title, title_card)))
+            if up_to_date:
+                return output_file
+
+            title_overlay = self.prepare_title_card(title, title_card)
+
+            # 背景（1枚をループ、またはスライドショー）
+            background_args, prebuilt = self.prepare_background(
+                background_files, audio_duration, temp_dir, slideshow_options, manifest, title_overlay)
+
+            visualizer_clip = self.prepare_visualizer(bgm_file, visualizer, audio_duration)
+
+            if not prebuilt and self.can_render_in_process(background_args[-1], visualizer_clip, title_overlay):
+                self.render_in_process(background_args[-1], bgm_file, output_file, fade_sec=3)
+            else:
+                print("FFmpegで動画を作成中...")
+                # FFmpegコマンドを構築
+                cmd = [self.ffmpeg_path] + background_args + [
+                    '-i', bgm_file,  # BGM
+                ]
+                if visualizer_clip:
+                    cmd += ['-i', visualizer_clip]  # ビジュアライザー
+                # タイトル画像
+                title_input = self.add_title_input(cmd, title_overlay, 3 if visualizer_clip else 2)
+                # ビデオコーデック・1920x1080にリサイズ
+                video_args = self.build_video_output_args(prebuilt, visualizer_clip,
+                                                          title_overlay=title_overlay, title_input=title_input)
+                cmd += video_args + self.build_quality_args(cmd, video_args, audio_duration)
+                cmd += [
+                    '-c:a', 'aac',  # オーディオコーデック
+                    '-shortest',  # 短い方に合わせる
+                    '-af', self.build_audio_fade_filter(audio_duration, 3),  # フェードイン・アウト
+                    '-y',  # 上書き
+                    output_file
+                ]
             
-            # 背景画像をランダムに選択
-            background_file = random.choice(background_files)
-            print(f"使用する背景: {os.path.basename(background_file)}")
-            
-            print("FFmpegで動画を作成中...")
-            # FFmpegコマンドを構築
-            cmd = [
-                self.ffmpeg_path,
-                '-loop', '1',  # 画像をループ
-                '-i', background_file,  # 背景画像
-                '-i', bgm_file,  # BGM
-                '-c:v', 'libx264',  # ビデオコーデック
-                '-c:a', 'aac',  # オーディオコーデック
-                '-shortest',  # 短い方に合わせる
-                '-pix_fmt', 'yuv420p',  # ピクセルフォーマット
-                '-vf', 'scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:(ow-iw)/2:(oh-ih)/2',  # 1920x1080にリサイズ
-                '-af', 'afade=t=in:st=0:d=3,afade=t=out:st=' + str(audio_duration - 3) + ':d=3',  # フェードイン・アウト
-                '-y',  # 上書き
-                output_file
-            ]
-            
-            # 動画を作成
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode != 0:
-                raise RuntimeError(f"動画作成に失敗しました: {result.stderr}")
+                # 動画を作成
+                self.run_ffmpeg(cmd, "動画作成に失敗しました", stage="encode", duration=audio_duration)
+            self.finish_output(output_file, manifest)
             
             print(f"動画を作成しました: {output_file}")
             return output_file
@@ -171,8 +577,14 @@ class VideoGenerator:
         finally:
             self.cleanup_temp_directory()
     
-    def create_loop_video(self, bgm_file, background_files, output_dir, duration_minutes, title=""):
-        """耐久動画を作成"""
+    def create_loop_video(self, bgm_file, background_files, output_dir, duration_minutes, title="",
+                          visualizer=None, slideshow_options=None, title_card=None):
+        """耐久動画を作成
+
+        visualizer: ビジュアライザーの種類（1ループ分だけ作成して繰り返し使う）
+        slideshow_options: 背景を順番に切り替える設定（True または dict）
+        title_card: タイトルを画面に表示する設定（True または dict）
+        """
         print(f"耐久動画を作成中... ({duration_minutes}分)")
         
         # 一時ディレクトリを作成
@@ -192,95 +604,507 @@ class VideoGenerator:
             print(f"目標時間: {target_duration}秒 ({duration_minutes}分)")
             
             # 音声をループして目標時間に達するまで繰り返す
-            loop_count = int(target_duration / audio_duration) + 1
+            loop_count = self.get_loop_count(duration_minutes, audio_duration)
             print(f"ループ回数: {loop_count}回")
-            
-            print("音声ファイルを連結中...")
-            # ループ用の音声ファイルを作成
-            loop_audio_file = os.path.join(temp_dir, "loop_audio.mp3")
-            
-            # 目標時間（秒）
-            target_duration = duration_minutes * 60
-            
-            # 音声をループして目標時間に達するまで繰り返す
-            loop_count = int(target_duration / audio_duration) + 1
-            
-            # ループ用の音声ファイルを作成
-            loop_audio_file = os.path.join(temp_dir, "loop_audio.mp3")
-            
-            # 音声ファイルを連結
-            concat_file = os.path.join(temp_dir, "concat.txt")
-            with open(concat_file, 'w') as f:
-                for _ in range(loop_count):
-                    f.write(f"file '{bgm_file}'\n")
-            
-            cmd_concat = [
-                self.ffmpeg_path,
-                '-f', 'concat',
-                '-safe', '0',
-                '-i', concat_file,
-                '-c', 'copy',
-                '-y',
-                loop_audio_file
-            ]
-            
-            result = subprocess.run(cmd_concat, capture_output=True, text=True)
-            if result.returncode != 0:
-                raise RuntimeError(f"音声の連結に失敗しました: {result.stderr}")
-            
-            print("音声の連結が完了しました")
-            
-            # 最終的な音声の長さを取得
-            final_audio_duration = self.get_audio_duration(loop_audio_file)
-            print(f"最終的な音声の長さ: {final_audio_duration:.2f}秒")
-            
-            # 出力ファイル名を生成
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            safe_title = self.sanitize_filename(title)
-            if safe_title:
-                filename = f"{safe_title}_{duration_minutes}min.mp4"
-                filename = self.get_unique_filename(output_dir, filename)
-                output_file = os.path.join(output_dir, filename)
-            else:
-                output_file = os.path.join(output_dir, f"loop_video_{duration_minutes}min_{timestamp}.mp4")
-            
+
+            output_file = self.build_loop_output_path(output_dir, duration_minutes, title)
             print(f"出力ファイル: {output_file}")
-            
-            # 背景画像をランダムに選択
-            background_file = random.choice(background_files)
-            print(f"使用する背景: {os.path.basename(background_file)}")
-            
-            print("FFmpegで動画を作成中...")
-            
-            # FFmpegコマンドを構築
-            cmd = [
-                self.ffmpeg_path,
-                '-loop', '1',  # 画像をループ
-                '-i', background_file,  # 背景画像
-                '-i', loop_audio_file,  # ループBGM
-                '-c:v', 'libx264',  # ビデオコーデック
-                '-c:a', 'aac',  # オーディオコーデック
-                '-shortest',  # 短い方に合わせる
-                '-pix_fmt', 'yuv420p',  # ピクセルフォーマット
-                '-vf', 'scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:(ow-iw)/2:(oh-ih)/2',  # 1920x1080にリサイズ
-                '-af', 'afade=t=in:st=0:d=3,afade=t=out:st=' + str(final_audio_duration - 3) + ':d=3',  # フェードイン・アウト
-                '-y',  # 上書き
-                output_file
-            ]
-            
+
+            # 入力・設定が前回と同じなら音声の連結から省略する
+            manifest, up_to_date = self.check_loop_manifest(
+                output_file, bgm_file, background_files, duration_minutes, visualizer, slideshow_options,
+                self.title_card_params(title, title_card))
+            if up_to_date:
+                return output_file
+
+            loop_audio_file, final_audio_duration = self.build_loop_audio(bgm_file, loop_count, temp_dir)
+
             # 動画を作成
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode != 0:
-                raise RuntimeError(f"動画作成に失敗しました: {result.stderr}")
+            self.encode_loop_video(
+                bgm_file, audio_duration, loop_audio_file, final_audio_duration, background_files,
+                temp_dir, output_file, visualizer, slideshow_options, manifest,
+                self.build_audio_fade_filter(final_audio_duration, 3),  # フェードイン・アウト
+                title_overlay=self.prepare_title_card(title, title_card))
+            self.finish_output(output_file, manifest)
             
             print(f"耐久動画を作成しました: {output_file}")
             return output_file
             
         finally:
             self.cleanup_temp_directory()
-    
-    def create_melody_video(self, melody_files, background_files, output_dir, title=""):
-        """メドレー動画を作成"""
+
+    def get_loop_count(self, duration_minutes, audio_duration):
+        """目標時間に達するまでのループ回数（曲の途中で終わらないよう1曲単位で切り上げる）"""
+        return int(duration_minutes * 60 / audio_duration) + 1
+
+    def build_loop_output_path(self, output_dir, duration_minutes, title):
+        """耐久動画の出力ファイル名を生成"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        safe_title = self.sanitize_filename(title)
+        return self.build_output_path(
+            output_dir, f"{safe_title}_{duration_minutes}min.mp4" if safe_title else None,
+            f"loop_video_{duration_minutes}min_{timestamp}.mp4")
+
+    def check_loop_manifest(self, output_file, bgm_file, background_files, duration_minutes,
+                            visualizer, slideshow_options, title_params=None):
+        """耐久動画の差分ビルド用マニフェストを確認（check_manifest を参照）"""
+        return self.check_manifest(
+            output_file, "loop", [bgm_file] + list(background_files),
+            self.loop_manifest_params(background_files, duration_minutes, visualizer, slideshow_options,
+                                      title_params))
+
+    def build_loop_audio(self, bgm_file, loop_count, temp_dir):
+        """BGMを loop_count 回連結した音声を作成し、(ファイル, 長さ) を返す"""
+        print("音声ファイルを連結中...")
+        # ループ用の音声ファイルを作成
+        loop_audio_file = os.path.join(temp_dir, "loop_audio.mp3")
+        
+        # 音声ファイルを連結
+        concat_file = os.path.join(temp_dir, "concat.txt")
+        with open(concat_file, 'w') as f:
+            for _ in range(loop_count):
+                f.write(f"file '{bgm_file}'\n")
+        
+        cmd_concat = [
+            self.ffmpeg_path,
+            '-f', 'concat',
+            '-safe', '0',
+            '-i', concat_file,
+            '-c', 'copy',
+            '-y',
+            loop_audio_file
+        ]
+        
+        self.run_ffmpeg(cmd_concat, "音声の連結に失敗しました", stage="audio")
+        
+        print("音声の連結が完了しました")
+        
+        # 最終的な音声の長さを取得
+        final_audio_duration = self.get_audio_duration(loop_audio_file)
+        print(f"最終的な音声の長さ: {final_audio_duration:.2f}秒")
+        return loop_audio_file, final_audio_duration
+
+    def encode_loop_video(self, bgm_file, audio_duration, loop_audio_file, final_audio_duration,
+                          background_files, temp_dir, output_file, visualizer, slideshow_options,
+                          manifest, audio_filter, keyframe_interval=None, exact_duration=False,
+                          title_overlay=None, output_duration=None):
+        """ループ音声に背景（とビジュアライザー・タイトル）を付けて耐久動画をエンコード
+
+        keyframe_interval: 指定した秒数ごとにキーフレームを置く（長さ違いの切り出し用）
+        exact_duration: 映像を音声の長さで正確に切る（-shortest だけでは映像が少し長くなる）
+        title_overlay: prepare_title_card で用意したタイトル（None で表示しない）
+        output_duration: 最終的な動画の長さ（ループ単位で作成する場合。画質の自動調整に使う）
+        戻り値: 画質の自動調整で決めたエンコード引数（続けてエンコードする部分を同じ画質にする）
+        """
+        # 背景（1枚をループ、またはスライドショー）
+        background_args, prebuilt = self.prepare_background(
+            background_files, final_audio_duration, temp_dir, slideshow_options, manifest, title_overlay)
+
+        # ビジュアライザーは1ループ分だけ作成し、-stream_loop で繰り返す
+        visualizer_clip = self.prepare_visualizer(bgm_file, visualizer, audio_duration)
+
+        print("FFmpegで動画を作成中...")
+
+        # FFmpegコマンドを構築
+        cmd = [self.ffmpeg_path] + background_args + [
+            '-i', loop_audio_file,  # ループBGM
+        ]
+        if visualizer_clip:
+            cmd += ['-stream_loop', '-1', '-i', visualizer_clip]  # ビジュアライザー（1ループ分）
+        # タイトル画像
+        title_input = self.add_title_input(cmd, title_overlay, 3 if visualizer_clip else 2)
+        # ビデオコーデック・1920x1080にリサイズ
+        video_args = self.build_video_output_args(prebuilt, visualizer_clip, keyframe_interval,
+                                                  title_overlay, title_input)
+        quality_args = self.build_quality_args(cmd, video_args, output_duration or final_audio_duration)
+        cmd += video_args + quality_args
+        cmd += [
+            '-c:a', 'aac',  # オーディオコーデック
+            '-shortest',  # 短い方に合わせる
+
+            '-af', audio_filter,
+        ]
+        if exact_duration:
+            cmd += ['-t', str(final_audio_duration)]
+        cmd += [
+            '-y',  # 上書き
+            output_file
+        ]
+        
+        self.run_ffmpeg(cmd, "動画作成に失敗しました", stage="encode", duration=final_audio_duration)
+        return quality_args
+
+    def create_loop_variants(self, bgm_file, background_files, output_dir, durations_minutes, title="",
+                             visualizer=None, slideshow_options=None, title_card=None):
+        """長さ違いの耐久動画をまとめて作成し、出力ファイルのリストを返す
+
+        最も長い動画の本体（フェードアウトなし）を1回だけエンコードし、
+        各長さの動画の映像はその先頭をキーフレーム位置でストリームコピーで切り出して、
+        末尾（数秒）だけをエンコードして連結する。音声は動画ごとに通しでエンコードする。
+        """
+        durations_minutes = sorted(set(durations_minutes))
+        print(f"耐久動画をまとめて作成中... ({', '.join(f'{m}分' for m in durations_minutes)})")
+
+        temp_dir = self.create_temp_directory()
+
+        try:
+            audio_duration = self.get_audio_duration(bgm_file)
+            if audio_duration == 0:
+                raise ValueError("音声ファイルの長さを取得できませんでした")
+            print(f"音声の長さ: {audio_duration:.2f}秒")
+
+            variants = []
+            for duration_minutes in durations_minutes:
+                output_file = self.build_loop_output_path(output_dir, duration_minutes, title)
+                manifest, up_to_date = self.check_loop_manifest(
+                    output_file, bgm_file, background_files, duration_minutes, visualizer,
+                    slideshow_options, self.title_card_params(title, title_card))
+                variants.append((duration_minutes, output_file, manifest, up_to_date))
+
+            pending = [variant for variant in variants if not variant[3]]
+            if pending:
+                # 本体は作成が必要な最長の動画に合わせる。背景の選択は全体の最長の動画で決める
+                loop_count = self.get_loop_count(pending[-1][0], audio_duration)
+                print(f"ループ回数: {loop_count}回")
+                loop_audio_file, body_duration = self.build_loop_audio(bgm_file, loop_count, temp_dir)
+
+                body_file = os.path.join(temp_dir, "loop_body.mp4")
+                quality_args = self.encode_loop_video(
+                    bgm_file, audio_duration, loop_audio_file, body_duration, background_files,
+                    temp_dir, body_file, visualizer, slideshow_options, variants[-1][2],
+                    'afade=t=in:st=0:d=3', keyframe_interval=self.LOOP_KEYFRAME_SECONDS,
+                    title_overlay=self.prepare_title_card(title, title_card))
+                background = variants[-1][2].get('background') if variants[-1][2] else None
+
+                # 各動画のフェードアウト開始前の最後のキーフレームで本体を分割しておく
+                keyframes = self.find_keyframes(body_file, body_duration)
+                cuts = []
+                for duration_minutes, output_file, manifest, _ in pending:
+                    duration = min(self.get_loop_count(duration_minutes, audio_duration) * audio_duration,
+                                   body_duration)
+                    cut = max([t for t in keyframes if 0 < t <= duration - 3], default=0)
+                    cuts.append((duration, cut))
+                segments = self.split_at_keyframes(
+                    body_file, sorted(set(cut for _, cut in cuts if cut > 0)), temp_dir)
+
+                for (duration_minutes, output_file, manifest, _), (duration, cut) in zip(pending, cuts):
+                    print(f"切り出し中: 先頭{cut:.1f}秒をコピー、末尾{duration - cut:.1f}秒をエンコード")
+                    head_files = [segment for start, segment in segments if start < cut]
+                    self.build_loop_variant(body_file, head_files, cut, duration, output_file, temp_dir,
+                                            loop_audio_file, quality_args=quality_args)
+                    if manifest is not None and background:
+                        manifest['background'] = background
+                    self.finish_output(output_file, manifest)
+                    print(f"耐久動画を作成しました: {output_file} ({duration_minutes}分)")
+
+            return [output_file for _, output_file, _, _ in variants]
+
+        finally:
+            self.cleanup_temp_directory()
+
+    def find_keyframes(self, video_file, duration):
+        """動画のキーフレームの時刻（秒）のリストを返す（キーフレームだけをデコードする）"""
+        keyframes = []
+
+        def on_line(line):
+            match = re.search(r'pts_time:\s*(-?\d+(?:\.\d+)?)', line)
+            if match and 'Parsed_showinfo' in line:
+                keyframes.append(float(match.group(1)))
+
+        self.runner.run(
+            [self.ffmpeg_path, '-hide_banner', '-skip_frame', 'nokey', '-i', video_file,
+             '-map', '0:v', '-vf', 'showinfo', '-f', 'null', '-'],
+            "キーフレームの取得に失敗しました", stage="concat", duration=duration,
+            progress=self.report_progress, on_line=on_line)
+        return sorted(keyframes)
+
+    def split_at_keyframes(self, video_file, cut_points, temp_dir):
+        """動画を指定したキーフレーム位置でストリームコピーのまま分割し、[(開始秒, ファイル)] を返す"""
+        if not cut_points:
+            return [(0, video_file)]
+        # 分割はキーフレームの到着時に行われるため、少し手前の時刻を指定すればそのキーフレームで分かれる
+        half_frame = 0.5 / self.VIDEO_FPS
+        pattern = os.path.join(temp_dir, "loop_segment_%03d.mp4")
+        self.run_ffmpeg([
+            self.ffmpeg_path,
+            '-i', video_file,
+            '-map', '0',
+            '-c', 'copy',
+            '-f', 'segment',
+            '-segment_times', ','.join(f'{cut - half_frame:.3f}' for cut in cut_points),
+            '-reset_timestamps', '1',
+            '-y',
+            pattern
+        ], "動画の分割に失敗しました", stage="concat", duration=cut_points[-1])
+        starts = [0] + list(cut_points)
+        return [(start, pattern % index) for index, start in enumerate(starts)]
+
+    def build_loop_variant(self, body_file, head_files, cut, duration, output_file, temp_dir, audio_file,
+                           fade_sec=3, quality_args=None):
+        """本体の先頭部分（分割済みファイル）の映像に、cut 秒から duration 秒までをエンコードした末尾の映像を
+        つなげ、音声は audio_file（ループ音声）から全体をフェードイン・アウト付きでエンコードして output_file に保存
+
+        AACはエンコーダーの遅延（プライミング）があるため、コピーした音声に別にエンコードした音声を連結すると
+        つなぎ目に途切れやノイズが入る。そのため映像だけを連結し、音声は1本の動画と同じく通しでエンコードする。
+        SPS/PPSが一致しない場合やつなぎ目を正しくデコードできない場合は、映像全体をエンコードする。
+        quality_args: 本体のエンコードで使った画質の引数（末尾も同じ画質にする）
+        """
+        video_encode_args = ['-c:v', 'libx264', '-pix_fmt', 'yuv420p'] + (quality_args or [])
+        if head_files:
+            tail_duration = duration - cut
+            tail_file = os.path.join(temp_dir, "variant_tail.mp4")
+            self.run_ffmpeg([
+                self.ffmpeg_path,
+                '-ss', str(cut),
+                '-i', body_file,
+                '-t', str(tail_duration),
+                '-map', '0:v',
+            ] + video_encode_args + [  # 本体と同じ設定（連結時にそのままつなげる）
+                '-an',
+                '-y',
+                tail_file
+            ], "末尾のエンコードに失敗しました", stage="encode", duration=tail_duration)
+            if self.read_parameter_sets(head_files[0], temp_dir) != self.read_parameter_sets(tail_file, temp_dir):
+                # SPS/PPSが異なるとストリームコピーで連結した末尾を正しくデコードできない
+                print("警告: 末尾のエンコード設定が本体と一致しないため、映像全体をエンコードします")
+                head_files = []
+
+        if head_files:
+            list_file = os.path.join(temp_dir, "variant.txt")
+            with open(list_file, 'w', encoding='utf-8') as f:
+                for part in head_files + [tail_file]:
+                    f.write(f"file '{part}'\n")
+            video_input = ['-f', 'concat', '-safe', '0', '-i', list_file]
+            video_args = ['-c:v', 'copy']
+        else:
+            video_input = ['-t', str(duration), '-i', body_file]
+            video_args = video_encode_args
+
+        self.run_ffmpeg([self.ffmpeg_path] + video_input + [
+            '-i', audio_file,
+            '-map', '0:v',
+            '-map', '1:a',
+        ] + video_args + [
+            '-c:a', 'aac',
+            '-af', self.build_audio_fade_filter(duration, fade_sec),
+            '-t', str(duration),
+            '-y',
+            output_file
+        ], "動画の連結に失敗しました", stage="concat" if head_files else "encode", duration=duration)
+
+        if head_files:
+            try:
+                self.verify_splice(output_file, cut)
+            except FFmpegError as e:
+                print(f"警告: {e}。映像全体をエンコードし直します")
+                self.build_loop_variant(body_file, [], cut, duration, output_file, temp_dir, audio_file,
+                                        fade_sec, quality_args)
+
+    def read_parameter_sets(self, video_file, temp_dir):
+        """H.264のSPS・PPS（NALユニットのバイト列のタプル）を返す（ストリームコピーで連結できるかの確認用）"""
+        header_file = os.path.join(temp_dir, "parameter_sets.h264")
+        self.runner.run([
+            self.ffmpeg_path,
+            '-i', video_file,
+            '-map', '0:v',
+            '-c:v', 'copy',
+            '-bsf:v', 'h264_mp4toannexb',
+            '-frames:v', '1',
+            '-f', 'h264',
+            '-y',
+            header_file
+        ], "SPS/PPSの取得に失敗しました", stage="probe")
+        with open(header_file, 'rb') as f:
+            data = f.read()
+        os.remove(header_file)
+        # Annex B のスタートコードで区切り、SPS（7）とPPS（8）だけを取り出す
+        units = [unit.rstrip(b'\x00') for unit in data.split(b'\x00\x00\x01')]
+        return tuple(unit for unit in units if unit and (unit[0] & 0x1f) in (7, 8))
+
+    def verify_splice(self, output_file, cut, margin=1.0):
+        """ストリームコピーで連結したつなぎ目の前後をデコードし、エラーがあれば FFmpegError を送出する"""
+        errors = []
+        start = max(0.0, cut - margin)
+        self.runner.run([
+            self.ffmpeg_path,
+            '-v', 'error',
+            '-xerror',
+            '-ss', str(start),
+            '-i', output_file,
+            '-t', str(margin * 2),
+            '-f', 'null',
+            '-'
+        ], "連結した動画のつなぎ目を確認できませんでした", stage="probe", on_line=errors.append)
+        if errors:
+            raise FFmpegError(f"連結した動画のつなぎ目を正しくデコードできません: {errors[-1]}",
+                              "concat", None, errors)
+
+    def create_long_loop_video(self, bgm_file, background_files, output_dir, duration_minutes, title="",
+                               visualizer=None, slideshow_options=None, part_minutes=None, part_size_mb=None,
+                               title_card=None):
+        """長時間（8〜12時間など）の耐久動画を一定のリソースで作成し、出力ファイルのリストを返す
+
+        エンコードするのは1ループ分の動画だけで、冒頭（フェードイン）・末尾（フェードアウト）は
+        その映像に音声だけを付け直して作る。全体はそれらを再エンコードせずに連結するため、
+        処理時間・メモリ・一時ファイルの容量は動画全体の長さではなく1ループ分で決まる。
+        part_minutes / part_size_mb: 指定すると、その時間・サイズを超えないよう曲の切れ目で分割する
+        title_card: タイトルを画面に表示する設定。冒頭のみ表示する場合は最初のループだけ別にエンコードする
+        """
+        print(f"耐久動画を長時間モードで作成中... ({duration_minutes}分)")
+
+        temp_dir = self.create_temp_directory()
+
+        try:
+            audio_duration = self.get_audio_duration(bgm_file)
+            if audio_duration == 0:
+                raise ValueError("音声ファイルの長さを取得できませんでした")
+            print(f"音声の長さ: {audio_duration:.2f}秒")
+
+            loop_count = self.get_loop_count(duration_minutes, audio_duration)
+            print(f"ループ回数: {loop_count}回")
+
+            split = bool(part_minutes or part_size_mb)
+            output_file = self.build_loop_output_path(output_dir, duration_minutes, title)
+            base, ext = os.path.splitext(output_file)
+            first_output = f"{base}_part1{ext}" if split else output_file
+
+            manifest, up_to_date = self.check_manifest(
+                first_output, "loop", [bgm_file] + list(background_files),
+                {'size': self.VIDEO_SIZE, 'fps': self.VIDEO_FPS, 'duration_minutes': duration_minutes,
+                 'visualizer': visualizer,
+                 'slideshow': self.slideshow_params(background_files, slideshow_options),
+                 'title_card': self.title_card_params(title, title_card),
+                 'long_form': True, 'part_minutes': part_minutes, 'part_size_mb': part_size_mb})
+            if up_to_date:
+                parts = [os.path.join(output_dir, name)
+                         for name in output_manifest.read_manifest(first_output).get('parts', [])]
+                if parts and all(output_manifest.is_up_to_date(part, manifest) for part in parts):
+                    return parts
+
+            # 1枚の背景はここで1回だけ選び、すべてのループで同じものを使う
+            if not self.slideshow_params(background_files, slideshow_options):
+                background_files = [self.choose_background(background_files, manifest)]
+
+            # 画質の自動調整は1ループ分ではなく動画全体の長さで目標を判断する
+            total_duration = loop_count * audio_duration
+            title_overlay = self.prepare_title_card(title, title_card)
+            intro_title = title_overlay if title_overlay and title_overlay['layout'] == 'intro' else None
+
+            # 途中のループ（フェードなし）をエンコードし、冒頭・末尾は音声だけ付け直す
+            middle_unit = os.path.join(temp_dir, "unit_middle.mp4")
+            self.encode_loop_video(
+                bgm_file, audio_duration, bgm_file, audio_duration, background_files, temp_dir,
+                middle_unit, visualizer, slideshow_options, manifest, 'anull', exact_duration=True,
+                output_duration=total_duration, title_overlay=None if intro_title else title_overlay)
+            if loop_count == 1:
+                single_unit = os.path.join(temp_dir, "unit_single.mp4")
+                if intro_title:
+                    self.encode_loop_video(
+                        bgm_file, audio_duration, bgm_file, audio_duration, background_files, temp_dir,
+                        single_unit, visualizer, slideshow_options, manifest,
+                        self.build_audio_fade_filter(audio_duration, 3), exact_duration=True,
+                        output_duration=total_duration, title_overlay=intro_title)
+                    units = [single_unit]
+                else:
+                    units = [self.remux_loop_unit(
+                        middle_unit, bgm_file, self.build_audio_fade_filter(audio_duration, 3), single_unit)]
+            else:
+                intro_unit = os.path.join(temp_dir, "unit_intro.mp4")
+                if intro_title:
+                    # 冒頭のタイトルは最初のループにだけ入れる（途中のループはタイトルなしのまま使い回す）
+                    self.encode_loop_video(
+                        bgm_file, audio_duration, bgm_file, audio_duration, background_files, temp_dir,
+                        intro_unit, visualizer, slideshow_options, manifest, 'afade=t=in:st=0:d=3',
+                        exact_duration=True, output_duration=total_duration, title_overlay=intro_title)
+                else:
+                    self.remux_loop_unit(middle_unit, bgm_file, 'afade=t=in:st=0:d=3', intro_unit)
+                outro_unit = self.remux_loop_unit(
+                    middle_unit, bgm_file, f'afade=t=out:st={audio_duration - 3}:d=3',
+                    os.path.join(temp_dir, "unit_outro.mp4"))
+                units = [intro_unit] + [middle_unit] * (loop_count - 2) + [outro_unit]
+
+            if split:
+                parts = self.split_units(units, self.get_units_per_part(
+                    units, audio_duration, part_minutes, part_size_mb))
+            else:
+                parts = [units]
+            part_count = len(parts)
+            outputs = [f"{base}_part{index + 1}{ext}" for index in range(part_count)] if split else [output_file]
+            if manifest is not None:
+                manifest['parts'] = [os.path.basename(path) for path in outputs]
+
+            for index, (part_file, part_units) in enumerate(zip(outputs, parts)):
+                if split:
+                    print(f"パート{index + 1}/{part_count}を作成中... ({len(part_units)}ループ)")
+                self.concat_loop_units(part_units, part_file, len(part_units) * audio_duration,
+                                       os.path.join(temp_dir, "units.txt"))
+            for part_file in outputs:
+                self.finish_output(part_file, manifest)
+
+            print(f"耐久動画を作成しました: {', '.join(outputs)}")
+            return outputs
+
+        finally:
+            self.cleanup_temp_directory()
+
+    def remux_loop_unit(self, video_unit, bgm_file, audio_filter, output_file):
+        """ループ1回分の映像はそのままに、フェードを付けた音声を元のBGMから作り直す"""
+        self.run_ffmpeg([
+            self.ffmpeg_path,
+            '-i', video_unit,
+            '-i', bgm_file,
+            '-map', '0:v',
+            '-map', '1:a',
+            '-c:v', 'copy',
+            '-c:a', 'aac',
+            '-af', audio_filter,
+            '-shortest',
+            '-y',
+            output_file
+        ], "ループ用の動画作成に失敗しました", stage="audio")
+        return output_file
+
+    def get_units_per_part(self, units, audio_duration, part_minutes, part_size_mb):
+        """1ファイルに入れるループ数（時間・サイズの上限を超えない最大数、最低1）"""
+        limits = []
+        if part_minutes:
+            limits.append(int(part_minutes * 60 / audio_duration))
+        if part_size_mb:
+            # コンテナのヘッダー分として少し余裕を持たせる
+            unit_size = max(os.path.getsize(unit) for unit in set(units))
+            limits.append(int(part_size_mb * 1024 * 1024 * 0.98 / unit_size))
+        units_per_part = min(limits)
+        if units_per_part < 1:
+            print("警告: 1ループ分が分割の上限を超えるため、1ループずつに分割します")
+            return 1
+        return units_per_part
+
+    def split_units(self, units, units_per_part):
+        """ループ単位を units_per_part ずつのパートに分ける（最後のパートは残りのループ）"""
+        return [units[index:index + units_per_part] for index in range(0, len(units), units_per_part)]
+
+    def concat_loop_units(self, units, output_file, duration, list_file):
+        """ループ単位の動画を再エンコードせずに連結"""
+        with open(list_file, 'w', encoding='utf-8') as f:
+            for unit in units:
+                f.write(f"file '{unit}'\n")
+        self.run_ffmpeg([
+            self.ffmpeg_path,
+            '-f', 'concat',
+            '-safe', '0',
+            '-i', list_file,
+            '-c', 'copy',
+            '-y',
+            output_file
+        ], "動画の連結に失敗しました", stage="concat", duration=duration)
+
+    def create_melody_video(self, melody_files, background_files, output_dir, title="",
+                            slideshow_options=None, title_card=None):
+        """メドレー動画を作成
+
+        slideshow_options: 背景を順番に切り替える設定（True または dict）
+        title_card: タイトルを画面に表示する設定（True または dict。tracks に曲目リストを指定できる）
+        """
         print("メドレー動画を作成中...")
         print(f"連結する動画数: {len(melody_files)}個")
         
@@ -291,14 +1115,22 @@ class VideoGenerator:
             # 出力ファイル名を生成
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             safe_title = self.sanitize_filename(title)
-            if safe_title:
-                filename = f"{safe_title}_melody.mp4"
-                filename = self.get_unique_filename(output_dir, filename)
-                output_file = os.path.join(output_dir, filename)
-            else:
-                output_file = os.path.join(output_dir, f"melody_video_{timestamp}.mp4")
+            output_file = self.build_output_path(
+                output_dir, f"{safe_title}_melody.mp4" if safe_title else None,
+                f"melody_video_{timestamp}.mp4")
             
             print(f"出力ファイル: {output_file}")
+
+            # 入力・設定が前回と同じなら作り直さない
+            manifest, up_to_date = self.check_manifest(
+                output_file, "melody", list(melody_files) + list(background_files),
+                {'size': self.VIDEO_SIZE, 'melody_count': len(melody_files),
+                 'slideshow': self.slideshow_params(background_files, slideshow_options),
+                 'title_card': self.title_card_params(title, title_card)})
+            if up_to_date:
+                return output_file
+
+            title_overlay = self.prepare_title_card(title, title_card)
             
             print("動画ファイルを連結中...")
             
@@ -307,36 +1139,9 @@ class VideoGenerator:
             with open(concat_file, 'w') as f:
                 for video_file in melody_files:
                     f.write(f"file '{video_file}'\n")
-            
-            # 背景画像をランダムに選択
-            background_file = random.choice(background_files)
-            print(f"使用する背景: {os.path.basename(background_file)}")
-            
-            print("背景動画を作成中...")
-            # 一時的な動画ファイルを作成（背景画像のみ）
-            temp_video = os.path.join(temp_dir, "temp_background.mp4")
-            
-            # 背景画像から動画を作成（十分な長さ）
-            cmd_bg = [
-                self.ffmpeg_path,
-                '-loop', '1',
-                '-i', background_file,
-                '-t', '3600',  # 1時間
-                '-c:v', 'libx264',
-                '-pix_fmt', 'yuv420p',
-                '-vf', 'scale=1920:1080:force_original_aspect_ratio=decrease,pad=1920:1080:(ow-iw)/2:(oh-ih)/2',
-                '-y',
-                temp_video
-            ]
-            
-            result = subprocess.run(cmd_bg, capture_output=True, text=True)
-            if result.returncode != 0:
-                raise RuntimeError(f"背景動画の作成に失敗しました: {result.stderr}")
-            
-            print("背景動画の作成が完了しました")
-            
+
             print("メドレー動画を連結中...")
-            # メドレー動画を連結
+            # メドレー動画を連結（背景より先に作成し、画質の自動調整では全体の長さを使う）
             temp_concat = os.path.join(temp_dir, "temp_concat.mp4")
             
             cmd_concat = [
@@ -349,21 +1154,63 @@ class VideoGenerator:
                 temp_concat
             ]
             
-            result = subprocess.run(cmd_concat, capture_output=True, text=True)
-            if result.returncode != 0:
-                raise RuntimeError(f"動画の連結に失敗しました: {result.stderr}")
+            self.run_ffmpeg(cmd_concat, "動画の連結に失敗しました", stage="concat")
             
             print("メドレー動画の連結が完了しました")
+            melody_duration = self.get_audio_duration(temp_concat) if self.quality_target else None
+            
+            if slideshow_options and len(background_files) > 1:
+                # スライドショーは作成済みクリップの連結リストをそのまま使う（十分な長さ）
+                background_args, _ = self.prepare_background(
+                    background_files, 3600, temp_dir, slideshow_options)
+                background_encoded = False
+            else:
+                # 背景画像をランダムに選択
+                background_file = self.choose_background(background_files, manifest)
+                background_file = self.bake_title(background_file, title_overlay)
+                background_file = self.normalize_background(background_file, self.VIDEO_SIZE)
+
+                print("背景動画を作成中...")
+                # 一時的な動画ファイルを作成（背景画像のみ）
+                temp_video = os.path.join(temp_dir, "temp_background.mp4")
+
+                # 背景画像から動画を作成（十分な長さ）。タイトルもここで重ね、最終動画は映像をコピーする
+                cmd_bg = [self.ffmpeg_path] + background_cache.build_input_args(background_file, 3600)
+                title_input = self.add_title_input(cmd_bg, title_overlay, 1)
+                video_args = [
+                    '-c:v', 'libx264',
+                    '-pix_fmt', 'yuv420p',
+                ] + self.build_background_filter_args(
+                    *self.VIDEO_SIZE, title_overlay=title_overlay, title_input=title_input,
+                    audio_map=None)
+                cmd_bg += video_args + self.build_quality_args(cmd_bg, video_args, melody_duration) + [
+                    '-t', '3600',  # 1時間
+                    '-y',
+                    temp_video
+                ]
+
+                self.run_ffmpeg(cmd_bg, "背景動画の作成に失敗しました", stage="encode", duration=3600)
+
+                print("背景動画の作成が完了しました")
+                background_args = ['-i', temp_video]
+                background_encoded = True
+                title_overlay = None
             
             print("最終的な動画を作成中...")
             # 最終的な動画を作成（背景画像 + メドレー音声）
-            cmd_final = [
-                self.ffmpeg_path,
-                '-i', temp_video,
+            cmd_final = [self.ffmpeg_path] + background_args + [
                 '-i', temp_concat,
-                '-map', '0:v',  # 背景動画の映像
-                '-map', '1:a',  # メドレーの音声
-                '-c:v', 'copy',
+            ]
+            if background_encoded:
+                # 背景動画の映像 + メドレーの音声
+                cmd_final += ['-map', '0:v', '-map', '1:a', '-c:v', 'copy']
+            else:
+                # スライドショーはタイトル・画質の自動調整がある場合のみ映像を再エンコードする
+                title_input = self.add_title_input(cmd_final, title_overlay, 2)
+                video_args = self.build_video_output_args(True, title_overlay=title_overlay,
+                                                          title_input=title_input)
+                cmd_final += video_args + self.build_quality_args(cmd_final, video_args, melody_duration)
+            cmd_final += [
                 '-c:a', 'aac',
                 '-shortest',
                 '-af', 'afade=t=in:st=0:d=3,afade=t=out:st=-3:d=3',
@@ -371,9 +1218,8 @@ class VideoGenerator:
                 output_file
             ]
             
-            result = subprocess.run(cmd_final, capture_output=True, text=True)
-            if result.returncode != 0:
-                raise RuntimeError(f"最終動画の作成に失敗しました: {result.stderr}")
+            self.run_ffmpeg(cmd_final, "最終動画の作成に失敗しました", stage="encode")
+            self.finish_output(output_file, manifest)
             
             print(f"メドレー動画を作成しました: {output_file}")
             return output_file
@@ -381,8 +1227,31 @@ class VideoGenerator:
         finally:
             self.cleanup_temp_directory()
     
-    def create_short_version(self, bgm_file, background_files, output_dir, duration_seconds, title=""):
-        """SNS用ショートバージョン動画を作成"""
+    def find_highlight_start(self, bgm_file, duration_seconds, audio_duration):
+        """ショート用に最も盛り上がる区間の開始位置（秒）を返す
+
+        解析結果は曲ごとにキャッシュされる。解析できない場合は0秒を返す。
+        """
+        if audio_duration <= duration_seconds:
+            return 0.0
+        try:
+            with self.profile_section("盛り上がり部分の検出"):
+                analysis = audio_analysis.load_analysis(self.ffmpeg_path, bgm_file, self.runner)
+                start = audio_analysis.find_highlight_start(analysis, duration_seconds)
+        except Exception as e:
+            print(f"ハイライト検出に失敗したため先頭から切り出します: {e}")
+            return 0.0
+        # 切り出し範囲が曲の終わりを超えないようにする
+        return max(0.0, min(start, audio_duration - duration_seconds))
+
+    def create_short_version(self, bgm_file, background_files, output_dir, duration_seconds, title="",
+                             start_seconds=None, auto_highlight=True, fill="pad"):
+        """SNS用ショートバージョン動画を作成
+
+        start_seconds: 切り出し開始位置（秒）。省略時は auto_highlight に従い
+        盛り上がり部分を自動検出する（False の場合は先頭から）。
+        fill: 縦型に収めた背景の余白の埋め方（"pad": 黒帯 / "blur": 背景のぼかし）
+        """
         print(f"SNS用ショートバージョン動画を作成中... ({duration_seconds}秒)")
         
         # 一時ディレクトリを作成
@@ -401,76 +1270,432 @@ class VideoGenerator:
             # 出力ファイル名を生成
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             safe_title = self.sanitize_filename(title)
-            if safe_title:
-                filename = f"{safe_title}_short_{duration_seconds}s.mp4"
-                filename = self.get_unique_filename(output_dir, filename)
-                output_file = os.path.join(output_dir, filename)
-            else:
-                output_file = os.path.join(output_dir, f"short_video_{duration_seconds}s_{timestamp}.mp4")
+            output_file = self.build_output_path(
+                output_dir, f"{safe_title}_short_{duration_seconds}s.mp4" if safe_title else None,
+                f"short_video_{duration_seconds}s_{timestamp}.mp4")
             
             print(f"出力ファイル: {output_file}")
+
+            # 入力・設定が前回と同じなら作り直さない
+            manifest, up_to_date = self.check_manifest(
+                output_file, "short", [bgm_file] + list(background_files),
+                self.short_manifest_params(duration_seconds, start_seconds, auto_highlight, fill))
+            if up_to_date:
+                return output_file
             
             # 背景画像をランダムに選択
-            background_file = random.choice(background_files)
-            print(f"使用する背景: {os.path.basename(background_file)}")
+            background_file = self.choose_background(background_files, manifest)
+            background_file, video_filter = self.prepare_short_background(background_file, fill)
+
+            # 切り出し開始位置を決定
+            if start_seconds is None:
+                if auto_highlight:
+                    print("盛り上がり部分を検出中...")
+                    start_seconds = self.find_highlight_start(bgm_file, duration_seconds, audio_duration)
+                else:
+                    start_seconds = 0
+            print(f"切り出し開始位置: {start_seconds:.1f}秒")
+
+            if self.can_render_in_process(background_file):
+                # デコード済みのBGMから切り出すため、音声のトリムは不要
+                self.render_in_process(background_file, bgm_file, output_file, fade_sec=1,
+                                       start=start_seconds, duration=duration_seconds)
+            else:
+                print("音声をトリム中...")
             
-            print("音声をトリム中...")
+                # 音声を指定時間にトリム
+                # ADTS(.aac)は長さが推定値になるため、コンテナに入れて正確な長さを取得する
+                trimmed_audio_file = os.path.join(temp_dir, "trimmed_audio.m4a")
+                fade_sec = 1
+                afade_filter = self.build_audio_fade_filter(duration_seconds, fade_sec)
+                cmd_trim = [
+                    self.ffmpeg_path,
+                    '-ss', str(start_seconds),
+                    '-i', bgm_file,
+                    '-map', 'a:0',
+                    '-vn',
+                    '-t', str(duration_seconds),
+                    '-af', afade_filter,
+                    '-acodec', 'aac',
+                    '-y',
+                    trimmed_audio_file
+                ]
             
-            # 音声を指定時間にトリム
-            trimmed_audio_file = os.path.join(temp_dir, "trimmed_audio.aac")
-            fade_sec = 1
-            afade_filter = f"afade=t=in:st=0:d={fade_sec},afade=t=out:st={duration_seconds-fade_sec}:d={fade_sec}"
-            cmd_trim = [
-                self.ffmpeg_path,
-                '-i', bgm_file,
-                '-map', 'a:0',
-                '-vn',
-                '-t', str(duration_seconds),
-                '-af', afade_filter,
-                '-acodec', 'aac',
-                '-y',
-                trimmed_audio_file
-            ]
+                self.run_ffmpeg(cmd_trim, "音声のトリムに失敗しました", stage="audio", duration=duration_seconds)
             
-            result = subprocess.run(cmd_trim, capture_output=True, text=True)
-            if result.returncode != 0:
-                raise RuntimeError(f"音声のトリムに失敗しました: {result.stderr}")
+                print("音声のトリムが完了しました")
             
-            print("音声のトリムが完了しました")
+                # 最終的な音声の長さを取得
+                final_audio_duration = self.get_audio_duration(trimmed_audio_file)
+                print(f"トリム後の音声の長さ: {final_audio_duration:.2f}秒")
             
-            # 最終的な音声の長さを取得
-            final_audio_duration = self.get_audio_duration(trimmed_audio_file)
-            print(f"トリム後の音声の長さ: {final_audio_duration:.2f}秒")
+                print("FFmpegで縦型動画を作成中...")
             
-            print("FFmpegで縦型動画を作成中...")
+                # FFmpegコマンドを構築（縦型動画用）
+                cmd = [self.ffmpeg_path] + background_cache.build_input_args(
+                    background_file, final_audio_duration) + [  # 背景画像をループ
+                    '-i', trimmed_audio_file,  # トリムされたBGM
+                ]
+                video_args = [
+                    '-c:v', 'libx264',  # ビデオコーデック
+                    '-pix_fmt', 'yuv420p',  # ピクセルフォーマット
+                    '-vf', video_filter,  # 1080x1920にリサイズ（縦型）
+                ]
+                cmd += video_args + self.build_quality_args(cmd, video_args, final_audio_duration) + [
+                    '-c:a', 'aac',  # オーディオコーデック
+                    '-shortest',  # 短い方に合わせる
+                    '-af', self.build_audio_fade_filter(final_audio_duration, 1),  # フェードイン・アウト（短縮版）
+                    '-y',  # 上書き
+                    output_file
+                ]
             
-            # FFmpegコマンドを構築（縦型動画用）
-            cmd = [
-                self.ffmpeg_path,
-                '-loop', '1',  # 画像をループ
-                '-i', background_file,  # 背景画像
-                '-i', trimmed_audio_file,  # トリムされたBGM
-                '-c:v', 'libx264',  # ビデオコーデック
-                '-c:a', 'aac',  # オーディオコーデック
-                '-shortest',  # 短い方に合わせる
-                '-pix_fmt', 'yuv420p',  # ピクセルフォーマット
-                '-vf', 'scale=1080:1920:force_original_aspect_ratio=decrease,pad=1080:1920:(ow-iw)/2:(oh-ih)/2',  # 1080x1920にリサイズ（縦型）
-                '-af', 'afade=t=in:st=0:d=1,afade=t=out:st=' + str(final_audio_duration - 1) + ':d=1',  # フェードイン・アウト（短縮版）
-                '-y',  # 上書き
-                output_file
-            ]
-            
-            # 動画を作成
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode != 0:
-                raise RuntimeError(f"ショートバージョン動画作成に失敗しました: {result.stderr}")
+                # 動画を作成
+                self.run_ffmpeg(cmd, "ショートバージョン動画作成に失敗しました", stage="encode", duration=final_audio_duration)
+            self.finish_output(output_file, manifest)
             
             print(f"SNS用ショートバージョン動画を作成しました: {output_file}")
             return output_file
-            
+
         finally:
             self.cleanup_temp_directory()
-    
+
+    def create_short_clips(self, bgm_file, background_files, output_dir, windows, title="",
+                           auto_highlight=True, fill="pad"):
+        """1曲から開始位置・長さの違うショート動画をまとめて作成し、出力ファイルのリストを返す
+
+        windows: [(開始位置（秒、None の場合は create_short_version と同じく auto_highlight に従う）, 長さ（秒）)]
+        BGMと背景は1つのFFmpegで1回だけデコードし、フィルターグラフを区間ごとに分岐して
+        （音声は atrim でサンプル単位で正確に切り出す）すべてのショートを同時に書き出す。
+        各ショートは create_short_version で作成したものと同じ内容になる。
+        """
+        print(f"SNS用ショートバージョン動画をまとめて作成中... ({', '.join(f'{d}秒' for _, d in windows)})")
+
+        # 画質の自動調整のサンプルは一時ディレクトリに作成する
+        self.create_temp_directory()
+
+        try:
+            audio_duration = self.get_audio_duration(bgm_file)
+            if audio_duration == 0:
+                raise ValueError("音声ファイルの長さを取得できませんでした")
+            print(f"元の音声の長さ: {audio_duration:.2f}秒")
+
+            # 同じ長さのショートが複数ある場合はファイル名に番号を付ける
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            safe_title = self.sanitize_filename(title)
+            lengths = [duration_seconds for _, duration_seconds in windows]
+            clips = []
+            for index, (start_seconds, duration_seconds) in enumerate(windows):
+                suffix = f"_{index + 1}" if lengths.count(duration_seconds) > 1 else ""
+                output_file = self.build_output_path(
+                    output_dir, f"{safe_title}_short_{duration_seconds}s{suffix}.mp4" if safe_title else None,
+                    f"short_video_{duration_seconds}s{suffix}_{timestamp}.mp4")
+                manifest, up_to_date = self.check_manifest(
+                    output_file, "short", [bgm_file] + list(background_files),
+                    self.short_manifest_params(duration_seconds, start_seconds, auto_highlight, fill))
+                clips.append((start_seconds, duration_seconds, output_file, manifest, up_to_date))
+
+            pending = [clip for clip in clips if not clip[4]]
+            if pending:
+                # 背景はすべてのショートで共通。一部だけ作り直す場合も同じ画像になるよう、
+                # 作成済みかどうかに関係なく最初のショートのマニフェストで決める
+                background_file = self.choose_background(background_files, clips[0][3])
+                background = os.path.abspath(background_file)
+                background_file, video_filter = self.prepare_short_background(background_file, fill)
+
+                windows = []
+                for start_seconds, duration_seconds, output_file, manifest, _ in pending:
+                    if start_seconds is None:
+                        if auto_highlight:
+                            print("盛り上がり部分を検出中...")
+                            start_seconds = self.find_highlight_start(bgm_file, duration_seconds, audio_duration)
+                        else:
+                            start_seconds = 0
+                    start_seconds = min(float(start_seconds), max(0.0, audio_duration - 1))
+                    length = min(duration_seconds, audio_duration - start_seconds)
+                    print(f"{os.path.basename(output_file)}: {start_seconds:.1f}秒から{length:.1f}秒")
+                    windows.append((start_seconds, duration_seconds, length, output_file))
+
+                if (self.can_render_in_process(background_file)
+                        and (len(windows) == 1 or self.media.keeps_track(audio_duration))):
+                    # BGMは1回だけデコードしてメモリに保持し、エンコード済みの背景とともにショートごとに使い回す
+                    # （メモリに保持しない長い曲はショートごとにデコードし直すことになるため、FFmpegで作成する）
+                    for start_seconds, duration_seconds, _, output_file in windows:
+                        self.render_in_process(background_file, bgm_file, output_file, fade_sec=1,
+                                               start=start_seconds, duration=duration_seconds)
+                else:
+                    self.encode_short_clips(bgm_file, background_file, video_filter, windows)
+
+                for _, _, output_file, manifest, _ in pending:
+                    if manifest is not None:
+                        manifest['background'] = background
+                    self.finish_output(output_file, manifest)
+                    print(f"SNS用ショートバージョン動画を作成しました: {output_file}")
+
+            return [output_file for _, _, output_file, _, _ in clips]
+
+        finally:
+            self.cleanup_temp_directory()
+
+    def encode_short_clips(self, bgm_file, background_file, video_filter, windows):
+        """1つのFFmpegで背景・BGMを1回だけデコードし、区間ごとのショートを書き出す
+
+        windows: [(開始位置, 指定の長さ, 実際の長さ, 出力ファイル)]
+        """
+        longest = max(length for _, _, length, _ in windows)
+        last_end = max(start + length for start, _, length, _ in windows)
+        input_args = background_cache.build_input_args(background_file, longest) + [
+            '-t', str(last_end), '-i', bgm_file,  # 最後の区間の終わりまでだけデコードする
+        ]
+
+        count = len(windows)
+        graph = [
+            f"[0:v]{video_filter},split={count}" + ''.join(f"[v{i}]" for i in range(count)),
+            f"[1:a]asplit={count}" + ''.join(f"[a{i}]" for i in range(count)),
+        ]
+        output_args = []
+        quality_by_length = {}  # 画質の自動調整は長さごとに1回だけ行う
+        for i, (start, duration_seconds, length, output_file) in enumerate(windows):
+            # 音声のフェードは create_short_version と同じく、指定の長さと実際の長さで2回かける
+            graph.append(f"[v{i}]trim=duration={length},setpts=PTS-STARTPTS[vout{i}]")
+            graph.append(f"[a{i}]atrim=start={start}:duration={length},asetpts=PTS-STARTPTS,"
+                         f"{self.build_audio_fade_filter(duration_seconds, 1)},"
+                         f"{self.build_audio_fade_filter(length, 1)}[aout{i}]")
+            # 画質の自動調整は1本だけ作成する場合と同じ入力・フィルターのサンプルで行う
+            video_args = ['-c:v', 'libx264', '-pix_fmt', 'yuv420p']
+            if length not in quality_by_length:
+                quality_by_length[length] = self.build_quality_args(
+                    [self.ffmpeg_path] + background_cache.build_input_args(background_file, length)
+                    + ['-i', bgm_file], video_args + ['-vf', video_filter], length)
+            quality_args = quality_by_length[length]
+            output_args += ['-map', f'[vout{i}]', '-map', f'[aout{i}]'] + video_args + quality_args + [
+                '-c:a', 'aac', '-y', output_file]
+
+        print(f"FFmpegで縦型動画を{count}本同時に作成中...")
+        cmd = [self.ffmpeg_path] + input_args + ['-filter_complex', ';'.join(graph)] + output_args
+        self.run_ffmpeg(cmd, "ショートバージョン動画作成に失敗しました", stage="encode", duration=longest)
+
+    def merge_preview_segments(self, segments, total_duration):
+        """プレビュー区間を範囲内に収め、重なる区間を結合する"""
+        clamped = []
+        for start, end in sorted(segments):
+            start = max(0.0, start)
+            end = min(total_duration, end)
+            if end <= start:
+                continue
+            if clamped and start <= clamped[-1][1]:
+                clamped[-1] = (clamped[-1][0], max(clamped[-1][1], end))
+            else:
+                clamped.append((start, end))
+        return clamped
+
+    def preview_manifest(self, kind, bgm_file, background_files, params):
+        """プレビューする本番の動画と同じマニフェスト（差分ビルドでない場合は None）
+
+        本番は差分ビルド時にマニフェストの key から背景を選ぶため、プレビューでも同じ背景になるようにする。
+        """
+        if not self.incremental:
+            return None
+        return self.build_render_manifest(kind, [bgm_file] + list(background_files), params)
+
+    def create_preview(self, bgm_file, background_files, output_dir=None, video_type="single",
+                       duration_minutes=15, duration_seconds=30, title="", auto_highlight=True,
+                       short_fill="pad", visualizer=None, slideshow_options=None, title_card=None):
+        """本番と同じフィルター設定で低解像度・高速なプレビュー動画を作成
+
+        冒頭・ループのつなぎ目（耐久動画のみ）・フェードアウトを含む末尾を
+        それぞれ数秒ずつ切り出して連結する。
+        video_type: "single" / "loop" / "short"
+        short_fill: ショートの余白の埋め方（create_short_version の fill と同じ）
+        visualizer / slideshow_options / title_card: 本番と同じように重ねる（単曲・耐久のみ）。
+        ビジュアライザーとスライドショーのクリップは本番と同じキャッシュに作成される。
+        """
+        print(f"プレビュー動画を作成中... ({video_type})")
+
+        if video_type not in ("single", "loop", "short"):
+            raise ValueError(f"この動画タイプはプレビューに対応していません: {video_type}")
+        if video_type == "short" and (visualizer or slideshow_options or title_card):
+            # ショートの本番でも使われないため、プレビューにも表示しない
+            print("警告: ショートではビジュアライザー・スライドショー・タイトル表示は使用されません")
+            visualizer = slideshow_options = title_card = None
+        if self.quality_target:
+            print("警告: 画質の自動調整（目標サイズ・最大ビットレート）はプレビューには反映されません")
+
+        print("音声ファイルの長さを取得中...")
+        audio_duration = self.get_audio_duration(bgm_file)
+        if audio_duration == 0:
+            raise ValueError("音声ファイルの長さを取得できませんでした")
+
+        seg = self.PREVIEW_SEGMENT_SECONDS
+        loop_audio = False
+        audio_offset = 0  # 元の音声内での切り出し開始位置（ショートのみ）
+
+        # 本番と同じ尺・フィルターを再現する
+        if video_type == "single":
+            total_duration = audio_duration
+            width, height = self.VIDEO_SIZE
+            audio_filters = [self.build_audio_fade_filter(audio_duration, 3)]
+            segments = [(0, seg), (total_duration - seg, total_duration)]
+        elif video_type == "loop":
+            target_duration = duration_minutes * 60
+            loop_count = int(target_duration / audio_duration) + 1
+            total_duration = audio_duration * loop_count
+            width, height = self.VIDEO_SIZE
+            audio_filters = [self.build_audio_fade_filter(total_duration, 3)]
+            loop_audio = True
+            segments = [
+                (0, seg),
+                (audio_duration - seg / 2, audio_duration + seg / 2),  # ループのつなぎ目
+                (total_duration - seg, total_duration)
+            ]
+        else:
+            total_duration = min(duration_seconds, audio_duration)
+            width, height = self.SHORT_VIDEO_SIZE
+            if auto_highlight:
+                audio_offset = self.find_highlight_start(bgm_file, duration_seconds, audio_duration)
+            # 本番ではトリム時と合成時の2回フェードを適用している
+            audio_filters = [
+                self.build_audio_fade_filter(duration_seconds, 1),
+                self.build_audio_fade_filter(total_duration, 1)
+            ]
+            segments = [(0, seg), (total_duration - seg, total_duration)]
+
+        segments = self.merge_preview_segments(segments, total_duration)
+        print(f"プレビュー区間: {', '.join(f'{s:.1f}-{e:.1f}秒' for s, e in segments)}")
+
+        # 出力ファイル名を生成（プレビューは毎回上書き）
+        if output_dir is None:
+            output_dir = os.path.join(tempfile.gettempdir(), "echogarden_preview")
+        os.makedirs(output_dir, exist_ok=True)
+        safe_title = self.sanitize_filename(title)
+        output_file = os.path.join(output_dir, f"{safe_title}_{video_type}_preview.mp4")
+
+        temp_dir = self.create_temp_directory()
+        try:
+            title_overlay = self.prepare_title_card(title, title_card)
+            slideshow_args = None
+            if video_type == "short":
+                background_file = self.choose_background(background_files, self.preview_manifest(
+                    "short", bgm_file, background_files,
+                    self.short_manifest_params(duration_seconds, None, auto_highlight, short_fill)))
+                background_file, video_filter = self.prepare_short_background(background_file, short_fill)
+            elif slideshow_options and len(background_files) > 1:
+                # 本番と同じクリップの連結リスト（区間ごとに位置を指定して読み込む）
+                slideshow_args, _ = self.prepare_background(background_files, total_duration, temp_dir,
+                                                            slideshow_options, title_overlay=title_overlay)
+                video_filter = self.build_video_filter(width, height)
+            else:
+                title_params = self.title_card_params(title, title_card)
+                if video_type == "loop":
+                    params = self.loop_manifest_params(background_files, duration_minutes, visualizer,
+                                                       slideshow_options, title_params)
+                else:
+                    params = self.single_manifest_params(background_files, visualizer, slideshow_options,
+                                                         title_params)
+                background_file = self.choose_background(
+                    background_files, self.preview_manifest(video_type, bgm_file, background_files, params))
+                background_file = self.bake_title(background_file, title_overlay)
+                background_file = self.normalize_background(background_file, self.VIDEO_SIZE)
+                video_filter = self.build_video_filter(width, height)
+            visualizer_clip = self.prepare_visualizer(bgm_file, visualizer, audio_duration)
+            show_title = self.title_needs_overlay(title_overlay)
+            audio_filter = ','.join(audio_filters)
+
+            # 重ねるものがあれば本番の解像度で重ねてから縮小し、なければ先に縮小する
+            overlays = bool(visualizer_clip or show_title)
+            preview_scale = f'scale=iw/{self.PREVIEW_SCALE}:-2,setsar=1'
+            cmd = [self.ffmpeg_path]
+            filter_parts = []
+            input_count = 0
+
+            def add_input(args):
+                nonlocal input_count
+                cmd.extend(args)
+                input_count += 1
+                return input_count - 1
+
+            if slideshow_args is None:
+                # 背景は1枚だけデコードし、本番のフィルターを1回適用してからメモリ上で繰り返す
+                add_input(['-i', background_file])
+                still_filter = video_filter if overlays else f'{video_filter},{preview_scale}'
+                filter_parts.append(
+                    f'[0:v]{still_filter},loop=loop=-1:size=1,fps={self.PREVIEW_FPS},split={len(segments)}'
+                    + ''.join(f'[s{i}]' for i in range(len(segments))))
+
+            concat_inputs = ''
+            for i, (start, end) in enumerate(segments):
+                length = end - start
+                if slideshow_args is None:
+                    base = f'[s{i}]trim=duration={length},setpts=PTS-STARTPTS'
+                else:
+                    slide_input = add_input(['-ss', str(start), '-t', str(length)] + slideshow_args)
+                    base = f'[{slide_input}:v]{video_filter},fps={self.PREVIEW_FPS},setpts=PTS-STARTPTS'
+                    if not overlays:
+                        base += f',{preview_scale}'
+
+                if loop_audio:
+                    # ループ音声は元ファイル内の位置にシークして繰り返す
+                    audio_args = ['-stream_loop', '-1', '-ss', str(start % audio_duration)]
+                else:
+                    audio_args = ['-ss', str(audio_offset + start)]
+                audio_input = add_input(audio_args + ['-t', str(length), '-i', bgm_file])
+
+                if not overlays:
+                    filter_parts.append(f'{base}[v{i}]')
+                else:
+                    filter_parts.append(f'{base}[b{i}]')
+                    label = f'b{i}'
+                    if visualizer_clip:
+                        # ビジュアライザーは1ループ分なので、耐久動画ではループ内の位置から読み込む
+                        viz_args = ['-stream_loop', '-1'] if loop_audio else []
+                        viz_input = add_input(viz_args + ['-ss', str(start % audio_duration), '-t', str(length),
+                                                          '-i', visualizer_clip])
+                        filter_parts.append(audio_visualizer.build_overlay_filter(
+                            'null', *self.VIDEO_SIZE, viz_input, output_label=f'z{i}',
+                            base_input=label, suffix=i))
+                        label = f'z{i}'
+                    if show_title and title_renderer.overlaps_intro(title_overlay, start):
+                        # 常に表示するタイトルは区間の長さだけ読み込む（冒頭表示は表示時間で終わる）
+                        title_args = title_renderer.build_input_args(title_overlay, self.PREVIEW_FPS)
+                        if title_overlay['layout'] != 'intro':
+                            title_args = ['-t', str(length)] + title_args
+                        title_input = add_input(title_args)
+                        filter_parts.append(title_renderer.build_overlay_filter(
+                            filter_parts.pop(), label, title_overlay, title_input,
+                            output_label=f't{i}', suffix=i, offset=start))
+                        label = f't{i}'
+                    filter_parts.append(f'[{label}]{preview_scale}[v{i}]')
+
+                # タイムスタンプを本番の位置に戻してフェードを適用
+                filter_parts.append(
+                    f'[{audio_input}:a]asetpts=PTS+{start}/TB,{audio_filter},asetpts=PTS-STARTPTS[a{i}]'
+                )
+                concat_inputs += f'[v{i}][a{i}]'
+            filter_parts.append(f'{concat_inputs}concat=n={len(segments)}:v=1:a=1[v][a]')
+
+            cmd += [
+                '-filter_complex', ';'.join(filter_parts),
+                '-map', '[v]',
+                '-map', '[a]',
+                '-c:v', 'libx264',
+                '-preset', 'ultrafast',
+                '-crf', '32',
+                '-r', str(self.PREVIEW_FPS),
+                '-pix_fmt', 'yuv420p',
+                '-c:a', 'aac',
+                '-b:a', '96k',
+                '-y',
+                output_file
+            ]
+
+            print("FFmpegでプレビューを作成中...")
+            preview_duration = sum(end - start for start, end in segments)
+            self.run_ffmpeg(cmd, "プレビューの作成に失敗しました", stage="preview", duration=preview_duration)
+        finally:
+            self.cleanup_temp_directory()
+
+        print(f"プレビュー動画を作成しました: {output_file}")
+        return output_file
+
     def __del__(self):
         """デストラクタで一時ディレクトリを削除"""
         self.cleanup_temp_directory() 
\ No newline at end of file
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+オーディオビジュアライザー
+音声をバッチ単位でFFT解析し、画面下部に重ねる小さな帯状の映像（マスク）を作成する
+
+背景全体ではなくオーバーレイ部分だけを描画し、合成時に alphamerge + overlay で重ねる。
+作成した映像は音声ファイルと設定ごとにキャッシュされ、耐久動画では1ループ分を繰り返し使う。
+"""
+
+import os
+
+from audio_analysis import np, require_numpy, stream_pcm
+from ffmpeg_runner import FFmpegRunner
+from media_cache import get_cache_dir, file_fingerprint, make_cache_key
+
+# ビジュアライザーの種類
+STYLES = ("spectrum", "waveform")
+
+# 解析設定
+SAMPLE_RATE = 22050
+FFT_SIZE = 2048
+MIN_FREQUENCY = 40
+MAX_FREQUENCY = 11000
+DB_FLOOR = -60.0
+# バーが下がる速さ（1フレームあたりの減衰率）
+DECAY = 0.85
+
+# マスクは出力の1/SCALEの解像度で描画し、合成時に拡大する
+SCALE = 2
+# 1回にまとめて処理するフレーム数
+BATCH_FRAMES = 50
+# 描画方法を変えたらキャッシュを無効化するため更新する
+VISUALIZER_VERSION = 1
+
+
+def overlay_size(video_width, video_height):
+    """出力解像度に対するオーバーレイの大きさ（幅, 高さ）と下端からの余白"""
+    width = int(video_width * 0.8) // 4 * 4
+    height = int(video_height * 0.15) // 4 * 4
+    margin = int(video_height * 0.05)
+    return width, height, margin
+
+
+def build_bar_edges(bars):
+    """FFTのビンを対数間隔のバーに割り当てる境界（ビン番号）"""
+    frequencies = np.geomspace(MIN_FREQUENCY, MAX_FREQUENCY, bars + 1)
+    edges = np.round(frequencies * FFT_SIZE / SAMPLE_RATE).astype(int)
+    # 低域で同じビンに重ならないよう最低1ビンずつ確保
+    for i in range(1, len(edges)):
+        edges[i] = max(edges[i], edges[i - 1] + 1)
+    return edges
+
+
+def spectrum_levels(windows, edges, window_function):
+    """フレームごとのスペクトラム（0〜1）をまとめて計算 (frames, bars)"""
+    spectrum = np.abs(np.fft.rfft(windows * window_function, axis=1))
+    # 各バーの範囲のビンの最大値
+    bands = np.maximum.reduceat(spectrum[:, edges[0]:edges[-1]], edges[:-1] - edges[0], axis=1)
+    db = 20 * np.log10(bands / (FFT_SIZE / 4) + 1e-10)
+    return np.clip((db - DB_FLOOR) / -DB_FLOOR, 0.0, 1.0)
+
+
+def waveform_levels(windows, bars):
+    """フレームごとの波形の振幅（0〜1）をまとめて計算 (frames, bars)"""
+    usable = windows.shape[1] // bars * bars
+    groups = windows[:, :usable].reshape(windows.shape[0], bars, -1)
+    return np.clip(np.max(np.abs(groups), axis=2), 0.0, 1.0)
+
+
+def draw_masks(levels, width, height, bars):
+    """バーの高さからマスク画像（frames, height, width）を描画"""
+    bar_width = width // bars
+    gap = max(1, bar_width // 4)
+    pixel_heights = (levels * height).astype(np.int32)
+    rows = np.arange(height, 0, -1, dtype=np.int32)  # 上端ほど大きい
+    # (frames, height, bars) のマスクを作ってから横方向に引き伸ばす
+    masks = rows[None, :, None] <= pixel_heights[:, None, :]
+    column_mask = np.ones(bar_width, dtype=bool)
+    column_mask[bar_width - gap:] = False
+    image = np.zeros((levels.shape[0], height, width), dtype=np.uint8)
+    drawn = np.repeat(masks, bar_width, axis=2) & np.tile(column_mask, bars)[None, None, :]
+    image[:, :, :bars * bar_width][drawn] = 255
+    return image
+
+
+def render_visualizer_clip(ffmpeg_path, audio_file, output_file, width, height, fps,
+                           style="spectrum", bars=64, audio_duration=None, runner=None):
+    """音声全体のビジュアライザーをグレースケールのマスク映像として書き出す
+
+    audio_duration を指定すると、映像の長さが音声と一致するようフレームレートを調整する
+    （耐久動画で繰り返してもずれが蓄積しない）。
+    runner: FFmpegRunner（デコードとエンコードの両方をキャンセル・停止検出の対象にする）
+    """
+    require_numpy()
+    if style not in STYLES:
+        raise ValueError(f"不明なビジュアライザーです: {style}")
+
+    mask_width, mask_height = width // SCALE, height // SCALE
+    hop = SAMPLE_RATE / fps
+    edges = build_bar_edges(bars)
+    window_function = np.hanning(FFT_SIZE).astype(np.float32)
+
+    if audio_duration:
+        frame_count = max(1, round(audio_duration * fps))
+        rate = f"{frame_count * 1000}/{round(audio_duration * 1000)}"
+    else:
+        rate = str(fps)
+
+    cmd = [
+        ffmpeg_path,
+        '-v', 'error',
+        '-f', 'rawvideo',
+        '-pix_fmt', 'gray',
+        '-s', f'{mask_width}x{mask_height}',
+        '-r', rate,
+        '-i', '-',
+        '-c:v', 'ffv1',
+        '-y',
+        output_file
+    ]
+    runner = runner or FFmpegRunner()
+
+    # フレームiの解析窓はサンプル位置 i*hop から始まる
+    chunk_samples = int(hop * BATCH_FRAMES)
+    buffer = np.zeros(0, dtype=np.float32)
+    buffer_start = 0  # buffer[0] の絶対サンプル位置
+    frame_index = 0
+    previous = np.zeros(bars)
+
+    def encode_frames(windows):
+        nonlocal previous
+        if style == "spectrum":
+            levels = spectrum_levels(windows, edges, window_function)
+        else:
+            levels = waveform_levels(windows, bars)
+        # 急に下がらないよう減衰させる（フレーム間に依存するため逐次処理）
+        for i in range(levels.shape[0]):
+            previous = np.maximum(levels[i], previous * DECAY)
+            levels[i] = previous
+        encoder.write(draw_masks(levels, mask_width, mask_height, bars).tobytes())
+
+    with runner.stream(cmd, "ビジュアライザーの作成に失敗しました", stage="visualizer",
+                       duration=audio_duration, stdin=True) as encoder:
+        for chunk in stream_pcm(ffmpeg_path, audio_file, SAMPLE_RATE, chunk_samples, runner=runner):
+            buffer = np.concatenate([buffer, chunk])
+            starts = []
+            while True:
+                start = int(frame_index * hop) - buffer_start
+                if start + FFT_SIZE > len(buffer):
+                    break
+                starts.append(start)
+                frame_index += 1
+            if starts:
+                indices = np.asarray(starts)[:, None] + np.arange(FFT_SIZE)[None, :]
+                encode_frames(buffer[indices])
+                consumed = starts[-1] + 1
+                buffer = buffer[consumed:]
+                buffer_start += consumed
+
+        # 末尾は無音で埋めて残りのフレームを描画
+        if audio_duration:
+            remaining = frame_count - frame_index
+        else:
+            remaining = int((buffer_start + len(buffer)) / hop) - frame_index
+        if remaining > 0:
+            buffer = np.concatenate([buffer, np.zeros(FFT_SIZE + int(hop * remaining), dtype=np.float32)])
+            starts = [int((frame_index + i) * hop) - buffer_start for i in range(remaining)]
+            for i in range(0, remaining, BATCH_FRAMES):
+                batch = np.asarray(starts[i:i + BATCH_FRAMES])
+                encode_frames(buffer[batch[:, None] + np.arange(FFT_SIZE)[None, :]])
+
+
+def get_visualizer_clip(ffmpeg_path, audio_file, video_width, video_height, fps,
+                        style="spectrum", audio_duration=None, runner=None):
+    """ビジュアライザー映像をキャッシュから取得（なければ作成）してパスを返す"""
+    width, height, _ = overlay_size(video_width, video_height)
+    key = make_cache_key(file_fingerprint(audio_file), style, width, height, fps,
+                         audio_duration, VISUALIZER_VERSION)
+    cache_file = get_cache_dir('visualizer') / f"{key}.mkv"
+    if cache_file.exists():
+        print(f"ビジュアライザーのキャッシュを使用します: {cache_file.name}")
+        return str(cache_file)
+
+    temp_file = cache_file.with_name(f".tmp_{os.getpid()}_{cache_file.name}")
+    try:
+        render_visualizer_clip(ffmpeg_path, audio_file, str(temp_file), width, height, fps,
+                               style=style, audio_duration=audio_duration, runner=runner)
+        os.replace(temp_file, cache_file)
+    finally:
+        if temp_file.exists():
+            temp_file.unlink()
+    return str(cache_file)
+
+
+def build_overlay_filter(base_filter, video_width, video_height, visualizer_input,
+                         color="white", opacity=0.8, output_label="v", base_input="0:v", suffix=""):
+    """背景フィルターの後にビジュアライザーを重ねる filter_complex を生成（出力ラベル [output_label]）
+
+    base_input: 背景の入力（またはラベル）/ suffix: 1つのグラフで複数回使う場合に内部のラベルに付ける
+    """
+    width, height, margin = overlay_size(video_width, video_height)
+    return (
+        f'[{base_input}]{base_filter}[bg{suffix}];'
+        f'[{visualizer_input}:v]scale={width}:{height}:flags=neighbor,format=gray,'
+        f'lutyuv=y=val*{opacity}[mask{suffix}];'
+        f'color=c={color}:s={width}x{height}[fill{suffix}];'
+        f'[fill{suffix}][mask{suffix}]alphamerge[viz{suffix}];'
+        f'[bg{suffix}][viz{suffix}]overlay=x=(W-w)/2:y=H-h-{margin}:shortest=1,format=yuv420p[{output_label}]'
+    )
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+監視フォルダからの自動動画作成
+設定したフォルダに追加されたBGMを検出し、フォルダごとのテンプレートに従ってジョブを投入する
+
+config.json の例:
+    "watch_folders": [
+        {"path": "../Sound", "type": "single", "backgrounds": "../Image",
+         "create_short": true, "output_dir": "../Movie"}
+    ]
+
+- 書き込み中のファイルは、サイズと更新日時が一定時間変わらなくなるまで待つ
+- 投入済みのファイル（同じ内容のもの）はジョブ履歴から判定して再投入しない
+- 出力フォルダに予定の出力（本編・ショートバージョン）がすべて同じ名前で既にある曲は作成済みとしてスキップする
+  （一部だけある場合は、ない方だけを作成する）
+- 同時に実行するジョブ数はレンダリングサービスの --concurrency で制限される
+"""
+
+import os
+import threading
+import time
+from pathlib import Path
+
+from media_cache import AUDIO_EXTENSIONS, BACKGROUND_EXTENSIONS, file_fingerprint
+from output_manifest import manifest_path
+from render_jobs import normalize_short_clips, split_job, validate_job_spec
+
+# フォルダを確認する間隔（秒）
+POLL_INTERVAL = 10
+# サイズ・更新日時がこの秒数変わらなければ書き込み完了とみなす
+SETTLE_SECONDS = 30
+
+# テンプレートのうちジョブ仕様にそのまま渡さないキー
+TEMPLATE_ONLY_KEYS = ('path', 'backgrounds')
+
+
+def list_files(directory, extensions):
+    """フォルダ内の指定拡張子のファイル（隠しファイルを除く）"""
+    if not directory.is_dir():
+        return []
+    return [path for path in sorted(directory.iterdir())
+            if path.suffix.lower() in extensions and not path.name.startswith('.') and path.is_file()]
+
+
+def resolve_backgrounds(backgrounds, base_dir):
+    """背景の指定（フォルダまたはファイルのリスト）を背景ファイルのリストに変換"""
+    if isinstance(backgrounds, str):
+        return [str(path) for path in list_files((base_dir / backgrounds).resolve(), BACKGROUND_EXTENSIONS)]
+    return [str((base_dir / path).resolve()) for path in backgrounds or []]
+
+
+def load_watch_templates(config, base_dir, default_output_dir=None):
+    """config.json の watch_folders を検証して、監視フォルダのテンプレートのリストを返す
+
+    相対パスは base_dir（MovieScript フォルダ）からの位置として扱う。
+    """
+    templates = []
+    for template in config.get('watch_folders', []):
+        if not template.get('path'):
+            raise ValueError("watch_folders の各項目には path を指定してください")
+        template = dict(template)
+        template.setdefault('type', 'single')
+        if template['type'] not in ('single', 'loop'):
+            raise ValueError(f"監視フォルダで使える動画タイプは single / loop です: {template['type']}")
+        output_dir = template.get('output_dir') or default_output_dir
+        if not output_dir:
+            raise ValueError(f"監視フォルダの出力先がありません（output_dir を指定してください）: {template['path']}")
+        template['output_dir'] = str((base_dir / output_dir).resolve())
+        template['path'] = (base_dir / template['path']).resolve()
+        templates.append(template)
+    return templates
+
+
+class FolderWatcher:
+    """監視フォルダを定期的に確認し、新しいBGMの動画作成ジョブをサービスに投入する"""
+
+    def __init__(self, service, templates, base_dir, poll_interval=POLL_INTERVAL,
+                 settle_seconds=SETTLE_SECONDS):
+        self.service = service
+        self.templates = templates
+        self.base_dir = Path(base_dir)
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.pending = {}  # パス -> (サイズ, 更新日時, 変化がなくなった時刻)
+        self.stop_event = threading.Event()
+        self.thread = None
+        # 過去に投入したファイル（再起動後も重複して投入しない）
+        self.submitted = {job['spec'].get('watch_source') for job in service.store.list()}
+        self.skipped = set()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="folder-watcher")
+        self.thread.daemon = True
+        self.thread.start()
+        for template in self.templates:
+            print(f"フォルダを監視しています: {template['path']} ({template['type']})")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=10)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                # 一時的なファイルアクセスのエラーなどで監視を止めない
+                print(f"監視フォルダの確認中にエラーが発生しました: {e}")
+            self.stop_event.wait(self.poll_interval)
+
+    def poll(self):
+        """全テンプレートのフォルダを1回確認し、書き込みが終わった新しいファイルを投入する"""
+        now = time.monotonic()
+        seen = set()
+        for template in self.templates:
+            for path in list_files(template['path'], AUDIO_EXTENSIONS):
+                seen.add(path)
+                if self.is_settled(path, now):
+                    self.submit(path, template)
+        # 削除されたファイルの状態は破棄する
+        for path in list(self.pending):
+            if path not in seen:
+                del self.pending[path]
+
+    def is_settled(self, path, now):
+        """サイズと更新日時が settle_seconds 以上変わっていなければ True"""
+        try:
+            stat = path.stat()
+        except OSError:
+            return False
+        current = (stat.st_size, stat.st_mtime_ns)
+        previous = self.pending.get(path)
+        if previous is None or previous[:2] != current:
+            self.pending[path] = current + (now,)
+            return False
+        return stat.st_size > 0 and now - previous[2] >= self.settle_seconds
+
+    def submit(self, path, template):
+        """テンプレートからジョブ仕様を作成して投入（投入済み・作成済みならスキップ）"""
+        source = file_fingerprint(path)
+        if source in self.submitted or source in self.skipped:
+            return
+
+        spec = {key: value for key, value in template.items() if key not in TEMPLATE_ONLY_KEYS}
+        spec.update({
+            'bgm_file': str(path),
+            'background_files': resolve_backgrounds(template.get('backgrounds'), self.base_dir),
+            'title': path.stem,
+            # 同じ内容のファイルが再投入されても、出力が最新なら作り直さない
+            'incremental': template.get('incremental', True),
+            'watch_source': source,
+        })
+
+        try:
+            coordinator = self.service.coordinator
+            validate_job_spec(spec, coordinator.allowed_roots, coordinator.output_roots)
+        except ValueError as e:
+            print(f"監視フォルダのジョブを作成できません: {path.name} - {e}")
+            self.skipped.add(source)
+            return
+
+        spec = self.remove_existing_parts(spec)
+        if spec is None:
+            print(f"作成済みのためスキップします: {path.name}")
+            self.skipped.add(source)
+            return
+
+        job_ids = self.service.submit(spec)
+        self.submitted.add(source)
+        print(f"新しい曲を検出しました。ジョブを追加します: {path.name} ({', '.join(job_ids)})")
+
+    def remove_existing_parts(self, spec):
+        """監視を始める前に作成した動画（マニフェストなし）がそろっている部分をジョブ仕様から除く
+
+        本編とショートバージョンのそれぞれについて、予定の出力がすべて出力フォルダにあれば作成済みとみなす。
+        マニフェストのある出力は差分ビルドで判定するため、ここでは作成済みとしない。
+        すべて作成済みの場合は None を返す。
+        """
+        main_done = self.outputs_exist(self.main_outputs(spec))
+        short_done = not spec.get('create_short') or self.outputs_exist(self.short_outputs(spec))
+        if main_done and short_done:
+            return None
+        if main_done:
+            # ショートバージョンだけを作成する
+            return split_job(spec)[1]
+        if short_done and spec.get('create_short'):
+            # 本編だけを作成する
+            return dict(spec, create_short=False)
+        return spec
+
+    def outputs_exist(self, output_files):
+        """出力がすべてあり、いずれもマニフェストがない（差分ビルド以前に作成した）場合は True"""
+        return all(os.path.exists(output_file) and not os.path.exists(manifest_path(output_file))
+                   for output_file in output_files)
+
+    def main_outputs(self, spec):
+        """本編の出力ファイルのリスト（VideoGenerator と同じファイル名）"""
+        title = self.service.generator.sanitize_filename(spec['title'])
+        if spec['type'] != 'loop':
+            filenames = [f"{title}.mp4"]
+        elif spec.get('long_form'):
+            # 分割する場合、2本目以降の数は作成するまで分からないため1本目で判定する
+            split = spec.get('part_minutes') or spec.get('part_size_mb')
+            suffix = "_part1" if split else ""
+            filenames = [f"{title}_{spec.get('duration_minutes', 15)}min{suffix}.mp4"]
+        elif spec.get('durations_minutes'):
+            filenames = [f"{title}_{minutes}min.mp4" for minutes in sorted(set(spec['durations_minutes']))]
+        else:
+            filenames = [f"{title}_{spec.get('duration_minutes', 15)}min.mp4"]
+        return [os.path.join(spec['output_dir'], filename) for filename in filenames]
+
+    def short_outputs(self, spec):
+        """ショートバージョンの出力ファイルのリスト（VideoGenerator と同じファイル名）"""
+        title = self.service.generator.sanitize_filename(spec['title'])
+        if spec.get('short_clips'):
+            lengths = [duration for _, duration in normalize_short_clips(spec['short_clips'])]
+        else:
+            lengths = [spec.get('short_duration_seconds', 30)]
+        filenames = []
+        for index, duration in enumerate(lengths):
+            # 同じ長さのショートが複数ある場合は番号が付く
+            suffix = f"_{index + 1}" if lengths.count(duration) > 1 else ""
+            filenames.append(f"{title}_short_{duration}s{suffix}.mp4")
+        return [os.path.join(spec['output_dir'], filename) for filename in filenames]